@@ -1,4 +1,6 @@
--- Drop the database if it already exists to start fresh
+-- Drop the database if it already exists to start fresh.
+-- To upgrade an existing database instead, run `python migrate_schema.py`
+-- from the WMS folder: it adds the new tables, columns and indexes in place.
 DROP DATABASE IF EXISTS wms_db;
 
 -- Create the new database
@@ -79,6 +81,10 @@ CREATE TABLE IF NOT EXISTS `CollectionPoints` (
   `latitude` DECIMAL(10, 8) NOT NULL,
   `longitude` DECIMAL(11, 8) NOT NULL,
   `client_id` INT NULL,
+  `window_start` TIME NULL,
+  `window_end` TIME NULL,
+  `service_minutes` SMALLINT NULL,
+  `tariff_zone` VARCHAR(50) NULL,
   PRIMARY KEY (`point_id`),
   CONSTRAINT `fk_point_client`
     FOREIGN KEY (`client_id`)
@@ -86,6 +92,34 @@ CREATE TABLE IF NOT EXISTS `CollectionPoints` (
     ON DELETE SET NULL
 ) ENGINE=InnoDB;
 
+-- -----------------------------------------------------
+-- Table `BookingSchedules` (recurring pickups; materialized into ServiceBookings ahead of time)
+-- -----------------------------------------------------
+CREATE TABLE IF NOT EXISTS `BookingSchedules` (
+  `schedule_id` INT NOT NULL AUTO_INCREMENT,
+  `client_id` INT NOT NULL,
+  `point_id` INT NOT NULL,
+  `frequency` ENUM('Weekly', 'Biweekly', 'Monthly') NOT NULL,
+  `start_date` DATE NOT NULL,
+  `end_date` DATE NULL,
+  `window_start` TIME NULL,
+  `window_end` TIME NULL,
+  `waste_type` VARCHAR(30) NOT NULL DEFAULT 'General',
+  `active` BOOLEAN NOT NULL DEFAULT TRUE,
+  `materialized_until` DATE NULL,
+  `created_at` TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  PRIMARY KEY (`schedule_id`),
+  INDEX `idx_schedule_client` (`client_id`, `active`),
+  CONSTRAINT `fk_schedule_client`
+    FOREIGN KEY (`client_id`)
+    REFERENCES `Users` (`user_id`)
+    ON DELETE CASCADE,
+  CONSTRAINT `fk_schedule_point`
+    FOREIGN KEY (`point_id`)
+    REFERENCES `CollectionPoints` (`point_id`)
+    ON DELETE CASCADE
+) ENGINE=InnoDB;
+
 -- -----------------------------------------------------
 -- Table `ServiceBookings` (Cleaned: simplified status)
 -- -----------------------------------------------------
@@ -95,7 +129,15 @@ CREATE TABLE IF NOT EXISTS `ServiceBookings` (
   `point_id` INT NOT NULL,
   `requested_date` DATE NOT NULL,
   `status` ENUM('Approved', 'Completed', 'Cancelled') NOT NULL DEFAULT 'Approved',
+  `window_start` TIME NULL,
+  `window_end` TIME NULL,
+  `waste_type` VARCHAR(30) NOT NULL DEFAULT 'General',
+  `schedule_id` INT NULL,
   PRIMARY KEY (`booking_id`),
+  -- Covers a client's history pages (keyset on requested_date, booking_id)
+  INDEX `idx_booking_client_history` (`client_id`, `requested_date`, `booking_id`, `status`, `point_id`),
+  -- One booking per schedule and day, so materializing again is a no-op
+  UNIQUE INDEX `uq_booking_schedule_date` (`schedule_id`, `requested_date`),
   CONSTRAINT `fk_booking_client`
     FOREIGN KEY (`client_id`)
     REFERENCES `Users` (`user_id`)
@@ -103,7 +145,11 @@ CREATE TABLE IF NOT EXISTS `ServiceBookings` (
   CONSTRAINT `fk_booking_point`
     FOREIGN KEY (`point_id`)
     REFERENCES `CollectionPoints` (`point_id`)
-    ON DELETE CASCADE
+    ON DELETE CASCADE,
+  CONSTRAINT `fk_booking_schedule`
+    FOREIGN KEY (`schedule_id`)
+    REFERENCES `BookingSchedules` (`schedule_id`)
+    ON DELETE SET NULL
 ) ENGINE=InnoDB;
 
 -- -----------------------------------------------------
@@ -116,6 +162,8 @@ CREATE TABLE IF NOT EXISTS `RouteAssignments` (
   `driver_id` INT NOT NULL,
   `assigned_date` DATE NOT NULL,
   `status` ENUM('Pending', 'In Progress', 'Completed') NOT NULL DEFAULT 'Pending',
+  `total_stops` INT NOT NULL DEFAULT 0,
+  `completed_stops` INT NOT NULL DEFAULT 0,
   PRIMARY KEY (`assignment_id`),
   INDEX `idx_assignment_date` (`assigned_date`),
   CONSTRAINT `fk_assignment_route`
@@ -144,6 +192,8 @@ CREATE TABLE IF NOT EXISTS `RouteStops` (
   `verification_gps_lon` DECIMAL(11, 8) NULL,
   `collected_volume_kg` DECIMAL(10, 2) NULL,
   PRIMARY KEY (`route_stop_id`),
+  INDEX `idx_stop_assignment_status` (`assignment_id`, `status`),
+  INDEX `idx_stop_status_completed` (`status`, `completed_at`),
   CONSTRAINT `fk_stop_assignment`
     FOREIGN KEY (`assignment_id`)
     REFERENCES `RouteAssignments` (`assignment_id`)
@@ -158,6 +208,50 @@ CREATE TABLE IF NOT EXISTS `RouteStops` (
     ON DELETE SET NULL
 ) ENGINE=InnoDB;
 
+-- -----------------------------------------------------
+-- Table `StopCompletionEvents` (idempotency log of offline completion syncs)
+-- -----------------------------------------------------
+CREATE TABLE IF NOT EXISTS `StopCompletionEvents` (
+  `idempotency_key` VARCHAR(64) NOT NULL,
+  `driver_id` INT NOT NULL,
+  `route_stop_id` INT NOT NULL,
+  `status` ENUM('applied', 'rejected') NOT NULL,
+  `message` VARCHAR(255) NULL,
+  `client_timestamp` DATETIME NULL,
+  `received_at` TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  PRIMARY KEY (`idempotency_key`),
+  INDEX `idx_completion_driver` (`driver_id`, `received_at`),
+  CONSTRAINT `fk_completion_driver`
+    FOREIGN KEY (`driver_id`)
+    REFERENCES `Users` (`user_id`)
+    ON DELETE CASCADE
+) ENGINE=InnoDB;
+
+-- -----------------------------------------------------
+-- Table `GeofenceEvents` (arrivals at / departures from route stops, from GPS)
+-- -----------------------------------------------------
+CREATE TABLE IF NOT EXISTS `GeofenceEvents` (
+  `event_id` BIGINT NOT NULL AUTO_INCREMENT,
+  `vehicle_id` INT NOT NULL,
+  `route_stop_id` INT NOT NULL,
+  `event_type` ENUM('arrived', 'departed') NOT NULL,
+  `event_time` TIMESTAMP NOT NULL,
+  `dwell_seconds` INT NULL,
+  `latitude` DECIMAL(10, 8) NOT NULL,
+  `longitude` DECIMAL(11, 8) NOT NULL,
+  PRIMARY KEY (`event_id`),
+  INDEX `idx_geofence_stop` (`route_stop_id`, `event_type`),
+  INDEX `idx_geofence_time` (`event_type`, `event_time`),
+  CONSTRAINT `fk_geofence_vehicle`
+    FOREIGN KEY (`vehicle_id`)
+    REFERENCES `Vehicles` (`vehicle_id`)
+    ON DELETE CASCADE,
+  CONSTRAINT `fk_geofence_stop`
+    FOREIGN KEY (`route_stop_id`)
+    REFERENCES `RouteStops` (`route_stop_id`)
+    ON DELETE CASCADE
+) ENGINE=InnoDB;
+
 -- -----------------------------------------------------
 -- Table `VehicleLocations`
 -- -----------------------------------------------------
@@ -175,6 +269,39 @@ CREATE TABLE IF NOT EXISTS `VehicleLocations` (
     ON DELETE CASCADE
 ) ENGINE=InnoDB;
 
+-- -----------------------------------------------------
+-- Table `VehicleLatestLocation` (one row per vehicle, for the live map)
+-- -----------------------------------------------------
+CREATE TABLE IF NOT EXISTS `VehicleLatestLocation` (
+  `vehicle_id` INT NOT NULL,
+  `latitude` DECIMAL(10, 8) NOT NULL,
+  `longitude` DECIMAL(11, 8) NOT NULL,
+  `timestamp` TIMESTAMP NOT NULL,
+  PRIMARY KEY (`vehicle_id`),
+  CONSTRAINT `fk_latest_location_vehicle`
+    FOREIGN KEY (`vehicle_id`)
+    REFERENCES `Vehicles` (`vehicle_id`)
+    ON DELETE CASCADE
+) ENGINE=InnoDB;
+
+-- -----------------------------------------------------
+-- Table `VehicleLocationRollups` (downsampled trace of older days)
+-- -----------------------------------------------------
+CREATE TABLE IF NOT EXISTS `VehicleLocationRollups` (
+  `rollup_id` BIGINT NOT NULL AUTO_INCREMENT,
+  `vehicle_id` INT NOT NULL,
+  `latitude` DECIMAL(10, 8) NOT NULL,
+  `longitude` DECIMAL(11, 8) NOT NULL,
+  `timestamp` TIMESTAMP NOT NULL,
+  PRIMARY KEY (`rollup_id`),
+  UNIQUE INDEX `uq_rollup_vehicle_timestamp` (`vehicle_id`, `timestamp`),
+  INDEX `idx_rollup_timestamp` (`timestamp`),
+  CONSTRAINT `fk_rollup_vehicle`
+    FOREIGN KEY (`vehicle_id`)
+    REFERENCES `Vehicles` (`vehicle_id`)
+    ON DELETE CASCADE
+) ENGINE=InnoDB;
+
 -- -----------------------------------------------------
 -- Table `Payments` (Cleaned: simplified status)
 -- -----------------------------------------------------
@@ -211,6 +338,136 @@ CREATE TABLE IF NOT EXISTS `Receipts` (
     ON DELETE RESTRICT
 ) ENGINE=InnoDB;
 
+-- -----------------------------------------------------
+-- Table `ReceiptSequences` (next receipt number of each year; reserved in blocks)
+-- -----------------------------------------------------
+CREATE TABLE IF NOT EXISTS `ReceiptSequences` (
+  `year` SMALLINT NOT NULL,
+  `next_value` INT NOT NULL DEFAULT 1,
+  PRIMARY KEY (`year`)
+) ENGINE=InnoDB;
+
+-- -----------------------------------------------------
+-- Table `DriverDailyCash` (running cash totals per driver and day, for reconciliation)
+-- -----------------------------------------------------
+CREATE TABLE IF NOT EXISTS `DriverDailyCash` (
+  `service_date` DATE NOT NULL,
+  `driver_id` INT NOT NULL,
+  `stops` INT NOT NULL DEFAULT 0,
+  `total_kg` DECIMAL(12, 2) NOT NULL DEFAULT 0,
+  `expected_amount` DECIMAL(12, 2) NOT NULL DEFAULT 0,
+  `logged_amount` DECIMAL(12, 2) NOT NULL DEFAULT 0,
+  `handed_in_amount` DECIMAL(12, 2) NULL,
+  `closed_at` TIMESTAMP NULL,
+  PRIMARY KEY (`service_date`, `driver_id`),
+  CONSTRAINT `fk_daily_cash_driver`
+    FOREIGN KEY (`driver_id`)
+    REFERENCES `Users` (`user_id`)
+    ON DELETE CASCADE
+) ENGINE=InnoDB;
+
+-- -----------------------------------------------------
+-- Table `Tariffs` (price per kg; client, zone and waste type may be left open)
+-- -----------------------------------------------------
+CREATE TABLE IF NOT EXISTS `Tariffs` (
+  `tariff_id` INT NOT NULL AUTO_INCREMENT,
+  `client_id` INT NULL,
+  `zone` VARCHAR(50) NULL,
+  `waste_type` VARCHAR(30) NULL,
+  `effective_from` DATE NOT NULL,
+  `effective_to` DATE NULL,
+  `updated_at` TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+  PRIMARY KEY (`tariff_id`),
+  INDEX `idx_tariff_key` (`client_id`, `zone`, `waste_type`, `effective_from`),
+  CONSTRAINT `fk_tariff_client`
+    FOREIGN KEY (`client_id`)
+    REFERENCES `Users` (`user_id`)
+    ON DELETE CASCADE
+) ENGINE=InnoDB;
+
+-- -----------------------------------------------------
+-- Table `TariffBrackets` (marginal rates from min_kg up to the next bracket)
+-- -----------------------------------------------------
+CREATE TABLE IF NOT EXISTS `TariffBrackets` (
+  `tariff_id` INT NOT NULL,
+  `min_kg` DECIMAL(10, 2) NOT NULL,
+  `rate_per_kg` DECIMAL(10, 4) NOT NULL,
+  PRIMARY KEY (`tariff_id`, `min_kg`),
+  CONSTRAINT `fk_bracket_tariff`
+    FOREIGN KEY (`tariff_id`)
+    REFERENCES `Tariffs` (`tariff_id`)
+    ON DELETE CASCADE
+) ENGINE=InnoDB;
+
+-- The flat rate used before tariffs existed
+INSERT INTO `Tariffs` (`tariff_id`, `effective_from`) VALUES (1, '2000-01-01');
+INSERT INTO `TariffBrackets` (`tariff_id`, `min_kg`, `rate_per_kg`) VALUES (1, 0, 3.0000);
+
+-- -----------------------------------------------------
+-- Table `BillingRuns` (one per billing period; last_client_id is where a stopped run resumes)
+-- -----------------------------------------------------
+CREATE TABLE IF NOT EXISTS `BillingRuns` (
+  `run_id` INT NOT NULL AUTO_INCREMENT,
+  `period_start` DATE NOT NULL,
+  `period_end` DATE NOT NULL,
+  `status` ENUM('Running', 'Completed') NOT NULL DEFAULT 'Running',
+  `last_client_id` INT NOT NULL DEFAULT 0,
+  `invoices` INT NOT NULL DEFAULT 0,
+  `started_at` TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  `finished_at` TIMESTAMP NULL,
+  PRIMARY KEY (`run_id`),
+  UNIQUE INDEX `uq_billing_period` (`period_start`, `period_end`)
+) ENGINE=InnoDB;
+
+-- -----------------------------------------------------
+-- Table `Invoices` (one per client and billing period)
+-- -----------------------------------------------------
+CREATE TABLE IF NOT EXISTS `Invoices` (
+  `invoice_id` INT NOT NULL AUTO_INCREMENT,
+  `run_id` INT NOT NULL,
+  `client_id` INT NOT NULL,
+  `invoice_number` VARCHAR(50) NOT NULL UNIQUE,
+  `period_start` DATE NOT NULL,
+  `period_end` DATE NOT NULL,
+  `total_kg` DECIMAL(12, 2) NOT NULL DEFAULT 0,
+  `amount_due` DECIMAL(12, 2) NOT NULL DEFAULT 0,
+  `amount_paid` DECIMAL(12, 2) NOT NULL DEFAULT 0,
+  `balance` DECIMAL(12, 2) NOT NULL DEFAULT 0,
+  `status` ENUM('Issued', 'Rendered') NOT NULL DEFAULT 'Issued',
+  `document_path` VARCHAR(512) NULL,
+  `created_at` TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  PRIMARY KEY (`invoice_id`),
+  UNIQUE INDEX `uq_invoice_client_period` (`client_id`, `period_start`, `period_end`),
+  INDEX `idx_invoice_run_status` (`run_id`, `status`),
+  CONSTRAINT `fk_invoice_run`
+    FOREIGN KEY (`run_id`)
+    REFERENCES `BillingRuns` (`run_id`),
+  CONSTRAINT `fk_invoice_client`
+    FOREIGN KEY (`client_id`)
+    REFERENCES `Users` (`user_id`)
+) ENGINE=InnoDB;
+
+-- -----------------------------------------------------
+-- Table `InvoiceLines` (one per completed stop billed)
+-- -----------------------------------------------------
+CREATE TABLE IF NOT EXISTS `InvoiceLines` (
+  `line_id` BIGINT NOT NULL AUTO_INCREMENT,
+  `invoice_id` INT NOT NULL,
+  `route_stop_id` INT NOT NULL,
+  `booking_id` INT NULL,
+  `service_date` DATE NOT NULL,
+  `description` VARCHAR(255) NOT NULL,
+  `weight_kg` DECIMAL(10, 2) NOT NULL,
+  `amount` DECIMAL(10, 2) NOT NULL,
+  `paid` DECIMAL(10, 2) NOT NULL DEFAULT 0,
+  PRIMARY KEY (`line_id`),
+  INDEX `idx_line_invoice` (`invoice_id`),
+  CONSTRAINT `fk_line_invoice`
+    FOREIGN KEY (`invoice_id`)
+    REFERENCES `Invoices` (`invoice_id`)
+    ON DELETE CASCADE
+) ENGINE=InnoDB;
+
 -- -----------------------------------------------------
 -- Table `AuditLogs`
 -- -----------------------------------------------------
@@ -242,6 +499,32 @@ CREATE TABLE IF NOT EXISTS `GroupChatMessages` (
     ON DELETE CASCADE
 ) ENGINE=InnoDB;
 
+-- -----------------------------------------------------
+-- Table `ClientNotifications` (Epic 4: "your truck is N minutes away")
+-- -----------------------------------------------------
+CREATE TABLE IF NOT EXISTS `ClientNotifications` (
+  `notification_id` BIGINT NOT NULL AUTO_INCREMENT,
+  `client_id` INT NOT NULL,
+  `booking_id` INT NULL,
+  `route_stop_id` INT NOT NULL,
+  `threshold_minutes` SMALLINT NOT NULL,
+  `minutes_away` SMALLINT NOT NULL,
+  `eta` DATETIME NOT NULL,
+  `emailed` BOOLEAN NOT NULL DEFAULT FALSE,
+  `created_at` TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  PRIMARY KEY (`notification_id`),
+  INDEX `idx_notification_stop` (`route_stop_id`, `created_at`),
+  INDEX `idx_notification_client` (`client_id`, `created_at`),
+  CONSTRAINT `fk_notification_client`
+    FOREIGN KEY (`client_id`)
+    REFERENCES `Users` (`user_id`)
+    ON DELETE CASCADE,
+  CONSTRAINT `fk_notification_stop`
+    FOREIGN KEY (`route_stop_id`)
+    REFERENCES `RouteStops` (`route_stop_id`)
+    ON DELETE CASCADE
+) ENGINE=InnoDB;
+
 -- -----------------------------------------------------
 -- Table `ClientFeedback` (Epic 4)
 -- -----------------------------------------------------
@@ -60,9 +60,9 @@ VALUES
 -- Assign the 'Morning Route - Sector A' (route_id 1)
 -- to Vijay (driver_id 3) and his vehicle (vehicle_id 1) for today.
 -- -----------------------------------------------------
-INSERT INTO `RouteAssignments` (`route_id`, `vehicle_id`, `driver_id`, `assigned_date`, `status`)
+INSERT INTO `RouteAssignments` (`route_id`, `vehicle_id`, `driver_id`, `assigned_date`, `status`, `total_stops`, `completed_stops`)
 VALUES
-(1, 1, 3, CURDATE(), 'In Progress');
+(1, 1, 3, CURDATE(), 'In Progress', 2, 1);
 -- (This will get assignment_id 1)
 
 -- -----------------------------------------------------
@@ -1,6 +1,10 @@
 # In epic_1_routing/assignment_logic.py
 
 from utils.db_connector import fetch_one, fetch_all, execute_query
+from epic_1_routing.optimize_logic import get_depot, optimize_stop_sequence
+from epic_2_operations.assignment_cache import get_assignment_cache
+from epic_2_operations.eta_logic import get_eta_engine
+from epic_2_operations.geofence_logic import get_geofence_engine
 
 # ... (all your existing functions: get_available_drivers, get_available_vehicles, etc. remain unchanged) ...
 
@@ -31,7 +35,7 @@ def get_available_vehicles():
     route for today.
     """
     query = """
-        SELECT v.vehicle_id, v.license_plate, v.model
+        SELECT v.vehicle_id, v.license_plate, v.model, v.capacity_kg
         FROM Vehicles v
         LEFT JOIN (
             SELECT vehicle_id
@@ -46,9 +50,13 @@ def get_available_vehicles():
 def get_pending_bookings():
     """
     Finds all bookings for today that are 'Approved' and not yet part of any route.
+    A booking's own time window overrides its collection point's window.
     """
     query = """
-        SELECT sb.booking_id, cp.point_name, cp.latitude, cp.longitude
+        SELECT sb.booking_id, sb.point_id, cp.point_name, cp.latitude, cp.longitude,
+               COALESCE(sb.window_start, cp.window_start) AS window_start,
+               COALESCE(sb.window_end, cp.window_end) AS window_end,
+               cp.service_minutes
         FROM ServiceBookings sb
         JOIN CollectionPoints cp ON sb.point_id = cp.point_id
         LEFT JOIN (
@@ -64,18 +72,67 @@ def get_pending_bookings():
     """
     return fetch_all(query)
 
-def create_route_assignment(supervisor_id, driver_id, vehicle_id, booking_ids):
+# Today's Approved bookings that no route of today has taken yet
+PENDING_BOOKING_FILTER = """
+    AND sb.requested_date = CURDATE()
+    AND sb.status = 'Approved'
+    AND NOT EXISTS (
+        SELECT 1
+        FROM RouteStops rs
+        JOIN RouteAssignments ra ON rs.assignment_id = ra.assignment_id
+        WHERE rs.booking_id = sb.booking_id AND ra.assigned_date = CURDATE()
+    )
+"""
+
+def get_booking_stop_details(booking_ids, pending_only=False):
+    """
+    Gets the collection point and coordinates for each of the given bookings.
+    With pending_only=True, bookings that are no longer pending for today
+    (see get_pending_bookings) are left out.
+    """
+    if not booking_ids:
+        return []
+    placeholders = ", ".join(["%s"] * len(booking_ids))
+    pending_filter = PENDING_BOOKING_FILTER if pending_only else ""
+    query = f"""
+        SELECT sb.booking_id, sb.point_id, cp.latitude, cp.longitude,
+               COALESCE(sb.window_start, cp.window_start) AS window_start,
+               COALESCE(sb.window_end, cp.window_end) AS window_end,
+               cp.service_minutes
+        FROM ServiceBookings sb
+        JOIN CollectionPoints cp ON sb.point_id = cp.point_id
+        WHERE sb.booking_id IN ({placeholders}) {pending_filter}
+    """
+    return fetch_all(query, tuple(booking_ids))
+
+def create_route_assignment(supervisor_id, driver_id, vehicle_id, booking_ids, optimize=True):
     """
     Creates a new route assignment (defaulting to 'Pending')
     and adds all selected bookings as stops.
+    With optimize=True the stops are sequenced by the route optimizer (US 1.2),
+    keeping to any pickup time windows, otherwise they keep the order they
+    were selected in.
     """
     try:
+        bookings = get_booking_stop_details(booking_ids)
+        if not bookings:
+            print("No bookings found for the selected booking ids.")
+            return False
+
+        if optimize:
+            depot = get_depot()
+            ordered_bookings, total_distance = optimize_stop_sequence(bookings, start=depot, end=depot)
+            print(f"Optimized route: {len(ordered_bookings)} stops, {total_distance / 1000:.1f} km.")
+        else:
+            position = {booking_id: i for i, booking_id in enumerate(booking_ids)}
+            ordered_bookings = sorted(bookings, key=lambda b: position.get(b['booking_id'], len(position)))
+
         default_route_id = 1 
         assignment_query = """
-            INSERT INTO RouteAssignments (route_id, vehicle_id, driver_id, assigned_date, status)
-            VALUES (%s, %s, %s, CURDATE(), 'Pending')
+            INSERT INTO RouteAssignments (route_id, vehicle_id, driver_id, assigned_date, status, total_stops)
+            VALUES (%s, %s, %s, CURDATE(), 'Pending', %s)
         """
-        assignment_id = execute_query(assignment_query, (default_route_id, vehicle_id, driver_id))
+        assignment_id = execute_query(assignment_query, (default_route_id, vehicle_id, driver_id, len(ordered_bookings)))
         
         if not assignment_id:
             print("Failed to create RouteAssignment entry.")
@@ -83,13 +140,15 @@ def create_route_assignment(supervisor_id, driver_id, vehicle_id, booking_ids):
         
         stop_query = """
             INSERT INTO RouteStops (assignment_id, point_id, booking_id, stop_order, status)
-            SELECT %s, sb.point_id, sb.booking_id, %s, 'Pending'
-            FROM ServiceBookings sb
-            WHERE sb.booking_id = %s
+            VALUES (%s, %s, %s, %s, 'Pending')
         """
         
-        for stop_order, booking_id in enumerate(booking_ids, 1):
-            execute_query(stop_query, (assignment_id, stop_order, booking_id))
+        for stop_order, booking in enumerate(ordered_bookings, 1):
+            execute_query(stop_query, (assignment_id, booking['point_id'], booking['booking_id'], stop_order))
+        # The driver's next lookup, ETAs and geofences read the new assignment
+        get_assignment_cache().invalidate(driver_id)
+        get_eta_engine().invalidate()
+        get_geofence_engine().invalidate()
             
         return True
     except Exception as e:
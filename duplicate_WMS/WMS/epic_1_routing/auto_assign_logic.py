@@ -0,0 +1,278 @@
+# In epic_1_routing/auto_assign_logic.py
+
+import time
+import numpy as np
+from utils.db_connector import fetch_all, transaction
+from epic_1_routing.assignment_logic import (
+    get_available_drivers, get_available_vehicles, get_pending_bookings
+)
+from epic_1_routing.optimize_logic import (
+    get_depot, optimize_stop_sequence, insertion_costs, removal_gains,
+    check_time_windows, insertion_feasible, route_distance
+)
+from epic_2_operations.assignment_cache import get_assignment_cache
+from epic_2_operations.eta_logic import get_eta_engine
+from epic_2_operations.geofence_logic import get_geofence_engine
+
+# Used when a collection point has no completed stops yet
+DEFAULT_STOP_VOLUME_KG = 25.0
+# Used when a vehicle has no capacity_kg recorded
+DEFAULT_VEHICLE_CAPACITY_KG = 1000.0
+DEFAULT_TIME_BUDGET_S = 5.0
+
+def get_expected_volumes(point_ids):
+    """
+    Gets the average kg collected per visit for each collection point,
+    based on completed stops. Returns {point_id: kg}.
+    """
+    point_ids = sorted(set(point_ids))
+    if not point_ids:
+        return {}
+    placeholders = ", ".join(["%s"] * len(point_ids))
+    query = f"""
+        SELECT point_id, AVG(collected_volume_kg) AS avg_kg
+        FROM RouteStops
+        WHERE status = 'Completed'
+          AND collected_volume_kg IS NOT NULL
+          AND point_id IN ({placeholders})
+        GROUP BY point_id
+    """
+    rows = fetch_all(query, tuple(point_ids)) or []
+    return {row['point_id']: float(row['avg_kg']) for row in rows}
+
+def _sweep_order(coords, center):
+    """
+    Sorts points by polar angle around the center, starting after the widest
+    empty angular gap so that no natural cluster is cut in two.
+    """
+    dy = coords[:, 0] - center[0]
+    dx = (coords[:, 1] - center[1]) * np.cos(np.radians(center[0]))
+    angles = np.arctan2(dy, dx)
+    order = np.argsort(angles)
+    if len(order) > 1:
+        sorted_angles = angles[order]
+        gaps = np.diff(np.append(sorted_angles, sorted_angles[0] + 2 * np.pi))
+        order = np.roll(order, -(int(np.argmax(gaps)) + 1))
+    return order
+
+def _relocate_between(route_a, route_b, depot, deadline):
+    """
+    Moves stops from route_a to route_b while that shortens the combined
+    distance and route_b has room. Returns True if anything moved.
+    """
+    moved = False
+    while route_a['stops'] and time.perf_counter() < deadline:
+        gains = removal_gains(route_a['stops'], depot, depot)
+        room = route_b['capacity_kg'] - route_b['load_kg']
+        best = None
+        for k in np.argsort(-gains)[:5]:
+            stop = route_a['stops'][k]
+            if stop['expected_kg'] > room:
+                continue
+            costs = insertion_costs(route_b['stops'], stop, depot, depot)
+            pos = int(np.argmin(costs))
+            saving = gains[k] - costs[pos]
+            if saving > 1.0 and (best is None or saving > best[0]):
+                best = (saving, int(k), pos)
+        if best is None:
+            break
+        saving, k, pos = best
+        stop = route_a['stops'].pop(k)
+        route_b['stops'].insert(pos, stop)
+        route_a['load_kg'] -= stop['expected_kg']
+        route_b['load_kg'] += stop['expected_kg']
+        route_a['distance_m'] -= gains[k]
+        route_b['distance_m'] += gains[k] - saving
+        moved = True
+    return moved
+
+def _repair_time_windows(routes, depot, depart_at, deadline):
+    """
+    Moves stops that would be served after their window closes to another
+    vehicle that has room and can still reach every one of its stops in time.
+    Returns the number of stops moved.
+    """
+    moved = 0
+    for route in routes:
+        if time.perf_counter() > deadline:
+            break
+        feasible, _, late = check_time_windows(route['stops'], depot, depart_at)
+        if feasible:
+            continue
+        for k in [k for k, seconds in enumerate(late) if seconds > 0][::-1]:
+            if time.perf_counter() > deadline:
+                break
+            stop = route['stops'][k]
+            best = None
+            for other in routes:
+                if other is route or other['load_kg'] + stop['expected_kg'] > other['capacity_kg']:
+                    continue
+                on_time = insertion_feasible(other['stops'], stop, depot, depart_at)
+                if not on_time.any():
+                    continue
+                costs = np.where(on_time, insertion_costs(other['stops'], stop, depot, depot), np.inf)
+                pos = int(np.argmin(costs))
+                if best is None or costs[pos] < best[0]:
+                    best = (costs[pos], other, pos)
+            if best is None:
+                continue
+            _, other, pos = best
+            route['stops'].pop(k)
+            other['stops'].insert(pos, stop)
+            route['load_kg'] -= stop['expected_kg']
+            other['load_kg'] += stop['expected_kg']
+            moved += 1
+    for route in routes:
+        route['distance_m'] = route_distance(route['stops'], depot, depot)
+    return moved
+
+def plan_vehicle_routes(bookings, vehicles, volumes, depot=None, time_budget=DEFAULT_TIME_BUDGET_S,
+                        depart_at=None):
+    """
+    Splits bookings across vehicles without exceeding any vehicle's capacity
+    (capacitated vehicle routing).
+
+    Bookings are swept by angle around the depot (or their centre) and poured
+    into vehicles until each is full. Every route is then sequenced with the
+    route optimizer, and stops are relocated between neighbouring routes
+    while that shortens the total distance. Stops that would miss their
+    pickup time window are finally moved to a vehicle that can make it.
+
+    Returns (routes, unassigned) where each route is a dict with vehicle_id,
+    capacity_kg, load_kg, distance_m and its ordered stops.
+    """
+    deadline = time.perf_counter() + time_budget
+    if not bookings or not vehicles:
+        return [], list(bookings or [])
+
+    stops = []
+    for booking in bookings:
+        stop = dict(booking)
+        stop['expected_kg'] = volumes.get(booking['point_id'], DEFAULT_STOP_VOLUME_KG)
+        stops.append(stop)
+
+    coords = np.array([(float(s['latitude']), float(s['longitude'])) for s in stops])
+    center = depot if depot is not None else tuple(coords.mean(axis=0))
+
+    # Biggest trucks first so the fewest vehicles leave the depot
+    fleet = sorted(
+        vehicles,
+        key=lambda v: float(v.get('capacity_kg') or DEFAULT_VEHICLE_CAPACITY_KG),
+        reverse=True
+    )
+    routes = []
+    unassigned = []
+    vehicle_iter = iter(fleet)
+    current = None
+    for idx in _sweep_order(coords, center):
+        stop = stops[idx]
+        if current is None or current['load_kg'] + stop['expected_kg'] > current['capacity_kg']:
+            current = None
+            for vehicle in vehicle_iter:
+                capacity = float(vehicle.get('capacity_kg') or DEFAULT_VEHICLE_CAPACITY_KG)
+                if stop['expected_kg'] <= capacity:
+                    current = {'vehicle_id': vehicle['vehicle_id'], 'capacity_kg': capacity,
+                               'load_kg': 0.0, 'stops': [], 'distance_m': 0.0}
+                    routes.append(current)
+                    break
+            if current is None:
+                unassigned.append(stop)
+                continue
+        current['stops'].append(stop)
+        current['load_kg'] += stop['expected_kg']
+
+    # Half the budget sequences the routes, the rest goes to local search.
+    # With time windows the last fifth is kept for repairing late stops,
+    # so the whole plan still finishes within time_budget.
+    windowed = any(s.get('window_start') or s.get('window_end') for s in stops)
+    search_deadline = deadline - time_budget * 0.2 if windowed else deadline
+    per_route_budget = max(time_budget * 0.5 / max(len(routes), 1), 0.01)
+    for route in routes:
+        route_budget = min(per_route_budget, max(search_deadline - time.perf_counter(), 0.0))
+        route['stops'], route['distance_m'] = optimize_stop_sequence(
+            route['stops'], start=depot, end=depot, time_budget=route_budget, depart_at=depart_at
+        )
+
+    if len(routes) > 1:
+        improved = True
+        while improved and time.perf_counter() < search_deadline:
+            improved = False
+            for i, route in enumerate(routes):
+                neighbour = routes[(i + 1) % len(routes)]
+                improved |= _relocate_between(route, neighbour, depot, search_deadline)
+                improved |= _relocate_between(neighbour, route, depot, search_deadline)
+
+    if windowed:
+        _repair_time_windows(routes, depot, depart_at, deadline)
+
+    routes = [r for r in routes if r['stops']]
+    return routes, unassigned
+
+def create_route_assignments_batch(supervisor_id, routes):
+    """
+    Creates one 'Pending' route assignment per planned route and all of
+    their stops in a single transaction. Returns the new assignment ids.
+    """
+    default_route_id = 1
+    assignment_query = """
+        INSERT INTO RouteAssignments (route_id, vehicle_id, driver_id, assigned_date, status, total_stops)
+        VALUES (%s, %s, %s, CURDATE(), 'Pending', %s)
+    """
+    stop_query = """
+        INSERT INTO RouteStops (assignment_id, point_id, booking_id, stop_order, status)
+        VALUES (%s, %s, %s, %s, 'Pending')
+    """
+    assignment_ids = []
+    stop_rows = []
+    with transaction() as cursor:
+        for route in routes:
+            cursor.execute(assignment_query, (default_route_id, route['vehicle_id'], route['driver_id'],
+                                              len(route['stops'])))
+            assignment_id = cursor.lastrowid
+            assignment_ids.append(assignment_id)
+            for stop_order, stop in enumerate(route['stops'], 1):
+                stop_rows.append((assignment_id, stop['point_id'], stop['booking_id'], stop_order))
+        cursor.executemany(stop_query, stop_rows)
+    cache = get_assignment_cache()
+    for route in routes:
+        cache.invalidate(route['driver_id'])
+    get_eta_engine().invalidate()
+    get_geofence_engine().invalidate()
+    return assignment_ids
+
+def auto_assign_pending_bookings(supervisor_id, time_budget=DEFAULT_TIME_BUDGET_S):
+    """
+    Plans routes for all of today's pending bookings across the available
+    drivers and vehicles, and creates the assignments in one batch.
+    Returns a summary dict, or None if the assignments could not be saved.
+    """
+    drivers = get_available_drivers() or []
+    vehicles = get_available_vehicles() or []
+    bookings = get_pending_bookings() or []
+    if not drivers or not vehicles or not bookings:
+        return {'routes': 0, 'stops': 0, 'unassigned': bookings}
+
+    # Only as many vehicles as there are drivers to drive them
+    vehicles = sorted(
+        vehicles,
+        key=lambda v: float(v.get('capacity_kg') or DEFAULT_VEHICLE_CAPACITY_KG),
+        reverse=True
+    )[:len(drivers)]
+    volumes = get_expected_volumes(b['point_id'] for b in bookings)
+    routes, unassigned = plan_vehicle_routes(bookings, vehicles, volumes, get_depot(), time_budget)
+
+    for route, driver in zip(routes, drivers):
+        route['driver_id'] = driver['user_id']
+
+    try:
+        create_route_assignments_batch(supervisor_id, routes)
+    except Exception as e:
+        print(f"Error creating assignments in batch: {e}")
+        return None
+
+    return {
+        'routes': len(routes),
+        'stops': sum(len(r['stops']) for r in routes),
+        'distance_km': sum(r['distance_m'] for r in routes) / 1000,
+        'unassigned': unassigned,
+    }
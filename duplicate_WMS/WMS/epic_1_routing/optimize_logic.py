@@ -1,63 +1,478 @@
-from utils.db_connector import fetch_all, fetch_one, execute_query
-from utils.geo_utils import calculate_distance
-
-def get_live_vehicle_locations():
-    """Gets the most recent location of all active vehicles (US 2.1)"""
-    query = """
-        SELECT v.license_plate, vl.latitude, vl.longitude, vl.timestamp
-        FROM VehicleLocations vl
-        JOIN (
-            SELECT vehicle_id, MAX(timestamp) AS max_time
-            FROM VehicleLocations
-            GROUP BY vehicle_id
-        ) AS latest ON vl.vehicle_id = latest.vehicle_id AND vl.timestamp = latest.max_time
-        JOIN Vehicles v ON vl.vehicle_id = v.vehicle_id
-    """
-    return fetch_all(query)
-
-def get_driver_assignment(driver_id):
-    """Gets the pending stops for a driver's active assignment (US 2.3)"""
-    query = """
-        SELECT rs.route_stop_id, cp.point_name, cp.address, cp.latitude, cp.longitude, rs.status
-        FROM RouteStops rs
-        JOIN RouteAssignments ra ON rs.assignment_id = ra.assignment_id
-        JOIN CollectionPoints cp ON rs.point_id = cp.point_id
-        WHERE ra.driver_id = %s
-        AND ra.assigned_date = CURDATE()
-        AND rs.status = 'Pending'
-        ORDER BY rs.stop_order ASC
-    """
-    return fetch_all(query, (driver_id,))
-
-def mark_stop_complete(driver_id, route_stop_id, driver_lat, driver_lon):
-    """Marks a stop as complete after checking GPS (US 2.3 & 2.4)"""
-    
-    stop_query = """
-        SELECT cp.latitude, cp.longitude
-        FROM RouteStops rs
-        JOIN CollectionPoints cp ON rs.point_id = cp.point_id
-        WHERE rs.route_stop_id = %s
-    """
-    stop = fetch_one(stop_query, (route_stop_id,))
-    if not stop:
-        return "Error: Stop not found."
-
-    stop_coords = (stop['latitude'], stop['longitude'])
-    driver_coords = (driver_lat, driver_lon)
-    distance = calculate_distance(driver_coords, stop_coords)
-
-    # US 2.4: The 100-meter check
-    if distance > 515302:
-        return f"Verification Failed. You are {distance:.0f} meters away. Must be within 100m."
-
-    # US 2.3: Mark as complete
-    update_query = """
-        UPDATE RouteStops
-        SET status = 'Completed',
-            completed_at = NOW(),
-            verification_gps_lat = %s,
-            verification_gps_lon = %s
-        WHERE route_stop_id = %s
-    """
-    execute_query(update_query, (driver_lat, driver_lon, route_stop_id))
-    return "Stop marked complete!"
\ No newline at end of file
+import os
+import time
+import datetime
+import numpy as np
+from utils.geo_utils import calculate_distance, distance_matrix
+from epic_1_routing.road_network import (
+    get_road_network, road_distance_matrix, road_travel_time_matrix
+)
+
+# How long the improvement phase may run for a single route (US 1.2)
+DEFAULT_TIME_BUDGET_S = 1.0
+# Used to turn distances into travel times for time-window checks
+AVERAGE_SPEED_KMH = 25.0
+# Time spent at a stop when its collection point has no estimate
+DEFAULT_SERVICE_MINUTES = 5.0
+# Lateness is weighed against distance: one second late counts like 1 km
+LATENESS_PENALTY_M_PER_S = 1000.0
+_EPS = 1e-7
+
+def _stop_coords(stop):
+    return (float(stop['latitude']), float(stop['longitude']))
+
+def get_depot():
+    """
+    Returns the depot (lat, lon) from the DEPOT_LATITUDE / DEPOT_LONGITUDE
+    settings in .env, or None if no depot is configured.
+    """
+    lat = os.getenv('DEPOT_LATITUDE')
+    lon = os.getenv('DEPOT_LONGITUDE')
+    if not lat or not lon:
+        return None
+    return (float(lat), float(lon))
+
+def time_to_seconds(value):
+    """
+    Converts a TIME column value (timedelta), a datetime.time or an 'HH:MM'
+    string to seconds since midnight. Returns None for empty values.
+    """
+    if value is None or value == '':
+        return None
+    if isinstance(value, datetime.timedelta):
+        return value.total_seconds()
+    if isinstance(value, (datetime.time, datetime.datetime)):
+        return value.hour * 3600 + value.minute * 60 + value.second
+    parts = [int(p) for p in str(value).split(':')] + [0, 0]
+    return parts[0] * 3600 + parts[1] * 60 + parts[2]
+
+def seconds_since_midnight(moment=None):
+    """Seconds since midnight for the given datetime (default: now)."""
+    moment = moment or datetime.datetime.now()
+    return moment.hour * 3600 + moment.minute * 60 + moment.second
+
+def get_matrix_functions(use_road_network=None):
+    """
+    Picks how distances and travel times between stops are measured.
+    Road-network routing is used when requested (or, by default, when
+    USE_ROAD_NETWORK is set in .env) and an OSM extract is available;
+    otherwise straight-line distances at AVERAGE_SPEED_KMH.
+    Returns (matrix_fn, travel_fn); travel_fn is None for straight lines.
+    """
+    if use_road_network is None:
+        use_road_network = os.getenv('USE_ROAD_NETWORK', '').lower() in ('1', 'true', 'yes')
+    if use_road_network and get_road_network() is not None:
+        return road_distance_matrix, road_travel_time_matrix
+    return distance_matrix, None
+
+def optimize_route_nearest_neighbor(stops):
+    """
+    Orders stops greedily: starting at the first stop, always drive to the
+    closest stop that has not been visited yet.
+    """
+    if len(stops) <= 1:
+        return list(stops)
+
+    route = [stops[0]]
+    remaining = list(stops[1:])
+    while remaining:
+        current = _stop_coords(route[-1])
+        nearest = None
+        nearest_distance = float('inf')
+        for stop in remaining:
+            distance = calculate_distance(current, _stop_coords(stop))
+            if distance < nearest_distance:
+                nearest = stop
+                nearest_distance = distance
+        route.append(nearest)
+        remaining.remove(nearest)
+    return route
+
+def _path_cost(matrix, path):
+    return float(matrix[path[:-1], path[1:]].sum())
+
+def _nearest_neighbor_order(matrix, n, start):
+    """Vectorized greedy construction over the first n nodes of the matrix."""
+    visited = np.zeros(n, dtype=bool)
+    order = []
+    current = start
+    for _ in range(n):
+        row = np.where(visited, np.inf, matrix[current, :n])
+        nxt = int(np.argmin(row))
+        visited[nxt] = True
+        order.append(nxt)
+        current = nxt
+    return order
+
+def _two_opt_pass(matrix, path, symmetric, deadline):
+    """One sweep of 2-opt (segment reversal) moves. Endpoints stay fixed."""
+    improved = False
+    last = len(path) - 1
+    for i in range(1, last - 1):
+        a, b = path[i - 1], path[i]
+        js = np.arange(i + 1, last)
+        c, d = path[js], path[js + 1]
+        delta = matrix[a, c] + matrix[b, d] - matrix[a, b] - matrix[c, d]
+        k = int(np.argmin(delta))
+        if delta[k] < -_EPS:
+            j = int(js[k])
+            candidate = path.copy()
+            candidate[i:j + 1] = candidate[i:j + 1][::-1]
+            if symmetric or _path_cost(matrix, candidate) < _path_cost(matrix, path) - _EPS:
+                path = candidate
+                improved = True
+        if time.perf_counter() > deadline:
+            break
+    return path, improved
+
+def _or_opt_pass(matrix, path, symmetric, deadline, max_segment=3):
+    """One sweep of Or-opt moves: relocate runs of 1-3 stops elsewhere in the path."""
+    improved = False
+    for seg_len in range(1, max_segment + 1):
+        i = 1
+        while i + seg_len < len(path):
+            first, last_node = path[i], path[i + seg_len - 1]
+            prev, nxt = path[i - 1], path[i + seg_len]
+            removal_gain = matrix[prev, first] + matrix[last_node, nxt] - matrix[prev, nxt]
+
+            rest = np.concatenate((path[:i], path[i + seg_len:]))
+            u, v = rest[:-1], rest[1:]
+            forward = matrix[u, first] + matrix[last_node, v] - matrix[u, v]
+            backward = matrix[u, last_node] + matrix[first, v] - matrix[u, v]
+            forward[i - 1] = np.inf  # putting it back where it was
+            backward[i - 1] = np.inf
+            best_f, best_b = int(np.argmin(forward)), int(np.argmin(backward))
+
+            if forward[best_f] <= backward[best_b]:
+                pos, delta, segment = best_f, forward[best_f], path[i:i + seg_len]
+            else:
+                pos, delta, segment = best_b, backward[best_b], path[i:i + seg_len][::-1]
+
+            if delta - removal_gain < -_EPS:
+                candidate = np.concatenate((rest[:pos + 1], segment, rest[pos + 1:]))
+                if symmetric or _path_cost(matrix, candidate) < _path_cost(matrix, path) - _EPS:
+                    path = candidate
+                    improved = True
+                    i -= 1  # re-examine the run that now starts here
+            i += 1
+            if time.perf_counter() > deadline:
+                return path, improved
+    return path, improved
+
+def _build_problem(stops, start, end, matrix_fn, depart_at, travel_fn=None):
+    """
+    Precomputes everything the sequencing moves need: distance and travel
+    time matrices plus time-window arrays, with the depots and a dummy node
+    appended after the stops.
+    """
+    coords = [_stop_coords(s) for s in stops]
+    start_idx = end_idx = None
+    if start is not None:
+        start_idx = len(coords)
+        coords.append(tuple(start))
+    if end is not None:
+        end_idx = len(coords)
+        coords.append(tuple(end))
+
+    # A dummy node with zero distance to everything stands in for a missing
+    # depot, so open paths and round trips share the same move evaluation.
+    size = len(coords)
+    matrix = np.zeros((size + 1, size + 1))
+    travel = np.zeros((size + 1, size + 1))
+    if size:
+        matrix[:size, :size] = matrix_fn(coords)
+        if travel_fn is None:
+            travel[:size, :size] = matrix[:size, :size] * 3.6 / AVERAGE_SPEED_KMH
+        else:
+            travel[:size, :size] = travel_fn(coords)
+    dummy = size
+
+    open_s = np.zeros(size + 1)
+    close_s = np.full(size + 1, np.inf)
+    service_s = np.zeros(size + 1)
+    has_windows = False
+    for k, stop in enumerate(stops):
+        window_start = time_to_seconds(stop.get('window_start'))
+        window_end = time_to_seconds(stop.get('window_end'))
+        if window_start is not None:
+            open_s[k] = window_start
+            has_windows = True
+        if window_end is not None:
+            close_s[k] = window_end
+            has_windows = True
+        minutes = stop.get('service_minutes')
+        service_s[k] = 60.0 * float(minutes if minutes is not None else DEFAULT_SERVICE_MINUTES)
+
+    return {
+        'matrix': matrix,
+        'travel': travel,
+        'open_s': open_s,
+        'close_s': close_s,
+        'service_s': service_s,
+        'has_windows': has_windows,
+        'symmetric': np.allclose(matrix, matrix.T),
+        'start_idx': dummy if start_idx is None else start_idx,
+        'end_idx': dummy if end_idx is None else end_idx,
+        'depart_s': seconds_since_midnight() if depart_at is None else depart_at,
+    }
+
+def _batch_lateness(problem, paths):
+    """
+    Fast time-window feasibility check for many candidate paths at once.
+    Walks every (m, L) path position by position with the precomputed travel
+    times, waiting at stops that are not open yet.
+    Returns (seconds late per path, arrival time at every position).
+    """
+    paths = np.atleast_2d(paths)
+    travel, service_s = problem['travel'], problem['service_s']
+    open_s, close_s = problem['open_s'], problem['close_s']
+
+    clock = np.full(len(paths), float(problem['depart_s']))
+    late = np.zeros(len(paths))
+    arrivals = np.empty(paths.shape)
+    arrivals[:, 0] = clock
+    for k in range(1, paths.shape[1]):
+        prev, node = paths[:, k - 1], paths[:, k]
+        arrive = clock + service_s[prev] + travel[prev, node]
+        late += np.maximum(arrive - close_s[node], 0.0)
+        clock = np.maximum(arrive, open_s[node])
+        arrivals[:, k] = arrive
+    return late, arrivals
+
+def _batch_cost(problem, paths):
+    paths = np.atleast_2d(paths)
+    matrix = problem['matrix']
+    cost = matrix[paths[:, :-1], paths[:, 1:]].sum(axis=1)
+    if problem['has_windows']:
+        cost = cost + LATENESS_PENALTY_M_PER_S * _batch_lateness(problem, paths)[0]
+    return cost
+
+def _time_oriented_order(problem, n):
+    """
+    Greedy construction for routes with time windows: next is the stop that
+    can be served soonest without being late, favouring windows closing soon.
+    """
+    travel, service_s = problem['travel'], problem['service_s']
+    open_s, close_s = problem['open_s'][:n], problem['close_s'][:n]
+    visited = np.zeros(n, dtype=bool)
+    order = []
+    current, clock = problem['start_idx'], float(problem['depart_s'])
+    for _ in range(n):
+        arrive = clock + service_s[current] + travel[current, :n]
+        begin = np.maximum(arrive, open_s)
+        late = np.maximum(arrive - close_s, 0.0)
+        slack = np.minimum(close_s - begin, 4 * 3600.0)
+        score = np.where(visited, np.inf, begin + 0.25 * slack + LATENESS_PENALTY_M_PER_S * late)
+        nxt = int(np.argmin(score))
+        visited[nxt] = True
+        order.append(nxt)
+        current, clock = nxt, float(begin[nxt])
+    return order
+
+def _two_opt_pass_windows(problem, path, deadline):
+    """2-opt where every candidate reversal is checked against the time windows."""
+    improved = False
+    last = len(path) - 1
+    current = _batch_cost(problem, path)[0]
+    for i in range(1, last - 1):
+        js = range(i + 1, last)
+        candidates = np.repeat(path[None, :], len(js), axis=0)
+        for row, j in enumerate(js):
+            candidates[row, i:j + 1] = path[i:j + 1][::-1]
+        costs = _batch_cost(problem, candidates)
+        k = int(np.argmin(costs))
+        if costs[k] < current - _EPS:
+            path, current = candidates[k].copy(), costs[k]
+            improved = True
+        if time.perf_counter() > deadline:
+            break
+    return path, improved
+
+def _or_opt_pass_windows(problem, path, deadline, max_segment=3):
+    """Or-opt where every candidate relocation is checked against the time windows."""
+    improved = False
+    current = _batch_cost(problem, path)[0]
+    for seg_len in range(1, max_segment + 1):
+        i = 1
+        while i + seg_len < len(path):
+            segment = path[i:i + seg_len]
+            rest = np.concatenate((path[:i], path[i + seg_len:]))
+            candidates = []
+            for pos in range(len(rest) - 1):
+                for piece in (segment, segment[::-1]):
+                    if pos == i - 1 and piece is segment:
+                        continue
+                    candidates.append(np.concatenate((rest[:pos + 1], piece, rest[pos + 1:])))
+            if candidates:
+                candidates = np.array(candidates)
+                costs = _batch_cost(problem, candidates)
+                k = int(np.argmin(costs))
+                if costs[k] < current - _EPS:
+                    path, current = candidates[k], costs[k]
+                    improved = True
+            i += 1
+            if time.perf_counter() > deadline:
+                return path, improved
+    return path, improved
+
+def optimize_stop_sequence(stops, start=None, end=None, time_budget=DEFAULT_TIME_BUDGET_S,
+                           matrix_fn=None, depart_at=None, travel_fn=None):
+    """
+    Orders stops to minimise total driving distance (US 1.2).
+
+    Builds a nearest-neighbour route and improves it with 2-opt and Or-opt
+    moves until no move helps or the time budget (seconds) runs out.
+    start / end are optional (lat, lon) depots; without them the route is an
+    open path. matrix_fn(coords) must return a square distance matrix in
+    meters and travel_fn(coords) one of travel times in seconds; by default
+    both come from get_matrix_functions().
+
+    Stops may carry window_start / window_end (TIME values) and
+    service_minutes. If any do, lateness is penalised far above distance so
+    windows are kept wherever possible. depart_at is the departure time in
+    seconds since midnight (default: now).
+
+    Returns (ordered_stops, total_distance_m).
+    """
+    stops = list(stops)
+    n = len(stops)
+    if n == 0:
+        return [], 0.0
+
+    if matrix_fn is None:
+        matrix_fn, travel_fn = get_matrix_functions()
+    problem = _build_problem(stops, start, end, matrix_fn, depart_at, travel_fn)
+    matrix = problem['matrix']
+    deadline = time.perf_counter() + time_budget
+
+    order = _nearest_neighbor_order(matrix, n, problem['start_idx'])
+    path = np.array([problem['start_idx']] + order + [problem['end_idx']])
+
+    improved = n > 1
+    while improved and time.perf_counter() < deadline:
+        path, improved_2opt = _two_opt_pass(matrix, path, problem['symmetric'], deadline)
+        path, improved_oropt = _or_opt_pass(matrix, path, problem['symmetric'], deadline)
+        improved = improved_2opt or improved_oropt
+
+    if problem['has_windows']:
+        # The shortest route is often close to feasible; repair it against the
+        # windows, unless a time-ordered construction starts off better.
+        timed = np.array([problem['start_idx']] + _time_oriented_order(problem, n) + [problem['end_idx']])
+        if _batch_cost(problem, timed)[0] < _batch_cost(problem, path)[0]:
+            path = timed
+        improved = n > 1
+        while improved and time.perf_counter() < deadline:
+            path, improved_2opt = _two_opt_pass_windows(problem, path, deadline)
+            path, improved_oropt = _or_opt_pass_windows(problem, path, deadline)
+            improved = improved_2opt or improved_oropt
+
+    ordered = [stops[k] for k in path[1:-1]]
+    return ordered, _path_cost(matrix, path)
+
+def check_time_windows(stops, start=None, depart_at=None, matrix_fn=None, travel_fn=None):
+    """
+    Checks an ordered route against its stops' time windows.
+    Returns (feasible, arrival seconds since midnight per stop, seconds late per stop).
+    """
+    if not stops:
+        return True, [], []
+    if matrix_fn is None:
+        matrix_fn, travel_fn = get_matrix_functions()
+    problem = _build_problem(stops, start, None, matrix_fn, depart_at, travel_fn)
+    path = np.array([problem['start_idx']] + list(range(len(stops))))
+    _, arrivals = _batch_lateness(problem, path)
+    arrivals = arrivals[0, 1:]
+    late = np.maximum(arrivals - problem['close_s'][:len(stops)], 0.0)
+    return bool((late <= 0).all()), arrivals.tolist(), late.tolist()
+
+def insertion_feasible(stops, new_stop, start=None, depart_at=None, matrix_fn=None, travel_fn=None):
+    """
+    For every position k in 0..len(stops), whether putting new_stop before
+    stops[k] keeps all time windows of the route. Returns a boolean array.
+    All positions are checked in one vectorized pass.
+    """
+    all_stops = list(stops) + [new_stop]
+    if matrix_fn is None:
+        matrix_fn, travel_fn = get_matrix_functions()
+    problem = _build_problem(all_stops, start, None, matrix_fn, depart_at, travel_fn)
+    new_idx = len(stops)
+    base = list(range(len(stops)))
+    paths = np.array([
+        [problem['start_idx']] + base[:k] + [new_idx] + base[k:]
+        for k in range(len(stops) + 1)
+    ])
+    late, _ = _batch_lateness(problem, paths)
+    return late <= 0
+
+def _route_nodes(stops, start=None, end=None):
+    nodes = [_stop_coords(s) for s in stops]
+    offset = 0
+    if start is not None:
+        nodes.insert(0, tuple(start))
+        offset = 1
+    if end is not None:
+        nodes.append(tuple(end))
+    return nodes, offset
+
+def insertion_costs(stops, new_stop, start=None, end=None, matrix_fn=None):
+    """
+    Extra distance (meters) of putting new_stop before stops[k], for every
+    k in 0..len(stops), as a numpy array. The last entry appends it.
+    Distances come from matrix_fn (default: get_matrix_functions()), so
+    they match what the route optimizer measures.
+    """
+    nodes, offset = _route_nodes(stops, start, end)
+    positions = np.arange(len(stops) + 1)
+    if not nodes:
+        return np.zeros(1)
+    if matrix_fn is None:
+        matrix_fn, _ = get_matrix_functions()
+
+    # The new stop is the last row/column; road distances need not be symmetric
+    matrix = np.asarray(matrix_fn(nodes + [_stop_coords(new_stop)]), dtype=float)
+    new = len(nodes)
+
+    pred = positions - 1 + offset
+    succ = positions + offset
+    has_pred = pred >= 0
+    has_succ = succ < len(nodes)
+    both = has_pred & has_succ
+
+    cost = np.zeros(len(positions))
+    cost[has_pred] += matrix[pred[has_pred], new]
+    cost[has_succ] += matrix[new, succ[has_succ]]
+    cost[both] -= matrix[pred[both], succ[both]]
+    return cost
+
+def removal_gains(stops, start=None, end=None, matrix_fn=None):
+    """
+    Distance (meters) saved by dropping each stop from an ordered route,
+    as a numpy array aligned with stops. Distances come from matrix_fn
+    (default: get_matrix_functions()).
+    """
+    if not stops:
+        return np.zeros(0)
+    if matrix_fn is None:
+        matrix_fn, _ = get_matrix_functions()
+    nodes, offset = _route_nodes(stops, start, end)
+    matrix = np.asarray(matrix_fn(nodes), dtype=float)
+    idx = np.arange(len(stops)) + offset
+
+    gains = np.zeros(len(stops))
+    has_pred = idx > 0
+    has_succ = idx < len(nodes) - 1
+    both = has_pred & has_succ
+    gains[has_pred] += matrix[idx[has_pred] - 1, idx[has_pred]]
+    gains[has_succ] += matrix[idx[has_succ], idx[has_succ] + 1]
+    gains[both] -= matrix[idx[both] - 1, idx[both] + 1]
+    return gains
+
+def route_distance(stops, start=None, end=None, matrix_fn=None):
+    """Total length in meters of an ordered route, including depot legs (default: get_matrix_functions())."""
+    nodes, _ = _route_nodes(stops, start, end)
+    if len(nodes) < 2:
+        return 0.0
+    if matrix_fn is None:
+        matrix_fn, _ = get_matrix_functions()
+    matrix = np.asarray(matrix_fn(nodes), dtype=float)
+    steps = np.arange(len(nodes) - 1)
+    return float(matrix[steps, steps + 1].sum())
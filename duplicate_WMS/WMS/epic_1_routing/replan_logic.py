@@ -0,0 +1,190 @@
+# In epic_1_routing/replan_logic.py
+
+import numpy as np
+from utils.db_connector import fetch_all, transaction
+from epic_1_routing.assignment_logic import get_booking_stop_details
+from epic_1_routing.auto_assign_logic import (
+    get_expected_volumes, DEFAULT_STOP_VOLUME_KG, DEFAULT_VEHICLE_CAPACITY_KG
+)
+from epic_1_routing.optimize_logic import get_depot, insertion_costs, insertion_feasible
+from epic_2_operations.assignment_cache import get_assignment_cache
+from epic_2_operations.eta_logic import get_eta_engine
+from epic_2_operations.geofence_logic import get_geofence_engine
+
+def get_active_routes():
+    """
+    Gets every stop of today's active ('Pending' or 'In Progress') assignments,
+    grouped per assignment. Returns {assignment_id: route dict}.
+    """
+    query = """
+        SELECT ra.assignment_id, v.capacity_kg,
+               rs.route_stop_id, rs.point_id, rs.booking_id, rs.stop_order,
+               rs.status, rs.collected_volume_kg, cp.latitude, cp.longitude,
+               COALESCE(sb.window_start, cp.window_start) AS window_start,
+               COALESCE(sb.window_end, cp.window_end) AS window_end,
+               cp.service_minutes
+        FROM RouteAssignments ra
+        JOIN Vehicles v ON ra.vehicle_id = v.vehicle_id
+        JOIN RouteStops rs ON rs.assignment_id = ra.assignment_id
+        JOIN CollectionPoints cp ON rs.point_id = cp.point_id
+        LEFT JOIN ServiceBookings sb ON rs.booking_id = sb.booking_id
+        WHERE ra.assigned_date = CURDATE()
+          AND ra.status IN ('Pending', 'In Progress')
+        ORDER BY ra.assignment_id, rs.stop_order
+    """
+    rows = fetch_all(query) or []
+    volumes = get_expected_volumes(r['point_id'] for r in rows if r['status'] == 'Pending')
+
+    routes = {}
+    for row in rows:
+        route = routes.setdefault(row['assignment_id'], {
+            'assignment_id': row['assignment_id'],
+            'capacity_kg': float(row['capacity_kg'] or DEFAULT_VEHICLE_CAPACITY_KG),
+            'load_kg': 0.0,
+            'last_position': None,
+            'last_stop_order': 0,
+            'pending': [],
+        })
+        route['last_stop_order'] = max(route['last_stop_order'], row['stop_order'])
+        if row['status'] == 'Pending':
+            route['pending'].append(row)
+            route['load_kg'] += volumes.get(row['point_id'], DEFAULT_STOP_VOLUME_KG)
+        else:
+            # Where the truck was last seen working: the insertion starts from there
+            route['last_position'] = (float(row['latitude']), float(row['longitude']))
+            route['load_kg'] += float(row['collected_volume_kg'] or 0)
+    return routes
+
+def _has_window(stop):
+    return bool(stop.get('window_start') or stop.get('window_end'))
+
+def find_cheapest_insertion(routes, booking, expected_kg, depot=None, depart_at=None):
+    """
+    Finds the active route and position where the booking adds the least
+    distance without overfilling the vehicle or making any stop miss its
+    time window. depart_at defaults to now.
+    Returns (route, position, added_distance_m) or None if nothing fits.
+    """
+    best = None
+    for route in routes.values():
+        if route['load_kg'] + expected_kg > route['capacity_kg']:
+            continue
+        start = route['last_position'] or depot
+        costs = insertion_costs(route['pending'], booking, start, depot)
+        if _has_window(booking) or any(_has_window(s) for s in route['pending']):
+            on_time = insertion_feasible(route['pending'], booking, start, depart_at)
+            costs = np.where(on_time, costs, np.inf)
+        position = int(np.argmin(costs))
+        if np.isinf(costs[position]):
+            continue
+        if best is None or costs[position] < best[2]:
+            best = (route, position, float(costs[position]))
+    return best
+
+ON_TODAYS_ROUTE = """
+    EXISTS (SELECT 1
+            FROM RouteStops rs
+            JOIN RouteAssignments ra ON rs.assignment_id = ra.assignment_id
+            WHERE rs.booking_id = %s AND ra.assigned_date = CURDATE())
+"""
+
+def _apply_insertion(route, position, booking):
+    """
+    Shifts the later stops of one assignment down and inserts the new stop,
+    in one transaction. Returns the stop_order given to the new stop, or
+    None if the booking is no longer pending (e.g. a supervisor assigned it
+    meanwhile) and nothing was written.
+    """
+    if position < len(route['pending']):
+        stop_order = route['pending'][position]['stop_order']
+    else:
+        stop_order = route['last_stop_order'] + 1
+
+    with transaction() as cursor:
+        cursor.execute("""
+            SELECT assignment_id FROM RouteAssignments
+            WHERE assignment_id = %s AND status IN ('Pending', 'In Progress')
+            FOR UPDATE
+        """, (route['assignment_id'],))
+        if not cursor.fetchone():
+            raise ValueError(f"Assignment {route['assignment_id']} is no longer active.")
+        # Locking the booking serializes concurrent insertions of it
+        cursor.execute(f"""
+            SELECT sb.booking_id FROM ServiceBookings sb
+            WHERE sb.booking_id = %s AND sb.status = 'Approved' AND NOT ({ON_TODAYS_ROUTE})
+            FOR UPDATE
+        """, (booking['booking_id'], booking['booking_id']))
+        if not cursor.fetchone():
+            return None
+        cursor.execute("""
+            UPDATE RouteStops
+            SET stop_order = stop_order + 1
+            WHERE assignment_id = %s AND stop_order >= %s
+        """, (route['assignment_id'], stop_order))
+        cursor.execute(f"""
+            INSERT INTO RouteStops (assignment_id, point_id, booking_id, stop_order, status)
+            SELECT %s, %s, %s, %s, 'Pending' FROM DUAL
+            WHERE NOT ({ON_TODAYS_ROUTE})
+        """, (route['assignment_id'], booking['point_id'], booking['booking_id'], stop_order, booking['booking_id']))
+        if cursor.rowcount != 1:
+            raise ValueError(f"Booking {booking['booking_id']} is already on a route.")
+        cursor.execute("""
+            UPDATE RouteAssignments SET total_stops = total_stops + 1 WHERE assignment_id = %s
+        """, (route['assignment_id'],))
+    get_assignment_cache().invalidate_assignment(route['assignment_id'])
+    # Later stops' ETAs move and the new stop needs a geofence
+    get_eta_engine().invalidate()
+    get_geofence_engine().invalidate()
+    return stop_order
+
+def insert_late_bookings(booking_ids):
+    """
+    Adds bookings into today's already published routes at their cheapest
+    position that keeps capacity and time windows, without re-optimizing
+    any route. Only the stops of the chosen assignment are renumbered.
+    Returns {booking_id: (assignment_id, stop_order) or None if it did not fit}.
+    """
+    results = {booking_id: None for booking_id in booking_ids}
+    bookings = get_booking_stop_details(list(booking_ids), pending_only=True)
+    if not bookings:
+        return results
+    routes = get_active_routes()
+    if not routes:
+        return results
+
+    depot = get_depot()
+    volumes = get_expected_volumes(b['point_id'] for b in bookings)
+    for booking in bookings:
+        expected_kg = volumes.get(booking['point_id'], DEFAULT_STOP_VOLUME_KG)
+        best = find_cheapest_insertion(routes, booking, expected_kg, depot)
+        if best is None:
+            continue
+        route, position, added_distance = best
+        try:
+            stop_order = _apply_insertion(route, position, booking)
+        except Exception as e:
+            print(f"Error inserting booking {booking['booking_id']}: {e}")
+            routes.pop(route['assignment_id'], None)
+            continue
+        if stop_order is None:
+            print(f"Booking {booking['booking_id']} is no longer pending; not inserted.")
+            continue
+
+        # Keep the in-memory route in step so the next booking sees this one
+        for stop in route['pending'][position:]:
+            stop['stop_order'] += 1
+        route['last_stop_order'] += 1
+        new_stop = dict(booking, stop_order=stop_order, status='Pending')
+        route['pending'].insert(position, new_stop)
+        route['load_kg'] += expected_kg
+        results[booking['booking_id']] = (route['assignment_id'], stop_order)
+        print(f"Booking {booking['booking_id']} added to assignment {route['assignment_id']} "
+              f"as stop {stop_order} (+{added_distance:.0f} m).")
+    return results
+
+def insert_late_booking(booking_id):
+    """
+    Adds a single booking to the best already published route for today.
+    Returns (assignment_id, stop_order) or None if no route could take it.
+    """
+    return insert_late_bookings([booking_id]).get(booking_id)
@@ -0,0 +1,391 @@
+# In epic_1_routing/road_network.py
+
+import os
+import heapq
+import sqlite3
+import xml.etree.ElementTree as ET
+import numpy as np
+from utils.geo_utils import distance_matrix, pairwise_distances
+
+# Free-flow speeds (km/h) used when a way has no usable maxspeed tag
+HIGHWAY_SPEEDS_KMH = {
+    'motorway': 80, 'motorway_link': 40,
+    'trunk': 60, 'trunk_link': 35,
+    'primary': 45, 'primary_link': 30,
+    'secondary': 40, 'secondary_link': 30,
+    'tertiary': 35, 'tertiary_link': 25,
+    'unclassified': 25, 'residential': 25,
+    'living_street': 10, 'service': 15, 'road': 25,
+}
+# How much longer than a straight line a trip is assumed to be when the
+# road graph has no path between two points
+DETOUR_FACTOR = 1.4
+# Grid cell size (degrees) of the spatial index used to snap points to nodes
+SNAP_CELL_DEG = 0.01
+GRAPH_FORMAT_VERSION = 1
+
+_network = None
+_last_matrices = None
+
+def _parse_speed(value, highway):
+    if value:
+        try:
+            number = float(value.split()[0])
+            return number * 1.609 if 'mph' in value else number
+        except ValueError:
+            pass
+    return HIGHWAY_SPEEDS_KMH[highway]
+
+def _oneway_direction(tags):
+    """1 = only along the way, -1 = only against it, 0 = both directions."""
+    value = tags.get('oneway', '').lower()
+    if value in ('yes', 'true', '1'):
+        return 1
+    if value == '-1':
+        return -1
+    if value == 'no':
+        return 0
+    if tags.get('junction') in ('roundabout', 'circular') or tags.get('highway') == 'motorway':
+        return 1
+    return 0
+
+def _file_signature(path):
+    stat = os.stat(path)
+    return f"{os.path.basename(path)}:{stat.st_size}:{int(stat.st_mtime)}:v{GRAPH_FORMAT_VERSION}"
+
+class RoadNetwork:
+    """
+    A drivable road graph in compressed sparse row (CSR) form: the edges
+    leaving node u are indices[indptr[u]:indptr[u + 1]], with their travel
+    time in seconds and length in meters.
+    """
+
+    def __init__(self, node_ids, node_lat, node_lon, indptr, indices, seconds, meters,
+                 signature='', cache_path=None):
+        self.node_ids = np.asarray(node_ids, dtype=np.int64)
+        self.node_lat = np.asarray(node_lat, dtype=float)
+        self.node_lon = np.asarray(node_lon, dtype=float)
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.indices = np.asarray(indices, dtype=np.int64)
+        self.seconds = np.asarray(seconds, dtype=float)
+        self.meters = np.asarray(meters, dtype=float)
+        self.signature = signature
+        self.cache_path = cache_path
+        self.max_speed_mps = float((self.meters / np.maximum(self.seconds, 1e-9)).max()) if len(self.meters) else 1.0
+
+        # Plain lists are much faster than numpy scalars inside the search loops
+        self._indptr = self.indptr.tolist()
+        self._indices = self.indices.tolist()
+        self._seconds = self.seconds.tolist()
+        self._meters = self.meters.tolist()
+        self._build_snap_index()
+
+    # --- Loading ---------------------------------------------------------
+
+    @classmethod
+    def from_osm_xml(cls, path, cache_path=None):
+        """
+        Builds the graph from a local OpenStreetMap XML extract (.osm).
+        Only ways with a drivable highway tag are kept; one-way streets
+        only get an edge in their direction of travel.
+        """
+        node_coords = {}
+        ways = []
+        for _, elem in ET.iterparse(path, events=('end',)):
+            if elem.tag == 'node':
+                node_coords[int(elem.get('id'))] = (float(elem.get('lat')), float(elem.get('lon')))
+                elem.clear()
+            elif elem.tag == 'way':
+                tags = {t.get('k'): t.get('v') for t in elem.findall('tag')}
+                if tags.get('highway') in HIGHWAY_SPEEDS_KMH and tags.get('access') not in ('no', 'private'):
+                    refs = [int(nd.get('ref')) for nd in elem.findall('nd')]
+                    speed = _parse_speed(tags.get('maxspeed'), tags['highway'])
+                    ways.append((refs, speed, _oneway_direction(tags)))
+                elem.clear()
+
+        used = sorted({ref for refs, _, _ in ways for ref in refs if ref in node_coords})
+        index = {osm_id: i for i, osm_id in enumerate(used)}
+        lat = np.array([node_coords[i][0] for i in used])
+        lon = np.array([node_coords[i][1] for i in used])
+
+        src, dst, speeds = [], [], []
+        for refs, speed, direction in ways:
+            refs = [index[r] for r in refs if r in index]
+            for a, b in zip(refs[:-1], refs[1:]):
+                if direction >= 0:
+                    src.append(a); dst.append(b); speeds.append(speed)
+                if direction <= 0:
+                    src.append(b); dst.append(a); speeds.append(speed)
+
+        src = np.array(src, dtype=np.int64)
+        dst = np.array(dst, dtype=np.int64)
+        meters = pairwise_distances(np.column_stack((lat[src], lon[src])),
+                                    np.column_stack((lat[dst], lon[dst]))) if len(src) else np.zeros(0)
+        seconds = meters / (np.array(speeds, dtype=float) / 3.6) if len(src) else np.zeros(0)
+
+        order = np.argsort(src, kind='stable')
+        indptr = np.concatenate(([0], np.cumsum(np.bincount(src, minlength=len(used)))))
+        return cls(used, lat, lon, indptr, dst[order], seconds[order], meters[order],
+                   signature=_file_signature(path), cache_path=cache_path)
+
+    def save(self, path):
+        """Saves the compiled graph so later loads skip the XML parsing."""
+        np.savez_compressed(
+            path, node_ids=self.node_ids, node_lat=self.node_lat, node_lon=self.node_lon,
+            indptr=self.indptr, indices=self.indices, seconds=self.seconds, meters=self.meters,
+            signature=np.array(self.signature)
+        )
+
+    @classmethod
+    def load(cls, osm_path, cache_path=None):
+        """
+        Loads the graph for an OSM extract, reusing the compiled .npz next to
+        it when it was built from the same file.
+        """
+        compiled_path = osm_path + '.graph.npz'
+        signature = _file_signature(osm_path)
+        if os.path.exists(compiled_path):
+            with np.load(compiled_path) as data:
+                if str(data['signature']) == signature:
+                    return cls(data['node_ids'], data['node_lat'], data['node_lon'], data['indptr'],
+                               data['indices'], data['seconds'], data['meters'],
+                               signature=signature, cache_path=cache_path)
+        network = cls.from_osm_xml(osm_path, cache_path=cache_path)
+        try:
+            network.save(compiled_path)
+        except OSError as e:
+            print(f"Could not save compiled road graph: {e}")
+        return network
+
+    # --- Snapping ----------------------------------------------------------
+
+    def _build_snap_index(self):
+        rows = np.floor(self.node_lat / SNAP_CELL_DEG).astype(np.int64)
+        cols = np.floor(self.node_lon / SNAP_CELL_DEG).astype(np.int64)
+        keys = rows * 1_000_003 + cols
+        self._snap_order = np.argsort(keys, kind='stable')
+        self._snap_keys = keys[self._snap_order]
+
+    def _candidates(self, lat, lon):
+        row = int(np.floor(lat / SNAP_CELL_DEG))
+        col = int(np.floor(lon / SNAP_CELL_DEG))
+        found = []
+        for dr in (-1, 0, 1):
+            for dc in (-1, 0, 1):
+                key = (row + dr) * 1_000_003 + (col + dc)
+                lo = np.searchsorted(self._snap_keys, key, side='left')
+                hi = np.searchsorted(self._snap_keys, key, side='right')
+                found.append(self._snap_order[lo:hi])
+        return np.concatenate(found)
+
+    def snap(self, coords):
+        """
+        Finds the nearest graph node for each (lat, lon).
+        Returns (node indices, distance in meters from each point to its node).
+        """
+        nodes, offsets = [], []
+        for lat, lon in np.asarray(coords, dtype=float).reshape(-1, 2):
+            candidates = self._candidates(lat, lon)
+            if len(candidates) == 0:
+                candidates = np.arange(len(self.node_ids))
+            d = distance_matrix([(lat, lon)], np.column_stack((self.node_lat[candidates],
+                                                                self.node_lon[candidates])))[0]
+            k = int(np.argmin(d))
+            nodes.append(int(candidates[k]))
+            offsets.append(float(d[k]))
+        return np.array(nodes, dtype=np.int64), np.array(offsets)
+
+    # --- Shortest paths ------------------------------------------------------
+
+    def shortest_paths(self, source, targets):
+        """
+        Dijkstra by travel time from one node, stopping as soon as every
+        target is settled. Returns {target: (seconds, meters)} for the
+        targets that can be reached.
+        """
+        indptr, indices, seconds, meters = self._indptr, self._indices, self._seconds, self._meters
+        best = {source: 0.0}
+        length = {source: 0.0}
+        remaining = set(targets)
+        settled = set()
+        heap = [(0.0, source)]
+        while heap and remaining:
+            time_u, u = heapq.heappop(heap)
+            if u in settled:
+                continue
+            settled.add(u)
+            remaining.discard(u)
+            for e in range(indptr[u], indptr[u + 1]):
+                v = indices[e]
+                time_v = time_u + seconds[e]
+                if time_v < best.get(v, float('inf')):
+                    best[v] = time_v
+                    length[v] = length[u] + meters[e]
+                    heapq.heappush(heap, (time_v, v))
+        return {t: (best[t], length[t]) for t in targets if t in settled}
+
+    def route(self, source, target):
+        """
+        A* search for the fastest path between two nodes, guided by the
+        straight-line distance at the network's top speed.
+        Returns (seconds, meters, [node indices]) or None if unreachable.
+        """
+        indptr, indices, seconds, meters = self._indptr, self._indices, self._seconds, self._meters
+        remaining_s = (distance_matrix(np.column_stack((self.node_lat, self.node_lon)),
+                                       [(self.node_lat[target], self.node_lon[target])])[:, 0]
+                       / self.max_speed_mps).tolist()
+
+        def heuristic(node):
+            return remaining_s[node]
+
+        best = {source: 0.0}
+        length = {source: 0.0}
+        previous = {}
+        heap = [(heuristic(source), source)]
+        settled = set()
+        while heap:
+            _, u = heapq.heappop(heap)
+            if u in settled:
+                continue
+            if u == target:
+                path = [u]
+                while path[-1] in previous:
+                    path.append(previous[path[-1]])
+                return best[u], length[u], path[::-1]
+            settled.add(u)
+            for e in range(indptr[u], indptr[u + 1]):
+                v = indices[e]
+                time_v = best[u] + seconds[e]
+                if time_v < best.get(v, float('inf')):
+                    best[v] = time_v
+                    length[v] = length[u] + meters[e]
+                    previous[v] = u
+                    heapq.heappush(heap, (time_v + heuristic(v), v))
+        return None
+
+    # --- Matrix cache --------------------------------------------------------
+
+    def _open_cache(self):
+        conn = sqlite3.connect(self.cache_path)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS travel_cache (
+                from_node INTEGER NOT NULL,
+                to_node INTEGER NOT NULL,
+                seconds REAL NOT NULL,
+                meters REAL NOT NULL,
+                PRIMARY KEY (from_node, to_node)
+            ) WITHOUT ROWID
+        """)
+        conn.execute("CREATE TABLE IF NOT EXISTS cache_meta (key TEXT PRIMARY KEY, value TEXT)")
+        row = conn.execute("SELECT value FROM cache_meta WHERE key = 'signature'").fetchone()
+        if not row or row[0] != self.signature:
+            # Built from another extract: every cached pair is stale
+            conn.execute("DELETE FROM travel_cache")
+            conn.execute("INSERT OR REPLACE INTO cache_meta VALUES ('signature', ?)", (self.signature,))
+            conn.commit()
+        return conn
+
+    def travel_matrix(self, coords):
+        """
+        Road travel times (seconds) and distances (meters) between every pair
+        of (lat, lon) points, as two square numpy arrays. Node-to-node results
+        are memoized in the on-disk cache, so only new pairs are searched.
+        Pairs with no road path fall back to the straight line times DETOUR_FACTOR.
+        """
+        nodes, offsets = self.snap(coords)
+        osm_ids = self.node_ids[nodes].tolist()
+        unique_nodes = sorted(set(nodes.tolist()))
+        known = {}
+
+        conn = self._open_cache() if self.cache_path else None
+        try:
+            if conn:
+                # The nodes go through a temp table, not IN (?, ...): SQLite caps
+                # the bound variables of one statement (999 before 3.32)
+                conn.execute("CREATE TEMP TABLE wanted_nodes (node INTEGER PRIMARY KEY)")
+                conn.executemany("INSERT OR IGNORE INTO wanted_nodes VALUES (?)", [(i,) for i in osm_ids])
+                for row in conn.execute("""
+                    SELECT c.from_node, c.to_node, c.seconds, c.meters
+                    FROM wanted_nodes f
+                    JOIN travel_cache c ON c.from_node = f.node
+                    JOIN wanted_nodes t ON t.node = c.to_node
+                """):
+                    known[(row[0], row[1])] = (row[2], row[3])
+
+            new_rows = []
+            for u in unique_nodes:
+                missing = [v for v in unique_nodes
+                           if v != u and (int(self.node_ids[u]), int(self.node_ids[v])) not in known]
+                if not missing:
+                    continue
+                for v, result in self.shortest_paths(u, missing).items():
+                    key = (int(self.node_ids[u]), int(self.node_ids[v]))
+                    known[key] = result
+                    new_rows.append(key + result)
+            if conn and new_rows:
+                conn.executemany("INSERT OR REPLACE INTO travel_cache VALUES (?, ?, ?, ?)", new_rows)
+                conn.commit()
+        finally:
+            if conn:
+                conn.close()
+
+        n = len(nodes)
+        straight = distance_matrix(coords)
+        seconds = np.zeros((n, n))
+        meters = np.zeros((n, n))
+        speed = self.max_speed_mps
+        for i in range(n):
+            for j in range(n):
+                if i == j:
+                    continue
+                if osm_ids[i] == osm_ids[j]:
+                    seconds[i, j], meters[i, j] = straight[i, j] / speed, straight[i, j]
+                    continue
+                result = known.get((osm_ids[i], osm_ids[j]))
+                if result is None:
+                    meters[i, j] = straight[i, j] * DETOUR_FACTOR
+                    seconds[i, j] = meters[i, j] / speed
+                else:
+                    # Getting from each point onto the road network and off it again
+                    access = offsets[i] + offsets[j]
+                    seconds[i, j] = result[0] + access / speed
+                    meters[i, j] = result[1] + access
+        return seconds, meters
+
+def get_road_network():
+    """
+    Returns the road network built from the OSM extract named by
+    OSM_EXTRACT_PATH in .env, loading it once per process.
+    Returns None when no extract is configured or it cannot be read.
+    """
+    global _network
+    if _network is not None:
+        return _network
+    path = os.getenv('OSM_EXTRACT_PATH')
+    if not path or not os.path.exists(path):
+        return None
+    cache_path = os.getenv('ROAD_CACHE_PATH') or path + '.cache.sqlite'
+    try:
+        _network = RoadNetwork.load(path, cache_path=cache_path)
+        print(f"Road network loaded: {len(_network.node_ids)} nodes, {len(_network.indices)} edges.")
+    except (OSError, ET.ParseError) as e:
+        print(f"Error loading road network from {path}: {e}")
+        return None
+    return _network
+
+def _matrices_for(coords):
+    # The sequencer asks for distances and then times for the same points;
+    # remember the last answer so the second call is free.
+    global _last_matrices
+    key = tuple((round(float(lat), 7), round(float(lon), 7)) for lat, lon in coords)
+    if _last_matrices is None or _last_matrices[0] != key:
+        _last_matrices = (key, get_road_network().travel_matrix(coords))
+    return _last_matrices[1]
+
+def road_distance_matrix(coords):
+    """Road distances in meters between every pair of points (matrix_fn for the sequencer)."""
+    return _matrices_for(coords)[1]
+
+def road_travel_time_matrix(coords):
+    """Road travel times in seconds between every pair of points (travel_fn for the sequencer)."""
+    return _matrices_for(coords)[0]
@@ -0,0 +1,148 @@
+# In epic_1_routing/zoning_logic.py
+
+import math
+import numpy as np
+from epic_1_routing.assignment_logic import get_pending_bookings
+from epic_1_routing.auto_assign_logic import (
+    get_expected_volumes, DEFAULT_STOP_VOLUME_KG, DEFAULT_VEHICLE_CAPACITY_KG
+)
+from utils.geo_utils import EARTH_RADIUS_M
+
+DEFAULT_MAX_ITER = 50
+# k-means stops once no centre moves by more than this (meters)
+CONVERGENCE_M = 1.0
+# The first pass clusters into at most this many regions; heavier regions
+# are then split on their own, which is far cheaper than one huge k-means
+MAX_FIRST_PASS_ZONES = 32
+
+def project(coords, origin=None):
+    """
+    Projects (lat, lon) pairs onto a flat x/y plane in meters around origin
+    (default: their mean). Accurate enough for clustering within a city.
+    """
+    coords = np.asarray(coords, dtype=float).reshape(-1, 2)
+    if origin is None:
+        origin = coords.mean(axis=0) if len(coords) else np.zeros(2)
+    lat0, lon0 = np.radians(origin)
+    lat, lon = np.radians(coords[:, 0]), np.radians(coords[:, 1])
+    x = (lon - lon0) * math.cos(lat0) * EARTH_RADIUS_M
+    y = (lat - lat0) * EARTH_RADIUS_M
+    return np.column_stack((x, y))
+
+def _sq_distances(points, centers):
+    # |p - c|^2 = |p|^2 - 2 p.c + |c|^2, for all pairs in one matrix product
+    d = (points ** 2).sum(axis=1)[:, None] - 2 * points @ centers.T + (centers ** 2).sum(axis=1)[None, :]
+    return np.maximum(d, 0)
+
+def _kmeans_plus_plus(points, k, rng):
+    """Spreads the initial centres out: each one is drawn weighted by squared distance."""
+    centers = np.empty((k, points.shape[1]))
+    centers[0] = points[rng.integers(len(points))]
+    closest = ((points - centers[0]) ** 2).sum(axis=1)
+    for i in range(1, k):
+        total = closest.sum()
+        if total <= 0:
+            centers[i:] = centers[0]
+            break
+        centers[i] = points[rng.choice(len(points), p=closest / total)]
+        closest = np.minimum(closest, ((points - centers[i]) ** 2).sum(axis=1))
+    return centers
+
+def kmeans(points, k, weights=None, max_iter=DEFAULT_MAX_ITER, seed=0):
+    """
+    Weighted k-means (Lloyd's algorithm) on projected points.
+    Returns (labels, centers) with labels an int array aligned with points.
+    """
+    points = np.asarray(points, dtype=float)
+    k = max(1, min(k, len(points)))
+    weights = np.ones(len(points)) if weights is None else np.asarray(weights, dtype=float)
+    rng = np.random.default_rng(seed)
+    centers = _kmeans_plus_plus(points, k, rng)
+    labels = np.zeros(len(points), dtype=np.int64)
+    for _ in range(max_iter):
+        labels = np.argmin(_sq_distances(points, centers), axis=1)
+        mass = np.bincount(labels, weights=weights, minlength=k)
+        sums = np.column_stack([
+            np.bincount(labels, weights=weights * points[:, dim], minlength=k)
+            for dim in range(points.shape[1])
+        ])
+        # Empty clusters keep their old centre
+        new_centers = np.where(mass[:, None] > 0, sums / np.maximum(mass, 1e-12)[:, None], centers)
+        shift = np.sqrt(((new_centers - centers) ** 2).sum(axis=1)).max()
+        centers = new_centers
+        if shift < CONVERGENCE_M:
+            break
+    return labels, centers
+
+def _split_to_capacity(points, kg, members, max_cluster_kg, seed):
+    """
+    Breaks a group of point indices into pieces of at most max_cluster_kg,
+    re-clustering only the groups that are too heavy.
+    """
+    done = []
+    pending = [members]
+    while pending:
+        group = pending.pop()
+        group_kg = kg[group].sum()
+        if group_kg <= max_cluster_kg or len(group) == 1:
+            done.append(group)
+            continue
+        parts = max(2, math.ceil(group_kg / max_cluster_kg))
+        labels, _ = kmeans(points[group], parts, kg[group], seed=seed)
+        pieces = [group[labels == label] for label in np.unique(labels)]
+        if len(pieces) == 1:
+            # All at the same spot: split by order so each piece still fits
+            piece = np.floor((np.cumsum(kg[group]) - 1e-9) / max_cluster_kg)
+            pieces = [group[piece == n] for n in np.unique(piece)]
+        pending.extend(pieces)
+    return done
+
+def cluster_bookings(bookings, volumes=None, max_cluster_kg=DEFAULT_VEHICLE_CAPACITY_KG, seed=0):
+    """
+    Groups bookings into geographic zones whose estimated load fits in one
+    vehicle. A first k-means pass cuts the area into regions, then every
+    region over max_cluster_kg is split again until all zones fit.
+
+    Returns a list of zone dicts (largest first) with zone_id, centroid
+    (lat, lon), count, estimated_kg, booking_ids and bookings.
+    """
+    if not bookings:
+        return []
+    volumes = volumes or {}
+    coords = np.array([(float(b['latitude']), float(b['longitude'])) for b in bookings])
+    kg = np.array([volumes.get(b['point_id'], DEFAULT_STOP_VOLUME_KG) for b in bookings])
+    points = project(coords)
+
+    k = min(max(1, math.ceil(kg.sum() / max_cluster_kg)), MAX_FIRST_PASS_ZONES)
+    labels, _ = kmeans(points, k, kg, seed=seed)
+    groups = []
+    for label in np.unique(labels):
+        members = np.flatnonzero(labels == label)
+        groups.extend(_split_to_capacity(points, kg, members, max_cluster_kg, seed))
+
+    groups.sort(key=lambda g: (-len(g), int(g[0])))
+    zones = []
+    for zone_id, group in enumerate(groups, 1):
+        zone_kg = kg[group]
+        if zone_kg.sum() > 0:
+            centroid = np.average(coords[group], axis=0, weights=zone_kg)
+        else:
+            centroid = coords[group].mean(axis=0)
+        zones.append({
+            'zone_id': zone_id,
+            'centroid': (float(centroid[0]), float(centroid[1])),
+            'count': len(group),
+            'estimated_kg': float(zone_kg.sum()),
+            'booking_ids': [bookings[i]['booking_id'] for i in group],
+            'bookings': [bookings[i] for i in group],
+        })
+    return zones
+
+def get_pending_booking_zones(max_cluster_kg=DEFAULT_VEHICLE_CAPACITY_KG):
+    """
+    Clusters today's pending bookings into zones of at most max_cluster_kg
+    so the supervisor can assign a whole zone to one vehicle.
+    """
+    bookings = get_pending_bookings() or []
+    volumes = get_expected_volumes(b['point_id'] for b in bookings)
+    return cluster_bookings(bookings, volumes, max_cluster_kg)
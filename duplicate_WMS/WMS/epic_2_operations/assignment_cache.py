@@ -0,0 +1,142 @@
+# In epic_2_operations/assignment_cache.py
+
+import time
+import datetime
+import threading
+from utils.db_connector import fetch_all
+
+# A driver without an active assignment is looked up again after this long,
+# in case one was created by another process
+NO_ASSIGNMENT_TTL_S = 60.0
+
+_assignment_cache = None
+_assignment_cache_lock = threading.Lock()
+
+ACTIVE_ASSIGNMENT_QUERY = """
+    SELECT ra.assignment_id, ra.vehicle_id,
+           rs.route_stop_id, rs.booking_id, rs.status,
+           cp.point_name, cp.address, cp.latitude, cp.longitude,
+           sb.client_id, u.email AS client_email, cp.tariff_zone, sb.waste_type
+    FROM RouteAssignments ra
+    LEFT JOIN RouteStops rs ON rs.assignment_id = ra.assignment_id AND rs.status = 'Pending'
+    LEFT JOIN CollectionPoints cp ON rs.point_id = cp.point_id
+    LEFT JOIN ServiceBookings sb ON rs.booking_id = sb.booking_id
+    LEFT JOIN Users u ON sb.client_id = u.user_id
+    WHERE ra.driver_id = %s
+      AND ra.assigned_date = %s
+      AND ra.status IN ('Pending', 'In Progress')
+    ORDER BY ra.assignment_id, rs.stop_order
+"""
+
+class AssignmentCache:
+    """
+    Each driver's active assignment for a day: its vehicle, assignment id
+    and pending stops in route order, read with one query and then kept in
+    memory. Keyed by (driver_id, date) so yesterday's entries are never
+    served. Whatever changes an assignment (creation, re-planning, a
+    completed stop or route) must tell the cache.
+    """
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._entries = {}   # (driver_id, date) -> (assignment dict or None, expires_at)
+        self._invalidations = 0
+
+    def _load(self, driver_id, day):
+        rows = fetch_all(ACTIVE_ASSIGNMENT_QUERY, (driver_id, day))
+        if rows is None:
+            return None, False  # query failed: do not remember anything
+        if not rows:
+            return None, True
+        assignment_id = rows[0]['assignment_id']
+        stops = [
+            {
+                'route_stop_id': r['route_stop_id'],
+                'booking_id': r['booking_id'],
+                'point_name': r['point_name'],
+                'address': r['address'],
+                'latitude': r['latitude'],
+                'longitude': r['longitude'],
+                'status': r['status'],
+                # What the stop is priced by
+                'client_id': r['client_id'],
+                'tariff_zone': r['tariff_zone'],
+                'waste_type': r['waste_type'],
+                # Who pays for it, and where the receipt goes
+                'client_email': r['client_email'],
+            }
+            for r in rows if r['assignment_id'] == assignment_id and r['route_stop_id'] is not None
+        ]
+        return {'assignment_id': assignment_id, 'vehicle_id': rows[0]['vehicle_id'], 'stops': stops}, True
+
+    def get(self, driver_id, day=None):
+        """
+        Returns {assignment_id, vehicle_id, stops} for the driver's active
+        assignment on day (default today), or None if there is none.
+        The dict is shared: callers must not modify it.
+        """
+        day = day or datetime.date.today()
+        key = (driver_id, day)
+        now = self.clock()
+        with self._lock:
+            cached = self._entries.get(key)
+            if cached and (cached[1] is None or cached[1] > now):
+                return cached[0]
+            invalidations = self._invalidations
+
+        assignment, ok = self._load(driver_id, day)
+        if ok:
+            expires_at = None if assignment else now + NO_ASSIGNMENT_TTL_S
+            with self._lock:
+                if invalidations != self._invalidations:
+                    return assignment   # an assignment changed while it was read: do not keep it
+                # Entries of earlier days can never be asked for again
+                for old_key in [k for k in self._entries if k[1] != day]:
+                    del self._entries[old_key]
+                self._entries[key] = (assignment, expires_at)
+        return assignment
+
+    def find_stop(self, driver_id, route_stop_id, day=None):
+        """Returns the cached pending stop with that id, or None."""
+        assignment = self.get(driver_id, day)
+        if not assignment:
+            return None
+        return next((s for s in assignment['stops'] if s['route_stop_id'] == route_stop_id), None)
+
+    def complete_stop(self, driver_id, route_stop_id, day=None):
+        """Drops a stop from the driver's cached pending list."""
+        key = (driver_id, day or datetime.date.today())
+        with self._lock:
+            # A load in flight may have read the stop before it was completed
+            self._invalidations += 1
+            cached = self._entries.get(key)
+            if cached and cached[0]:
+                assignment = dict(cached[0])
+                assignment['stops'] = [s for s in assignment['stops'] if s['route_stop_id'] != route_stop_id]
+                self._entries[key] = (assignment, cached[1])
+
+    def invalidate(self, driver_id=None):
+        """Forgets one driver's entries (or everything)."""
+        with self._lock:
+            self._invalidations += 1
+            if driver_id is None:
+                self._entries.clear()
+            else:
+                for key in [k for k in self._entries if k[0] == driver_id]:
+                    del self._entries[key]
+
+    def invalidate_assignment(self, assignment_id):
+        """Forgets whichever driver's entry holds that assignment."""
+        with self._lock:
+            self._invalidations += 1
+            for key in [k for k, v in self._entries.items() if v[0] and v[0]['assignment_id'] == assignment_id]:
+                del self._entries[key]
+
+def get_assignment_cache():
+    """The process-wide assignment cache."""
+    global _assignment_cache
+    with _assignment_cache_lock:
+        if _assignment_cache is None:
+            _assignment_cache = AssignmentCache()
+        return _assignment_cache
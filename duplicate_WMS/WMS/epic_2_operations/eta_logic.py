@@ -0,0 +1,436 @@
+# In epic_2_operations/eta_logic.py
+#
+# Arrival estimates for every pending stop of today's routes, kept up to
+# date from the GPS feed, and "your truck is N minutes away" notifications
+# for the clients of those stops.
+
+import time
+import queue
+import atexit
+import datetime
+import threading
+from collections import defaultdict
+import numpy as np
+from utils.db_connector import fetch_all, execute_many
+from utils.geo_utils import pairwise_distances, path_distances, calculate_distance
+from utils.email_utils import send_eta_email
+from epic_1_routing.optimize_logic import AVERAGE_SPEED_KMH, DEFAULT_SERVICE_MINUTES
+from epic_2_operations.geofence_logic import get_stop_arrival, EXIT_RADIUS_M
+
+# Clients hear from us when their stop's ETA first drops to each of these (minutes)
+NOTIFY_THRESHOLDS_MIN = (30, 10)
+# Notifications are sent in batches, this often
+NOTIFY_INTERVAL_S = 30.0
+# Today's routes are re-read this often (in the background), to pick up new and re-planned routes
+REFRESH_INTERVAL_S = 300.0
+# Historical leg times: how far back, and how many trips make a leg time trustworthy
+SEGMENT_WINDOW_DAYS = 60
+SEGMENT_MIN_TRIPS = 2
+# Seconds per meter of straight-line distance when a leg has no history
+DEFAULT_SECONDS_PER_M = 3.6 / AVERAGE_SPEED_KMH
+
+ROUTE_STOPS_QUERY = """
+    SELECT ra.vehicle_id, ra.assignment_id, rs.route_stop_id, rs.point_id, rs.booking_id, rs.status,
+           cp.point_name, cp.latitude, cp.longitude, cp.service_minutes,
+           u.user_id AS client_id, u.email,
+           sent.notified_minutes
+    FROM RouteAssignments ra
+    JOIN RouteStops rs ON rs.assignment_id = ra.assignment_id
+    JOIN CollectionPoints cp ON rs.point_id = cp.point_id
+    LEFT JOIN ServiceBookings sb ON rs.booking_id = sb.booking_id
+    LEFT JOIN Users u ON u.user_id = COALESCE(sb.client_id, cp.client_id)
+    LEFT JOIN (
+        SELECT route_stop_id, MIN(threshold_minutes) AS notified_minutes
+        FROM ClientNotifications
+        WHERE created_at >= CURDATE()
+        GROUP BY route_stop_id
+    ) AS sent ON sent.route_stop_id = rs.route_stop_id
+    WHERE ra.assigned_date = CURDATE()
+      AND ra.status IN ('Pending', 'In Progress')
+    ORDER BY ra.vehicle_id, ra.assignment_id, rs.stop_order
+"""
+# Time from leaving one collection point to arriving at the next, from the geofence events
+SEGMENT_TIMES_QUERY = """
+    SELECT from_point, to_point, AVG(seconds) AS seconds
+    FROM (
+        SELECT rs.point_id AS from_point,
+               LEAD(rs.point_id) OVER w AS to_point,
+               ge.event_type,
+               LEAD(ge.event_type) OVER w AS next_type,
+               TIMESTAMPDIFF(SECOND, ge.event_time, LEAD(ge.event_time) OVER w) AS seconds
+        FROM GeofenceEvents ge
+        JOIN RouteStops rs ON ge.route_stop_id = rs.route_stop_id
+        WHERE ge.event_time >= NOW() - INTERVAL %s DAY
+        WINDOW w AS (PARTITION BY ge.vehicle_id ORDER BY ge.event_time, ge.event_id)
+    ) AS legs
+    WHERE event_type = 'departed' AND next_type = 'arrived'
+      AND from_point <> to_point AND seconds > 0
+    GROUP BY from_point, to_point
+    HAVING COUNT(*) >= %s
+"""
+INSERT_NOTIFICATIONS_QUERY = """
+    INSERT INTO ClientNotifications
+        (client_id, booking_id, route_stop_id, threshold_minutes, minutes_away, eta, emailed)
+    VALUES (%s, %s, %s, %s, %s, %s, %s)
+"""
+
+_engine = None
+_engine_lock = threading.Lock()
+
+def _epoch_seconds(timestamp):
+    return timestamp.timestamp() if isinstance(timestamp, datetime.datetime) else float(timestamp)
+
+def build_plan(stops, segments, previous_point=None):
+    """
+    Precomputes the part of a route's ETAs that does not depend on where
+    the truck is: offsets[k] is the time from arriving at the first pending
+    stop to arriving at stop k (legs plus service times in between). Each
+    GPS point then only adds the approach to the first stop.
+    stops are the pending stops in route order; segments maps
+    (from point_id, to point_id) to historical leg seconds; previous_point
+    is the stop the truck last completed, if any.
+    """
+    coords = np.array([(float(s['latitude']), float(s['longitude'])) for s in stops], dtype=float).reshape(-1, 2)
+    points = [s['point_id'] for s in stops]
+    travel = path_distances(coords) * DEFAULT_SECONDS_PER_M
+    for k, leg in enumerate(zip(points[:-1], points[1:])):
+        if leg in segments:
+            travel[k] = segments[leg]
+    service = np.array([60.0 * float(s['service_minutes'] if s['service_minutes'] is not None
+                                     else DEFAULT_SERVICE_MINUTES) for s in stops])
+    offsets = np.concatenate(([0.0], np.cumsum(service[:-1] + travel))) if stops else np.zeros(0)
+
+    # The approach to the first stop runs at the pace trucks usually make on that leg
+    approach_s_per_m = DEFAULT_SECONDS_PER_M
+    if stops and previous_point and (previous_point['point_id'], points[0]) in segments:
+        straight = calculate_distance((float(previous_point['latitude']), float(previous_point['longitude'])),
+                                      tuple(coords[0]))
+        if straight > 0:
+            approach_s_per_m = segments[(previous_point['point_id'], points[0])] / straight
+    return {
+        'stops': stops,
+        'ids': [s['route_stop_id'] for s in stops],
+        'coords': coords,
+        'offsets': offsets,
+        'service': service,
+        'approach_s_per_m': approach_s_per_m,
+        'previous_point': previous_point,
+        'notified': np.zeros(len(stops), dtype=int),
+        'eta': np.full(len(stops), np.nan),
+        'position': None,
+    }
+
+class EtaEngine:
+    """
+    ETAs of every pending stop of today's routes, per vehicle. Routes are
+    read in one query and turned into plans (build_plan) once; a GPS point
+    then costs one distance to the vehicle's next stop and one vector add,
+    and only the newest point per vehicle of a batch is used. A stop whose
+    ETA falls below a notification threshold is put on the notification
+    queue, once per threshold. Once start()ed, routes are re-read by a
+    background thread, so GPS points never wait on a query.
+    """
+
+    def __init__(self, thresholds_min=NOTIFY_THRESHOLDS_MIN, refresh_interval_s=REFRESH_INTERVAL_S,
+                 notifications=None, arrivals=get_stop_arrival, clock=time.monotonic):
+        self.thresholds_min = np.array(sorted(thresholds_min, reverse=True), dtype=float)
+        self.refresh_interval_s = refresh_interval_s
+        self.notifications = notifications if notifications is not None else queue.Queue()
+        self.arrivals = arrivals
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._plans = {}          # vehicle_id -> plan
+        self._stop_vehicle = {}   # route_stop_id -> vehicle_id
+        self._segments = {}
+        self._segments_day = None
+        self._loaded_at = None
+        self._day = None
+        self._wake = None   # set to re-read now, once the refresh thread runs
+
+    # --- Routes -----------------------------------------------------------------
+
+    def _load_segments(self):
+        rows = fetch_all(SEGMENT_TIMES_QUERY, (SEGMENT_WINDOW_DAYS, SEGMENT_MIN_TRIPS))
+        if rows is None:
+            return False
+        self._segments = {(r['from_point'], r['to_point']): float(r['seconds']) for r in rows}
+        self._segments_day = datetime.date.today()
+        return True
+
+    def _notified_level(self, minutes):
+        return 0 if minutes is None else int((self.thresholds_min >= float(minutes)).sum())
+
+    def load(self):
+        """Reads today's routes and rebuilds every plan (historical leg times once a day)."""
+        today = datetime.date.today()
+        if self._segments_day != today:
+            self._load_segments()
+        rows = fetch_all(ROUTE_STOPS_QUERY)
+        if rows is None:
+            self._loaded_at = self.clock()  # keep the old plans; retry after the interval
+            return False
+        per_vehicle, assignment_of = defaultdict(list), {}
+        for row in rows:
+            # One route per truck at a time: the first active assignment
+            if assignment_of.setdefault(row['vehicle_id'], row['assignment_id']) == row['assignment_id']:
+                per_vehicle[row['vehicle_id']].append(row)
+
+        events = []
+        with self._lock:
+            plans, stop_vehicle = {}, {}
+            for vehicle_id, route in per_vehicle.items():
+                pending = [s for s in route if s['status'] == 'Pending']
+                if not pending:
+                    continue
+                first = route.index(pending[0])
+                previous_point = route[first - 1] if first > 0 else None
+                plan = build_plan(pending, self._segments, previous_point)
+                plan['notified'] = np.array([self._notified_level(s['notified_minutes']) for s in pending], dtype=int)
+                old = self._plans.get(vehicle_id)
+                if old:
+                    # Keep what this process already sent even if it is not in the table yet
+                    sent = dict(zip(old['ids'], old['notified']))
+                    plan['notified'] = np.maximum(plan['notified'], [sent.get(i, 0) for i in plan['ids']])
+                plans[vehicle_id] = plan
+                stop_vehicle.update((stop_id, vehicle_id) for stop_id in plan['ids'])
+                if old and old['position']:
+                    events.extend(self._estimate(vehicle_id, plan, *old['position']))
+            self._plans, self._stop_vehicle = plans, stop_vehicle
+            self._day = today
+            self._loaded_at = self.clock()
+        self._queue(events)
+        return True
+
+    def _refresh_if_due(self):
+        if self._loaded_at is None or self.clock() - self._loaded_at >= self.refresh_interval_s \
+                or self._day not in (None, datetime.date.today()):
+            if self._wake is not None:
+                self._wake.set()
+            else:
+                self.load()
+
+    def invalidate(self):
+        """Re-reads today's routes soon (e.g. after routes were published)."""
+        with self._lock:
+            self._loaded_at = None
+        if self._wake is not None:
+            self._wake.set()
+
+    def start(self):
+        """Starts the background thread that re-reads the routes every interval, or when invalidated."""
+        if self._wake is not None:
+            return
+        self._wake = threading.Event()
+        self._wake.set()   # first read straight away
+
+        def run():
+            while True:
+                self._wake.wait(self.refresh_interval_s)
+                self._wake.clear()
+                try:
+                    self.load()
+                except Exception as e:
+                    print(f"Error loading ETA plans: {e}")
+
+        threading.Thread(target=run, name='eta-refresh', daemon=True).start()
+
+    def complete_stop(self, route_stop_id):
+        """Drops a completed stop from its vehicle's plan and re-estimates the rest."""
+        events = []
+        with self._lock:
+            vehicle_id = self._stop_vehicle.pop(route_stop_id, None)
+            plan = self._plans.get(vehicle_id)
+            if plan is None or route_stop_id not in plan['ids']:
+                return
+            k = plan['ids'].index(route_stop_id)
+            stops = plan['stops'][:k] + plan['stops'][k + 1:]
+            if not stops:
+                del self._plans[vehicle_id]
+                return
+            new_plan = build_plan(stops, self._segments, plan['stops'][k] if k == 0 else plan['previous_point'])
+            new_plan['notified'] = np.delete(plan['notified'], k)
+            self._plans[vehicle_id] = new_plan
+            if plan['position']:
+                events = self._estimate(vehicle_id, new_plan, *plan['position'])
+        self._queue(events)
+
+    # --- Estimates ---------------------------------------------------------------
+
+    def update(self, rows):
+        """
+        Re-estimates the vehicles of (vehicle_id, lat, lon, timestamp) rows
+        from each one's newest point. Returns the notifications queued.
+        """
+        self._refresh_if_due()
+        newest = {}
+        for row in rows:
+            if row[0] not in newest or _epoch_seconds(row[3]) >= _epoch_seconds(newest[row[0]][3]):
+                newest[row[0]] = row
+        events = []
+        with self._lock:
+            moved = [(v, self._plans[v], float(r[1]), float(r[2]), _epoch_seconds(r[3]))
+                     for v, r in newest.items() if v in self._plans]
+            if not moved:
+                return events
+            # Distance of every moved truck to its next stop, in one pass
+            distances = pairwise_distances(np.array([(m[2], m[3]) for m in moved]),
+                                           np.array([m[1]['coords'][0] for m in moved]))
+            for (vehicle_id, plan, lat, lon, t), distance in zip(moved, distances):
+                events.extend(self._estimate(vehicle_id, plan, lat, lon, t, distance))
+        self._queue(events)
+        return events
+
+    def _queue(self, events):
+        for event in events:
+            self.notifications.put(event)
+
+    def _estimate(self, vehicle_id, plan, lat, lon, t, distance=None):
+        if distance is None:
+            distance = calculate_distance((lat, lon), tuple(plan['coords'][0]))
+        eta = t + distance * plan['approach_s_per_m'] + plan['offsets']
+        arrival = self.arrivals(plan['ids'][0]) if distance <= EXIT_RADIUS_M else None
+        if arrival and arrival['vehicle_id'] == vehicle_id:
+            # At the first stop: only what is left of its service time is still ahead
+            arrived = _epoch_seconds(arrival['arrived_at'])
+            eta = t + plan['offsets'] - min(max(t - arrived, 0.0), plan['service'][0])
+            eta[0] = arrived
+        plan['eta'] = eta
+        plan['position'] = (lat, lon, t)
+
+        minutes = (eta - t) / 60.0
+        levels = (minutes[:, None] <= self.thresholds_min[None, :]).sum(axis=1)
+        crossed = np.flatnonzero(levels > plan['notified'])
+        events = []
+        for k in crossed:
+            stop = plan['stops'][k]
+            if stop['client_id'] and stop['email']:
+                events.append({
+                    'client_id': stop['client_id'],
+                    'email': stop['email'],
+                    'booking_id': stop['booking_id'],
+                    'route_stop_id': stop['route_stop_id'],
+                    'point_name': stop['point_name'],
+                    'vehicle_id': vehicle_id,
+                    'threshold_minutes': int(self.thresholds_min[levels[k] - 1]),
+                    'minutes_away': max(0, int(round(minutes[k]))),
+                    'eta': datetime.datetime.fromtimestamp(eta[k]),
+                })
+        plan['notified'] = np.maximum(plan['notified'], levels)
+        return events
+
+    def _stop_eta(self, plan, k):
+        return {
+            'route_stop_id': plan['ids'][k],
+            'booking_id': plan['stops'][k]['booking_id'],
+            'point_name': plan['stops'][k]['point_name'],
+            'stops_before': k,
+            'eta': datetime.datetime.fromtimestamp(plan['eta'][k]),
+            'minutes_away': max(0, int(round((plan['eta'][k] - time.time()) / 60.0))),
+        }
+
+    def get_vehicle_etas(self, vehicle_id):
+        """ETAs of a vehicle's pending stops in route order ([] before its first GPS point)."""
+        with self._lock:
+            plan = self._plans.get(vehicle_id)
+            if not plan or plan['position'] is None:
+                return []
+            return [self._stop_eta(plan, k) for k in range(len(plan['ids']))]
+
+    def get_client_etas(self, client_id):
+        """ETAs of a client's pending stops today, soonest first."""
+        with self._lock:
+            etas = [self._stop_eta(plan, k)
+                    for plan in self._plans.values() if plan['position'] is not None
+                    for k, stop in enumerate(plan['stops']) if stop['client_id'] == client_id]
+        return sorted(etas, key=lambda e: e['eta'])
+
+class NotificationDispatcher:
+    """
+    Sends queued ETA notifications in batches: every interval it empties
+    the queue, sends each client one email for all of their stops, and
+    records the notifications in one multi-row insert.
+    """
+
+    def __init__(self, notifications, send=send_eta_email, interval_s=NOTIFY_INTERVAL_S):
+        self.notifications = notifications
+        self.send = send
+        self.interval_s = interval_s
+        self._stop = None
+
+    def drain(self):
+        """Takes everything currently queued."""
+        batch = []
+        while True:
+            try:
+                batch.append(self.notifications.get_nowait())
+            except queue.Empty:
+                return batch
+
+    def dispatch(self, batch):
+        """Emails and records a batch of notifications. Returns the number of emails sent."""
+        per_email = defaultdict(list)
+        for event in batch:
+            per_email[event['email']].append(event)
+        rows, sent = [], 0
+        for email, events in per_email.items():
+            emailed = bool(self.send(email, [(e['point_name'], e['minutes_away'], e['eta']) for e in events]))
+            sent += emailed
+            rows.extend((e['client_id'], e['booking_id'], e['route_stop_id'], e['threshold_minutes'],
+                         e['minutes_away'], e['eta'], emailed) for e in events)
+        if rows:
+            execute_many(INSERT_NOTIFICATIONS_QUERY, rows)
+        return sent
+
+    def run_once(self):
+        batch = self.drain()
+        if batch:
+            try:
+                self.dispatch(batch)
+            except Exception as e:
+                print(f"Error sending ETA notifications: {e}")
+        return len(batch)
+
+    def start(self):
+        """Starts the background thread that dispatches a batch every interval."""
+        if self._stop is not None:
+            return
+        self._stop = threading.Event()
+
+        def run():
+            while not self._stop.wait(self.interval_s):
+                self.run_once()
+
+        threading.Thread(target=run, name='eta-notify', daemon=True).start()
+
+    def close(self):
+        """Stops the thread and sends whatever is still queued."""
+        if self._stop is not None:
+            self._stop.set()
+        self.run_once()
+
+def update_etas(rows, engine=None):
+    """
+    Feeds written GPS rows to the ETA engine. Returns the notifications
+    queued, or [] if the update failed (points are never lost over it).
+    """
+    try:
+        return (engine or get_eta_engine()).update(rows)
+    except Exception as e:
+        print(f"Error updating ETAs: {e}")
+        return []
+
+def get_eta_engine():
+    """The process-wide ETA engine, with its refresh thread and notification dispatcher started on first use."""
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = EtaEngine()
+            _engine.start()
+            dispatcher = NotificationDispatcher(_engine.notifications)
+            dispatcher.start()
+            atexit.register(dispatcher.close)
+        return _engine
+
+def get_client_etas(client_id):
+    """Live ETAs of a client's stops for the client portal."""
+    return get_eta_engine().get_client_etas(client_id)
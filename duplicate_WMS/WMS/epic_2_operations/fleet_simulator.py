@@ -0,0 +1,354 @@
+# In epic_2_operations/fleet_simulator.py
+#
+# Load test for the tracking path, against a local database only. Creates
+# simulated drivers, vehicles and today's assignments over the seeded
+# collection points, drives GPS traces and stop completions through the
+# real tracking_logic functions and reports latency and database cost:
+#   python -m epic_2_operations.fleet_simulator run --drivers 200 --stops 40 --duration 120
+#   python -m epic_2_operations.fleet_simulator remove
+
+import sys
+import math
+import time
+import random
+import argparse
+import datetime
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, wait
+import numpy as np
+from utils.db_connector import (
+    fetch_all, transaction, get_db_stats, reset_db_stats, get_thread_statements
+)
+from utils.geo_utils import EARTH_RADIUS_M
+from epic_1_routing.optimize_logic import optimize_route_nearest_neighbor
+from epic_2_operations.assignment_cache import get_assignment_cache
+from epic_2_operations.gps_ingestion import get_ingestor
+from epic_2_operations.fleet_state import get_fleet_state
+from epic_2_operations.tracking_logic import (
+    log_driver_location, mark_stop_complete, get_driver_assignment,
+    get_live_vehicle_locations, get_assignment_progress
+)
+
+# Everything the simulator creates is marked with this, so it can be removed again
+SIM_EMAIL_DOMAIN = 'fleet-sim.invalid'
+SIM_PLATE_PREFIX = 'SIM-'
+SIM_ROUTE_NAME = 'Fleet simulation'
+
+DEFAULT_SPEED_KMH = (15.0, 40.0)
+DEFAULT_GPS_INTERVAL_S = 10.0
+DEFAULT_SERVICE_S = 60.0
+# Receivers are off by a few meters
+GPS_JITTER_M = 5.0
+# Supervisors refresh the live map this often (simulated seconds)
+SUPERVISOR_REFRESH_S = 15.0
+
+def _percentile(values, q):
+    return float(np.percentile(values, q)) if values else 0.0
+
+class LatencyRecorder:
+    """Durations, statement counts and failures per operation name."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._durations = defaultdict(list)
+        self._statements = defaultdict(int)
+        self._errors = defaultdict(int)
+
+    def call(self, name, fn, *args, failed=lambda result: False):
+        """Runs fn(*args), timing it and counting the statements this thread ran for it."""
+        statements = get_thread_statements()
+        started = time.perf_counter()
+        try:
+            result = fn(*args)
+            error = failed(result)
+        except Exception as e:
+            print(f"Simulated {name} raised: {e}")
+            result, error = None, True
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self._durations[name].append(elapsed)
+            self._statements[name] += get_thread_statements() - statements
+            self._errors[name] += bool(error)
+        return result
+
+    def summary(self, wall_s):
+        """Per operation: count, throughput, p50/p95/p99/max in ms, statements per call, errors."""
+        with self._lock:
+            report = {}
+            for name, durations in sorted(self._durations.items()):
+                ms = [d * 1000.0 for d in durations]
+                report[name] = {
+                    'count': len(ms),
+                    'per_s': len(ms) / wall_s if wall_s else 0.0,
+                    'p50_ms': _percentile(ms, 50),
+                    'p95_ms': _percentile(ms, 95),
+                    'p99_ms': _percentile(ms, 99),
+                    'max_ms': max(ms),
+                    'statements_per_op': self._statements[name] / len(ms),
+                    'errors': self._errors[name],
+                }
+            return report
+
+class SimulatedDriver:
+    """
+    A driver following their route at their own speed: straight legs
+    between stops with GPS jitter, a service stop at each one, then the
+    stop is completed.
+    """
+
+    def __init__(self, driver, rng, speed_kmh=DEFAULT_SPEED_KMH, service_s=DEFAULT_SERVICE_S):
+        self.driver_id = driver['driver_id']
+        self.stops = list(driver['stops'])   # [(route_stop_id, lat, lon)]
+        self.rng = rng
+        self.speed_ms = rng.uniform(*speed_kmh) / 3.6
+        self.service_s = service_s
+        # Start about a kilometer south of the first stop
+        self.lat, self.lon = self.stops[0][1] - 0.009, self.stops[0][2]
+        self.dwell_left = None
+
+    @property
+    def done(self):
+        return not self.stops
+
+    def position(self):
+        """The driver's position as their phone reports it."""
+        dlat = self.rng.gauss(0, GPS_JITTER_M) / EARTH_RADIUS_M
+        dlon = self.rng.gauss(0, GPS_JITTER_M) / (EARTH_RADIUS_M * math.cos(math.radians(self.lat)))
+        return self.lat + math.degrees(dlat), self.lon + math.degrees(dlon)
+
+    def advance(self, seconds):
+        """
+        Moves the driver on by seconds of simulated time. Returns the
+        (route_stop_id, lat, lon) of a stop whose service just ended, or None.
+        """
+        if self.done:
+            return None
+        stop_id, lat, lon = self.stops[0]
+        if self.dwell_left is not None:
+            self.dwell_left -= seconds
+            if self.dwell_left > 0:
+                return None
+            self.dwell_left = None
+            self.stops.pop(0)
+            return (stop_id,) + self.position()
+        north = math.radians(lat - self.lat) * EARTH_RADIUS_M
+        east = math.radians(lon - self.lon) * EARTH_RADIUS_M * math.cos(math.radians(self.lat))
+        remaining = math.hypot(north, east)
+        step = self.speed_ms * seconds
+        if step >= remaining:
+            self.lat, self.lon = lat, lon
+            self.dwell_left = self.service_s
+        else:
+            self.lat += (lat - self.lat) * step / remaining
+            self.lon += (lon - self.lon) * step / remaining
+        return None
+
+def create_fleet(drivers, stops_per_route, seed=0):
+    """
+    Creates drivers, vehicles and one assignment for today per driver over
+    random seeded collection points, in route order. Returns
+    [{driver_id, vehicle_id, assignment_id, stops: [(route_stop_id, lat, lon)]}],
+    or None if there are no collection points or the insert failed.
+    """
+    points = fetch_all("SELECT point_id, latitude, longitude FROM CollectionPoints")
+    if not points:
+        print("No collection points to build routes from.")
+        return None
+    rng = random.Random(seed)
+    tag = f"{int(time.time()) % 10 ** 6}-{seed}"
+    today = datetime.date.today()
+    try:
+        with transaction() as cursor:
+            cursor.execute("SELECT role_id, role_name FROM Roles WHERE role_name IN ('Supervisor', 'Driver')")
+            roles = {row['role_name']: row['role_id'] for row in cursor.fetchall()}
+            emails = [f"sim-{tag}-supervisor@{SIM_EMAIL_DOMAIN}"] + \
+                     [f"sim-{tag}-driver-{i}@{SIM_EMAIL_DOMAIN}" for i in range(drivers)]
+            cursor.executemany(
+                "INSERT INTO Users (role_id, first_name, last_name, email, password_hash) VALUES (%s, %s, %s, %s, '!')",
+                [(roles.get('Supervisor'), 'Sim', 'Supervisor', emails[0])] +
+                [(roles.get('Driver'), 'Sim', f"Driver {i}", email) for i, email in enumerate(emails[1:])]
+            )
+            cursor.execute("SELECT user_id, email FROM Users WHERE email LIKE %s", (f"sim-{tag}-%",))
+            user_ids = {row['email']: row['user_id'] for row in cursor.fetchall()}
+            driver_ids = [user_ids[email] for email in emails[1:]]
+
+            plates = [f"{SIM_PLATE_PREFIX}{tag}-{i}" for i in range(drivers)]
+            cursor.executemany("INSERT INTO Vehicles (license_plate, model, capacity_kg) VALUES (%s, 'Simulated', 5000)",
+                               [(plate,) for plate in plates])
+            cursor.execute("SELECT vehicle_id, license_plate FROM Vehicles WHERE license_plate LIKE %s",
+                           (f"{SIM_PLATE_PREFIX}{tag}-%",))
+            vehicle_ids = {row['license_plate']: row['vehicle_id'] for row in cursor.fetchall()}
+
+            cursor.execute("INSERT INTO Routes (route_name, created_by_supervisor_id) VALUES (%s, %s)",
+                           (SIM_ROUTE_NAME, user_ids[emails[0]]))
+            route_id = cursor.lastrowid
+            per_route = min(stops_per_route, len(points))
+            cursor.executemany(
+                "INSERT INTO RouteAssignments (route_id, vehicle_id, driver_id, assigned_date, status, total_stops) "
+                "VALUES (%s, %s, %s, %s, 'Pending', %s)",
+                [(route_id, vehicle_ids[plate], driver_id, today, per_route) for plate, driver_id in zip(plates, driver_ids)]
+            )
+            cursor.execute("SELECT assignment_id, driver_id, vehicle_id FROM RouteAssignments WHERE route_id = %s",
+                           (route_id,))
+            fleet = {row['driver_id']: dict(row, stops=[]) for row in cursor.fetchall()}
+
+            stop_rows = []
+            for driver_id in driver_ids:
+                route = optimize_route_nearest_neighbor(rng.sample(points, per_route))
+                stop_rows.extend((fleet[driver_id]['assignment_id'], p['point_id'], order)
+                                 for order, p in enumerate(route, start=1))
+            cursor.executemany("INSERT INTO RouteStops (assignment_id, point_id, stop_order) VALUES (%s, %s, %s)",
+                               stop_rows)
+            cursor.execute(
+                "SELECT ra.driver_id, rs.route_stop_id, cp.latitude, cp.longitude "
+                "FROM RouteStops rs JOIN RouteAssignments ra ON rs.assignment_id = ra.assignment_id "
+                "JOIN CollectionPoints cp ON rs.point_id = cp.point_id "
+                "WHERE ra.route_id = %s ORDER BY ra.driver_id, rs.stop_order",
+                (route_id,)
+            )
+            for row in cursor.fetchall():
+                fleet[row['driver_id']]['stops'].append(
+                    (row['route_stop_id'], float(row['latitude']), float(row['longitude'])))
+    except Exception as e:
+        print(f"Error creating the simulated fleet: {e}")
+        return None
+    get_assignment_cache().invalidate()
+    return [fleet[driver_id] for driver_id in driver_ids]
+
+def remove_fleet():
+    """Deletes every simulated user, vehicle, route and assignment (and, by cascade, their data)."""
+    try:
+        with transaction() as cursor:
+            cursor.execute(
+                "DELETE ra FROM RouteAssignments ra JOIN Users u ON ra.driver_id = u.user_id WHERE u.email LIKE %s",
+                (f"%@{SIM_EMAIL_DOMAIN}",)
+            )
+            cursor.execute(
+                "DELETE r FROM Routes r JOIN Users u ON r.created_by_supervisor_id = u.user_id WHERE u.email LIKE %s",
+                (f"%@{SIM_EMAIL_DOMAIN}",)
+            )
+            cursor.execute("DELETE FROM Vehicles WHERE license_plate LIKE %s", (f"{SIM_PLATE_PREFIX}%",))
+            cursor.execute("DELETE FROM Users WHERE email LIKE %s", (f"%@{SIM_EMAIL_DOMAIN}",))
+    except Exception as e:
+        print(f"Error removing the simulated fleet: {e}")
+        return False
+    get_assignment_cache().invalidate()
+    return True
+
+def run_simulation(fleet, duration_s, gps_interval_s=DEFAULT_GPS_INTERVAL_S, speedup=1.0, workers=16,
+                   supervisors=1, seed=0, recorder=None, sql_map=False):
+    """
+    Drives the fleet for duration_s of simulated time. Every gps_interval_s
+    each driver reloads their stops and sends a GPS fix, and completes
+    a stop when its service ends; supervisors refresh the live map (as the
+    dashboard does: the in-memory fleet state changed since the version
+    each one last saw) and progress table. sql_map=True also times the
+    live-location query, for comparison. With speedup > 1 simulated time
+    runs faster than the clock (the ingestion filter still works on wall
+    time, so it drops more points). Calls run on a pool of workers threads.
+    Returns {wall_s, operations: LatencyRecorder.summary, db: get_db_stats, ingestion}.
+    """
+    rng = random.Random(seed)
+    recorder = recorder or LatencyRecorder()
+    drivers = [SimulatedDriver(d, random.Random(rng.random())) for d in fleet if d['stops']]
+    tick_wall_s = gps_interval_s / speedup
+    next_supervisor = 0.0
+    fleet_state = get_fleet_state()   # loaded once, before anything is timed
+    versions = [0] * supervisors      # the fleet version each supervisor's map last saw
+
+    def drive(driver):
+        recorder.call('get_driver_assignment', get_driver_assignment, driver.driver_id)
+        completed = driver.advance(gps_interval_s)
+        if completed:
+            stop_id, lat, lon = completed
+            recorder.call('mark_stop_complete', mark_stop_complete, driver.driver_id, stop_id, lat, lon,
+                          round(driver.rng.uniform(5, 50), 2),
+                          failed=lambda msg: not str(msg).startswith("Stop marked complete"))
+        else:
+            lat, lon = driver.position()
+            recorder.call('log_driver_location', log_driver_location, driver.driver_id, lat, lon,
+                          failed=lambda ok: not ok)
+
+    def supervise(viewer):
+        changes = recorder.call('fleet_changes_since', fleet_state.changes_since, versions[viewer])
+        if changes:
+            versions[viewer] = changes[0]
+        if sql_map:
+            recorder.call('get_live_vehicle_locations', get_live_vehicle_locations, failed=lambda rows: rows is None)
+        recorder.call('get_assignment_progress', get_assignment_progress, failed=lambda rows: rows is None)
+
+    reset_db_stats()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        simulated = 0.0
+        while simulated < duration_s and not all(d.done for d in drivers):
+            tick_started = time.perf_counter()
+            futures = [pool.submit(drive, d) for d in drivers if not d.done]
+            if simulated >= next_supervisor:
+                futures.extend(pool.submit(supervise, viewer) for viewer in range(supervisors))
+                next_supervisor += SUPERVISOR_REFRESH_S
+            wait(futures)
+            simulated += gps_interval_s
+            time.sleep(max(0.0, tick_wall_s - (time.perf_counter() - tick_started)))
+    recorder.call('gps_flush', get_ingestor().flush)
+    wall_s = time.perf_counter() - started
+    return {
+        'wall_s': wall_s,
+        'simulated_s': simulated,
+        'operations': recorder.summary(wall_s),
+        'db': get_db_stats(),
+        'ingestion': get_ingestor().get_stats(),
+    }
+
+def format_report(result):
+    """The simulation result as a plain-text table."""
+    lines = [f"Simulated {result['simulated_s']:.0f} s in {result['wall_s']:.1f} s wall time.", "",
+             f"{'operation':<28}{'count':>8}{'ops/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}"
+             f"{'max ms':>9}{'stmts/op':>10}{'errors':>8}"]
+    for name, op in result['operations'].items():
+        lines.append(f"{name:<28}{op['count']:>8}{op['per_s']:>9.1f}{op['p50_ms']:>9.1f}{op['p95_ms']:>9.1f}"
+                     f"{op['p99_ms']:>9.1f}{op['max_ms']:>9.1f}{op['statements_per_op']:>10.2f}{op['errors']:>8}")
+    db = result['db']
+    average_wait = db['pool_wait_s'] / db['connections'] * 1000.0 if db['connections'] else 0.0
+    lines += ["",
+              f"Database: {db['statements']} statements, {db['connections']} connections, "
+              f"pool wait {average_wait:.2f} ms average / {db['pool_wait_max_s'] * 1000.0:.1f} ms max, "
+              f"{db['pool_exhausted']} times the pool was exhausted.",
+              "GPS ingestion: " + ", ".join(f"{k} {v}" for k, v in result['ingestion'].items())]
+    return "\n".join(lines)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Simulated fleet load test for the tracking path (local database only).")
+    sub = parser.add_subparsers(dest='command', required=True)
+    run = sub.add_parser('run', help="Create a simulated fleet, drive it and report.")
+    run.add_argument('--drivers', type=int, default=50)
+    run.add_argument('--stops', type=int, default=40, help="Stops per route.")
+    run.add_argument('--duration', type=float, default=600.0, help="Simulated seconds.")
+    run.add_argument('--gps-interval', type=float, default=DEFAULT_GPS_INTERVAL_S)
+    run.add_argument('--speedup', type=float, default=10.0)
+    run.add_argument('--workers', type=int, default=16)
+    run.add_argument('--supervisors', type=int, default=1)
+    run.add_argument('--sql-map', action='store_true',
+                     help="Also time the live-location query the map used before the in-memory fleet state.")
+    run.add_argument('--seed', type=int, default=0)
+    run.add_argument('--keep', action='store_true', help="Keep the simulated data afterwards.")
+    sub.add_parser('remove', help="Delete all simulated data.")
+    args = parser.parse_args(argv)
+
+    if args.command == 'remove':
+        return 0 if remove_fleet() else 1
+    fleet = create_fleet(args.drivers, args.stops, args.seed)
+    if not fleet:
+        return 1
+    try:
+        result = run_simulation(fleet, args.duration, args.gps_interval, args.speedup, args.workers,
+                                args.supervisors, args.seed, sql_map=args.sql_map)
+        print(format_report(result))
+    finally:
+        if not args.keep:
+            remove_fleet()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
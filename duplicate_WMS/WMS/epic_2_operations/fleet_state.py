@@ -0,0 +1,123 @@
+# In epic_2_operations/fleet_state.py
+
+import math
+import threading
+from utils.db_connector import fetch_all, fetch_one
+from utils.geo_utils import calculate_distance
+
+_fleet_state = None
+_fleet_state_lock = threading.Lock()
+
+def bearing_degrees(start, end):
+    """Initial compass bearing (0 = north, 90 = east) from start to end (lat, lon)."""
+    lat1, lat2 = math.radians(start[0]), math.radians(end[0])
+    dlon = math.radians(end[1] - start[1])
+    x = math.sin(dlon) * math.cos(lat2)
+    y = math.cos(lat1) * math.sin(lat2) - math.sin(lat1) * math.cos(lat2) * math.cos(dlon)
+    return (math.degrees(math.atan2(x, y)) + 360) % 360
+
+class FleetState:
+    """
+    The latest position, heading and speed of every vehicle, held in memory
+    and fed by the GPS write path. Every change bumps a global version;
+    viewers keep the version they last saw and ask only for what changed
+    since, so any number of map viewers cost no database queries.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = 0
+        self._vehicles = {}   # vehicle_id -> vehicle dict (with the version it last changed in)
+        self._plates = {}
+
+    def load(self):
+        """Seeds the state from VehicleLatestLocation (one query, at startup)."""
+        query = """
+            SELECT v.vehicle_id, v.license_plate, vll.latitude, vll.longitude, vll.timestamp
+            FROM Vehicles v
+            LEFT JOIN VehicleLatestLocation vll ON vll.vehicle_id = v.vehicle_id
+        """
+        rows = fetch_all(query) or []
+        with self._lock:
+            for row in rows:
+                self._plates[row['vehicle_id']] = row['license_plate']
+            for row in rows:
+                if row['latitude'] is not None and row['longitude'] is not None:
+                    self._apply(row['vehicle_id'], float(row['latitude']), float(row['longitude']),
+                                row['timestamp'])
+        return self
+
+    def _license_plate(self, vehicle_id):
+        if vehicle_id not in self._plates:
+            # Only for a vehicle added after startup: once per vehicle per process
+            row = fetch_one("SELECT license_plate FROM Vehicles WHERE vehicle_id = %s", (vehicle_id,))
+            self._plates[vehicle_id] = row['license_plate'] if row else str(vehicle_id)
+        return self._plates[vehicle_id]
+
+    def _apply(self, vehicle_id, latitude, longitude, timestamp):
+        previous = self._vehicles.get(vehicle_id)
+        heading = previous['heading_deg'] if previous else None
+        speed = previous['speed_kmh'] if previous else None
+        if previous:
+            if timestamp and previous['timestamp'] and timestamp < previous['timestamp']:
+                return False  # an older point arriving late
+            if (latitude, longitude) != (previous['latitude'], previous['longitude']):
+                heading = bearing_degrees((previous['latitude'], previous['longitude']), (latitude, longitude))
+            if timestamp and previous['timestamp']:
+                seconds = (timestamp - previous['timestamp']).total_seconds()
+                if seconds > 0:
+                    meters = calculate_distance((previous['latitude'], previous['longitude']),
+                                                (latitude, longitude))
+                    speed = meters / seconds * 3.6
+        self._version += 1
+        self._vehicles[vehicle_id] = {
+            'vehicle_id': vehicle_id,
+            'license_plate': self._plates.get(vehicle_id, str(vehicle_id)),
+            'latitude': latitude,
+            'longitude': longitude,
+            'timestamp': timestamp,
+            'heading_deg': heading,
+            'speed_kmh': speed,
+            'version': self._version,
+        }
+        return True
+
+    def update(self, vehicle_id, latitude, longitude, timestamp):
+        """Records a new position. Returns False if it is older than the one held."""
+        self._license_plate(vehicle_id)
+        with self._lock:
+            return self._apply(vehicle_id, float(latitude), float(longitude), timestamp)
+
+    def update_many(self, rows):
+        """Records (vehicle_id, lat, lon, timestamp) rows, in order."""
+        for vehicle_id, latitude, longitude, timestamp in rows:
+            self.update(vehicle_id, latitude, longitude, timestamp)
+
+    @property
+    def version(self):
+        return self._version
+
+    def snapshot(self):
+        """Returns (version, [vehicle dicts]) with every vehicle's latest state."""
+        with self._lock:
+            return self._version, [dict(v) for v in self._vehicles.values()]
+
+    def changes_since(self, version):
+        """
+        Returns (current version, [vehicle dicts changed after version]).
+        Pass the returned version next time to get only newer changes.
+        """
+        with self._lock:
+            if version > self._version:
+                version = 0  # the viewer saw an earlier process: send everything
+            if version == self._version:
+                return self._version, []
+            return self._version, [dict(v) for v in self._vehicles.values() if v['version'] > version]
+
+def get_fleet_state():
+    """The process-wide fleet state, loaded from the database on first use."""
+    global _fleet_state
+    with _fleet_state_lock:
+        if _fleet_state is None:
+            _fleet_state = FleetState().load()
+        return _fleet_state
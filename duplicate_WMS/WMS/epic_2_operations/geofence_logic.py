@@ -0,0 +1,290 @@
+# In epic_2_operations/geofence_logic.py
+#
+# Turns the GPS feed into arrived / departed events at route stops.
+# Learned service times can be written back for routing, e.g. nightly:
+#   python -m epic_2_operations.geofence_logic update-service-times
+
+import sys
+import math
+import time
+import argparse
+import datetime
+import threading
+import numpy as np
+from utils.db_connector import fetch_all, execute_query, execute_many
+from utils.geo_utils import EARTH_RADIUS_M
+
+# A vehicle has arrived within this distance of a stop (the verification radius)...
+GEOFENCE_RADIUS_M = 100.0
+# ...and has left once it is this far away, so GPS jitter at the edge is not a departure
+EXIT_RADIUS_M = 150.0
+# Stops of today's routes are re-read this often (in the background), to pick up new and re-planned routes
+REFRESH_INTERVAL_S = 300.0
+# Visits outside this range are drive-bys or forgotten departures, not service times
+MIN_DWELL_S = 30
+MAX_DWELL_S = 3600
+SERVICE_TIME_MIN_VISITS = 3
+SERVICE_TIME_WINDOW_DAYS = 90
+
+ARRIVED = 'arrived'
+DEPARTED = 'departed'
+
+INSERT_EVENTS_QUERY = """
+    INSERT INTO GeofenceEvents (vehicle_id, route_stop_id, event_type, event_time, dwell_seconds, latitude, longitude)
+    VALUES (%s, %s, %s, %s, %s, %s, %s)
+"""
+
+_engine = None
+_engine_lock = threading.Lock()
+
+class GeofenceIndex:
+    """
+    Uniform grid over a set of stops, with cells as wide as the exit
+    radius: the stop nearest to a point can only be in the point's cell
+    or one of its eight neighbours, so a lookup never scans every stop.
+    """
+
+    def __init__(self, stops, cell_m=EXIT_RADIUS_M):
+        # stops: [(route_stop_id, lat, lon)]
+        self.cell_m = cell_m
+        self.ids = np.array([s[0] for s in stops])
+        coords = np.array([(float(s[1]), float(s[2])) for s in stops], dtype=float).reshape(-1, 2)
+        self._lat0 = math.radians(coords[:, 0].mean()) if len(coords) else 0.0
+        self.xy = self._project(coords)
+        self._positions = {stop_id.item(): i for i, stop_id in enumerate(self.ids)}
+        self._cells = {}
+        for i, key in enumerate(map(tuple, np.floor(self.xy / cell_m).astype(int))):
+            self._cells.setdefault(key, []).append(i)
+
+    def _project(self, coords):
+        lat, lon = np.radians(coords[:, 0]), np.radians(coords[:, 1])
+        return np.column_stack((lon * math.cos(self._lat0) * EARTH_RADIUS_M, lat * EARTH_RADIUS_M))
+
+    def distance_to(self, route_stop_id, lat, lon):
+        """Distance in meters from (lat, lon) to one stop of the index (inf if unknown)."""
+        i = self._positions.get(route_stop_id)
+        if i is None:
+            return math.inf
+        point = self._project(np.array([[lat, lon]], dtype=float))[0]
+        return float(np.sqrt(((self.xy[i] - point) ** 2).sum()))
+
+    def nearest(self, coords):
+        """
+        For each (lat, lon), the nearest stop within one cell width.
+        Returns (stop ids, with None where there is none; distances in m).
+        """
+        points = self._project(np.asarray(coords, dtype=float).reshape(-1, 2))
+        keys = np.floor(points / self.cell_m).astype(int)
+        found, distances = [None] * len(points), np.full(len(points), np.inf)
+        for i, (cx, cy) in enumerate(keys):
+            candidates = [j for dx in (-1, 0, 1) for dy in (-1, 0, 1)
+                          for j in self._cells.get((cx + dx, cy + dy), ())]
+            if not candidates:
+                continue
+            d = np.sqrt(((self.xy[candidates] - points[i]) ** 2).sum(axis=1))
+            k = int(d.argmin())
+            if d[k] <= self.cell_m:
+                found[i], distances[i] = self.ids[candidates[k]].item(), d[k]
+        return found, distances
+
+class GeofenceEngine:
+    """
+    Follows each vehicle in and out of the geofences of its route's stops.
+    Per vehicle it keeps the stop it is at (if any) and since when; every
+    arrival of the day is also kept in memory so a stop's verification can
+    be pre-filled from it without a query. Once start()ed, stops are
+    re-read by a background thread, so GPS batches never wait on a query.
+    """
+
+    def __init__(self, radius_m=GEOFENCE_RADIUS_M, exit_radius_m=EXIT_RADIUS_M,
+                 refresh_interval_s=REFRESH_INTERVAL_S, clock=time.monotonic):
+        self.radius_m = radius_m
+        self.exit_radius_m = exit_radius_m
+        self.refresh_interval_s = refresh_interval_s
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._indexes = {}     # vehicle_id -> GeofenceIndex of its stops today
+        self._loaded_at = None
+        self._day = None
+        self._inside = {}      # vehicle_id -> (route_stop_id, arrived_at)
+        self._arrivals = {}    # route_stop_id -> {vehicle_id, arrived_at, latitude, longitude}
+        self._wake = None      # set to re-read now, once the refresh thread runs
+
+    def load(self):
+        """Reads the stops of today's active routes (all statuses, so departures are still seen)."""
+        query = """
+            SELECT ra.vehicle_id, rs.route_stop_id, cp.latitude, cp.longitude
+            FROM RouteStops rs
+            JOIN RouteAssignments ra ON rs.assignment_id = ra.assignment_id
+            JOIN CollectionPoints cp ON rs.point_id = cp.point_id
+            WHERE ra.assigned_date = CURDATE()
+              AND ra.status IN ('Pending', 'In Progress')
+        """
+        rows = fetch_all(query)
+        if rows is None:
+            self._loaded_at = self.clock()  # keep the old stops; retry after the interval
+            return False
+        per_vehicle = {}
+        for row in rows:
+            per_vehicle.setdefault(row['vehicle_id'], []).append(
+                (row['route_stop_id'], row['latitude'], row['longitude']))
+        indexes = {vehicle_id: GeofenceIndex(stops, self.exit_radius_m) for vehicle_id, stops in per_vehicle.items()}
+        with self._lock:
+            today = datetime.date.today()
+            if self._day != today:
+                self._arrivals.clear()
+                self._inside.clear()
+                self._day = today
+            # A vehicle whose route just completed keeps its stops until it leaves the last one
+            for vehicle_id in self._inside:
+                if vehicle_id not in indexes and vehicle_id in self._indexes:
+                    indexes[vehicle_id] = self._indexes[vehicle_id]
+            self._indexes = indexes
+            self._loaded_at = self.clock()
+        return True
+
+    def _refresh_if_due(self):
+        if self._loaded_at is None or self.clock() - self._loaded_at >= self.refresh_interval_s \
+                or self._day not in (None, datetime.date.today()):
+            if self._wake is not None:
+                self._wake.set()
+            else:
+                self.load()
+
+    def invalidate(self):
+        """Re-reads today's stops soon (e.g. after routes were published)."""
+        with self._lock:
+            self._loaded_at = None
+        if self._wake is not None:
+            self._wake.set()
+
+    def start(self):
+        """Starts the background thread that re-reads the stops every interval, or when invalidated."""
+        if self._wake is not None:
+            return
+        self._wake = threading.Event()
+        self._wake.set()   # first read straight away
+
+        def run():
+            while True:
+                self._wake.wait(self.refresh_interval_s)
+                self._wake.clear()
+                try:
+                    self.load()
+                except Exception as e:
+                    print(f"Error loading geofences: {e}")
+
+        threading.Thread(target=run, name='geofence-refresh', daemon=True).start()
+
+    def process(self, rows):
+        """
+        Runs (vehicle_id, lat, lon, timestamp) rows through each vehicle's
+        geofences, in time order. Returns the new events as
+        (vehicle_id, route_stop_id, event_type, event_time, dwell_seconds, lat, lon).
+        """
+        self._refresh_if_due()
+        events = []
+        with self._lock:
+            per_vehicle = {}
+            for row in sorted(rows, key=lambda r: (r[0], r[3])):
+                per_vehicle.setdefault(row[0], []).append(row)
+            for vehicle_id, points in per_vehicle.items():
+                index = self._indexes.get(vehicle_id)
+                if index is None:
+                    continue
+                nearest, distances = index.nearest([(p[1], p[2]) for p in points])
+                for (_, lat, lon, ts), stop_id, dist in zip(points, nearest, distances):
+                    events.extend(self._step(index, vehicle_id, float(lat), float(lon), ts, stop_id, dist))
+        return events
+
+    def _step(self, index, vehicle_id, lat, lon, ts, stop_id, dist):
+        events = []
+        current = self._inside.get(vehicle_id)
+        if current:
+            current_stop, arrived_at = current
+            reached_other = stop_id is not None and stop_id != current_stop and dist <= self.radius_m
+            if not reached_other and index.distance_to(current_stop, lat, lon) <= self.exit_radius_m:
+                return events
+            dwell = max(0, int((ts - arrived_at).total_seconds()))
+            events.append((vehicle_id, current_stop, DEPARTED, ts, dwell, lat, lon))
+            del self._inside[vehicle_id]
+        if stop_id is not None and dist <= self.radius_m:
+            self._inside[vehicle_id] = (stop_id, ts)
+            self._arrivals.setdefault(stop_id, {'vehicle_id': vehicle_id, 'arrived_at': ts,
+                                                'latitude': lat, 'longitude': lon})
+            events.append((vehicle_id, stop_id, ARRIVED, ts, None, lat, lon))
+        return events
+
+    def get_arrival(self, route_stop_id):
+        """The first detected arrival at a stop today, or None."""
+        with self._lock:
+            arrival = self._arrivals.get(route_stop_id)
+            return dict(arrival) if arrival else None
+
+def record_geofence_events(rows, engine=None):
+    """
+    Feeds written GPS rows to the geofence engine and stores any events.
+    Returns the events, or [] if the check failed (points are never lost
+    over it).
+    """
+    try:
+        events = (engine or get_geofence_engine()).process(rows)
+        if events:
+            execute_many(INSERT_EVENTS_QUERY, events)
+        return events
+    except Exception as e:
+        print(f"Error processing geofence events: {e}")
+        return []
+
+def get_geofence_engine():
+    """The process-wide geofence engine."""
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = GeofenceEngine()
+            _engine.start()
+        return _engine
+
+def get_stop_arrival(route_stop_id):
+    """The detected arrival at a stop, for pre-filling its verification."""
+    return get_geofence_engine().get_arrival(route_stop_id)
+
+def update_service_times(min_visits=SERVICE_TIME_MIN_VISITS, window_days=SERVICE_TIME_WINDOW_DAYS):
+    """
+    Sets CollectionPoints.service_minutes to the average measured dwell of
+    points with at least min_visits plausible visits in the last
+    window_days. Returns the affected row count, or None on error.
+    """
+    query = """
+        UPDATE CollectionPoints cp
+        JOIN (
+            SELECT rs.point_id, AVG(ge.dwell_seconds) AS avg_dwell, COUNT(*) AS visits
+            FROM GeofenceEvents ge
+            JOIN RouteStops rs ON ge.route_stop_id = rs.route_stop_id
+            WHERE ge.event_type = 'departed'
+              AND ge.event_time >= NOW() - INTERVAL %s DAY
+              AND ge.dwell_seconds BETWEEN %s AND %s
+            GROUP BY rs.point_id
+        ) AS dwell ON dwell.point_id = cp.point_id
+        SET cp.service_minutes = ROUND(dwell.avg_dwell / 60, 1)
+        WHERE dwell.visits >= %s
+    """
+    return execute_query(query, (window_days, MIN_DWELL_S, MAX_DWELL_S, min_visits))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Geofence maintenance.")
+    sub = parser.add_subparsers(dest='command', required=True)
+    update = sub.add_parser('update-service-times', help="Learn service minutes from measured dwell times.")
+    update.add_argument('--min-visits', type=int, default=SERVICE_TIME_MIN_VISITS)
+    update.add_argument('--window-days', type=int, default=SERVICE_TIME_WINDOW_DAYS)
+    args = parser.parse_args(argv)
+
+    result = update_service_times(args.min_visits, args.window_days)
+    if result is None:
+        print("Updating service times failed.")
+        return 1
+    print(f"Updated service times of {result} collection points.")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
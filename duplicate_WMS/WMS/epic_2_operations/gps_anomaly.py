@@ -0,0 +1,190 @@
+# In epic_2_operations/gps_anomaly.py
+
+import threading
+import datetime
+from collections import deque
+import numpy as np
+from utils.geo_utils import pairwise_distances, calculate_distance
+
+# Faster than this between two fixes is not a collection truck
+MAX_SPEED_KMH = 130.0
+# An impossible speed over at least this distance is reported as a teleport
+TELEPORT_DISTANCE_M = 1000.0
+# Speed changes faster than this (m/s^2) are not physical for a loaded truck
+MAX_ACCELERATION_MS2 = 2.5
+# Real receivers jitter; this many bit-identical fixes in a row look like a mocked location
+FROZEN_FIX_RUN = 5
+# A stop verified closer than this to the stop's stored coordinates was typed in, not measured
+EXACT_MATCH_M = 0.5
+# Flags kept in memory for the supervisor view
+MAX_FLAGS = 1000
+
+_detector = None
+_detector_lock = threading.Lock()
+
+def _epoch_seconds(timestamp):
+    return timestamp.timestamp() if isinstance(timestamp, datetime.datetime) else float(timestamp)
+
+class GpsAnomalyDetector:
+    """
+    Checks GPS points as they are written, per vehicle, for impossible
+    speeds, teleports and impossible acceleration. Each batch is checked in
+    one vectorized pass; between batches only the last point and speed of
+    each vehicle are kept. Frozen (mocked) fixes are counted on every raw
+    fix instead, since the ingestion filter drops repeats of a point.
+    Flags stay in memory, so checking never costs a database query.
+    """
+
+    def __init__(self, max_speed_kmh=MAX_SPEED_KMH, teleport_distance_m=TELEPORT_DISTANCE_M,
+                 max_acceleration_ms2=MAX_ACCELERATION_MS2, frozen_fix_run=FROZEN_FIX_RUN, max_flags=MAX_FLAGS):
+        self.max_speed_ms = max_speed_kmh / 3.6
+        self.teleport_distance_m = teleport_distance_m
+        self.max_acceleration_ms2 = max_acceleration_ms2
+        self.frozen_fix_run = frozen_fix_run
+        self._lock = threading.Lock()
+        self._state = {}   # vehicle_id -> (lat, lon, epoch seconds, speed m/s or nan, flagged)
+        self._fix_runs = {}   # vehicle_id -> (lat, lon, identical raw fixes after the first)
+        self._flags = deque(maxlen=max_flags)
+
+    def _flag(self, vehicle_id, kind, latitude, longitude, timestamp, detail, route_stop_id=None):
+        flag = {
+            'vehicle_id': vehicle_id,
+            'kind': kind,
+            'latitude': latitude,
+            'longitude': longitude,
+            'timestamp': timestamp,
+            'detail': detail,
+            'route_stop_id': route_stop_id,
+        }
+        self._flags.append(flag)
+        return flag
+
+    def check_batch(self, rows):
+        """
+        Checks (vehicle_id, lat, lon, timestamp) rows against each other and
+        against each vehicle's previous point. Returns the new flags.
+        """
+        if not rows:
+            return []
+        with self._lock:
+            vehicle = np.array([r[0] for r in rows])
+            t = np.array([_epoch_seconds(r[3]) for r in rows])
+            order = np.lexsort((t, vehicle))
+            vehicle, t = vehicle[order], t[order]
+            coords = np.array([(float(rows[i][1]), float(rows[i][2])) for i in order])
+            n = len(order)
+
+            # The previous point of every row: the row before it, or the vehicle's stored state
+            first = np.r_[True, vehicle[1:] != vehicle[:-1]]
+            prev = np.vstack((np.full((1, 2), np.nan), coords[:-1]))
+            prev_t = np.r_[np.nan, t[:-1]]
+            prev_speed = np.full(n, np.nan)
+            for i in np.flatnonzero(first):
+                state = self._state.get(vehicle[i].item())
+                prev[i], prev_t[i] = (np.nan, np.nan), np.nan
+                if state:
+                    prev[i], prev_t[i], prev_speed[i] = state[:2], state[2], state[3]
+
+            has_prev = ~np.isnan(prev_t)
+            dist = np.zeros(n)
+            dist[has_prev] = pairwise_distances(prev[has_prev], coords[has_prev])
+            dt = np.where(has_prev, t - np.nan_to_num(prev_t), 0.0)
+            moving = has_prev & (dt > 0)
+            speed = np.full(n, np.nan)
+            speed[moving] = dist[moving] / dt[moving]
+            # Speed of the previous segment, for acceleration
+            shifted = np.r_[np.nan, speed[:-1]]
+            prev_speed = np.where(first, prev_speed, shifted)
+            accel = np.full(n, np.nan)
+            both = moving & ~np.isnan(prev_speed)
+            accel[both] = (speed[both] - prev_speed[both]) / dt[both]
+
+            too_fast = moving & (speed > self.max_speed_ms)
+            teleport = too_fast & (dist >= self.teleport_distance_m)
+            jerky = both & ~too_fast & (np.abs(np.nan_to_num(accel)) > self.max_acceleration_ms2)
+
+            flags = []
+            flagged = teleport | too_fast | jerky
+            for i in np.flatnonzero(flagged):
+                vehicle_id, (lat, lon) = vehicle[i].item(), coords[i]
+                timestamp = datetime.datetime.fromtimestamp(t[i])
+                if teleport[i]:
+                    kind, detail = 'teleport', f"Jumped {dist[i] / 1000:.1f} km in {dt[i]:.0f} s."
+                elif too_fast[i]:
+                    kind, detail = 'impossible_speed', f"{speed[i] * 3.6:.0f} km/h."
+                else:
+                    kind, detail = 'acceleration', f"{accel[i]:.1f} m/s² between fixes."
+                flags.append(self._flag(vehicle_id, kind, float(lat), float(lon), timestamp, detail))
+
+            # Keep only each vehicle's newest point (never move its state back in time)
+            last = np.r_[first[1:], True]
+            for i in np.flatnonzero(last):
+                vehicle_id = vehicle[i].item()
+                state = self._state.get(vehicle_id)
+                if state and t[i] < state[2]:
+                    continue
+                self._state[vehicle_id] = (coords[i, 0], coords[i, 1], t[i], speed[i], bool(flagged[i]))
+            return flags
+
+    def check_fix(self, vehicle_id, latitude, longitude, timestamp=None):
+        """
+        Counts bit-identical raw fixes in a row, before the ingestion filter
+        drops repeats of a point. A run is flagged once, at its Nth fix.
+        Returns the new flags.
+        """
+        with self._lock:
+            last = self._fix_runs.get(vehicle_id)
+            run = last[2] + 1 if last and (last[0], last[1]) == (latitude, longitude) else 0
+            self._fix_runs[vehicle_id] = (latitude, longitude, run)
+            if run != self.frozen_fix_run - 1:   # the Nth identical fix is the (N-1)th repeat
+                return []
+            return [self._flag(vehicle_id, 'frozen_fix', latitude, longitude, timestamp or datetime.datetime.now(),
+                               f"{run + 1} identical fixes in a row.")]
+
+    def check_stop(self, vehicle_id, route_stop_id, driver_coords, stop_coords, timestamp=None):
+        """
+        Checks the point a stop was verified at, after it went through
+        check_batch. Flags a point identical to the stop's stored
+        coordinates (typed in rather than measured) and a verification
+        whose point was itself flagged. Returns the new flags.
+        """
+        timestamp = timestamp or datetime.datetime.now()
+        flags = []
+        with self._lock:
+            if calculate_distance(tuple(driver_coords), tuple(stop_coords)) < EXACT_MATCH_M:
+                flags.append(self._flag(vehicle_id, 'stop_exact_match', driver_coords[0], driver_coords[1],
+                                        timestamp, "Verified at exactly the stop's coordinates.", route_stop_id))
+            state = self._state.get(vehicle_id)
+            fix_run = self._fix_runs.get(vehicle_id)
+            if (state and state[4]) or (fix_run and fix_run[2] >= self.frozen_fix_run - 1):
+                flags.append(self._flag(vehicle_id, 'stop_after_anomaly', driver_coords[0], driver_coords[1],
+                                        timestamp, "Verification point was flagged.", route_stop_id))
+        return flags
+
+    def get_flags(self, limit=None):
+        """Returns the kept flags, newest first."""
+        with self._lock:
+            flags = list(reversed(self._flags))
+        return flags[:limit] if limit else flags
+
+    def forget(self, vehicle_id=None):
+        """Drops the per-vehicle state of one vehicle (or of all)."""
+        with self._lock:
+            if vehicle_id is None:
+                self._state.clear()
+                self._fix_runs.clear()
+            else:
+                self._state.pop(vehicle_id, None)
+                self._fix_runs.pop(vehicle_id, None)
+
+def get_anomaly_detector():
+    """The process-wide anomaly detector."""
+    global _detector
+    with _detector_lock:
+        if _detector is None:
+            _detector = GpsAnomalyDetector()
+        return _detector
+
+def get_anomaly_flags(limit=200):
+    """Recent GPS and stop anomaly flags for the supervisor dashboard, newest first."""
+    return get_anomaly_detector().get_flags(limit)
@@ -0,0 +1,366 @@
+# In epic_2_operations/gps_ingestion.py
+
+import os
+import json
+import time
+import atexit
+import datetime
+import tempfile
+import threading
+from utils.db_connector import transaction
+from utils.geo_utils import calculate_distance
+from epic_2_operations.fleet_state import get_fleet_state
+from epic_2_operations.assignment_cache import get_assignment_cache
+from epic_2_operations.gps_anomaly import get_anomaly_detector
+from epic_2_operations.geofence_logic import record_geofence_events, get_geofence_engine
+from epic_2_operations.eta_logic import update_etas, get_eta_engine
+
+# A new point is kept only if the truck moved at least this far...
+MIN_DISTANCE_M = 15.0
+# ...and at least this long after the last kept point
+MIN_INTERVAL_S = 10.0
+# A parked truck still gets one point this often, so the map knows it is alive
+HEARTBEAT_S = 300.0
+# Buffered points are written once there are this many, or this long after the last write
+FLUSH_SIZE = 50
+FLUSH_INTERVAL_S = 30.0
+# Above this many buffered points (e.g. the database is down) the rest goes to disk
+MAX_BUFFERED = 10000
+
+ACCEPTED = 'accepted'
+DROPPED = 'dropped'
+NO_VEHICLE = 'no_vehicle'
+
+INSERT_LOCATIONS_QUERY = """
+    INSERT INTO VehicleLocations (vehicle_id, latitude, longitude, timestamp)
+    VALUES (%s, %s, %s, %s)
+"""
+# Only ever moves a vehicle's latest position forward in time. The
+# timestamp must be assigned last: MySQL applies the SET list in order.
+UPSERT_LATEST_QUERY = """
+    INSERT INTO VehicleLatestLocation (vehicle_id, latitude, longitude, timestamp)
+    VALUES (%s, %s, %s, %s)
+    ON DUPLICATE KEY UPDATE
+        latitude = IF(VALUES(timestamp) >= timestamp, VALUES(latitude), latitude),
+        longitude = IF(VALUES(timestamp) >= timestamp, VALUES(longitude), longitude),
+        timestamp = GREATEST(timestamp, VALUES(timestamp))
+"""
+
+_ingestor = None
+_ingestor_lock = threading.Lock()
+
+def write_locations(cursor, rows):
+    """
+    Inserts GPS rows (vehicle_id, lat, lon, timestamp) into the history and
+    moves each vehicle's VehicleLatestLocation row to its newest point,
+    on the caller's transaction cursor.
+    """
+    latest = {}
+    for row in rows:
+        if row[0] not in latest or row[3] >= latest[row[0]][3]:
+            latest[row[0]] = row
+    cursor.executemany(INSERT_LOCATIONS_QUERY, rows)
+    cursor.executemany(UPSERT_LATEST_QUERY, list(latest.values()))
+
+def record_locations(rows):
+    """
+    Writes GPS rows straight away, bypassing the buffer (e.g. the point a
+    stop was verified at). Returns True on success.
+    """
+    try:
+        with transaction() as cursor:
+            write_locations(cursor, rows)
+    except Exception as e:
+        print(f"Error recording locations: {e}")
+        return False
+    try:
+        get_fleet_state().update_many(rows)
+    except Exception as e:
+        print(f"Error updating fleet state: {e}")
+    _check_anomalies(get_anomaly_detector(), rows)
+    record_geofence_events(rows)
+    update_etas(rows)
+    return True
+
+def _check_anomalies(detector, rows):
+    # Flags are informational: a failing check must never lose points
+    try:
+        detector.check_batch(rows)
+    except Exception as e:
+        print(f"Error checking GPS anomalies: {e}")
+
+def default_spill_path():
+    return os.getenv('GPS_SPILL_PATH') or os.path.join(tempfile.gettempdir(), 'wms_gps_spill.jsonl')
+
+class GpsIngestor:
+    """
+    Collects driver GPS points in memory and writes them to VehicleLocations
+    (and VehicleLatestLocation) in multi-row inserts. Points that add nothing (truck has not moved, or
+    reported again too soon) are dropped before they reach the buffer.
+    Anything still buffered at shutdown is spilled to a JSONL file and
+    picked up again by the next process.
+    """
+
+    def __init__(self, spill_path=None, min_distance_m=MIN_DISTANCE_M, min_interval_s=MIN_INTERVAL_S,
+                 heartbeat_s=HEARTBEAT_S, flush_size=FLUSH_SIZE, flush_interval_s=FLUSH_INTERVAL_S,
+                 max_buffered=MAX_BUFFERED, clock=time.monotonic, fleet_state=None, assignments=None,
+                 detector=None, geofences=None, etas=None):
+        self.spill_path = spill_path or default_spill_path()
+        self.min_distance_m = min_distance_m
+        self.min_interval_s = min_interval_s
+        self.heartbeat_s = heartbeat_s
+        self.flush_size = flush_size
+        self.flush_interval_s = flush_interval_s
+        self.max_buffered = max_buffered
+        self.clock = clock
+        # Live positions are published as soon as a point is accepted, not at flush time
+        self.fleet_state = fleet_state
+        # Driver -> vehicle comes from the shared assignment cache unless one is given
+        self.assignments = assignments
+        # Raw fixes and written batches are checked for GPS anomalies, in memory
+        self.detector = detector
+        # ...and run through the stop geofences for arrival/departure events
+        self.geofences = geofences
+        # Stop ETAs follow every accepted point, like the live map
+        self.etas = etas
+
+        # Guards the buffer and counters only; never held during database work
+        self._lock = threading.Lock()
+        # One flush at a time (size trigger, timer and shutdown)
+        self._flush_lock = threading.Lock()
+        self._wake = None
+        self._last_kept = {}     # vehicle_id -> (lat, lon, clock time)
+        self._buffers = {}       # vehicle_id -> [row, ...]
+        self._buffered = 0
+        self._last_flush = clock()
+        self._stats = {'accepted': 0, 'dropped': 0, 'no_vehicle': 0,
+                       'flushed': 0, 'flush_errors': 0, 'spilled': 0, 'restored': 0}
+        self._stop = None
+        self._restore_spill()
+
+    # --- Driver -> vehicle ----------------------------------------------------
+
+    def _assignments(self):
+        return self.assignments if self.assignments is not None else get_assignment_cache()
+
+    def get_vehicle_for_driver(self, driver_id):
+        """Returns the vehicle on the driver's active assignment for today, or None."""
+        assignment = self._assignments().get(driver_id)
+        return assignment['vehicle_id'] if assignment else None
+
+    def forget_driver(self, driver_id=None):
+        """Drops the cached assignment of one driver (or of all drivers)."""
+        self._assignments().invalidate(driver_id)
+
+    # --- Ingestion -----------------------------------------------------------
+
+    def submit(self, driver_id, latitude, longitude, timestamp=None, force=False):
+        """
+        Offers one GPS fix from a driver. Returns ACCEPTED if it was buffered,
+        DROPPED if it was too close in space/time to the last kept point, or
+        NO_VEHICLE if the driver has no active assignment. force=True skips
+        the distance/time filter (e.g. for a stop verification point).
+        Only the filter and the buffer run under the lock; lookups, live
+        updates and writes never hold up other drivers' points.
+        """
+        # May query the database on a cache miss, so before taking the lock
+        vehicle_id = self.get_vehicle_for_driver(driver_id)
+        if not vehicle_id:
+            with self._lock:
+                self._stats['no_vehicle'] += 1
+            return NO_VEHICLE
+
+        latitude, longitude = float(latitude), float(longitude)
+        if self.detector is not None:
+            # Every fix, so repeats the filter below drops still count
+            try:
+                self.detector.check_fix(vehicle_id, latitude, longitude, timestamp)
+            except Exception as e:
+                print(f"Error checking GPS anomalies: {e}")
+        with self._lock:
+            now = self.clock()
+            last = self._last_kept.get(vehicle_id)
+            if last and not force:
+                elapsed = now - last[2]
+                if elapsed < self.min_interval_s:
+                    self._stats['dropped'] += 1
+                    return DROPPED
+                if elapsed < self.heartbeat_s and \
+                        calculate_distance((last[0], last[1]), (latitude, longitude)) < self.min_distance_m:
+                    self._stats['dropped'] += 1
+                    return DROPPED
+
+            self._last_kept[vehicle_id] = (latitude, longitude, now)
+            row = (vehicle_id, latitude, longitude, timestamp or datetime.datetime.now())
+            self._buffers.setdefault(vehicle_id, []).append(row)
+            self._buffered += 1
+            self._stats['accepted'] += 1
+            flush_due = self._buffered >= self.flush_size or now - self._last_flush >= self.flush_interval_s
+
+        if self.fleet_state is not None:
+            try:
+                self.fleet_state.update(*row)
+            except Exception as e:
+                print(f"Error updating fleet state: {e}")
+        if self.etas is not None:
+            update_etas([row], self.etas)
+        if flush_due:
+            if self._wake is not None:
+                # The flush thread writes; the driver's request does not wait for it
+                self._wake.set()
+            else:
+                self.flush()
+        return ACCEPTED
+
+    def _take_buffer(self):
+        """Empties the buffer under the lock and returns its rows."""
+        with self._lock:
+            self._last_flush = self.clock()
+            rows = [row for buffer in self._buffers.values() for row in buffer]
+            self._buffers.clear()
+            self._buffered = 0
+            return rows
+
+    def _put_back(self, rows):
+        """Returns rows that could not be written to the front of the buffer."""
+        with self._lock:
+            for row in reversed(rows):
+                self._buffers.setdefault(row[0], []).insert(0, row)
+            self._buffered += len(rows)
+
+    def flush(self):
+        """
+        Writes every buffered point in one multi-row insert, together with
+        each vehicle's newest point, in one transaction. On failure the
+        points go back into the buffer for the next attempt (or to disk when
+        the buffer is full). Returns the number of points written.
+        The buffer is swapped out under the lock; the write and the
+        anomaly and geofence checks run outside it, one flush at a time.
+        """
+        with self._flush_lock:
+            rows = self._take_buffer()
+            if not rows:
+                return 0
+            try:
+                with transaction() as cursor:
+                    write_locations(cursor, rows)
+            except Exception:
+                self._put_back(rows)
+                with self._lock:
+                    self._stats['flush_errors'] += 1
+                    over = self._buffered > self.max_buffered
+                if over:
+                    self.spill()
+                return 0
+            with self._lock:
+                self._stats['flushed'] += len(rows)
+            if self.detector is not None:
+                _check_anomalies(self.detector, rows)
+            if self.geofences is not None:
+                record_geofence_events(rows, self.geofences)
+            # The database is reachable again: bring back anything spilled earlier
+            if os.path.exists(self.spill_path):
+                self._restore_spill()
+        return len(rows)
+
+    # --- Durable spill ---------------------------------------------------------
+
+    def spill(self):
+        """Appends every buffered point to the spill file and empties the buffer."""
+        with self._lock:
+            rows = [row for buffer in self._buffers.values() for row in buffer]
+            if not rows:
+                return 0
+            try:
+                with open(self.spill_path, 'a', encoding='utf-8') as f:
+                    for vehicle_id, lat, lon, ts in rows:
+                        f.write(json.dumps({'vehicle_id': vehicle_id, 'latitude': lat,
+                                            'longitude': lon, 'timestamp': ts.isoformat()}) + "\n")
+                    f.flush()
+                    os.fsync(f.fileno())
+            except OSError as e:
+                print(f"Error spilling GPS points to {self.spill_path}: {e}")
+                return 0
+            self._buffers.clear()
+            self._buffered = 0
+            self._stats['spilled'] += len(rows)
+            return len(rows)
+
+    def _restore_spill(self):
+        """Loads points spilled by an earlier run back into the buffer."""
+        claimed = f"{self.spill_path}.{os.getpid()}.restoring"
+        try:
+            # Renaming first means two processes never restore the same file
+            os.replace(self.spill_path, claimed)
+        except OSError:
+            return 0
+        restored = 0
+        with self._lock:
+            with open(claimed, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        point = json.loads(line)
+                        row = (point['vehicle_id'], point['latitude'], point['longitude'],
+                               datetime.datetime.fromisoformat(point['timestamp']))
+                    except (ValueError, KeyError):
+                        continue  # a half-written last line
+                    self._buffers.setdefault(row[0], []).append(row)
+                    restored += 1
+            self._buffered += restored
+            self._stats['restored'] += restored
+        os.remove(claimed)
+        return restored
+
+    # --- Lifecycle -------------------------------------------------------------
+
+    def start(self):
+        """
+        Starts the background thread that does the writes: on the time
+        trigger, and as soon as submit finds the buffer full.
+        """
+        if self._stop is not None:
+            return
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+
+        def run():
+            while not self._stop.is_set():
+                self._wake.wait(self.flush_interval_s)
+                self._wake.clear()
+                try:
+                    self.flush()
+                except Exception as e:
+                    print(f"Error flushing GPS points: {e}")
+
+        threading.Thread(target=run, name='gps-flush', daemon=True).start()
+
+    def close(self):
+        """Final flush; whatever cannot be written is spilled to disk."""
+        if self._stop is not None:
+            self._stop.set()
+            self._wake.set()
+        try:
+            self.flush()
+        except Exception as e:
+            print(f"Error flushing GPS points at shutdown: {e}")
+        self.spill()
+
+    def get_stats(self):
+        """Counts of points accepted, dropped, flushed and spilled, plus the current buffer size."""
+        with self._lock:
+            return dict(self._stats, buffered=self._buffered)
+
+def get_ingestor():
+    """The process-wide ingestor, started on first use and closed at exit."""
+    global _ingestor
+    with _ingestor_lock:
+        if _ingestor is None:
+            _ingestor = GpsIngestor(fleet_state=get_fleet_state(), detector=get_anomaly_detector(),
+                                    geofences=get_geofence_engine(), etas=get_eta_engine())
+            _ingestor.start()
+            atexit.register(_ingestor.close)
+        return _ingestor
+
+def get_ingestion_stats():
+    """Ingestion counters for the supervisor dashboard."""
+    return get_ingestor().get_stats()
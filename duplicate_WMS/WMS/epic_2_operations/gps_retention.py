@@ -0,0 +1,226 @@
+# In epic_2_operations/gps_retention.py
+#
+# Tiered retention for GPS points. Run from the WMS folder, e.g. nightly:
+#   python -m epic_2_operations.gps_retention run
+#
+#   raw      VehicleLocations           every point, for RAW_RETENTION_DAYS
+#   rollup   VehicleLocationRollups     one point per 30 s / 50 m, for ROLLUP_RETENTION_DAYS
+#   archive  <GPS_ARCHIVE_DIR>/vehicle_<id>/<YYYY-MM-DD>.npz   every point, compressed, kept
+
+import os
+import sys
+import argparse
+import datetime
+import numpy as np
+from utils.db_connector import fetch_all, fetch_one, execute_query, execute_many
+from utils.geo_utils import calculate_distance
+
+RAW_RETENTION_DAYS = int(os.getenv('GPS_RAW_RETENTION_DAYS', '30'))
+ROLLUP_RETENTION_DAYS = int(os.getenv('GPS_ROLLUP_RETENTION_DAYS', '180'))
+# A rolled-up trace keeps a point once this long or this far from the last kept one
+ROLLUP_INTERVAL_S = 30.0
+ROLLUP_DISTANCE_M = 50.0
+# Rows per DELETE, so no statement holds its locks for long
+DELETE_CHUNK_ROWS = 5000
+ARCHIVE_DIR = os.getenv('GPS_ARCHIVE_DIR') or os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'gps_archive')
+
+# --- Downsampling --------------------------------------------------------------
+
+def downsample(points, interval_s=ROLLUP_INTERVAL_S, distance_m=ROLLUP_DISTANCE_M):
+    """
+    Thins a time-ordered list of (timestamp, lat, lon) to one point per
+    interval_s or per distance_m, whichever comes first. The first and last
+    points are always kept.
+    """
+    if len(points) <= 2:
+        return list(points)
+    kept = [points[0]]
+    for point in points[1:-1]:
+        last = kept[-1]
+        if (point[0] - last[0]).total_seconds() >= interval_s or \
+                calculate_distance(last[1:], point[1:]) >= distance_m:
+            kept.append(point)
+    kept.append(points[-1])
+    return kept
+
+# --- Archive files -----------------------------------------------------------------
+
+def archive_path(vehicle_id, day, archive_dir=None):
+    return os.path.join(archive_dir or ARCHIVE_DIR, f"vehicle_{vehicle_id}", f"{day.isoformat()}.npz")
+
+def read_archive(vehicle_id, day, archive_dir=None):
+    """Returns the archived (timestamp, lat, lon) points of one vehicle-day, oldest first."""
+    path = archive_path(vehicle_id, day, archive_dir)
+    if not os.path.exists(path):
+        return []
+    with np.load(path) as data:
+        seconds, lat, lon = data['timestamp'], data['latitude'], data['longitude']
+    return [(datetime.datetime.fromtimestamp(int(t)), float(a), float(b))
+            for t, a, b in zip(seconds, lat, lon)]
+
+def write_archive(vehicle_id, day, points, archive_dir=None):
+    """
+    Stores one vehicle-day as compressed columns (timestamp, latitude,
+    longitude), merged with whatever was archived for that day before.
+    Written to a temporary file first so a crash never leaves half a file.
+    """
+    merged = sorted(set(read_archive(vehicle_id, day, archive_dir)) |
+                    {(ts.replace(microsecond=0), float(lat), float(lon)) for ts, lat, lon in points})
+    path = archive_path(vehicle_id, day, archive_dir)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + '.tmp.npz'
+    np.savez_compressed(
+        tmp_path,
+        timestamp=np.array([int(p[0].timestamp()) for p in merged], dtype=np.int64),
+        latitude=np.array([p[1] for p in merged]),
+        longitude=np.array([p[2] for p in merged]),
+    )
+    os.replace(tmp_path, path)
+    return len(merged)
+
+# --- Database tiers ------------------------------------------------------------------
+
+def _day_bounds(day):
+    start = datetime.datetime.combine(day, datetime.time.min)
+    return start, start + datetime.timedelta(days=1)
+
+def get_raw_points(vehicle_id, day):
+    """[(timestamp, lat, lon)] of one vehicle-day, or None on error."""
+    query = """
+        SELECT timestamp, latitude, longitude
+        FROM VehicleLocations
+        WHERE vehicle_id = %s AND timestamp >= %s AND timestamp < %s
+        ORDER BY timestamp
+    """
+    rows = fetch_all(query, (vehicle_id, *_day_bounds(day)))
+    if rows is None:
+        return None
+    return [(r['timestamp'], float(r['latitude']), float(r['longitude'])) for r in rows]
+
+def get_rollup_points(vehicle_id, day):
+    """[(timestamp, lat, lon)] of one rolled-up vehicle-day, or None on error."""
+    query = """
+        SELECT timestamp, latitude, longitude
+        FROM VehicleLocationRollups
+        WHERE vehicle_id = %s AND timestamp >= %s AND timestamp < %s
+        ORDER BY timestamp
+    """
+    rows = fetch_all(query, (vehicle_id, *_day_bounds(day)))
+    if rows is None:
+        return None
+    return [(r['timestamp'], float(r['latitude']), float(r['longitude'])) for r in rows]
+
+def delete_in_chunks(query, params, chunk_rows=DELETE_CHUNK_ROWS):
+    """
+    Runs a DELETE ... LIMIT %s repeatedly (each in its own short transaction)
+    until fewer than chunk_rows rows go. Returns the rows deleted, or None
+    if a chunk failed.
+    """
+    total = 0
+    while True:
+        deleted = execute_query(query, (*params, chunk_rows))
+        if deleted is None:
+            return None
+        total += deleted
+        if deleted < chunk_rows:
+            return total
+
+def get_location_trace(vehicle_id, day):
+    """
+    The GPS trace of one vehicle on one day from whichever tier holds it:
+    raw points, then the rolled-up trace, then the archive.
+    Returns (an (n, 2) float array of lat/lon, tier name or None), or
+    (None, None) if a tier could not be read.
+    """
+    if isinstance(day, str):
+        day = datetime.date.fromisoformat(day)
+    for tier, reader in (('raw', get_raw_points), ('rollup', get_rollup_points), ('archive', read_archive)):
+        points = reader(vehicle_id, day)
+        if points is None:
+            return None, None
+        if points:
+            return np.array([(lat, lon) for _, lat, lon in points], dtype=float), tier
+    return np.zeros((0, 2)), None
+
+# --- Retention run -------------------------------------------------------------------
+
+def roll_up_vehicle_day(vehicle_id, day, archive_dir=None, chunk_rows=DELETE_CHUNK_ROWS):
+    """
+    Moves one vehicle-day out of the raw table: archives every point,
+    stores the downsampled trace, then deletes the raw rows in chunks.
+    Each step can be repeated safely if an earlier run stopped half way.
+    Returns the number of raw rows deleted, or None on error.
+    """
+    points = get_raw_points(vehicle_id, day)
+    if points is None:
+        return None
+    if points:
+        write_archive(vehicle_id, day, points, archive_dir)
+        rollup = downsample(points)
+        result = execute_many(
+            """
+            INSERT IGNORE INTO VehicleLocationRollups (vehicle_id, timestamp, latitude, longitude)
+            VALUES (%s, %s, %s, %s)
+            """,
+            [(vehicle_id, ts, lat, lon) for ts, lat, lon in rollup]
+        )
+        if result is None:
+            return None
+    start, end = _day_bounds(day)
+    return delete_in_chunks(
+        "DELETE FROM VehicleLocations WHERE vehicle_id = %s AND timestamp >= %s AND timestamp < %s LIMIT %s",
+        (vehicle_id, start, end), chunk_rows
+    )
+
+def run_retention(raw_days=RAW_RETENTION_DAYS, rollup_days=ROLLUP_RETENTION_DAYS,
+                  archive_dir=None, chunk_rows=DELETE_CHUNK_ROWS, today=None):
+    """
+    Rolls up and archives every vehicle-day older than raw_days, then drops
+    rolled-up points older than rollup_days (the archive keeps them).
+    Returns a summary dict.
+    """
+    today = today or datetime.date.today()
+    raw_cutoff = datetime.datetime.combine(today - datetime.timedelta(days=raw_days), datetime.time.min)
+    rollup_cutoff = datetime.datetime.combine(today - datetime.timedelta(days=rollup_days), datetime.time.min)
+    summary = {'vehicle_days': 0, 'raw_deleted': 0, 'rollups_deleted': 0, 'errors': 0}
+
+    for vehicle in fetch_all("SELECT vehicle_id FROM Vehicles") or []:
+        vehicle_id = vehicle['vehicle_id']
+        while True:
+            # Uses idx_vehicle_timestamp: no scan of the whole table
+            oldest = fetch_one("SELECT MIN(timestamp) AS oldest FROM VehicleLocations WHERE vehicle_id = %s",
+                               (vehicle_id,))
+            if not oldest or not oldest['oldest'] or oldest['oldest'] >= raw_cutoff:
+                break
+            deleted = roll_up_vehicle_day(vehicle_id, oldest['oldest'].date(), archive_dir, chunk_rows)
+            if not deleted:
+                # None: a query failed; 0: nothing could be deleted, so stop rather than spin
+                summary['errors'] += 1
+                break
+            summary['vehicle_days'] += 1
+            summary['raw_deleted'] += deleted
+
+    deleted = delete_in_chunks("DELETE FROM VehicleLocationRollups WHERE timestamp < %s LIMIT %s",
+                               (rollup_cutoff,), chunk_rows)
+    if deleted is None:
+        summary['errors'] += 1
+    else:
+        summary['rollups_deleted'] = deleted
+    return summary
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Roll up, archive and expire old GPS points.")
+    sub = parser.add_subparsers(dest='command', required=True)
+    run = sub.add_parser('run', help="Run the retention job once.")
+    run.add_argument('--raw-days', type=int, default=RAW_RETENTION_DAYS)
+    run.add_argument('--rollup-days', type=int, default=ROLLUP_RETENTION_DAYS)
+    run.add_argument('--archive-dir', default=None)
+    args = parser.parse_args(argv)
+
+    summary = run_retention(args.raw_days, args.rollup_days, args.archive_dir)
+    print(f"Rolled up {summary['vehicle_days']} vehicle-days, deleted {summary['raw_deleted']} raw points "
+          f"and {summary['rollups_deleted']} expired rollup points ({summary['errors']} errors).")
+    return 1 if summary['errors'] else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,107 @@
+# In epic_2_operations/latest_location.py
+#
+# Maintenance for the VehicleLatestLocation table. Run from the WMS folder:
+#   python -m epic_2_operations.latest_location backfill
+#   python -m epic_2_operations.latest_location check [--repair]
+
+import sys
+import argparse
+from utils.db_connector import fetch_all, execute_query
+
+def backfill_latest_locations():
+    """
+    Fills VehicleLatestLocation from the newest VehicleLocations row of
+    every vehicle. Safe to re-run: rows already newer are left alone.
+    Returns the affected row count, or None on error.
+    """
+    query = """
+        INSERT INTO VehicleLatestLocation (vehicle_id, latitude, longitude, timestamp)
+        SELECT vl.vehicle_id, vl.latitude, vl.longitude, vl.timestamp
+        FROM VehicleLocations vl
+        JOIN (
+            SELECT vehicle_id, MAX(timestamp) AS max_time
+            FROM VehicleLocations
+            GROUP BY vehicle_id
+        ) AS latest ON vl.vehicle_id = latest.vehicle_id AND vl.timestamp = latest.max_time
+        ON DUPLICATE KEY UPDATE
+            latitude = IF(VALUES(timestamp) >= VehicleLatestLocation.timestamp,
+                          VALUES(latitude), VehicleLatestLocation.latitude),
+            longitude = IF(VALUES(timestamp) >= VehicleLatestLocation.timestamp,
+                           VALUES(longitude), VehicleLatestLocation.longitude),
+            timestamp = GREATEST(VehicleLatestLocation.timestamp, VALUES(timestamp))
+    """
+    return execute_query(query)
+
+def check_latest_locations():
+    """
+    Compares VehicleLatestLocation with the history. Returns a list of
+    {vehicle_id, problem, history_time, latest_time} for every vehicle whose
+    latest row is missing, older than its newest history point, or not at
+    the position recorded in the history for that time.
+    """
+    query = """
+        SELECT h.vehicle_id, h.max_time AS history_time, l.timestamp AS latest_time,
+               EXISTS (
+                   SELECT 1 FROM VehicleLocations vl
+                   WHERE vl.vehicle_id = l.vehicle_id
+                     AND vl.timestamp = l.timestamp
+                     AND vl.latitude = l.latitude
+                     AND vl.longitude = l.longitude
+               ) AS position_matches
+        FROM (
+            SELECT vehicle_id, MAX(timestamp) AS max_time
+            FROM VehicleLocations
+            GROUP BY vehicle_id
+        ) AS h
+        LEFT JOIN VehicleLatestLocation l ON l.vehicle_id = h.vehicle_id
+    """
+    mismatches = []
+    for row in fetch_all(query) or []:
+        if row['latest_time'] is None:
+            problem = 'missing'
+        elif row['latest_time'] < row['history_time']:
+            problem = 'stale'
+        elif row['latest_time'] == row['history_time'] and not row['position_matches']:
+            problem = 'position'
+        else:
+            continue
+        mismatches.append({
+            'vehicle_id': row['vehicle_id'],
+            'problem': problem,
+            'history_time': row['history_time'],
+            'latest_time': row['latest_time'],
+        })
+    return mismatches
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Maintain the VehicleLatestLocation table.")
+    sub = parser.add_subparsers(dest='command', required=True)
+    sub.add_parser('backfill', help="Fill the table from the location history.")
+    check = sub.add_parser('check', help="Compare the table with the location history.")
+    check.add_argument('--repair', action='store_true', help="Backfill if anything is out of step.")
+    args = parser.parse_args(argv)
+
+    if args.command == 'backfill':
+        result = backfill_latest_locations()
+        if result is None:
+            print("Backfill failed.")
+            return 1
+        print(f"Backfill done ({result} rows affected).")
+        return 0
+
+    mismatches = check_latest_locations()
+    for m in mismatches:
+        print(f"Vehicle {m['vehicle_id']}: {m['problem']} "
+              f"(history {m['history_time']}, latest {m['latest_time']})")
+    if not mismatches:
+        print("VehicleLatestLocation is consistent with VehicleLocations.")
+        return 0
+    if args.repair:
+        backfill_latest_locations()
+        remaining = check_latest_locations()
+        print(f"Repaired {len(mismatches) - len(remaining)} of {len(mismatches)} vehicles.")
+        return 0 if not remaining else 1
+    return 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,327 @@
+# In epic_2_operations/offline_sync.py
+#
+# Batch stop completion for drivers who collected stops while offline.
+# Each event is a dict:
+#   {idempotency_key, route_stop_id, latitude, longitude, weight, client_timestamp}
+# and comes back with a status:
+#   applied    the stop, payment and booking were updated
+#   rejected   the event failed validation (message says why)
+#   duplicate  this idempotency key was already synced (the earlier outcome is kept)
+#   error      the batch could not be written; nothing was recorded, retry it
+
+import datetime
+import numpy as np
+from utils.db_connector import fetch_all, transaction
+from utils.geo_utils import pairwise_distances
+from epic_2_operations.assignment_cache import get_assignment_cache
+from epic_2_operations.gps_ingestion import record_locations
+from epic_2_operations.gps_anomaly import get_anomaly_detector
+from epic_2_operations.eta_logic import get_eta_engine
+from epic_2_operations.geofence_logic import get_stop_arrival, GEOFENCE_RADIUS_M
+from epic_2_operations.tracking_logic import invalidate_route_history
+from epic_3_billing.tariff_logic import price_many
+from epic_3_billing.payment_logic import record_cash_payments, get_receipt_allocator
+from epic_3_billing.cash_reconciliation import record_stop_cash
+from epic_3_billing.client_summary import invalidate_client_summary
+
+APPLIED = 'applied'
+REJECTED = 'rejected'
+DUPLICATE = 'duplicate'
+ERROR = 'error'
+
+MAX_KEY_LENGTH = 64
+
+def _placeholders(values):
+    return ', '.join(['%s'] * len(values))
+
+def _rows_table(columns, rows):
+    """
+    A derived table of literal rows, for joining a whole batch into one
+    UPDATE: 'SELECT %s AS a, %s AS b UNION ALL SELECT %s, %s ...'.
+    Returns (sql, flat params).
+    """
+    first = 'SELECT ' + ', '.join(f"%s AS {c}" for c in columns)
+    rest = ' UNION ALL SELECT ' + ', '.join(['%s'] * len(columns))
+    sql = first + rest * (len(rows) - 1)
+    return sql, [value for row in rows for value in row]
+
+def _parse_timestamp(value):
+    if value is None or isinstance(value, datetime.datetime):
+        return value
+    return datetime.datetime.fromisoformat(str(value))
+
+def _normalize(event):
+    """Checks one event's fields. Returns (clean event, None) or (None, reason)."""
+    key = str(event.get('idempotency_key') or '').strip()
+    if not key or len(key) > MAX_KEY_LENGTH:
+        return None, "Missing or invalid idempotency key."
+    try:
+        clean = {
+            'idempotency_key': key,
+            'route_stop_id': int(event['route_stop_id']),
+            'latitude': float(event['latitude']),
+            'longitude': float(event['longitude']),
+            'weight': float(event['weight']),
+            'client_timestamp': _parse_timestamp(event.get('client_timestamp')),
+        }
+    except (KeyError, TypeError, ValueError):
+        return None, "Malformed event."
+    if clean['weight'] <= 0:
+        return None, "Weight must be greater than zero."
+    return clean, None
+
+def _get_stops(driver_id, route_stop_ids):
+    """
+    Coordinates, booking and assignment of each stop: from the driver's
+    cached assignment where possible, then one query for the rest (already
+    completed stops, or stops the cache has not seen).
+    Returns {route_stop_id: stop dict with 'driver_id' and 'status'}.
+    """
+    assignments = get_assignment_cache()
+    assignment = assignments.get(driver_id)
+    stops = {}
+    for route_stop_id in route_stop_ids:
+        stop = assignments.find_stop(driver_id, route_stop_id)
+        if stop:
+            stops[route_stop_id] = dict(stop, assignment_id=assignment['assignment_id'],
+                                        vehicle_id=assignment['vehicle_id'], driver_id=driver_id)
+    missing = [i for i in route_stop_ids if i not in stops]
+    if missing:
+        query = f"""
+            SELECT rs.route_stop_id, rs.assignment_id, rs.booking_id, rs.status,
+                   cp.latitude, cp.longitude, ra.driver_id, ra.vehicle_id,
+                   sb.client_id, u.email AS client_email, cp.tariff_zone, sb.waste_type
+            FROM RouteStops rs
+            JOIN RouteAssignments ra ON rs.assignment_id = ra.assignment_id
+            JOIN CollectionPoints cp ON rs.point_id = cp.point_id
+            LEFT JOIN ServiceBookings sb ON rs.booking_id = sb.booking_id
+            LEFT JOIN Users u ON sb.client_id = u.user_id
+            WHERE rs.route_stop_id IN ({_placeholders(missing)})
+        """
+        for row in fetch_all(query, tuple(missing)) or []:
+            stops[row['route_stop_id']] = row
+    return stops
+
+def _apply(cursor, driver_id, accepted, outcomes, receipt_numbers):
+    """
+    Writes every accepted event, and the outcome of every validated one,
+    inside the caller's transaction. Stops completed online in the meantime
+    are turned into rejections. Receipt numbers used are added to
+    receipt_numbers. Returns the events actually applied.
+    """
+    if accepted:
+        ids = [e['route_stop_id'] for e in accepted]
+        cursor.execute(
+            f"SELECT route_stop_id FROM RouteStops WHERE route_stop_id IN ({_placeholders(ids)}) "
+            "AND status = 'Pending' FOR UPDATE",
+            tuple(ids)
+        )
+        still_pending = {row['route_stop_id'] for row in cursor.fetchall()}
+        for event in accepted:
+            if event['route_stop_id'] not in still_pending:
+                outcomes[event['idempotency_key']].update(status=REJECTED, message="Stop was already completed.")
+        accepted = [e for e in accepted if e['route_stop_id'] in still_pending]
+
+    if accepted:
+        stops_sql, stops_params = _rows_table(
+            ('route_stop_id', 'lat', 'lon', 'weight', 'completed_at'),
+            [(e['route_stop_id'], *e['verified_at'], e['weight'], e['client_timestamp']) for e in accepted]
+        )
+        cursor.execute(f"""
+            UPDATE RouteStops rs
+            JOIN ({stops_sql}) AS ev ON ev.route_stop_id = rs.route_stop_id
+            SET rs.status = 'Completed',
+                rs.completed_at = COALESCE(ev.completed_at, NOW()),
+                rs.verification_gps_lat = ev.lat,
+                rs.verification_gps_lon = ev.lon,
+                rs.collected_volume_kg = ev.weight
+        """, stops_params)
+
+        per_assignment = {}
+        for event in accepted:
+            per_assignment[event['assignment_id']] = per_assignment.get(event['assignment_id'], 0) + 1
+        # Same transitions as a live completion. Single-table so MySQL assigns
+        # in order and status sees the new count (a batch rarely spans routes).
+        cursor.executemany("""
+            UPDATE RouteAssignments
+            SET completed_stops = completed_stops + %s,
+                status = IF(completed_stops >= total_stops, 'Completed', 'In Progress')
+            WHERE assignment_id = %s
+        """, [(done, assignment_id) for assignment_id, done in per_assignment.items()])
+
+        # The whole batch is priced in one pass, by the tariffs in effect on each collection day
+        amounts = price_many([e['weight'] for e in accepted], [e['tariff'][0] for e in accepted],
+                             [e['tariff'][1] for e in accepted], [e['tariff'][2] for e in accepted],
+                             [e['client_timestamp'] for e in accepted])
+        # Client and receipt address come with the stop, like the tariff key
+        paid = [(e, float(amount)) for e, amount in zip(accepted, amounts)
+                if e['booking_id'] and e['tariff'][0] is not None]
+        # Unbooked stops are not billed; logged is what is actually written to Payments
+        billed = {e['idempotency_key']: amount for e, amount in paid}
+        logged = {}
+        if paid:
+            booking_ids = tuple(e['booking_id'] for e, _ in paid)
+            receipt_numbers.extend(record_cash_payments(cursor, [
+                (e['booking_id'], e['tariff'][0], e['client_email'], amount) for e, amount in paid
+            ]))
+            logged = billed
+            cursor.execute(
+                f"UPDATE ServiceBookings SET status = 'Completed' WHERE booking_id IN ({_placeholders(booking_ids)})",
+                booking_ids
+            )
+        record_stop_cash(cursor, driver_id, [
+            (e['client_timestamp'], e['weight'], billed.get(e['idempotency_key'], 0),
+             logged.get(e['idempotency_key'], 0))
+            for e in accepted
+        ])
+        for event in accepted:
+            outcomes[event['idempotency_key']].update(status=APPLIED)
+
+    if outcomes:
+        cursor.executemany("""
+            INSERT INTO StopCompletionEvents
+                (idempotency_key, driver_id, route_stop_id, status, message, client_timestamp)
+            VALUES (%s, %s, %s, %s, %s, %s)
+        """, [(key, driver_id, o['route_stop_id'], o['status'], o['message'], o['client_timestamp'])
+              for key, o in outcomes.items()])
+    return accepted
+
+def sync_stop_completions(driver_id, events):
+    """
+    Applies a queue of stop completions a driver collected offline.
+    Every event is validated in one pass (fields, idempotency key, stop
+    ownership and status, distance to the stop), then all accepted ones
+    are written set-based in a single transaction. Replaying a batch is
+    safe: known idempotency keys come back as 'duplicate'.
+    Returns one result dict per event, in order:
+    {idempotency_key, route_stop_id, status, message}.
+    """
+    results = [None] * len(events)
+    candidates = []   # (position, clean event)
+    seen_keys = set()
+    for i, event in enumerate(events):
+        clean, reason = _normalize(event)
+        if reason:
+            results[i] = {'idempotency_key': event.get('idempotency_key'),
+                          'route_stop_id': event.get('route_stop_id'), 'status': REJECTED, 'message': reason}
+        elif clean['idempotency_key'] in seen_keys:
+            results[i] = {'idempotency_key': clean['idempotency_key'], 'route_stop_id': clean['route_stop_id'],
+                          'status': DUPLICATE, 'message': "Repeated in this batch."}
+        else:
+            seen_keys.add(clean['idempotency_key'])
+            candidates.append((i, clean))
+
+    # Keys synced by an earlier batch keep their first outcome
+    if candidates:
+        keys = tuple(e['idempotency_key'] for _, e in candidates)
+        known = fetch_all(
+            f"SELECT idempotency_key, status, message FROM StopCompletionEvents "
+            f"WHERE idempotency_key IN ({_placeholders(keys)})",
+            keys
+        )
+        if known is None:
+            for i, e in candidates:
+                results[i] = {'idempotency_key': e['idempotency_key'], 'route_stop_id': e['route_stop_id'],
+                              'status': ERROR, 'message': "Could not check earlier syncs."}
+            return results
+        known = {row['idempotency_key']: row for row in known}
+        for i, e in candidates:
+            if e['idempotency_key'] in known:
+                row = known[e['idempotency_key']]
+                results[i] = {'idempotency_key': e['idempotency_key'], 'route_stop_id': e['route_stop_id'],
+                              'status': DUPLICATE, 'message': f"Already synced ({row['status']})."}
+        candidates = [(i, e) for i, e in candidates if e['idempotency_key'] not in known]
+
+    # Ownership, status and distance of every remaining event in one pass
+    stops = _get_stops(driver_id, sorted({e['route_stop_id'] for _, e in candidates})) if candidates else {}
+    outcomes = {}
+    accepted = []
+    claimed = set()
+    located = [(i, e) for i, e in candidates if e['route_stop_id'] in stops]
+    distances = pairwise_distances(
+        [(e['latitude'], e['longitude']) for _, e in located],
+        [(float(stops[e['route_stop_id']]['latitude']), float(stops[e['route_stop_id']]['longitude']))
+         for _, e in located]
+    ) if located else np.zeros(0)
+    distance_of = {i: d for (i, _), d in zip(located, distances)}
+    for i, e in candidates:
+        stop = stops.get(e['route_stop_id'])
+        message = None
+        # Same rule as a live completion: where the driver is, or where the truck was seen arriving
+        verified_at = (e['latitude'], e['longitude'])
+        if not stop or stop['driver_id'] != driver_id:
+            message = "Stop not found on your routes."
+        elif stop['status'] != 'Pending' or e['route_stop_id'] in claimed:
+            message = "Stop was already completed."
+        elif distance_of[i] > GEOFENCE_RADIUS_M:
+            arrival = get_stop_arrival(e['route_stop_id'])
+            if arrival and stop.get('vehicle_id') and arrival['vehicle_id'] == stop['vehicle_id']:
+                verified_at = (arrival['latitude'], arrival['longitude'])
+            else:
+                message = (f"Verification Failed. You were {distance_of[i]:.0f} meters away. "
+                           f"Must be within {GEOFENCE_RADIUS_M:.0f}m.")
+        outcomes[e['idempotency_key']] = {'route_stop_id': e['route_stop_id'], 'status': REJECTED,
+                                          'message': message, 'client_timestamp': e['client_timestamp']}
+        if message is None:
+            claimed.add(e['route_stop_id'])
+            accepted.append(dict(e, verified_at=verified_at, assignment_id=stop['assignment_id'],
+                                 booking_id=stop['booking_id'],
+                                 client_email=stop.get('client_email'),
+                                 tariff=(stop.get('client_id'), stop.get('tariff_zone'), stop.get('waste_type'))))
+
+    receipt_numbers = []
+    try:
+        with transaction() as cursor:
+            applied = _apply(cursor, driver_id, accepted, outcomes, receipt_numbers)
+            assignment_ids = tuple({e['assignment_id'] for e in applied})
+            vehicles, days, completed = {}, {}, []
+            if assignment_ids:
+                cursor.execute(
+                    f"SELECT assignment_id, vehicle_id, assigned_date, status FROM RouteAssignments "
+                    f"WHERE assignment_id IN ({_placeholders(assignment_ids)})",
+                    assignment_ids
+                )
+                rows = cursor.fetchall()
+                vehicles = {row['assignment_id']: row['vehicle_id'] for row in rows}
+                days = {row['assignment_id']: row['assigned_date'] for row in rows}
+                completed = [row['assignment_id'] for row in rows if row['status'] == 'Completed']
+    except Exception as e:
+        get_receipt_allocator().release(receipt_numbers)
+        print(f"Error syncing stop completions for driver {driver_id}: {e}")
+        for i, event in candidates:
+            results[i] = {'idempotency_key': event['idempotency_key'], 'route_stop_id': event['route_stop_id'],
+                          'status': ERROR, 'message': "Could not save; try again."}
+        return results
+
+    invalidate_client_summary(*{e['tariff'][0] for e in applied if e['booking_id'] and e['tariff'][0] is not None})
+    # The verification points go to the location history like live ones
+    points = [
+        (vehicles[e['assignment_id']], e['latitude'], e['longitude'], e['client_timestamp'] or datetime.datetime.now())
+        for e in applied if vehicles.get(e['assignment_id'])
+    ]
+    if points:
+        record_locations(points)
+        detector = get_anomaly_detector()
+        for e in applied:
+            if vehicles.get(e['assignment_id']):
+                stop = stops[e['route_stop_id']]
+                detector.check_stop(vehicles[e['assignment_id']], e['route_stop_id'], e['verified_at'],
+                                    (float(stop['latitude']), float(stop['longitude'])), e['client_timestamp'])
+    assignments = get_assignment_cache()
+    etas = get_eta_engine()
+    for event in applied:
+        assignments.complete_stop(driver_id, event['route_stop_id'])
+        etas.complete_stop(event['route_stop_id'])
+    for assignment_id in completed:
+        assignments.invalidate_assignment(assignment_id)
+    # Past days are cached as final; a late sync adds stops (and path points) to them
+    history_keys = {(vehicles[e['assignment_id']], days[e['assignment_id']])
+                    for e in applied if vehicles.get(e['assignment_id'])}
+    history_keys.update((vehicle_id, ts.date()) for vehicle_id, _, _, ts in points)
+    invalidate_route_history(*history_keys)
+
+    for i, event in candidates:
+        outcome = outcomes[event['idempotency_key']]
+        results[i] = {'idempotency_key': event['idempotency_key'], 'route_stop_id': event['route_stop_id'],
+                      'status': outcome['status'], 'message': outcome['message']}
+    return results
@@ -1,87 +1,125 @@
 # In epic_2_operations/tracking_logic.py
 
-from utils.db_connector import fetch_all, fetch_one, execute_query
+import datetime
+import threading
+from collections import OrderedDict
+import numpy as np
+from utils.db_connector import fetch_all, fetch_one, execute_query, transaction
 from utils.geo_utils import calculate_distance
-from epic_3_billing.payment_logic import process_cash_payment
+from utils.polyline_utils import encode_polyline
+from utils.simplify_utils import simplification_levels
+from epic_3_billing.payment_logic import record_cash_payments, get_receipt_allocator
+from epic_3_billing.cash_reconciliation import record_stop_cash
+from epic_3_billing.tariff_logic import price_stop
+from epic_3_billing.client_summary import invalidate_client_summary
+from epic_2_operations.gps_ingestion import get_ingestor, record_locations, NO_VEHICLE
+from epic_2_operations.gps_retention import get_location_trace
+from epic_2_operations.assignment_cache import get_assignment_cache
+from epic_2_operations.gps_anomaly import get_anomaly_detector
+from epic_2_operations.geofence_logic import get_stop_arrival, GEOFENCE_RADIUS_M
+from epic_2_operations.eta_logic import get_eta_engine
+
+# Route histories of past days, most recently used last
+HISTORY_CACHE_SIZE = 256
+# Route playback detail levels (Douglas-Peucker tolerance in meters), coarse to full
+PLAYBACK_TOLERANCES_M = (250.0, 50.0, 10.0, 0.0)
+# The map opens at the most detailed level that stays within this many points
+PLAYBACK_DEFAULT_POINTS = 300
+_history_cache = OrderedDict()
+_history_cache_lock = threading.Lock()
 
 # ... (all your existing functions: get_live_vehicle_locations, get_driver_assignment, etc. remain unchanged) ...
 
 def get_live_vehicle_locations():
-    """Gets the most recent location of all active vehicles (US 2.1)"""
+    """
+    Gets the most recent location of all active vehicles (US 2.1).
+    Reads the one-row-per-vehicle VehicleLatestLocation table kept up to
+    date by the GPS write path, not the location history.
+    """
     query = """
-        SELECT v.license_plate, vl.latitude, vl.longitude, vl.timestamp
-        FROM VehicleLocations vl
-        JOIN (
-            SELECT vehicle_id, MAX(timestamp) AS max_time
-            FROM VehicleLocations
-            GROUP BY vehicle_id
-        ) AS latest ON vl.vehicle_id = latest.vehicle_id AND vl.timestamp = latest.max_time
-        JOIN Vehicles v ON vl.vehicle_id = v.vehicle_id
+        SELECT v.license_plate, vll.latitude, vll.longitude, vll.timestamp
+        FROM VehicleLatestLocation vll
+        JOIN Vehicles v ON vll.vehicle_id = v.vehicle_id
     """
     return fetch_all(query)
 
 def get_driver_assignment(driver_id):
-    """Gets the pending stops for a driver's active assignment (US 2.3)"""
-    query = """
-        SELECT rs.route_stop_id, cp.point_name, cp.address, cp.latitude, cp.longitude, rs.status
-        FROM RouteStops rs
-        JOIN RouteAssignments ra ON rs.assignment_id = ra.assignment_id
-        JOIN CollectionPoints cp ON rs.point_id = cp.point_id
-        WHERE ra.driver_id = %s
-        AND ra.assigned_date = CURDATE()
-        AND rs.status = 'Pending'
-        ORDER BY rs.stop_order ASC
     """
-    return fetch_all(query, (driver_id,))
+    Gets the pending stops for a driver's active assignment (US 2.3),
+    in route order, from the shared assignment cache.
+    """
+    assignment = get_assignment_cache().get(driver_id)
+    if not assignment:
+        return []
+    return [dict(stop) for stop in assignment['stops']]
 
-def _check_and_complete_assignment(assignment_id):
+# Counts one more completed stop and moves the assignment along in the same
+# statement: Pending -> In Progress on the first stop, -> Completed on the
+# last. MySQL applies the SET list in order, so status sees the new count.
+COMPLETE_STOP_COUNTER_QUERY = """
+    UPDATE RouteAssignments
+    SET completed_stops = completed_stops + 1,
+        status = IF(completed_stops >= total_stops, 'Completed', 'In Progress')
+    WHERE assignment_id = %s
+"""
+
+def _record_stop_completion(cursor, assignment_id):
     """
-    Private helper function. Checks if all stops for an assignment are done.
-    If so, marks the main RouteAssignment as 'Completed'.
+    Private helper function. Bumps the assignment's completed_stops counter
+    inside the caller's transaction. Returns True if that completed it.
     """
     if not assignment_id:
-        return
+        return False
+    cursor.execute(COMPLETE_STOP_COUNTER_QUERY, (assignment_id,))
+    cursor.execute("SELECT status FROM RouteAssignments WHERE assignment_id = %s", (assignment_id,))
+    row = cursor.fetchone()
+    return bool(row) and row['status'] == 'Completed'
 
-    check_query = """
-        SELECT COUNT(*) as pending_count
-        FROM RouteStops
-        WHERE assignment_id = %s AND status = 'Pending'
+def get_assignment_progress(assignment_id=None):
     """
-    result = fetch_one(check_query, (assignment_id,))
-    
-    if result and result['pending_count'] == 0:
-        complete_query = """
-            UPDATE RouteAssignments
-            SET status = 'Completed'
-            WHERE assignment_id = %s
-        """
-        execute_query(complete_query, (assignment_id,))
-        print(f"Assignment {assignment_id} marked as completed.")
+    Reads stop progress from the RouteAssignments counters, without
+    touching RouteStops. Returns one dict for assignment_id, or a list
+    for all of today's assignments when it is None.
+    """
+    query = """
+        SELECT ra.assignment_id, ra.status, ra.total_stops, ra.completed_stops,
+               v.license_plate, u.first_name, u.last_name
+        FROM RouteAssignments ra
+        JOIN Vehicles v ON ra.vehicle_id = v.vehicle_id
+        JOIN Users u ON ra.driver_id = u.user_id
+    """
+    if assignment_id is not None:
+        return fetch_one(query + " WHERE ra.assignment_id = %s", (assignment_id,))
+    return fetch_all(query + " WHERE ra.assigned_date = CURDATE() ORDER BY ra.assignment_id")
+
+def backfill_assignment_counters():
+    """
+    Recomputes total_stops/completed_stops of every assignment from its
+    RouteStops, for databases created before the counters existed.
+    migrate_schema.py runs it after adding the columns.
+    Returns the affected row count, or None on error.
+    """
+    query = """
+        UPDATE RouteAssignments ra
+        JOIN (
+            SELECT assignment_id, COUNT(*) AS total, SUM(status = 'Completed') AS completed
+            FROM RouteStops
+            GROUP BY assignment_id
+        ) AS counts ON counts.assignment_id = ra.assignment_id
+        SET ra.total_stops = counts.total,
+            ra.completed_stops = counts.completed
+    """
+    return execute_query(query)
 
 def log_driver_location(driver_id, driver_lat, driver_lon):
     """
-    Finds the driver's active vehicle and logs their current location.
-    This is called on every reload of the driver's dashboard.
+    Hands the driver's current location to the GPS ingestion buffer.
+    This is called on every reload of the driver's dashboard; points that
+    add nothing are dropped there and the rest are written in batches.
+    Returns False if the driver has no active vehicle.
     """
     try:
-        vehicle_query = """
-            SELECT vehicle_id FROM RouteAssignments
-            WHERE driver_id = %s 
-              AND assigned_date = CURDATE() 
-              AND status IN ('Pending', 'In Progress')
-            LIMIT 1
-        """
-        assignment = fetch_one(vehicle_query, (driver_id,))
-        vehicle_id = assignment.get('vehicle_id') if assignment else None
-        
-        if vehicle_id:
-            log_location_query = """
-                INSERT INTO VehicleLocations (vehicle_id, latitude, longitude, timestamp)
-                VALUES (%s, %s, %s, NOW())
-            """
-            execute_query(log_location_query, (vehicle_id, driver_lat, driver_lon))
-            return True
-        return False
+        return get_ingestor().submit(driver_id, driver_lat, driver_lon) != NO_VEHICLE
     except Exception as e:
         print(f"Error logging driver location: {e}")
         return False
@@ -89,15 +127,28 @@ def log_driver_location(driver_id, driver_lat, driver_lon):
 def mark_stop_complete(driver_id, route_stop_id, driver_lat, driver_lon, weight):
     """
     Marks a stop as complete, logs cash payment, and checks if assignment is finished.
+    The stop and vehicle come from the driver's cached assignment; only a
+    stop missing from it is looked up in the database. A driver who has
+    moved on is still verified if the truck's arrival at the stop was
+    detected by its geofence. The stop, its cash payment and receipt are
+    written in one transaction, and only while the stop is still Pending.
     """
-    
-    stop_query = """
-        SELECT cp.latitude, cp.longitude, rs.booking_id, rs.assignment_id
-        FROM RouteStops rs
-        JOIN CollectionPoints cp ON rs.point_id = cp.point_id
-        WHERE rs.route_stop_id = %s
-    """
-    stop = fetch_one(stop_query, (route_stop_id,))
+    assignments = get_assignment_cache()
+    assignment = assignments.get(driver_id)
+    stop = assignments.find_stop(driver_id, route_stop_id)
+    if stop:
+        stop = dict(stop, assignment_id=assignment['assignment_id'])
+    else:
+        stop_query = """
+            SELECT cp.latitude, cp.longitude, rs.booking_id, rs.assignment_id,
+                   sb.client_id, u.email AS client_email, cp.tariff_zone, sb.waste_type
+            FROM RouteStops rs
+            JOIN CollectionPoints cp ON rs.point_id = cp.point_id
+            LEFT JOIN ServiceBookings sb ON rs.booking_id = sb.booking_id
+            LEFT JOIN Users u ON sb.client_id = u.user_id
+            WHERE rs.route_stop_id = %s
+        """
+        stop = fetch_one(stop_query, (route_stop_id,))
     if not stop:
         return "Error: Stop not found."
 
@@ -106,30 +157,26 @@ def mark_stop_complete(driver_id, route_stop_id, driver_lat, driver_lon, weight)
     stop_coords = (stop['latitude'], stop['longitude'])
     driver_coords = (driver_lat, driver_lon)
     
+    vehicle_id = assignment['vehicle_id'] if assignment else None
+    # Verified where the driver is, or where the truck was seen arriving at the stop
+    verify_lat, verify_lon = driver_lat, driver_lon
     distance = calculate_distance(driver_coords, stop_coords)
-    if distance > 100:
-        return f"Verification Failed. You are {distance:.0f} meters away. Must be within 100m."
-
-    vehicle_query = """
-        SELECT vehicle_id FROM RouteAssignments
-        WHERE driver_id = %s AND assigned_date = CURDATE() AND status IN ('Pending', 'In Progress')
-        LIMIT 1
-    """
-    assignment = fetch_one(vehicle_query, (driver_id,))
-    vehicle_id = assignment.get('vehicle_id') if assignment else None
+    if distance > GEOFENCE_RADIUS_M:
+        arrival = get_stop_arrival(route_stop_id)
+        if not arrival or not vehicle_id or arrival['vehicle_id'] != vehicle_id:
+            return f"Verification Failed. You are {distance:.0f} meters away. Must be within {GEOFENCE_RADIUS_M:.0f}m."
+        verify_lat, verify_lon = arrival['latitude'], arrival['longitude']
     
     if vehicle_id:
-        log_location_query = """
-            INSERT INTO VehicleLocations (vehicle_id, latitude, longitude, timestamp)
-            VALUES (%s, %s, %s, NOW())
-        """
-        execute_query(log_location_query, (vehicle_id, driver_lat, driver_lon))
+        record_locations([(vehicle_id, driver_lat, driver_lon, datetime.datetime.now())])
+        # Suspicious verifications are flagged for supervisors, not blocked
+        try:
+            get_anomaly_detector().check_stop(vehicle_id, route_stop_id, (verify_lat, verify_lon), stop_coords)
+        except Exception as e:
+            print(f"Error checking stop verification: {e}")
 
-    if booking_id_to_update:
-        amount = float(weight) * 3.0
-        payment_success = process_cash_payment(booking_id_to_update, amount)
-        if not payment_success:
-            return "Error: Could not process cash payment."
+    # What the tariff says the collection costs; only booked stops are paid for
+    amount = price_stop(stop, weight)
 
     update_stop_query = """
         UPDATE RouteStops
@@ -138,19 +185,47 @@ def mark_stop_complete(driver_id, route_stop_id, driver_lat, driver_lon, weight)
             verification_gps_lat = %s,
             verification_gps_lon = %s,
             collected_volume_kg = %s
-        WHERE route_stop_id = %s
+        WHERE route_stop_id = %s AND status = 'Pending'
     """
-    execute_query(update_stop_query, (driver_lat, driver_lon, weight, route_stop_id))
-    
+    update_booking_query = """
+        UPDATE ServiceBookings
+        SET status = 'Completed'
+        WHERE booking_id = %s
+    """
+    allocator = get_receipt_allocator()
+    receipt_numbers = []
+    try:
+        with transaction() as cursor:
+            cursor.execute(update_stop_query, (verify_lat, verify_lon, weight, route_stop_id))
+            # A stop completed twice (e.g. a resubmitted form) is neither counted nor paid again
+            if cursor.rowcount != 1:
+                # Completed by another request: stop showing it to the driver
+                assignments.complete_stop(driver_id, route_stop_id)
+                return "Stop already completed."
+            completed = _record_stop_completion(cursor, assignment_id_to_check)
+            if booking_id_to_update:
+                # The payment and its receipt commit or roll back with the stop
+                receipt_numbers = record_cash_payments(cursor, [
+                    (booking_id_to_update, stop.get('client_id'), stop.get('client_email'), amount)
+                ], allocator)
+                cursor.execute(update_booking_query, (booking_id_to_update,))
+            # Only booked stops are billed; logged is what was just written to Payments
+            billed = amount if booking_id_to_update else 0
+            logged = amount if receipt_numbers else 0
+            record_stop_cash(cursor, driver_id, [(None, weight, billed, logged)])
+    except Exception as e:
+        # Nothing was written: the receipt number goes to the next payment
+        allocator.release(receipt_numbers)
+        print(f"Error completing stop {route_stop_id}: {e}")
+        return "Error: Could not update the stop."
+
+    assignments.complete_stop(driver_id, route_stop_id)
+    get_eta_engine().complete_stop(route_stop_id)
     if booking_id_to_update:
-        update_booking_query = """
-            UPDATE ServiceBookings
-            SET status = 'Completed'
-            WHERE booking_id = %s
-        """
-        execute_query(update_booking_query, (booking_id_to_update,))
-    
-    _check_and_complete_assignment(assignment_id_to_check)
+        invalidate_client_summary(stop.get('client_id'))
+    if completed:
+        assignments.invalidate_assignment(assignment_id_to_check)
+        print(f"Assignment {assignment_id_to_check} marked as completed.")
     
     return "Stop marked complete! Payment logged."
 
@@ -158,8 +233,20 @@ def mark_stop_complete(driver_id, route_stop_id, driver_lat, driver_lon, weight)
 def get_route_history(vehicle_id, selected_date):
     """
     Gets all completed stops and the full GPS path for a vehicle
-    on a specific date (US 2.2).
+    on a specific date (US 2.2). The path comes back as an encoded
+    polyline (see utils.polyline_utils), simplified to a few hundred
+    points; path_levels holds every precomputed detail level for the
+    map to switch to. Past days never change, so their results are
+    cached per (vehicle, date).
     """
+    day = datetime.date.fromisoformat(selected_date) if isinstance(selected_date, str) else selected_date
+    cache_key = (vehicle_id, day)
+    cacheable = day < datetime.date.today()
+    if cacheable:
+        with _history_cache_lock:
+            if cache_key in _history_cache:
+                _history_cache.move_to_end(cache_key)
+                return _history_cache[cache_key]
     
     # 1. Get all completed stops
     stops_query = """
@@ -178,16 +265,37 @@ def get_route_history(vehicle_id, selected_date):
         ORDER BY rs.completed_at;
     """
     
-    # 2. Get the full GPS path from VehicleLocations
-    path_query = """
-        SELECT latitude, longitude
-        FROM VehicleLocations
-        WHERE vehicle_id = %s
-          AND DATE(timestamp) = %s
-        ORDER BY timestamp;
-    """
+    # 2. Get the GPS path from whichever retention tier holds that day
+    stops = fetch_all(stops_query, (vehicle_id, day))
+    coords, path_source = get_location_trace(vehicle_id, day)
+    path_read = coords is not None
+    if not path_read:
+        coords = np.zeros((0, 2))
     
-    stops = fetch_all(stops_query, (vehicle_id, selected_date))
-    path = fetch_all(path_query, (vehicle_id, selected_date))
-    
-    return {"stops": stops, "path": path}
\ No newline at end of file
+    levels = [
+        {"tolerance_m": tolerance, "points": len(level), "path": encode_polyline(level)}
+        for tolerance, level in simplification_levels(coords, PLAYBACK_TOLERANCES_M)
+    ]
+    default = max([i for i, level in enumerate(levels) if level["points"] <= PLAYBACK_DEFAULT_POINTS],
+                  default=0)
+    history = {
+        "stops": stops,
+        "path": levels[default]["path"],
+        "path_level": default,
+        "path_levels": levels,
+        "path_points": len(coords),
+        "path_source": path_source,
+    }
+    # A failed read is shown once but not remembered
+    if cacheable and stops is not None and path_read:
+        with _history_cache_lock:
+            _history_cache[cache_key] = history
+            while len(_history_cache) > HISTORY_CACHE_SIZE:
+                _history_cache.popitem(last=False)
+    return history
+
+def invalidate_route_history(*keys):
+    """Forgets the cached histories of the given (vehicle_id, date) pairs, e.g. after a late offline sync."""
+    with _history_cache_lock:
+        for key in keys:
+            _history_cache.pop(key, None)
@@ -1,49 +1,85 @@
 # In epic_3_billing/booking_logic.py
 
+import datetime
 from utils.db_connector import execute_query, fetch_all
+from epic_1_routing.replan_logic import insert_late_booking
+from epic_3_billing.tariff_logic import DEFAULT_WASTE_TYPE
+from epic_3_billing.client_summary import invalidate_client_summary
 
-def create_booking(client_id, point_id, requested_date):
-    """Creates a new service booking (US 3.1)"""
+# Bookings per page of a client's history
+BOOKING_PAGE_SIZE = 50
+
+def create_booking(client_id, point_id, requested_date, window_start=None, window_end=None,
+                   waste_type=DEFAULT_WASTE_TYPE):
+    """
+    Creates a new service booking (US 3.1).
+    window_start / window_end optionally limit the pickup to set hours;
+    waste_type picks the tariff the collection is priced by.
+    Same-day bookings are slotted straight into a running route if one has room.
+    """
     query = """
-        INSERT INTO ServiceBookings (client_id, point_id, requested_date, status)
-        VALUES (%s, %s, %s, 'Approved')
+        INSERT INTO ServiceBookings (client_id, point_id, requested_date, status, window_start, window_end, waste_type)
+        VALUES (%s, %s, %s, 'Approved', %s, %s, %s)
     """
-    booking_id = execute_query(query, (client_id, point_id, requested_date))
+    booking_id = execute_query(query, (client_id, point_id, requested_date, window_start, window_end, waste_type))
+    if booking_id:
+        invalidate_client_summary(client_id)
+
+    if booking_id and str(requested_date) == datetime.date.today().isoformat():
+        try:
+            insert_late_booking(booking_id)
+        except Exception as e:
+            print(f"Could not add booking {booking_id} to a running route: {e}")
     return booking_id
 
-def get_client_bookings(client_id):
+def get_client_bookings(client_id, after=None, limit=BOOKING_PAGE_SIZE):
     """
-    Gets all bookings for a specific client, including payment status and amount.
-    This now serves as the client's bill.
+    One page of a client's bookings, newest first, with payment status and
+    amount. This now serves as the client's bill.
+    Pages are keyset-paginated on (requested_date, booking_id): pass the
+    last row's values as after=(requested_date, booking_id) for the next
+    page. A page shorter than limit is the last one.
     """
-    query = """
+    keyset, params = "", (client_id,)
+    if after:
+        keyset = "AND (sb.requested_date < %s OR (sb.requested_date = %s AND sb.booking_id < %s))"
+        params += (after[0], after[0], after[1])
+    # Only the page's rows look up their payments
+    query = f"""
         SELECT 
+            sb.booking_id,
             sb.requested_date, 
             cp.point_name,
             sb.status AS job_status, 
-            p.status AS payment_status,
-            p.amount AS amount_paid
+            (SELECT p.status FROM Payments p WHERE p.booking_id = sb.booking_id
+             ORDER BY p.payment_id DESC LIMIT 1) AS payment_status,
+            (SELECT SUM(p.amount) FROM Payments p WHERE p.booking_id = sb.booking_id
+             AND p.status = 'Succeeded') AS amount_paid
         FROM ServiceBookings sb
         JOIN CollectionPoints cp ON sb.point_id = cp.point_id
-        LEFT JOIN Payments p ON sb.booking_id = p.booking_id
-        WHERE sb.client_id = %s
-        ORDER BY sb.requested_date DESC
+        WHERE sb.client_id = %s {keyset}
+        ORDER BY sb.requested_date DESC, sb.booking_id DESC
+        LIMIT %s
     """
-    return fetch_all(query, (client_id,))
+    return fetch_all(query, params + (limit,))
 
 def get_client_collection_points(client_id):
     """Gets all collection points for a client"""
     query = "SELECT point_id, point_name FROM CollectionPoints WHERE client_id = %s"
     return fetch_all(query, (client_id,))
 
-def add_collection_point(client_id, point_name, address, latitude, longitude):
+def add_collection_point(client_id, point_name, address, latitude, longitude,
+                         window_start=None, window_end=None, service_minutes=None):
     """
     Adds a new collection point (address) for a client.
+    Commercial clients can give the hours pickups are allowed and how long
+    a pickup usually takes.
     """
     query = """
-        INSERT INTO CollectionPoints (client_id, point_name, address, latitude, longitude)
-        VALUES (%s, %s, %s, %s, %s)
+        INSERT INTO CollectionPoints (client_id, point_name, address, latitude, longitude,
+                                      window_start, window_end, service_minutes)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
     """
-    params = (client_id, point_name, address, latitude, longitude)
+    params = (client_id, point_name, address, latitude, longitude, window_start, window_end, service_minutes)
     point_id = execute_query(query, params)
     return True if point_id else False
\ No newline at end of file
@@ -0,0 +1,143 @@
+# In epic_3_billing/cash_reconciliation.py
+#
+# End-of-day reconciliation of the cash drivers collect. DriverDailyCash
+# keeps a running total per driver and day, added to by every stop
+# completion in the same transaction:
+#   total_kg         what was collected
+#   expected_amount  what the tariff says the booked (billed) stops cost
+#   logged_amount    what was written to Payments as paid in cash
+# At the end of the day the cash handed in is recorded against it.
+# Reports read only these rows, never Payments.
+#   python -m epic_3_billing.cash_reconciliation report --date 2025-01-31
+#   python -m epic_3_billing.cash_reconciliation discrepancies --from 2025-01-01 --to 2025-01-31
+
+import sys
+import argparse
+import datetime
+from utils.db_connector import fetch_all, execute_query
+
+# Differences up to this (rounding) are not discrepancies
+TOLERANCE = 0.01
+
+UPSERT_QUERY = """
+    INSERT INTO DriverDailyCash (service_date, driver_id, stops, total_kg, expected_amount, logged_amount)
+    VALUES (%s, %s, %s, %s, %s, %s)
+    ON DUPLICATE KEY UPDATE
+        stops = stops + VALUES(stops),
+        total_kg = total_kg + VALUES(total_kg),
+        expected_amount = expected_amount + VALUES(expected_amount),
+        logged_amount = logged_amount + VALUES(logged_amount)
+"""
+
+def _as_date(day):
+    if isinstance(day, datetime.datetime):
+        return day.date()
+    if isinstance(day, str):
+        return datetime.date.fromisoformat(day)
+    return day
+
+def record_stop_cash(cursor, driver_id, completions):
+    """
+    Adds completed stops to their drivers' daily totals, inside the
+    caller's transaction (the one completing the stops). completions is
+    [(day, weight_kg, expected_amount, logged_amount)]; days default to
+    today. Stops of the same day become one upsert row.
+    """
+    totals = {}
+    for day, weight, expected, logged in completions:
+        key = _as_date(day) or datetime.date.today()
+        stops, kg, exp, log = totals.get(key, (0, 0.0, 0.0, 0.0))
+        totals[key] = (stops + 1, kg + float(weight or 0), exp + float(expected or 0), log + float(logged or 0))
+    if not totals:
+        return
+    cursor.executemany(UPSERT_QUERY, [
+        (day, driver_id, stops, round(kg, 2), round(exp, 2), round(log, 2))
+        for day, (stops, kg, exp, log) in sorted(totals.items())
+    ])
+
+def close_day(driver_id, day, handed_in):
+    """
+    Records the cash a driver handed in for a day. A day without stops
+    gets a row too, so it appears in the report. Returns True on success.
+    """
+    if handed_in is None or float(handed_in) < 0:
+        print("Error: Cash handed in must be zero or more.")
+        return False
+    query = """
+        INSERT INTO DriverDailyCash (service_date, driver_id, handed_in_amount, closed_at)
+        VALUES (%s, %s, %s, NOW())
+        ON DUPLICATE KEY UPDATE handed_in_amount = VALUES(handed_in_amount), closed_at = NOW()
+    """
+    result = execute_query(query, (_as_date(day), driver_id, round(float(handed_in), 2)))
+    if result is None:
+        print(f"Error: Could not close the day for driver {driver_id}.")
+        return False
+    return True
+
+def get_close_of_day_report(day):
+    """Every driver's totals for a day, with the difference between cash handed in and logged."""
+    query = """
+        SELECT dc.driver_id, u.first_name, u.last_name, dc.stops, dc.total_kg,
+               dc.expected_amount, dc.logged_amount, dc.handed_in_amount,
+               dc.handed_in_amount - dc.logged_amount AS cash_difference,
+               dc.closed_at
+        FROM DriverDailyCash dc
+        JOIN Users u ON dc.driver_id = u.user_id
+        WHERE dc.service_date = %s
+        ORDER BY u.last_name, u.first_name
+    """
+    return fetch_all(query, (_as_date(day),))
+
+def get_discrepancies(start_date, end_date, tolerance=TOLERANCE):
+    """
+    Driver days in [start_date, end_date] that do not reconcile: cash handed
+    in differs from cash logged, or a past day with stops was never closed.
+    """
+    query = """
+        SELECT dc.service_date, dc.driver_id, u.first_name, u.last_name, dc.stops, dc.total_kg,
+               dc.expected_amount, dc.logged_amount, dc.handed_in_amount,
+               CASE
+                   WHEN ABS(dc.handed_in_amount - dc.logged_amount) > %s THEN 'Cash handed in differs from logged'
+                   ELSE 'Not closed'
+               END AS issue
+        FROM DriverDailyCash dc
+        JOIN Users u ON dc.driver_id = u.user_id
+        WHERE dc.service_date BETWEEN %s AND %s
+          AND (ABS(dc.handed_in_amount - dc.logged_amount) > %s
+               OR (dc.closed_at IS NULL AND dc.stops > 0 AND dc.service_date < CURDATE()))
+        ORDER BY dc.service_date, dc.driver_id
+    """
+    return fetch_all(query, (tolerance, _as_date(start_date), _as_date(end_date), tolerance))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Driver cash reconciliation.")
+    sub = parser.add_subparsers(dest='command', required=True)
+    report = sub.add_parser('report', help="Close-of-day totals per driver.")
+    report.add_argument('--date', default=None, help="YYYY-MM-DD (default today)")
+    discrepancies = sub.add_parser('discrepancies', help="Driver days that do not reconcile.")
+    discrepancies.add_argument('--from', dest='start', required=True, help="YYYY-MM-DD")
+    discrepancies.add_argument('--to', dest='end', required=True, help="YYYY-MM-DD")
+    args = parser.parse_args(argv)
+
+    if args.command == 'report':
+        day = args.date or datetime.date.today().isoformat()
+        rows = get_close_of_day_report(day)
+        if rows is None:
+            return 1
+        for r in rows:
+            handed_in = '-' if r['handed_in_amount'] is None else f"{r['handed_in_amount']:.2f}"
+            print(f"{r['first_name']} {r['last_name']}: {r['stops']} stops, {r['total_kg']:.2f} kg, "
+                  f"expected {r['expected_amount']:.2f}, logged {r['logged_amount']:.2f}, handed in {handed_in}")
+        return 0
+
+    rows = get_discrepancies(args.start, args.end)
+    if rows is None:
+        return 1
+    for r in rows:
+        handed_in = '-' if r['handed_in_amount'] is None else f"{r['handed_in_amount']:.2f}"
+        print(f"{r['service_date']} {r['first_name']} {r['last_name']}: {r['issue']} "
+              f"(logged {r['logged_amount']:.2f}, handed in {handed_in})")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
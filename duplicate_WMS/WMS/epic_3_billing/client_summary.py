@@ -0,0 +1,98 @@
+# In epic_3_billing/client_summary.py
+#
+# Per-client lifetime totals for the "My Bookings & Bills" tab, cached in
+# memory. Whatever adds a booking, a payment or an invoice for a client
+# calls invalidate_client_summary(client_id) after committing. The TTL
+# only bounds staleness from writes made by other processes.
+
+import time
+import threading
+from utils.db_connector import fetch_one
+
+SUMMARY_TTL_S = 300.0
+# Clients kept in the cache at most; the stalest are dropped first
+MAX_CLIENTS = 10000
+
+_cache = None
+_cache_lock = threading.Lock()
+
+# Invoice balances are frozen when the invoice is built; outstanding subtracts
+# every payment made for the invoiced bookings, including later ones
+SUMMARY_QUERY = """
+    SELECT
+        (SELECT COUNT(*) FROM ServiceBookings WHERE client_id = %s) AS bookings,
+        (SELECT COUNT(*) FROM ServiceBookings WHERE client_id = %s AND status = 'Approved') AS open_bookings,
+        (SELECT COALESCE(SUM(rs.collected_volume_kg), 0)
+         FROM ServiceBookings sb
+         JOIN RouteStops rs ON rs.booking_id = sb.booking_id
+         WHERE sb.client_id = %s AND rs.status = 'Completed') AS lifetime_kg,
+        (SELECT COALESCE(SUM(amount), 0) FROM Payments
+         WHERE client_id = %s AND status = 'Succeeded') AS amount_paid,
+        (SELECT COALESCE(SUM(amount_due), 0) FROM Invoices WHERE client_id = %s)
+        - (SELECT COALESCE(SUM(p.amount), 0) FROM Payments p
+           WHERE p.status = 'Succeeded'
+             AND p.booking_id IN (SELECT il.booking_id
+                                  FROM InvoiceLines il
+                                  JOIN Invoices i ON il.invoice_id = i.invoice_id
+                                  WHERE i.client_id = %s)) AS outstanding
+"""
+
+class ClientSummaryCache:
+    """Summaries by client_id, each read with one query and kept until invalidated or expired."""
+
+    def __init__(self, ttl_s=SUMMARY_TTL_S, max_clients=MAX_CLIENTS, clock=time.monotonic):
+        self.ttl_s = ttl_s
+        self.max_clients = max_clients
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._entries = {}   # client_id -> (summary, expires_at)
+        self._invalidations = 0
+
+    def get(self, client_id):
+        """{bookings, open_bookings, lifetime_kg, amount_paid, outstanding}, or None if it cannot be read."""
+        now = self.clock()
+        with self._lock:
+            entry = self._entries.get(client_id)
+            if entry and entry[1] > now:
+                return entry[0]
+            invalidations = self._invalidations
+        row = fetch_one(SUMMARY_QUERY, (client_id,) * 6)
+        if row is None:
+            return None   # not cached: the next call tries again
+        summary = {
+            'bookings': int(row['bookings']),
+            'open_bookings': int(row['open_bookings']),
+            'lifetime_kg': round(float(row['lifetime_kg']), 2),
+            'amount_paid': round(float(row['amount_paid']), 2),
+            'outstanding': round(float(row['outstanding']), 2),
+        }
+        with self._lock:
+            if invalidations != self._invalidations:
+                return summary   # something changed while it was read: do not keep it
+            if len(self._entries) >= self.max_clients and client_id not in self._entries:
+                oldest = min(self._entries, key=lambda c: self._entries[c][1])
+                del self._entries[oldest]
+            self._entries[client_id] = (summary, now + self.ttl_s)
+        return summary
+
+    def invalidate(self, *client_ids):
+        with self._lock:
+            self._invalidations += 1
+            for client_id in client_ids:
+                self._entries.pop(client_id, None)
+
+def get_client_summary_cache():
+    """The process-wide client summary cache."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ClientSummaryCache()
+        return _cache
+
+def get_client_summary(client_id):
+    """A client's lifetime totals (see ClientSummaryCache.get)."""
+    return get_client_summary_cache().get(client_id)
+
+def invalidate_client_summary(*client_ids):
+    """Drops cached totals of clients whose bookings, payments or invoices just changed."""
+    get_client_summary_cache().invalidate(*client_ids)
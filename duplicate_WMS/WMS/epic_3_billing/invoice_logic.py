@@ -0,0 +1,421 @@
+# In epic_3_billing/invoice_logic.py
+#
+# Monthly invoicing for every client in one billing run, e.g. nightly on
+# the 1st:
+#   python -m epic_3_billing.invoice_logic run --month 2025-01
+# Clients are taken in chunks by ascending client_id. Each chunk's invoices
+# are written in one transaction together with the run's cursor, so a run
+# that stops for any reason continues after the last written chunk when
+# started again. Invoice documents are rendered on a process pool while
+# the next chunk is being read.
+
+import os
+import sys
+import html
+import argparse
+import datetime
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from utils.db_connector import fetch_one, fetch_all, transaction
+from epic_3_billing.tariff_logic import price_many
+from epic_3_billing.client_summary import invalidate_client_summary
+
+# Clients per chunk: one client query, one lines query and one transaction each
+CHUNK_SIZE = 2000
+
+RUNNING = 'Running'
+COMPLETED = 'Completed'
+
+CLIENTS_QUERY = """
+    SELECT u.user_id AS client_id, u.first_name, u.last_name, u.email
+    FROM Users u
+    WHERE u.user_id > %s
+      AND EXISTS (
+          SELECT 1
+          FROM ServiceBookings sb
+          JOIN RouteStops rs ON rs.booking_id = sb.booking_id
+          WHERE sb.client_id = u.user_id
+            AND rs.status = 'Completed'
+            AND rs.completed_at >= %s AND rs.completed_at < %s
+      )
+    ORDER BY u.user_id
+    LIMIT %s
+"""
+# Every completed stop of a range of clients, with what was paid for its booking
+LINES_QUERY = """
+    SELECT sb.client_id, rs.route_stop_id, rs.booking_id, DATE(rs.completed_at) AS service_date,
+           cp.point_name, cp.tariff_zone, sb.waste_type, rs.collected_volume_kg AS weight_kg,
+           COALESCE(pay.paid, 0) AS paid
+    FROM RouteStops rs
+    JOIN ServiceBookings sb ON rs.booking_id = sb.booking_id
+    JOIN CollectionPoints cp ON rs.point_id = cp.point_id
+    LEFT JOIN (
+        SELECT booking_id, SUM(amount) AS paid
+        FROM Payments
+        WHERE status = 'Succeeded' AND client_id BETWEEN %s AND %s
+        GROUP BY booking_id
+    ) AS pay ON pay.booking_id = rs.booking_id
+    WHERE sb.client_id BETWEEN %s AND %s
+      AND rs.status = 'Completed'
+      AND rs.completed_at >= %s AND rs.completed_at < %s
+    ORDER BY sb.client_id, rs.completed_at, rs.route_stop_id
+"""
+INSERT_INVOICES_QUERY = """
+    INSERT INTO Invoices (run_id, client_id, invoice_number, period_start, period_end,
+                          total_kg, amount_due, amount_paid, balance)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+"""
+INSERT_LINES_QUERY = """
+    INSERT INTO InvoiceLines (invoice_id, route_stop_id, booking_id, service_date, description,
+                              weight_kg, amount, paid)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+"""
+
+def _placeholders(values):
+    return ', '.join(['%s'] * len(values))
+
+def month_period(month):
+    """'2025-01' (or a date in that month) -> (first day, first day of the next month)."""
+    if isinstance(month, str):
+        month = datetime.datetime.strptime(month, '%Y-%m').date()
+    start = month.replace(day=1)
+    end = (start + datetime.timedelta(days=32)).replace(day=1)
+    return start, end
+
+def invoice_number(client_id, period_start):
+    return f"INV-{period_start:%Y%m}-{client_id}"
+
+def default_output_dir():
+    return os.getenv('INVOICE_DIR') or os.path.join(tempfile.gettempdir(), 'wms_invoices')
+
+def build_invoices(clients, lines, period_start, period_end):
+    """
+    Turns one chunk of clients and their stop lines into invoice documents.
+    All lines are priced in one price_many call, each by the tariff in
+    effect on its service day. Clients are billed in client_id order.
+    """
+    amounts = price_many(
+        [float(line['weight_kg'] or 0) for line in lines],
+        [line['client_id'] for line in lines],
+        [line['tariff_zone'] for line in lines],
+        [line['waste_type'] for line in lines],
+        [line['service_date'] for line in lines],
+    ) if lines else []
+    per_client = {}
+    for line, amount in zip(lines, amounts):
+        per_client.setdefault(line['client_id'], []).append({
+            'route_stop_id': line['route_stop_id'],
+            'booking_id': line['booking_id'],
+            'service_date': line['service_date'],
+            'description': f"Waste collection at {line['point_name']}",
+            'weight_kg': round(float(line['weight_kg'] or 0), 2),
+            'amount': float(amount),
+            'paid': round(float(line['paid']), 2),
+        })
+    invoices = []
+    for client in clients:
+        client_lines = per_client.get(client['client_id'], [])
+        due = round(sum(l['amount'] for l in client_lines), 2)
+        paid = round(sum(l['paid'] for l in client_lines), 2)
+        invoices.append({
+            'client_id': client['client_id'],
+            'client_name': f"{client['first_name']} {client['last_name']}",
+            'email': client['email'],
+            'invoice_number': invoice_number(client['client_id'], period_start),
+            'period_start': period_start,
+            'period_end': period_end,
+            'total_kg': round(sum(l['weight_kg'] for l in client_lines), 2),
+            'amount_due': due,
+            'amount_paid': paid,
+            'balance': round(due - paid, 2),
+            'lines': client_lines,
+        })
+    return invoices
+
+def render_invoice(document, output_dir):
+    """
+    Writes one invoice as an HTML file and returns its path. Runs in a
+    worker process: it only uses its arguments.
+    """
+    rows = "\n".join(
+        f"<tr><td>{line['service_date']}</td><td>{html.escape(line['description'])}</td>"
+        f"<td>{line['weight_kg']:.2f}</td><td>{line['amount']:.2f}</td><td>{line['paid']:.2f}</td></tr>"
+        for line in document['lines']
+    )
+    last_day = document['period_end'] - datetime.timedelta(days=1)
+    body = f"""<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>{document['invoice_number']}</title></head>
+<body>
+<h1>Invoice {document['invoice_number']}</h1>
+<p>{html.escape(document['client_name'])} &lt;{html.escape(document['email'])}&gt;</p>
+<p>Period: {document['period_start']:%d %b %Y} to {last_day:%d %b %Y}</p>
+<table>
+<tr><th>Date</th><th>Service</th><th>Weight (kg)</th><th>Amount</th><th>Paid</th></tr>
+{rows}
+</table>
+<p>Total weight: {document['total_kg']:.2f} kg</p>
+<p>Amount due: {document['amount_due']:.2f}<br>Paid: {document['amount_paid']:.2f}<br>
+<strong>Balance: {document['balance']:.2f}</strong></p>
+</body></html>
+"""
+    path = os.path.join(output_dir, f"{document['invoice_number']}.html")
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(body)
+    return path
+
+def _get_or_start_run(period_start, period_end):
+    """The billing run of a period: the unfinished one to resume, or a new one."""
+    query = "SELECT run_id, status, last_client_id, invoices FROM BillingRuns WHERE period_start = %s AND period_end = %s"
+    run = fetch_one(query, (period_start, period_end))
+    if run:
+        return run
+    try:
+        with transaction() as cursor:
+            cursor.execute("""
+                INSERT IGNORE INTO BillingRuns (period_start, period_end, status, last_client_id, invoices)
+                VALUES (%s, %s, %s, 0, 0)
+            """, (period_start, period_end, RUNNING))
+    except Exception as e:
+        print(f"Error starting billing run: {e}")
+        return None
+    return fetch_one(query, (period_start, period_end))
+
+def _write_chunk(run_id, invoices, last_client_id):
+    """
+    Writes a chunk's invoices and lines with multi-row inserts and moves
+    the run's cursor past the chunk, all in one transaction.
+    Returns {client_id: invoice_id}.
+    """
+    with transaction() as cursor:
+        cursor.executemany(INSERT_INVOICES_QUERY, [
+            (run_id, inv['client_id'], inv['invoice_number'], inv['period_start'], inv['period_end'],
+             inv['total_kg'], inv['amount_due'], inv['amount_paid'], inv['balance'])
+            for inv in invoices
+        ])
+        client_ids = tuple(inv['client_id'] for inv in invoices)
+        cursor.execute(
+            f"SELECT invoice_id, client_id FROM Invoices WHERE run_id = %s AND client_id IN ({_placeholders(client_ids)})",
+            (run_id,) + client_ids
+        )
+        invoice_ids = {row['client_id']: row['invoice_id'] for row in cursor.fetchall()}
+        lines = [
+            (invoice_ids[inv['client_id']], line['route_stop_id'], line['booking_id'], line['service_date'],
+             line['description'], line['weight_kg'], line['amount'], line['paid'])
+            for inv in invoices for line in inv['lines']
+        ]
+        if lines:
+            cursor.executemany(INSERT_LINES_QUERY, lines)
+        cursor.execute(
+            "UPDATE BillingRuns SET last_client_id = %s, invoices = invoices + %s WHERE run_id = %s",
+            (last_client_id, len(invoices), run_id)
+        )
+    return invoice_ids
+
+def _mark_rendered(invoice_ids, output_dir):
+    """One statement per rendered chunk; the file name follows from the invoice number."""
+    if not invoice_ids:
+        return
+    try:
+        with transaction() as cursor:
+            cursor.execute(f"""
+                UPDATE Invoices
+                SET status = 'Rendered', document_path = CONCAT(%s, invoice_number, '.html')
+                WHERE invoice_id IN ({_placeholders(invoice_ids)})
+            """, (os.path.join(output_dir, ''),) + tuple(invoice_ids))
+    except Exception as e:
+        print(f"Error recording rendered invoices: {e}")
+
+class _Renderer:
+    """Renders chunks on a process pool (or inline with workers=0) and records finished ones."""
+
+    def __init__(self, output_dir, workers):
+        self.output_dir = output_dir
+        self.pool = ProcessPoolExecutor(max_workers=workers) if workers != 0 else None
+        self.pending = []   # (invoice ids, futures) per chunk, oldest first
+        self.rendered = 0
+        self.failed = 0
+
+    def submit(self, documents, invoice_ids):
+        if self.pool is None:
+            results = []
+            for document in documents:
+                try:
+                    results.append(render_invoice(document, self.output_dir))
+                except OSError as e:
+                    print(f"Error rendering invoice {document['invoice_number']}: {e}")
+                    results.append(None)
+            self._record(invoice_ids, results)
+            return
+        futures = [self.pool.submit(render_invoice, document, self.output_dir) for document in documents]
+        self.pending.append((invoice_ids, futures))
+        self.collect(block=False)
+
+    def _record(self, invoice_ids, results):
+        done = [invoice_id for invoice_id, path in zip(invoice_ids, results) if path]
+        self.rendered += len(done)
+        self.failed += len(results) - len(done)
+        _mark_rendered(done, self.output_dir)
+
+    def collect(self, block=True):
+        """Records finished chunks, in order; with block=True waits for all of them."""
+        while self.pending and (block or all(f.done() for f in self.pending[0][1])):
+            invoice_ids, futures = self.pending.pop(0)
+            results = []
+            for document_future in futures:
+                try:
+                    results.append(document_future.result())
+                except Exception as e:
+                    print(f"Error rendering invoice: {e}")
+                    results.append(None)
+            self._record(invoice_ids, results)
+
+    def close(self):
+        self.collect()
+        if self.pool is not None:
+            self.pool.shutdown()
+
+def _render_pending(run_id, renderer, chunk_size):
+    """
+    Renders invoices of the run written but not rendered earlier (e.g. the
+    run was stopped mid-render), reading them back in keyset chunks.
+    """
+    after = 0
+    while True:
+        invoices = fetch_all("""
+            SELECT i.invoice_id, i.client_id, i.invoice_number, i.period_start, i.period_end,
+                   i.total_kg, i.amount_due, i.amount_paid, i.balance,
+                   u.first_name, u.last_name, u.email
+            FROM Invoices i
+            JOIN Users u ON i.client_id = u.user_id
+            WHERE i.run_id = %s AND i.status = 'Issued' AND i.invoice_id > %s
+            ORDER BY i.invoice_id
+            LIMIT %s
+        """, (run_id, after, chunk_size))
+        if not invoices:
+            return
+        ids = tuple(inv['invoice_id'] for inv in invoices)
+        lines = fetch_all(
+            f"SELECT invoice_id, service_date, description, weight_kg, amount, paid FROM InvoiceLines "
+            f"WHERE invoice_id IN ({_placeholders(ids)}) ORDER BY invoice_id, line_id",
+            ids
+        ) or []
+        per_invoice = {}
+        for line in lines:
+            per_invoice.setdefault(line['invoice_id'], []).append({
+                'service_date': line['service_date'], 'description': line['description'],
+                'weight_kg': float(line['weight_kg']), 'amount': float(line['amount']), 'paid': float(line['paid']),
+            })
+        documents = [
+            dict(inv, client_name=f"{inv['first_name']} {inv['last_name']}",
+                 total_kg=float(inv['total_kg']), amount_due=float(inv['amount_due']),
+                 amount_paid=float(inv['amount_paid']), balance=float(inv['balance']),
+                 lines=per_invoice.get(inv['invoice_id'], []))
+            for inv in invoices
+        ]
+        renderer.submit(documents, list(ids))
+        after = ids[-1]
+
+def run_billing(period_start, period_end, chunk_size=CHUNK_SIZE, workers=None, output_dir=None):
+    """
+    Invoices every client with completed stops in [period_start, period_end),
+    resuming an unfinished run of the same period. workers is the size of
+    the rendering process pool (None: one per CPU, 0: render inline).
+    Returns {run_id, status, invoices, rendered, render_errors, chunks}, or
+    None if the run could not be started.
+    """
+    run = _get_or_start_run(period_start, period_end)
+    if not run:
+        return None
+    summary = {'run_id': run['run_id'], 'status': run['status'], 'invoices': run['invoices'],
+               'rendered': 0, 'render_errors': 0, 'chunks': 0}
+
+    output_dir = output_dir or default_output_dir()
+    os.makedirs(output_dir, exist_ok=True)
+    renderer = _Renderer(output_dir, workers)
+    try:
+        # Anything written but left unrendered by an earlier attempt
+        _render_pending(run['run_id'], renderer, chunk_size)
+        after = run['last_client_id']
+        while run['status'] != COMPLETED:
+            clients = fetch_all(CLIENTS_QUERY, (after, period_start, period_end, chunk_size))
+            if clients is None:
+                print(f"Billing run {run['run_id']} stopped: could not read clients after {after}.")
+                return summary
+            if not clients:
+                break
+            first, last = clients[0]['client_id'], clients[-1]['client_id']
+            lines = fetch_all(LINES_QUERY, (first, last, first, last, period_start, period_end))
+            if lines is None:
+                print(f"Billing run {run['run_id']} stopped: could not read lines of clients {first}-{last}.")
+                return summary
+            invoices = build_invoices(clients, lines, period_start, period_end)
+            try:
+                invoice_ids = _write_chunk(run['run_id'], invoices, last)
+            except Exception as e:
+                print(f"Billing run {run['run_id']} stopped at clients {first}-{last}: {e}")
+                return summary
+            invalidate_client_summary(*(inv['client_id'] for inv in invoices))
+            renderer.submit(invoices, [invoice_ids[inv['client_id']] for inv in invoices])
+            summary['invoices'] += len(invoices)
+            summary['chunks'] += 1
+            after = last
+    finally:
+        renderer.close()
+        summary['rendered'] = renderer.rendered
+        summary['render_errors'] = renderer.failed
+
+    if run['status'] == COMPLETED:
+        return summary
+    if renderer.failed:
+        # Still Running, so the next attempt renders what failed
+        print(f"Billing run {run['run_id']}: {renderer.failed} invoices could not be rendered; run it again.")
+        return summary
+    try:
+        with transaction() as cursor:
+            # An invoice still Issued (e.g. its Rendered update failed) keeps the run open
+            cursor.execute("""
+                UPDATE BillingRuns SET status = %s, finished_at = NOW()
+                WHERE run_id = %s
+                  AND NOT EXISTS (SELECT 1 FROM Invoices WHERE run_id = %s AND status = 'Issued')
+            """, (COMPLETED, run['run_id'], run['run_id']))
+            completed = cursor.rowcount == 1
+        if completed:
+            summary['status'] = COMPLETED
+        else:
+            print(f"Billing run {run['run_id']}: some invoices are still unrendered; run it again.")
+    except Exception as e:
+        print(f"Error completing billing run {run['run_id']}: {e}")
+    return summary
+
+def get_client_invoices(client_id):
+    """A client's invoices, newest first."""
+    query = """
+        SELECT invoice_number, period_start, period_end, total_kg, amount_due, amount_paid, balance, status
+        FROM Invoices
+        WHERE client_id = %s
+        ORDER BY period_start DESC
+    """
+    return fetch_all(query, (client_id,))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Monthly client invoicing.")
+    sub = parser.add_subparsers(dest='command', required=True)
+    run = sub.add_parser('run', help="Run (or resume) the billing run of a month.")
+    run.add_argument('--month', required=True, help="YYYY-MM")
+    run.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+    run.add_argument('--workers', type=int, default=None, help="Rendering processes (0 renders inline).")
+    run.add_argument('--output-dir', default=None)
+    args = parser.parse_args(argv)
+
+    period_start, period_end = month_period(args.month)
+    summary = run_billing(period_start, period_end, args.chunk_size, args.workers, args.output_dir)
+    if summary is None:
+        print("Could not start the billing run.")
+        return 1
+    print(f"Billing run {summary['run_id']} {summary['status'].lower()}: {summary['invoices']} invoices, "
+          f"{summary['rendered']} rendered ({summary['render_errors']} render errors) "
+          f"in {summary['chunks']} chunks this time.")
+    return 0 if summary['status'] == COMPLETED and not summary['render_errors'] else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,39 +1,179 @@
 # In epic_3_billing/payment_logic.py
+#
+# Cash payments and their receipts. A payment and its receipt are always
+# written in the same transaction. Receipt numbers run per year
+# (RCPT-2025-000001, ...) from the ReceiptSequences table. Each process
+# reserves them RECEIPT_BLOCK_SIZE at a time, so the sequence row is
+# locked once per block instead of once per payment.
 
-from utils.db_connector import execute_query, fetch_one
-import datetime # Make sure this is imported
+import atexit
+import heapq
+import datetime
+import threading
+from utils.db_connector import fetch_one, transaction
+from epic_3_billing.client_summary import invalidate_client_summary
 
-def process_cash_payment(booking_id, amount):
+RECEIPT_BLOCK_SIZE = 50
+CASH_TXN_ID = 'CASH_COLLECTED_BY_DRIVER'
+
+_allocator = None
+_allocator_lock = threading.Lock()
+
+def receipt_number(year, sequence):
+    return f"RCPT-{year}-{sequence:06d}"
+
+class ReceiptNumberAllocator:
     """
-    Logs a CASH payment collected by a driver.
+    Hands out this process's receipt numbers from blocks reserved in
+    ReceiptSequences. A block is reserved in its own short transaction.
+    Numbers taken by a payment that then rolls back are released and
+    handed out again first. Unused numbers at shutdown go back to the
+    table if no other process has reserved a block since. Numbers stay
+    unique, but a process that crashes leaves the rest of its block
+    unissued.
     """
-    # 1. Get the client_id associated with this booking
-    client_query = "SELECT client_id FROM ServiceBookings WHERE booking_id = %s"
-    client_result = fetch_one(client_query, (booking_id,))
-    if not client_result:
-        print(f"Error: Could not find client for booking_id {booking_id}")
-        return False
-    
-    client_id = client_result['client_id']
 
-    # 2. Create the payment record with a special transaction ID
-    payment_query = """
-        INSERT INTO Payments (booking_id, client_id, amount, payment_gateway_txn_id, status, payment_date)
-        VALUES (%s, %s, %s, 'CASH_COLLECTED_BY_DRIVER', 'Succeeded', NOW())
+    def __init__(self, block_size=RECEIPT_BLOCK_SIZE):
+        self.block_size = block_size
+        self._lock = threading.Lock()
+        self._blocks = {}     # year -> [next, end)
+        self._released = {}   # year -> heap of numbers to hand out again
+
+    def _reserve(self, year, count):
+        """Reserves a block of at least count numbers for year. Returns [start, end)."""
+        size = max(self.block_size, count)
+        with transaction() as cursor:
+            cursor.execute("INSERT IGNORE INTO ReceiptSequences (year, next_value) VALUES (%s, 1)", (year,))
+            cursor.execute("SELECT next_value FROM ReceiptSequences WHERE year = %s FOR UPDATE", (year,))
+            start = cursor.fetchone()['next_value']
+            cursor.execute("UPDATE ReceiptSequences SET next_value = %s WHERE year = %s", (start + size, year))
+        return [start, start + size]
+
+    def take(self, count=1, year=None):
+        """count receipt numbers (strings) for year (default this year). Raises if no block can be reserved."""
+        year = year or datetime.date.today().year
+        with self._lock:
+            released = self._released.setdefault(year, [])
+            sequences = [heapq.heappop(released) for _ in range(min(count, len(released)))]
+            block = self._blocks.get(year)
+            need = count - len(sequences)
+            if need and (block is None or block[1] - block[0] < need):
+                if block:
+                    # What is left of the old block is used up before the new one
+                    sequences.extend(range(block[0], block[1]))
+                    need -= block[1] - block[0]
+                block = self._blocks[year] = self._reserve(year, need)
+            if need:
+                sequences.extend(range(block[0], block[0] + need))
+                block[0] += need
+        return [receipt_number(year, s) for s in sequences]
+
+    def release(self, numbers):
+        """Returns numbers whose payment was not written, so the next payments use them."""
+        with self._lock:
+            for number in numbers:
+                _, year, sequence = number.split('-')
+                heapq.heappush(self._released.setdefault(int(year), []), int(sequence))
+
+    def close(self):
+        """Gives the unused tail of each block back, where no other process has reserved past it."""
+        with self._lock:
+            blocks, self._blocks = self._blocks, {}
+        for year, (start, end) in blocks.items():
+            if start == end:
+                continue
+            try:
+                with transaction() as cursor:
+                    cursor.execute(
+                        "UPDATE ReceiptSequences SET next_value = %s WHERE year = %s AND next_value = %s",
+                        (start, year, end)
+                    )
+            except Exception as e:
+                print(f"Error returning receipt numbers {start}-{end - 1} of {year}: {e}")
+
+def get_receipt_allocator():
+    """The process-wide receipt number allocator."""
+    global _allocator
+    with _allocator_lock:
+        if _allocator is None:
+            _allocator = ReceiptNumberAllocator()
+            atexit.register(_allocator.close)
+        return _allocator
+
+def record_cash_payments(cursor, payments, allocator=None):
     """
-    payment_id = execute_query(payment_query, (booking_id, client_id, amount))
+    Writes cash payments and their receipts inside the caller's
+    transaction. payments is [(booking_id, client_id, client_email,
+    amount)]. Returns the receipt numbers used, which the caller must
+    release (allocator.release) if the transaction does not commit.
+    """
+    if not payments:
+        return []
+    allocator = allocator or get_receipt_allocator()
+    numbers = allocator.take(len(payments))
+    try:
+        if len(payments) == 1:
+            booking_id, client_id, _, amount = payments[0]
+            cursor.execute("""
+                INSERT INTO Payments (booking_id, client_id, amount, payment_gateway_txn_id, status, payment_date)
+                VALUES (%s, %s, %s, %s, 'Succeeded', NOW())
+            """, (booking_id, client_id, amount, CASH_TXN_ID))
+            payment_ids = [cursor.lastrowid]
+        else:
+            cursor.executemany("""
+                INSERT INTO Payments (booking_id, client_id, amount, payment_gateway_txn_id, status, payment_date)
+                VALUES (%s, %s, %s, %s, 'Succeeded', NOW())
+            """, [(booking_id, client_id, amount, CASH_TXN_ID) for booking_id, client_id, _, amount in payments])
+            # Ids of a multi-row insert are only guaranteed increasing, not consecutive
+            booking_ids = tuple(payment[0] for payment in payments)
+            cursor.execute(f"""
+                SELECT payment_id FROM Payments
+                WHERE payment_id >= %s AND booking_id IN ({', '.join(['%s'] * len(booking_ids))})
+                ORDER BY payment_id
+                LIMIT %s
+            """, (cursor.lastrowid,) + booking_ids + (len(payments),))
+            payment_ids = [row['payment_id'] for row in cursor.fetchall()]
+        cursor.executemany("""
+            INSERT INTO Receipts (payment_id, receipt_number, generated_at, sent_to_email)
+            VALUES (%s, %s, NOW(), %s)
+        """, [(payment_id, number, payment[2])
+              for payment_id, number, payment in zip(payment_ids, numbers, payments)])
+    except Exception:
+        allocator.release(numbers)
+        raise
+    return numbers
 
-    if not payment_id:
-        print(f"Error: Failed to insert cash payment for booking_id {booking_id}")
+def process_cash_payment(booking_id, amount, client_id=None, client_email=None):
+    """
+    Logs a CASH payment collected by a driver, with its receipt, in one
+    transaction. Callers that already have the booking's client (e.g. from
+    the assignment cache) pass client_id and client_email; otherwise they
+    are read with one query.
+    """
+    if client_id is None or client_email is None:
+        client_query = """
+            SELECT sb.client_id, u.email
+            FROM ServiceBookings sb
+            JOIN Users u ON sb.client_id = u.user_id
+            WHERE sb.booking_id = %s
+        """
+        client_result = fetch_one(client_query, (booking_id,))
+        if not client_result:
+            print(f"Error: Could not find client for booking_id {booking_id}")
+            return False
+        client_id, client_email = client_result['client_id'], client_result['email']
+
+    allocator = get_receipt_allocator()
+    numbers = []
+    try:
+        with transaction() as cursor:
+            numbers = record_cash_payments(cursor, [(booking_id, client_id, client_email, amount)], allocator)
+    except Exception as e:
+        # The transaction did not commit: its receipt number is issued to the next payment
+        allocator.release(numbers)
+        print(f"Error: Failed to log cash payment for booking_id {booking_id}: {e}")
         return False
 
-    # 3. Generate a receipt for the client's records
-    receipt_query = """
-        INSERT INTO Receipts (payment_id, receipt_number, generated_at, sent_to_email)
-        VALUES (%s, %s, NOW(), (SELECT email FROM Users WHERE user_id = %s))
-    """
-    receipt_num = f"RCPT-{datetime.date.today().year}-{payment_id}"
-    execute_query(receipt_query, (payment_id, receipt_num, client_id))
-    
-    print(f"Successfully logged cash payment {payment_id} for booking {booking_id}")
-    return True
\ No newline at end of file
+    invalidate_client_summary(client_id)
+    print(f"Successfully logged cash payment {numbers[0]} for booking {booking_id}")
+    return True
@@ -0,0 +1,212 @@
+# In epic_3_billing/schedule_logic.py
+#
+# Recurring bookings. A schedule repeats a pickup at one collection point
+# weekly, biweekly or monthly. A daily job turns the next MATERIALIZE_DAYS
+# of every active schedule into ServiceBookings rows, so route planning
+# sees the volume ahead of time:
+#   python -m epic_3_billing.schedule_logic materialize --days 14
+# Bookings are written with multi-row upserts keyed on (schedule_id,
+# requested_date), so running the job twice, or over a range already
+# covered, adds nothing. A date the client cancelled stays cancelled.
+
+import sys
+import argparse
+import calendar
+import datetime
+from utils.db_connector import fetch_all, transaction
+from epic_3_billing.tariff_logic import DEFAULT_WASTE_TYPE
+from epic_3_billing.client_summary import invalidate_client_summary
+
+FREQUENCIES = ('Weekly', 'Biweekly', 'Monthly')
+MATERIALIZE_DAYS = 14
+# Schedules per materialization transaction
+CHUNK_SIZE = 500
+
+UPSERT_BOOKINGS_QUERY = """
+    INSERT INTO ServiceBookings (client_id, point_id, requested_date, status, window_start, window_end,
+                                 waste_type, schedule_id)
+    VALUES (%s, %s, %s, 'Approved', %s, %s, %s, %s)
+    ON DUPLICATE KEY UPDATE schedule_id = VALUES(schedule_id)
+"""
+
+def _placeholders(values):
+    return ', '.join(['%s'] * len(values))
+
+def _add_months(day, months, day_of_month):
+    month_index = day.month - 1 + months
+    year, month = day.year + month_index // 12, month_index % 12 + 1
+    return datetime.date(year, month, min(day_of_month, calendar.monthrange(year, month)[1]))
+
+def occurrences(frequency, start_date, first, last):
+    """
+    Dates of a schedule starting on start_date that fall in [first, last].
+    Monthly schedules keep start_date's day of the month, or the month's
+    last day when it is shorter.
+    """
+    first = max(first, start_date)
+    if first > last:
+        return []
+    if frequency == 'Monthly':
+        months = (first.year - start_date.year) * 12 + first.month - start_date.month
+        dates = []
+        day = _add_months(start_date, months, start_date.day)
+        while day <= last:
+            if day >= first:
+                dates.append(day)
+            months += 1
+            day = _add_months(start_date, months, start_date.day)
+        return dates
+    step = 7 if frequency == 'Weekly' else 14
+    skip = -(-(first - start_date).days // step)
+    day = start_date + datetime.timedelta(days=skip * step)
+    dates = []
+    while day <= last:
+        dates.append(day)
+        day += datetime.timedelta(days=step)
+    return dates
+
+def materialize_bookings(horizon_days=MATERIALIZE_DAYS, today=None, chunk_size=CHUNK_SIZE, schedule_ids=None):
+    """
+    Creates the bookings of every active schedule (or only schedule_ids)
+    from tomorrow up to horizon_days ahead. Today's routes are already
+    planned, so a schedule never books today. Schedules are processed in
+    chunks. Each chunk does one multi-row upsert of its bookings and one
+    UPDATE of how far they are materialized, in a single transaction.
+    Returns {'schedules', 'bookings'} (bookings actually created), or None
+    on a database error; chunks already written stay written.
+    """
+    today = today or datetime.date.today()
+    first, last = today + datetime.timedelta(days=1), today + datetime.timedelta(days=horizon_days)
+    only = f"AND schedule_id IN ({_placeholders(schedule_ids)})" if schedule_ids else ""
+    summary = {'schedules': 0, 'bookings': 0}
+    after = 0
+    while True:
+        schedules = fetch_all(f"""
+            SELECT schedule_id, client_id, point_id, frequency, start_date, end_date,
+                   window_start, window_end, waste_type, materialized_until
+            FROM BookingSchedules
+            WHERE active = 1 AND schedule_id > %s {only}
+              AND start_date <= %s
+              AND (end_date IS NULL OR end_date >= %s)
+              AND (materialized_until IS NULL OR materialized_until < %s)
+            ORDER BY schedule_id
+            LIMIT %s
+        """, (after,) + tuple(schedule_ids or ()) + (last, first, last, chunk_size))
+        if schedules is None:
+            print("Error: Could not read booking schedules.")
+            return None
+        if not schedules:
+            return summary
+
+        rows = []
+        for s in schedules:
+            # Only the days not covered by an earlier run
+            start = first
+            if s['materialized_until'] and s['materialized_until'] >= start:
+                start = s['materialized_until'] + datetime.timedelta(days=1)
+            end = min(last, s['end_date']) if s['end_date'] else last
+            rows.extend(
+                (s['client_id'], s['point_id'], day, s['window_start'], s['window_end'],
+                 s['waste_type'], s['schedule_id'])
+                for day in occurrences(s['frequency'], s['start_date'], start, end)
+            )
+        ids = tuple(s['schedule_id'] for s in schedules)
+        try:
+            with transaction() as cursor:
+                if rows:
+                    cursor.executemany(UPSERT_BOOKINGS_QUERY, rows)
+                    # Existing (schedule, date) rows are left unchanged and count 0
+                    summary['bookings'] += max(cursor.rowcount, 0)
+                cursor.execute(
+                    f"UPDATE BookingSchedules SET materialized_until = %s WHERE schedule_id IN ({_placeholders(ids)})",
+                    (last,) + ids
+                )
+        except Exception as e:
+            print(f"Error materializing schedules {ids[0]}-{ids[-1]}: {e}")
+            return None
+        invalidate_client_summary(*sorted({s['client_id'] for s in schedules}))
+        summary['schedules'] += len(schedules)
+        after = ids[-1]
+
+def create_schedule(client_id, point_id, frequency, start_date, end_date=None,
+                    window_start=None, window_end=None, waste_type=DEFAULT_WASTE_TYPE):
+    """
+    Adds a recurring booking and materializes its first MATERIALIZE_DAYS
+    straight away. Schedules start tomorrow at the earliest; a pickup today
+    is booked with create_booking. Returns the schedule_id, or None.
+    """
+    if frequency not in FREQUENCIES:
+        print(f"Error: Unknown frequency {frequency}.")
+        return None
+    if start_date <= datetime.date.today():
+        print("Error: Recurring bookings start from tomorrow.")
+        return None
+    if end_date and end_date < start_date:
+        print("Error: Schedule must end after it starts.")
+        return None
+    try:
+        with transaction() as cursor:
+            cursor.execute("""
+                INSERT INTO BookingSchedules (client_id, point_id, frequency, start_date, end_date,
+                                              window_start, window_end, waste_type)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+            """, (client_id, point_id, frequency, start_date, end_date, window_start, window_end, waste_type))
+            schedule_id = cursor.lastrowid
+    except Exception as e:
+        print(f"Error creating booking schedule: {e}")
+        return None
+    materialize_bookings(schedule_ids=[schedule_id])
+    return schedule_id
+
+def cancel_schedule(schedule_id, client_id):
+    """
+    Stops a client's schedule and cancels its bookings after today, in one
+    transaction. Returns True on success.
+    """
+    try:
+        with transaction() as cursor:
+            cursor.execute("UPDATE BookingSchedules SET active = 0 WHERE schedule_id = %s AND client_id = %s",
+                           (schedule_id, client_id))
+            if cursor.rowcount != 1:
+                print(f"Error: Schedule {schedule_id} not found for client {client_id}.")
+                return False
+            cursor.execute("""
+                UPDATE ServiceBookings
+                SET status = 'Cancelled'
+                WHERE schedule_id = %s AND status = 'Approved' AND requested_date > CURDATE()
+            """, (schedule_id,))
+    except Exception as e:
+        print(f"Error cancelling schedule {schedule_id}: {e}")
+        return False
+    invalidate_client_summary(client_id)
+    return True
+
+def get_client_schedules(client_id):
+    """A client's active schedules, with the collection point name."""
+    query = """
+        SELECT bs.schedule_id, cp.point_name, bs.frequency, bs.start_date, bs.end_date,
+               bs.window_start, bs.window_end, bs.waste_type, bs.materialized_until
+        FROM BookingSchedules bs
+        JOIN CollectionPoints cp ON bs.point_id = cp.point_id
+        WHERE bs.client_id = %s AND bs.active = 1
+        ORDER BY bs.start_date
+    """
+    return fetch_all(query, (client_id,))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Recurring booking schedules.")
+    sub = parser.add_subparsers(dest='command', required=True)
+    run = sub.add_parser('materialize', help="Create the bookings of every schedule for the coming days.")
+    run.add_argument('--days', type=int, default=MATERIALIZE_DAYS)
+    run.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+    args = parser.parse_args(argv)
+
+    summary = materialize_bookings(args.days, chunk_size=args.chunk_size)
+    if summary is None:
+        return 1
+    print(f"Materialized {summary['schedules']} schedules: {summary['bookings']} new bookings "
+          f"for the next {args.days} days.")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
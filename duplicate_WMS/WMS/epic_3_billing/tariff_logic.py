@@ -0,0 +1,291 @@
+# In epic_3_billing/tariff_logic.py
+#
+# Prices for collected waste, from the Tariffs / TariffBrackets tables.
+# A tariff applies to a client, a tariff zone and a waste type (each may be
+# left open), from effective_from to effective_to. Its brackets are
+# marginal: with brackets at 0 kg (3.00/kg) and 100 kg (2.50/kg), 150 kg
+# costs 100 * 3.00 + 50 * 2.50. The most specific tariff in effect wins.
+
+import time
+import bisect
+import datetime
+import threading
+import numpy as np
+from utils.db_connector import fetch_all, fetch_one, execute_query, transaction
+from epic_2_operations.assignment_cache import get_assignment_cache
+
+# Used when no tariff applies (or none could be read), so a stop can always be paid
+DEFAULT_RATE_PER_KG = 3.0
+DEFAULT_WASTE_TYPE = 'General'
+WASTE_TYPES = (DEFAULT_WASTE_TYPE, 'Recyclable', 'Organic', 'Hazardous')
+# How often the tables are checked for changes made by other processes
+RELOAD_CHECK_S = 60.0
+
+_engine = None
+_engine_lock = threading.Lock()
+
+def _day_number(day):
+    if day is None:
+        return datetime.date.today().toordinal()
+    if isinstance(day, datetime.datetime):
+        return day.date().toordinal()
+    return day.toordinal()
+
+def _candidate_keys(client_id, zone, waste_type):
+    """Tariff keys that could apply, most specific first (client, then zone, then waste type)."""
+    keys = []
+    for c in (client_id, None):
+        for z in (zone, None):
+            for w in (waste_type, None):
+                if (c, z, w) not in keys:
+                    keys.append((c, z, w))
+    return keys
+
+class TariffBook:
+    """
+    Tariffs compiled for lookup: per (client, zone, waste type) key the
+    versions sorted by start date, so finding the one in effect is a
+    bisection; per version the bracket bounds, rates and the cost up to
+    each bound, so a price is one searchsorted and one multiply-add.
+    """
+
+    def __init__(self, tariffs):
+        # tariffs: [{tariff_id, client_id, zone, waste_type, effective_from, effective_to, brackets: [(min_kg, rate)]}]
+        self.bounds, self.rates, self.base = [], [], []
+        by_key = {}
+        for tariff in tariffs:
+            brackets = sorted((float(b[0]), float(b[1])) for b in tariff['brackets'])
+            if not brackets:
+                continue
+            bounds = np.array([b[0] for b in brackets])
+            rates = np.array([b[1] for b in brackets])
+            self.bounds.append(bounds)
+            self.rates.append(rates)
+            self.base.append(np.concatenate(([0.0], np.cumsum(np.diff(bounds) * rates[:-1]))))
+            ends = tariff['effective_to'].toordinal() if tariff['effective_to'] else float('inf')
+            key = (tariff['client_id'], tariff['zone'], tariff['waste_type'])
+            by_key.setdefault(key, []).append((tariff['effective_from'].toordinal(), ends, len(self.bounds) - 1))
+        self._versions = {}
+        for key, versions in by_key.items():
+            versions.sort()
+            self._versions[key] = ([v[0] for v in versions], [v[1] for v in versions], [v[2] for v in versions])
+
+    def __len__(self):
+        return len(self.bounds)
+
+    def find(self, client_id, zone, waste_type, day_number):
+        """Index of the tariff version in effect, or None."""
+        for key in _candidate_keys(client_id, zone, waste_type):
+            versions = self._versions.get(key)
+            if not versions:
+                continue
+            starts, ends, indexes = versions
+            i = bisect.bisect_right(starts, day_number) - 1
+            # A later start replaces an earlier version; an expired one leaves the next key to decide
+            if i >= 0 and ends[i] >= day_number:
+                return indexes[i]
+        return None
+
+    def cost(self, version, weights):
+        """Marginal-bracket cost of each weight under one version."""
+        bounds, rates, base = self.bounds[version], self.rates[version], self.base[version]
+        k = np.searchsorted(bounds, weights, side='right') - 1
+        below = k < 0
+        k = np.maximum(k, 0)
+        return np.where(below, 0.0, base[k] + (weights - bounds[k]) * rates[k])
+
+class TariffEngine:
+    """
+    The compiled tariff book of this process. It is rebuilt when the
+    tables change: save_tariff rebuilds it straight away, and a cheap
+    count/last-change query every RELOAD_CHECK_S picks up changes made
+    elsewhere.
+    """
+
+    def __init__(self, reload_check_s=RELOAD_CHECK_S, clock=time.monotonic):
+        self.reload_check_s = reload_check_s
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._book = None
+        self._version = None
+        self._checked_at = None
+
+    def _table_version(self):
+        row = fetch_one("SELECT COUNT(*) AS tariffs, MAX(updated_at) AS changed FROM Tariffs")
+        return (row['tariffs'], row['changed']) if row else None
+
+    def load(self):
+        """Reads and compiles every tariff. Returns False (keeping the old book) on error."""
+        version = self._table_version()
+        rows = fetch_all("""
+            SELECT t.tariff_id, t.client_id, t.zone, t.waste_type, t.effective_from, t.effective_to,
+                   b.min_kg, b.rate_per_kg
+            FROM Tariffs t
+            JOIN TariffBrackets b ON b.tariff_id = t.tariff_id
+            ORDER BY t.tariff_id, b.min_kg
+        """)
+        with self._lock:
+            self._checked_at = self.clock()
+            if rows is None or version is None:
+                return False
+            tariffs = {}
+            for row in rows:
+                tariff = tariffs.setdefault(row['tariff_id'], dict(row, brackets=[]))
+                tariff['brackets'].append((row['min_kg'], row['rate_per_kg']))
+            self._book = TariffBook(list(tariffs.values()))
+            self._version = version
+        return True
+
+    def invalidate(self):
+        """Makes the next price re-check the tables."""
+        with self._lock:
+            self._checked_at = None
+
+    def _current_book(self):
+        with self._lock:
+            due = self._checked_at is None or self.clock() - self._checked_at >= self.reload_check_s
+            book = self._book
+        if due:
+            if book is None:
+                self.load()
+            else:
+                version = self._table_version()
+                if version is not None and version != self._version:
+                    self.load()
+                else:
+                    with self._lock:
+                        self._checked_at = self.clock()
+            with self._lock:
+                book = self._book
+        return book
+
+    def price_many(self, weights, client_ids=None, zones=None, waste_types=None, days=None):
+        """
+        Prices many collections at once. weights is a sequence of kg; the
+        other arguments are each either one value for all of them or a
+        sequence of the same length. Returns a numpy array of amounts,
+        rounded to cents.
+        """
+        weights = np.asarray(weights, dtype=float).reshape(-1)
+        n = len(weights)
+
+        def column(values):
+            return list(values) if isinstance(values, (list, tuple, np.ndarray)) else [values] * n
+
+        clients, zone_list, wastes = column(client_ids), column(zones), column(waste_types)
+        day_numbers = [_day_number(d) for d in column(days)]
+        wastes = [w or DEFAULT_WASTE_TYPE for w in wastes]
+
+        book = self._current_book()
+        amounts = weights * DEFAULT_RATE_PER_KG
+        if book:
+            # Few distinct (client, zone, waste type, day) combinations even in a big batch
+            resolved = {}
+            versions = np.empty(n, dtype=int)
+            for i, key in enumerate(zip(clients, zone_list, wastes, day_numbers)):
+                if key not in resolved:
+                    found = book.find(*key)
+                    resolved[key] = -1 if found is None else found
+                versions[i] = resolved[key]
+            for version in np.unique(versions[versions >= 0]):
+                rows = versions == version
+                amounts[rows] = book.cost(version, weights[rows])
+        return np.round(amounts, 2)
+
+    def price(self, weight, client_id=None, zone=None, waste_type=None, day=None):
+        """Price of a single collection."""
+        return float(self.price_many([weight], client_id, zone, waste_type, day)[0])
+
+def get_tariff_engine():
+    """The process-wide tariff engine."""
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = TariffEngine()
+        return _engine
+
+def price_stop(stop, weight, day=None):
+    """
+    Amount to collect for weight kg at a route stop (a dict with client_id,
+    tariff_zone and waste_type, as the assignment cache has them).
+    """
+    return get_tariff_engine().price(float(weight), stop.get('client_id'), stop.get('tariff_zone'),
+                                     stop.get('waste_type'), day)
+
+def price_many(weights, client_ids=None, zones=None, waste_types=None, days=None):
+    """Prices a batch of collections with the process-wide tariff book (see TariffEngine.price_many)."""
+    return get_tariff_engine().price_many(weights, client_ids, zones, waste_types, days)
+
+def get_tariffs():
+    """Every tariff with its brackets, for the admin panel."""
+    query = """
+        SELECT t.tariff_id, u.email AS client, t.zone, t.waste_type, t.effective_from, t.effective_to,
+               GROUP_CONCAT(CONCAT(b.min_kg, ' kg: ', b.rate_per_kg, '/kg') ORDER BY b.min_kg SEPARATOR ', ') AS brackets
+        FROM Tariffs t
+        LEFT JOIN Users u ON t.client_id = u.user_id
+        LEFT JOIN TariffBrackets b ON b.tariff_id = t.tariff_id
+        GROUP BY t.tariff_id
+        ORDER BY t.effective_from DESC, t.tariff_id DESC
+    """
+    return fetch_all(query)
+
+def save_tariff(brackets, effective_from, effective_to=None, client_id=None, zone=None, waste_type=None):
+    """
+    Adds a tariff. brackets is [(min_kg, rate_per_kg)] and must include
+    0 kg. Takes effect in this process at once, elsewhere within
+    RELOAD_CHECK_S. Returns the new tariff_id, or None.
+    """
+    brackets = sorted((float(min_kg), float(rate)) for min_kg, rate in brackets)
+    if not brackets or brackets[0][0] != 0 or any(rate < 0 for _, rate in brackets) \
+            or len({min_kg for min_kg, _ in brackets}) != len(brackets):
+        print("Error: Tariff brackets must start at 0 kg, be distinct and have non-negative rates.")
+        return None
+    if effective_to and effective_to < effective_from:
+        print("Error: Tariff must end after it starts.")
+        return None
+    try:
+        with transaction() as cursor:
+            cursor.execute("""
+                INSERT INTO Tariffs (client_id, zone, waste_type, effective_from, effective_to)
+                VALUES (%s, %s, %s, %s, %s)
+            """, (client_id, zone or None, waste_type or None, effective_from, effective_to))
+            tariff_id = cursor.lastrowid
+            cursor.executemany(
+                "INSERT INTO TariffBrackets (tariff_id, min_kg, rate_per_kg) VALUES (%s, %s, %s)",
+                [(tariff_id, min_kg, rate) for min_kg, rate in brackets]
+            )
+    except Exception as e:
+        print(f"Error saving tariff: {e}")
+        return None
+    get_tariff_engine().load()
+    return tariff_id
+
+def get_point_zones():
+    """Every collection point with its client and tariff zone, for the admin panel."""
+    query = """
+        SELECT cp.point_id, cp.point_name, cp.address, u.email AS client, cp.tariff_zone
+        FROM CollectionPoints cp
+        LEFT JOIN Users u ON cp.client_id = u.user_id
+        ORDER BY cp.tariff_zone, cp.point_id
+    """
+    return fetch_all(query)
+
+def set_point_tariff_zone(point_ids, zone):
+    """
+    Puts collection points in a tariff zone (an empty zone takes them out
+    of any). Collections from then on are priced by the zone's tariffs.
+    Returns the number of points changed, or None on error.
+    """
+    point_ids = tuple(int(point_id) for point_id in point_ids)
+    if not point_ids:
+        return 0
+    placeholders = ', '.join(['%s'] * len(point_ids))
+    changed = execute_query(
+        f"UPDATE CollectionPoints SET tariff_zone = %s WHERE point_id IN ({placeholders})",
+        ((zone or '').strip() or None,) + point_ids
+    )
+    if changed is None:
+        return None
+    # Drivers' cached stops carry the zone they are priced with
+    get_assignment_cache().invalidate()
+    return changed
@@ -4,6 +4,7 @@ import folium
 import sys
 import os
 import datetime
+import uuid
 
 # Add the project root directory to the Python path
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
@@ -21,25 +22,42 @@ from epic_1_routing.assignment_logic import (
     get_pending_bookings, create_route_assignment, 
     get_daily_booking_report, get_active_vehicles_by_date
 )
+from epic_1_routing.auto_assign_logic import auto_assign_pending_bookings, DEFAULT_VEHICLE_CAPACITY_KG
+from epic_1_routing.zoning_logic import get_pending_booking_zones
 
 # Epic 2: Operations
 from epic_2_operations.tracking_logic import (
-    get_live_vehicle_locations, get_driver_assignment, 
+    get_driver_assignment, 
     mark_stop_complete, log_driver_location,
-    get_route_history
+    get_route_history, get_assignment_progress
 )
+from epic_2_operations.gps_ingestion import get_ingestion_stats
+from epic_2_operations.fleet_state import get_fleet_state
+from epic_2_operations.offline_sync import sync_stop_completions, ERROR as SYNC_ERROR
+from epic_2_operations.gps_anomaly import get_anomaly_flags
+from epic_2_operations.geofence_logic import get_stop_arrival
+from epic_2_operations.eta_logic import get_client_etas
 
 # Epic 3: Billing
 from epic_3_billing.booking_logic import (
-    create_booking, get_client_bookings, 
+    create_booking, get_client_bookings, BOOKING_PAGE_SIZE,
     get_client_collection_points, add_collection_point
 )
+from epic_3_billing.tariff_logic import (
+    price_stop, get_tariffs, save_tariff, get_point_zones, set_point_tariff_zone, WASTE_TYPES
+)
+from epic_3_billing.invoice_logic import get_client_invoices
+from epic_3_billing.client_summary import get_client_summary
+from epic_3_billing.schedule_logic import create_schedule, cancel_schedule, get_client_schedules, FREQUENCIES
+from epic_3_billing.cash_reconciliation import get_close_of_day_report, get_discrepancies, close_day
 
 # --- NEW: Epic 4 Imports ---
 from epic_4_communication.chat_logic import get_group_messages, send_group_message
 from epic_4_communication.feedback_logic import submit_feedback, get_all_feedback
 
 
+from utils.polyline_utils import decode_polyline
+
 # UI Components
 from streamlit_folium import st_folium
 from streamlit_geolocation import streamlit_geolocation
@@ -154,9 +172,10 @@ def dashboard_supervisor():
         "Route History",
         "Daily Booking Report",
         "Internal Chat",
-        "Client Feedback"
+        "Client Feedback",
+        "Cash Reconciliation"
     ]
-    tab1, tab2, tab3, tab4, tab5, tab6 = st.tabs(tab_list)
+    tab1, tab2, tab3, tab4, tab5, tab6, tab7 = st.tabs(tab_list)
 
     with tab1:
         st.subheader("Assign Routes for Today")
@@ -170,43 +189,93 @@ def dashboard_supervisor():
             driver_options = {d['user_id']: f"{d['first_name']} {d['last_name']}" for d in drivers}
             vehicle_options = {v['vehicle_id']: f"{v['license_plate']} ({v['model']})" for v in vehicles}
             booking_options = {b['booking_id']: f"{b['point_name']} (Booking #{b['booking_id']})" for b in bookings}
+            # Zones are sized to fit the biggest free vehicle
+            zone_capacity = max((float(v.get('capacity_kg') or DEFAULT_VEHICLE_CAPACITY_KG) for v in vehicles), default=DEFAULT_VEHICLE_CAPACITY_KG)
+            zones = get_pending_booking_zones(zone_capacity)
+            zone_options = {z['zone_id']: f"Zone {z['zone_id']}: {z['count']} bookings, ~{z['estimated_kg']:.0f} kg (near {z['bookings'][0]['point_name']})" for z in zones}
+            zone_bookings = {z['zone_id']: z['booking_ids'] for z in zones}
 
             selected_driver = st.selectbox("1. Select Driver", options=driver_options.keys(), format_func=lambda x: driver_options.get(x, "N/A"))
             selected_vehicle = st.selectbox("2. Select Vehicle", options=vehicle_options.keys(), format_func=lambda x: vehicle_options.get(x, "N/A"))
-            selected_bookings = st.multiselect("3. Select Bookings to Assign", options=booking_options.keys(), format_func=lambda x: booking_options.get(x, "N/A"))
+            selected_zones = st.multiselect("3. Select Zones to Assign", options=zone_options.keys(), format_func=lambda x: zone_options.get(x, "N/A"))
+            selected_bookings = st.multiselect("...and/or individual Bookings", options=booking_options.keys(), format_func=lambda x: booking_options.get(x, "N/A"))
+            optimize_order = st.checkbox("Optimize stop order (shortest route)", value=True)
 
             submitted = st.form_submit_button("Create and Assign Route")
             if submitted:
+                for zone_id in selected_zones:
+                    selected_bookings += [b for b in zone_bookings[zone_id] if b not in selected_bookings]
                 if not selected_driver or not selected_vehicle or not selected_bookings:
-                    st.error("Please fill all fields and select at least one booking.")
+                    st.error("Please fill all fields and select at least one zone or booking.")
                 else:
-                    success = create_route_assignment(st.session_state['user_id'], selected_driver, selected_vehicle, selected_bookings)
+                    success = create_route_assignment(st.session_state['user_id'], selected_driver, selected_vehicle, selected_bookings, optimize=optimize_order)
                     if success:
                         st.success("Route assigned successfully!")
                     else:
                         st.error("Failed to create route assignment.")
 
+        st.divider()
+        st.write("**Auto-assign all pending bookings**")
+        st.caption("Splits every pending booking across the free drivers and vehicles, respecting vehicle capacity.")
+        if st.button("Auto-assign Routes", key="auto_assign_btn"):
+            with st.spinner("Planning routes..."):
+                summary = auto_assign_pending_bookings(st.session_state['user_id'])
+            if summary is None:
+                st.error("Failed to create route assignments.")
+            elif summary['routes'] == 0:
+                st.warning("Nothing to assign: need pending bookings, free drivers and free vehicles.")
+            else:
+                st.success(f"Created {summary['routes']} routes with {summary['stops']} stops ({summary['distance_km']:.1f} km total).")
+                if summary['unassigned']:
+                    st.warning(f"{len(summary['unassigned'])} bookings did not fit in the available vehicles.")
+
     with tab2:
         st.subheader("Live Vehicle Map")
         if st.button("Refresh Map"):
             st.rerun()
-        locations = get_live_vehicle_locations()
-        if not locations:
+        gps_stats = get_ingestion_stats()
+        st.caption(f"GPS points: {gps_stats['accepted']} accepted, {gps_stats['dropped']} dropped, {gps_stats['flushed']} written, {gps_stats['buffered']} waiting.")
+        # Pull only the vehicles that changed since this viewer's last rerun
+        fleet_version, changed = get_fleet_state().changes_since(st.session_state.get('fleet_version', 0))
+        fleet_positions = st.session_state.setdefault('fleet_positions', {})
+        for vehicle in changed:
+            fleet_positions[vehicle['vehicle_id']] = vehicle
+        st.session_state['fleet_version'] = fleet_version
+
+        valid_locations = [loc for loc in fleet_positions.values() if loc.get('latitude') and loc.get('longitude')]
+        if not valid_locations:
             st.warning("No live vehicle data available.")
         else:
-            valid_locations = [loc for loc in locations if loc and loc.get('latitude') and loc.get('longitude')]
-            if not valid_locations:
-                st.warning("No valid location data to display.")
-            else:
+            if changed or 'fleet_map' not in st.session_state:
                 map_center = [valid_locations[0]['latitude'], valid_locations[0]['longitude']]
                 m = folium.Map(location=map_center, zoom_start=12)
                 for loc in valid_locations:
+                    details = f"{loc['license_plate']} @ {loc['timestamp']}"
+                    if loc['speed_kmh'] is not None:
+                        details += f" ({loc['speed_kmh']:.0f} km/h, heading {loc['heading_deg'] or 0:.0f}°)"
                     folium.Marker(
                         [loc['latitude'], loc['longitude']],
                         tooltip=loc['license_plate'],
-                        popup=f"{loc['license_plate']} @ {loc['timestamp']}"
+                        popup=details
                     ).add_to(m)
-                st_folium(m, width='100%')
+                st.session_state['fleet_map'] = m
+            st_folium(st.session_state['fleet_map'], width='100%')
+
+        progress = get_assignment_progress() or []
+        if progress:
+            st.write("**Today's Route Progress**")
+            progress_df = pd.DataFrame(progress)
+            progress_df['driver'] = progress_df['first_name'] + ' ' + progress_df['last_name']
+            progress_df['stops'] = progress_df['completed_stops'].astype(str) + ' / ' + progress_df['total_stops'].astype(str)
+            st.dataframe(progress_df[['license_plate', 'driver', 'status', 'stops']], use_container_width=True)
+
+        anomaly_flags = get_anomaly_flags()
+        if anomaly_flags:
+            with st.expander(f"GPS anomalies ({len(anomaly_flags)})"):
+                plates = {v['vehicle_id']: v['license_plate'] for v in fleet_positions.values()}
+                flags_df = pd.DataFrame(anomaly_flags)
+                flags_df['vehicle'] = flags_df['vehicle_id'].map(lambda v: plates.get(v, v))
+                st.dataframe(flags_df[['timestamp', 'vehicle', 'kind', 'route_stop_id', 'detail']], use_container_width=True)
 
     with tab3:
         st.subheader("View Historical Routes")
@@ -245,8 +314,17 @@ def dashboard_supervisor():
                             popup=f"{stop['point_name']} @ {stop['completed_at']}",
                             icon=folium.Icon(color='green')
                         ).add_to(m_history)
+                    levels = history.get('path_levels') or []
+                    if len(levels) > 1:
+                        level = st.select_slider(
+                            "Path detail",
+                            options=range(len(levels)),
+                            value=history.get('path_level', 0),
+                            format_func=lambda i: f"{levels[i]['points']} of {history.get('path_points')} points"
+                        )
+                        path = levels[level]['path']
                     if path:
-                        path_coords = [(float(p['latitude']), float(p['longitude'])) for p in path]
+                        path_coords = decode_polyline(path).tolist()
                         folium.PolyLine(
                             path_coords,
                             color='blue',
@@ -289,6 +367,31 @@ def dashboard_supervisor():
             df = df[['created_at', 'rating', 'comment', 'first_name', 'last_name', 'email']]
             st.dataframe(df, use_container_width=True)
 
+    with tab7:
+        st.subheader("Driver Cash Reconciliation")
+        cash_date = st.date_input("Day", datetime.date.today(), key="cash_date")
+        cash_report = get_close_of_day_report(cash_date) or []
+        if not cash_report:
+            st.info("No stops completed on this day.")
+        else:
+            st.dataframe(pd.DataFrame(cash_report), use_container_width=True)
+            with st.form("close_day_form"):
+                drivers = {f"{r['first_name']} {r['last_name']}": r['driver_id'] for r in cash_report}
+                driver_name = st.selectbox("Driver", list(drivers))
+                handed_in = st.number_input("Cash handed in", min_value=0.0, step=1.0)
+                if st.form_submit_button("Close Day"):
+                    if close_day(drivers[driver_name], cash_date, handed_in):
+                        st.success(f"Day closed for {driver_name}.")
+                    else:
+                        st.error("Could not close the day.")
+
+        st.subheader("Discrepancies (last 30 days)")
+        discrepancies = get_discrepancies(datetime.date.today() - datetime.timedelta(days=30), datetime.date.today()) or []
+        if not discrepancies:
+            st.success("Every driver day reconciles.")
+        else:
+            st.dataframe(pd.DataFrame(discrepancies), use_container_width=True)
+
 
 def dashboard_driver():
     st.header(f"Driver App")
@@ -315,8 +418,25 @@ def dashboard_driver():
         st.divider()
 
         st.subheader("Your Assigned Stops for Today")
+        offline_mode = st.toggle("Low signal: queue completions and sync later", key="offline_mode")
+        queue = st.session_state.setdefault('completion_queue', [])
+        if queue:
+            st.info(f"{len(queue)} completed stops waiting to sync.")
+            if st.button("Sync queued stops"):
+                results = sync_stop_completions(st.session_state['user_id'], queue)
+                for result in results:
+                    if result['status'] in ('applied', 'duplicate'):
+                        st.success(f"Stop {result['route_stop_id']}: synced.")
+                    else:
+                        st.error(f"Stop {result['route_stop_id']}: {result['message']}")
+                # Only events that could not be saved stay queued for the next try
+                st.session_state['completion_queue'] = [
+                    event for event, result in zip(queue, results) if result['status'] == SYNC_ERROR
+                ]
+                queue = st.session_state['completion_queue']
+        queued_stop_ids = {event['route_stop_id'] for event in queue}
         stops_list = get_driver_assignment(st.session_state['user_id'])
-        stops = stops_list if stops_list is not None else []
+        stops = [s for s in (stops_list or []) if s['route_stop_id'] not in queued_stop_ids]
 
         if not stops:
             st.success("No more stops for today. Great job!")
@@ -324,14 +444,27 @@ def dashboard_driver():
             for stop in stops:
                 st.subheader(stop['point_name'])
                 st.write(stop['address'])
+                arrival = get_stop_arrival(stop['route_stop_id'])
+                if arrival:
+                    st.caption(f"Arrival detected at {arrival['arrived_at']:%H:%M}; location verified.")
                 with st.form(key=f"form_stop_{stop['route_stop_id']}"):
                     weight = st.number_input("Enter Weight (KG)", min_value=0.0, format="%.2f", key=f"weight_{stop['route_stop_id']}")
-                    amount = float(weight) * 3.0
+                    amount = price_stop(stop, weight)
                     st.info(f"Amount to Collect: ₹{amount:.2f}")
                     submitted = st.form_submit_button("Confirm Cash Payment & Mark Complete")
                     if submitted:
                         if weight <= 0:
                             st.error("Weight must be greater than zero.")
+                        elif offline_mode:
+                            queue.append({
+                                'idempotency_key': uuid.uuid4().hex,
+                                'route_stop_id': stop['route_stop_id'],
+                                'latitude': driver_lat,
+                                'longitude': driver_lon,
+                                'weight': weight,
+                                'client_timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+                            })
+                            st.rerun()
                         else:
                             result = mark_stop_complete(
                                 st.session_state['user_id'],
@@ -399,13 +532,51 @@ def dashboard_client():
             with st.form("booking_form"):
                 selected_point = st.selectbox("Select Collection Point", options=point_options.keys(), format_func=lambda x: point_options.get(x, "N/A"))
                 selected_date = st.date_input("Select Date", min_value=datetime.date.today())
+                waste_type = st.selectbox("Type of Waste", WASTE_TYPES)
+                repeat = st.selectbox("Repeat", ("Never",) + FREQUENCIES)
+                use_window = st.checkbox("Pickup only allowed between set hours")
+                window_col1, window_col2 = st.columns(2)
+                window_start = window_col1.time_input("From", datetime.time(9, 0))
+                window_end = window_col2.time_input("Until", datetime.time(17, 0))
                 submitted = st.form_submit_button("Book Service")
-                if submitted:
-                    booking_id = create_booking(st.session_state['user_id'], selected_point, selected_date)
+                if submitted and use_window and window_end <= window_start:
+                    st.error("The pickup window must end after it starts.")
+                elif submitted and repeat != "Never" and selected_date <= datetime.date.today():
+                    st.error("Recurring bookings start from tomorrow.")
+                elif submitted and repeat != "Never":
+                    schedule_id = create_schedule(
+                        st.session_state['user_id'], selected_point, repeat, selected_date,
+                        window_start=window_start if use_window else None,
+                        window_end=window_end if use_window else None,
+                        waste_type=waste_type
+                    )
+                    if schedule_id:
+                        st.success(f"{repeat} pickups booked from {selected_date:%d %b %Y}.")
+                    else:
+                        st.error("Failed to create the recurring booking.")
+                elif submitted:
+                    booking_id = create_booking(
+                        st.session_state['user_id'], selected_point, selected_date,
+                        window_start if use_window else None,
+                        window_end if use_window else None,
+                        waste_type
+                    )
                     if booking_id:
                         st.success(f"Booking successful! Your Booking ID is {booking_id}.")
                     else:
                         st.error("Failed to create booking.")
+            schedules = get_client_schedules(st.session_state['user_id']) or []
+            if schedules:
+                st.write("**Your recurring pickups**")
+                for schedule in schedules:
+                    col_info, col_cancel = st.columns([4, 1])
+                    col_info.write(f"{schedule['frequency']} at {schedule['point_name']} "
+                                   f"from {schedule['start_date']:%d %b %Y} ({schedule['waste_type']})")
+                    if col_cancel.button("Cancel", key=f"cancel_schedule_{schedule['schedule_id']}"):
+                        if cancel_schedule(schedule['schedule_id'], st.session_state['user_id']):
+                            st.rerun()
+                        else:
+                            st.error("Could not cancel the recurring pickup.")
             st.divider()
             with st.expander("Add a new collection point (address)"):
                 with st.form("add_new_point_form"):
@@ -427,14 +598,41 @@ def dashboard_client():
                                 st.error("Failed to add new address.")
 
     with tab2:
+        for eta in get_client_etas(st.session_state['user_id']):
+            st.info(f"Your truck is about {eta['minutes_away']} minutes away from {eta['point_name']} "
+                    f"(around {eta['eta']:%H:%M}, {eta['stops_before']} stops before yours).")
         st.subheader("Your Bookings & Bills")
-        bookings_list = get_client_bookings(st.session_state['user_id'])
+        summary = get_client_summary(st.session_state['user_id'])
+        if summary:
+            col1, col2, col3, col4 = st.columns(4)
+            col1.metric("Bookings", summary['bookings'])
+            col2.metric("Collected (kg)", f"{summary['lifetime_kg']:.2f}")
+            col3.metric("Paid", f"{summary['amount_paid']:.2f}")
+            col4.metric("Outstanding", f"{summary['outstanding']:.2f}")
+
+        # Keyset cursors of the pages seen so far; the last one is the page shown
+        pages = st.session_state.setdefault('booking_pages', [None])
+        bookings_list = get_client_bookings(st.session_state['user_id'], after=pages[-1])
         bookings = bookings_list if bookings_list is not None else []
-        if not bookings:
+        if not bookings and len(pages) == 1:
             st.write("You have no booking history.")
         else:
-            st.write("Here is your complete history of service and payments.")
+            st.write(f"Your service and payment history (page {len(pages)}).")
             st.dataframe(bookings, use_container_width=True)
+            col_prev, col_next = st.columns(2)
+            if len(pages) > 1 and col_prev.button("Previous page"):
+                pages.pop()
+                st.rerun()
+            if len(bookings) == BOOKING_PAGE_SIZE and col_next.button("Next page"):
+                pages.append((bookings[-1]['requested_date'], bookings[-1]['booking_id']))
+                st.rerun()
+
+        st.subheader("Your Invoices")
+        invoices = get_client_invoices(st.session_state['user_id']) or []
+        if not invoices:
+            st.write("You have no invoices yet.")
+        else:
+            st.dataframe(invoices, use_container_width=True)
 
     # --- NEW: Give Feedback Tab ---
     with tab3:
@@ -462,6 +660,56 @@ def dashboard_admin():
         st.rerun()
     st.write("Admin features (like user management, audit logs) would go here.")
 
+    st.subheader("Tariffs")
+    st.caption("The most specific tariff in effect prices a collection; leave a field empty to apply it to all.")
+    tariffs = get_tariffs()
+    if tariffs:
+        st.dataframe(tariffs, use_container_width=True)
+    with st.form("tariff_form"):
+        col1, col2, col3 = st.columns(3)
+        client_id = col1.number_input("Client ID (0 = all clients)", min_value=0, step=1)
+        zone = col2.text_input("Tariff zone")
+        waste_type = col3.selectbox("Waste type", ("",) + WASTE_TYPES, format_func=lambda w: w or "All")
+        col4, col5 = st.columns(2)
+        effective_from = col4.date_input("Effective from", datetime.date.today())
+        has_end = col5.checkbox("Ends")
+        effective_to = col5.date_input("Effective until", datetime.date.today())
+        brackets_text = st.text_input("Brackets (from kg: rate per kg)", "0: 3.00")
+        if st.form_submit_button("Add Tariff"):
+            try:
+                brackets = [tuple(float(x) for x in part.split(':')) for part in brackets_text.split(',')]
+            except ValueError:
+                brackets = None
+            if not brackets or any(len(b) != 2 for b in brackets):
+                st.error("Enter brackets like '0: 3.00, 100: 2.50'.")
+            elif save_tariff(brackets, effective_from, effective_to if has_end else None,
+                             client_id or None, zone.strip() or None, waste_type or None):
+                st.success("Tariff added.")
+                st.rerun()
+            else:
+                st.error("Could not add the tariff. Brackets must start at 0 kg.")
+
+    st.subheader("Tariff Zones")
+    st.caption("Collection points in a zone are priced by that zone's tariffs.")
+    points = get_point_zones()
+    if points is None:
+        st.error("Could not load collection points.")
+    elif not points:
+        st.info("No collection points yet.")
+    else:
+        st.dataframe(points, use_container_width=True)
+        labels = {p['point_id']: f"#{p['point_id']} {p['point_name']} ({p['client'] or 'no client'})" for p in points}
+        with st.form("tariff_zone_form"):
+            point_ids = st.multiselect("Collection points", list(labels), format_func=labels.get)
+            zone = st.text_input("Tariff zone (empty = no zone)")
+            if st.form_submit_button("Set Zone"):
+                changed = set_point_tariff_zone(point_ids, zone)
+                if changed is None:
+                    st.error("Could not update the tariff zone.")
+                else:
+                    st.success(f"Updated {changed} collection point(s).")
+                    st.rerun()
+
 
 # -----------------------------------------------------------------
 # --- 4. MAIN APPLICATION ROUTER ---
@@ -0,0 +1,155 @@
+# In migrate_schema.py
+#
+# Brings an existing wms_db up to DDL_Final.sql without dropping it.
+# DDL_Final.sql starts from an empty database; a database created from an
+# older version is upgraded with, from the WMS folder:
+#   python migrate_schema.py
+# Every step checks information_schema first, so running it again (or
+# after a partial run) only adds what is still missing:
+#   1. tables that do not exist yet (the CREATE TABLE statements of DDL_Final.sql)
+#   2. columns, indexes and foreign keys added to existing tables
+#   3. the default tariff
+#   4. RouteAssignments.total_stops/completed_stops recomputed from RouteStops
+
+import os
+import re
+import sys
+import argparse
+from utils.db_connector import fetch_all, execute_query
+from epic_2_operations.tracking_logic import backfill_assignment_counters
+
+DDL_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'DDL_Final.sql')
+
+# (table, column, definition)
+COLUMNS = [
+    ('CollectionPoints', 'window_start', 'TIME NULL'),
+    ('CollectionPoints', 'window_end', 'TIME NULL'),
+    ('CollectionPoints', 'service_minutes', 'SMALLINT NULL'),
+    ('CollectionPoints', 'tariff_zone', 'VARCHAR(50) NULL'),
+    ('ServiceBookings', 'window_start', 'TIME NULL'),
+    ('ServiceBookings', 'window_end', 'TIME NULL'),
+    ('ServiceBookings', 'waste_type', "VARCHAR(30) NOT NULL DEFAULT 'General'"),
+    ('ServiceBookings', 'schedule_id', 'INT NULL'),
+    ('RouteAssignments', 'total_stops', 'INT NOT NULL DEFAULT 0'),
+    ('RouteAssignments', 'completed_stops', 'INT NOT NULL DEFAULT 0'),
+]
+
+# (table, index, definition)
+INDEXES = [
+    ('ServiceBookings', 'idx_booking_client_history',
+     'INDEX `idx_booking_client_history` (`client_id`, `requested_date`, `booking_id`, `status`, `point_id`)'),
+    ('ServiceBookings', 'uq_booking_schedule_date',
+     'UNIQUE INDEX `uq_booking_schedule_date` (`schedule_id`, `requested_date`)'),
+    ('RouteStops', 'idx_stop_assignment_status', 'INDEX `idx_stop_assignment_status` (`assignment_id`, `status`)'),
+    ('RouteStops', 'idx_stop_status_completed', 'INDEX `idx_stop_status_completed` (`status`, `completed_at`)'),
+]
+
+# (table, constraint, definition)
+FOREIGN_KEYS = [
+    ('ServiceBookings', 'fk_booking_schedule',
+     'CONSTRAINT `fk_booking_schedule` FOREIGN KEY (`schedule_id`) '
+     'REFERENCES `BookingSchedules` (`schedule_id`) ON DELETE SET NULL'),
+]
+
+SEED_QUERIES = [
+    "INSERT IGNORE INTO `Tariffs` (`tariff_id`, `effective_from`) VALUES (1, '2000-01-01')",
+    "INSERT IGNORE INTO `TariffBrackets` (`tariff_id`, `min_kg`, `rate_per_kg`) VALUES (1, 0, 3.0000)",
+]
+
+def create_table_statements(path=DDL_PATH):
+    """The CREATE TABLE IF NOT EXISTS statements of the DDL file, in file order."""
+    with open(path, encoding='utf-8') as f:
+        sql = re.sub(r'^\s*--.*$', '', f.read(), flags=re.MULTILINE)
+    return [s.strip() for s in sql.split(';') if s.strip().upper().startswith('CREATE TABLE IF NOT EXISTS')]
+
+def _existing(query):
+    rows = fetch_all(query)
+    if rows is None:
+        return None
+    return {(row['table_name'], row['name']) for row in rows}
+
+def _alter(table, clauses):
+    """One ALTER TABLE adding every clause. Returns False on error."""
+    if not clauses:
+        return True
+    query = f"ALTER TABLE `{table}` " + ', '.join(f"ADD {clause}" for clause in clauses)
+    if execute_query(query) is None:
+        print(f"Error: Could not alter table {table}.")
+        return False
+    print(f"{table}: added {len(clauses)} column(s)/index(es)/key(s).")
+    return True
+
+def _missing_by_table(wanted, existing):
+    """{table: [(name, definition)]} of the wanted (table, name, definition) entries not in existing."""
+    missing = {}
+    for table, name, definition in wanted:
+        if (table, name) not in existing:
+            missing.setdefault(table, []).append((name, definition))
+    return missing
+
+def migrate(path=DDL_PATH, backfill=True):
+    """
+    Runs the steps above. Stops at the first failing step and returns
+    False; what was already added stays. Returns True when the schema is
+    up to date.
+    """
+    for statement in create_table_statements(path):
+        if execute_query(statement) is None:
+            print(f"Error: Could not run {statement.splitlines()[0]}")
+            return False
+
+    columns = _existing("""
+        SELECT TABLE_NAME AS table_name, COLUMN_NAME AS name
+        FROM information_schema.COLUMNS WHERE TABLE_SCHEMA = DATABASE()
+    """)
+    indexes = _existing("""
+        SELECT DISTINCT TABLE_NAME AS table_name, INDEX_NAME AS name
+        FROM information_schema.STATISTICS WHERE TABLE_SCHEMA = DATABASE()
+    """)
+    if columns is None or indexes is None:
+        print("Error: Could not read the current schema.")
+        return False
+    # Columns and indexes of a table go in one ALTER, so it is rebuilt once
+    missing = {table: [f"COLUMN `{name}` {definition}" for name, definition in added]
+               for table, added in _missing_by_table(COLUMNS, columns).items()}
+    for table, added in _missing_by_table(INDEXES, indexes).items():
+        missing.setdefault(table, []).extend(definition for _, definition in added)
+    for table, clauses in missing.items():
+        if not _alter(table, clauses):
+            return False
+
+    # Foreign keys last: they may reference a column added above
+    foreign_keys = _existing("""
+        SELECT TABLE_NAME AS table_name, CONSTRAINT_NAME AS name
+        FROM information_schema.TABLE_CONSTRAINTS
+        WHERE TABLE_SCHEMA = DATABASE() AND CONSTRAINT_TYPE = 'FOREIGN KEY'
+    """)
+    if foreign_keys is None:
+        print("Error: Could not read the current foreign keys.")
+        return False
+    for table, added in _missing_by_table(FOREIGN_KEYS, foreign_keys).items():
+        if not _alter(table, [definition for _, definition in added]):
+            return False
+
+    for query in SEED_QUERIES:
+        if execute_query(query) is None:
+            print("Error: Could not add the default tariff.")
+            return False
+
+    if backfill:
+        if backfill_assignment_counters() is None:
+            print("Error: Could not backfill the assignment stop counters.")
+            return False
+        print("Recomputed the stop counters of every assignment.")
+    return True
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Upgrade an existing wms_db to DDL_Final.sql.")
+    parser.add_argument('--ddl', default=DDL_PATH, help="DDL file to take new tables from.")
+    parser.add_argument('--skip-backfill', action='store_true',
+                        help="Do not recompute the assignment stop counters.")
+    args = parser.parse_args(argv)
+    return 0 if migrate(args.ddl, backfill=not args.skip_backfill) else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,6 +1,9 @@
 import mysql.connector.pooling
 import mysql.connector.errors
 import os
+import time
+import threading
+from contextlib import contextmanager
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -19,6 +22,72 @@ except mysql.connector.Error as err:
     print(f"Error creating connection pool: {err}")
     exit()
 
+# Counters for load testing and the supervisor dashboard. Statements are
+# also counted per thread, so a caller can see what one operation cost.
+_stats_lock = threading.Lock()
+_stats = {'statements': 0, 'connections': 0, 'pool_wait_s': 0.0, 'pool_wait_max_s': 0.0, 'pool_exhausted': 0}
+_thread_stats = threading.local()
+
+def _count_statements(count=1):
+    _thread_stats.statements = getattr(_thread_stats, 'statements', 0) + count
+    with _stats_lock:
+        _stats['statements'] += count
+
+def _statements_in_batch(query, params_list):
+    # The connector sends INSERT ... VALUES batches as one multi-row insert, anything else row by row
+    return 1 if query.lstrip().upper().startswith('INSERT') else len(params_list)
+
+def _get_connection():
+    """Takes a pooled connection, timing how long that took."""
+    started = time.perf_counter()
+    try:
+        conn = db_pool.get_connection()
+    except mysql.connector.errors.PoolError:
+        with _stats_lock:
+            _stats['pool_exhausted'] += 1
+        raise
+    waited = time.perf_counter() - started
+    with _stats_lock:
+        _stats['connections'] += 1
+        _stats['pool_wait_s'] += waited
+        _stats['pool_wait_max_s'] = max(_stats['pool_wait_max_s'], waited)
+    conn.ping(reconnect=True)
+    return conn
+
+def get_db_stats():
+    """Statements run, connections taken and time spent waiting for the pool, since the last reset."""
+    with _stats_lock:
+        return dict(_stats)
+
+def reset_db_stats():
+    with _stats_lock:
+        _stats.update(statements=0, connections=0, pool_wait_s=0.0, pool_wait_max_s=0.0, pool_exhausted=0)
+
+def get_thread_statements():
+    """Statements run by the calling thread so far."""
+    return getattr(_thread_stats, 'statements', 0)
+
+class _CountingCursor:
+    """Passes everything through to a cursor, counting the statements it runs."""
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def execute(self, query, *args, **kwargs):
+        _count_statements()
+        return self._cursor.execute(query, *args, **kwargs)
+
+    def executemany(self, query, params_list, *args, **kwargs):
+        params_list = list(params_list)
+        _count_statements(_statements_in_batch(query, params_list))
+        return self._cursor.executemany(query, params_list, *args, **kwargs)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
 def fetch_one(query, params=None):
     """
     Fetches a single record from the database.
@@ -26,10 +95,10 @@ def fetch_one(query, params=None):
     conn = None
     cursor = None
     try:
-        conn = db_pool.get_connection()
-        conn.ping(reconnect=True) 
+        conn = _get_connection()
         cursor = conn.cursor(dictionary=True, buffered=True)
         cursor.execute(query, params or ())
+        _count_statements()
         return cursor.fetchone()
     except mysql.connector.Error as err:
         print(f"Database Fetch Error (fetch_one): {err}")
@@ -50,10 +119,10 @@ def fetch_all(query, params=None):
     conn = None
     cursor = None
     try:
-        conn = db_pool.get_connection()
-        conn.ping(reconnect=True) 
+        conn = _get_connection()
         cursor = conn.cursor(dictionary=True, buffered=True)
         cursor.execute(query, params or ())
+        _count_statements()
         return cursor.fetchall()
     except mysql.connector.Error as err:
         print(f"Database Fetch Error (fetch_all): {err}")
@@ -74,10 +143,10 @@ def execute_query(query, params=None):
     conn = None
     cursor = None
     try:
-        conn = db_pool.get_connection()
-        conn.ping(reconnect=True) 
+        conn = _get_connection()
         cursor = conn.cursor()
         cursor.execute(query, params or ())
+        _count_statements()
         conn.commit()
         
         if cursor.lastrowid:
@@ -93,4 +162,62 @@ def execute_query(query, params=None):
             try:
                 conn.close()
             except mysql.connector.Error as e:
-                print(f"Error closing connection (execute_query): {e}")
\ No newline at end of file
+                print(f"Error closing connection (execute_query): {e}")
+
+def execute_many(query, params_list):
+    """
+    Executes one INSERT, UPDATE, or DELETE query for many rows and commits once.
+    INSERT ... VALUES statements are sent as a single multi-row insert.
+    """
+    if not params_list:
+        return 0
+    conn = None
+    cursor = None
+    try:
+        conn = _get_connection()
+        cursor = conn.cursor()
+        cursor.executemany(query, params_list)
+        _count_statements(_statements_in_batch(query, params_list))
+        conn.commit()
+        return cursor.rowcount
+    except mysql.connector.Error as err:
+        print(f"Database Execute Error (execute_many): {err}")
+        return None
+    finally:
+        if cursor: 
+            cursor.close()
+        if conn:
+            try:
+                conn.close()
+            except mysql.connector.Error as e:
+                print(f"Error closing connection (execute_many): {e}")
+
+@contextmanager
+def transaction():
+    """
+    Yields a cursor for several statements that must succeed or fail together.
+    Commits when the block finishes, rolls back and re-raises on any error.
+    """
+    conn = None
+    cursor = None
+    try:
+        conn = _get_connection()
+        cursor = conn.cursor(dictionary=True, buffered=True)
+        yield _CountingCursor(cursor)
+        conn.commit()
+    except Exception as err:
+        print(f"Database Transaction Error (transaction): {err}")
+        if conn:
+            try:
+                conn.rollback()
+            except mysql.connector.Error as e:
+                print(f"Error rolling back transaction: {e}")
+        raise
+    finally:
+        if cursor: 
+            cursor.close()
+        if conn:
+            try:
+                conn.close()
+            except mysql.connector.Error as e:
+                print(f"Error closing connection (transaction): {e}")
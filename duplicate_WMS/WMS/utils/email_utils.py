@@ -50,4 +50,52 @@ def send_otp_email(to_email, otp):
         return False
     except Exception as e:
         print(f"An unexpected error occurred: {e}")
-        return False
\ No newline at end of file
+        return False
+
+def send_eta_email(to_email, stops):
+    """
+    Tells a client their truck is on its way. stops is a list of
+    (point_name, minutes_away, eta) for each of the client's stops.
+    """
+    try:
+        sender_email = os.getenv('EMAIL_USER')
+        sender_password = os.getenv('EMAIL_PASSWORD')
+        smtp_server = os.getenv('SMTP_SERVER')
+        smtp_port = int(os.getenv('SMTP_PORT'))
+
+        if not all([sender_email, sender_password, smtp_server, smtp_port]):
+            print("Email configuration is missing in .env file.")
+            return False
+
+        soonest = min(minutes for _, minutes, _ in stops)
+        subject = f"Your WMS collection truck is about {soonest} minutes away"
+        lines = "\n".join(
+            f"        - {point_name}: about {minutes} minutes away (around {eta:%H:%M})"
+            for point_name, minutes, eta in stops
+        )
+        body = f"""
+        Hello,
+
+        Your waste collection truck is on its way:
+{lines}
+
+        Please have your waste ready for pickup.
+        """
+
+        msg = MIMEMultipart()
+        msg['From'] = sender_email
+        msg['To'] = to_email
+        msg['Subject'] = subject
+        msg.attach(MIMEText(body, 'plain'))
+
+        with smtplib.SMTP(smtp_server, smtp_port) as server:
+            server.starttls()
+            server.login(sender_email, sender_password)
+            server.sendmail(sender_email, to_email, msg.as_string())
+        return True
+    except smtplib.SMTPException as e:
+        print(f"Error: Unable to send email. {e}")
+        return False
+    except Exception as e:
+        print(f"An unexpected error occurred: {e}")
+        return False
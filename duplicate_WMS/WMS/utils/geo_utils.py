@@ -1,5 +1,8 @@
+import numpy as np
 from geopy.distance import great_circle
 
+EARTH_RADIUS_M = 6371008.8
+
 def calculate_distance(coords_1, coords_2):
     """
     Calculates the distance between two (lat, lon) points in meters.
@@ -7,4 +10,42 @@ def calculate_distance(coords_1, coords_2):
     if not coords_1 or not coords_2 or None in coords_1 or None in coords_2:
         return float('inf')
     
-    return great_circle(coords_1, coords_2).meters
\ No newline at end of file
+    return great_circle(coords_1, coords_2).meters
+
+def _haversine(lat_1, lon_1, lat_2, lon_2):
+    """Great-circle distance in meters between arrays of points given in radians."""
+    h = (np.sin((lat_2 - lat_1) / 2.0) ** 2
+         + np.cos(lat_1) * np.cos(lat_2) * np.sin((lon_2 - lon_1) / 2.0) ** 2)
+    return 2.0 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.clip(h, 0.0, 1.0)))
+
+def _to_radians(coords):
+    return np.radians(np.asarray(coords, dtype=float).reshape(-1, 2))
+
+def distance_matrix(coords_a, coords_b=None):
+    """
+    Calculates great-circle distances in meters between every point in
+    coords_a and every point in coords_b (or coords_a itself) in one
+    vectorized pass. Returns an (len(a), len(b)) numpy array.
+    """
+    a = _to_radians(coords_a)
+    b = a if coords_b is None else _to_radians(coords_b)
+    return _haversine(a[:, 0][:, None], a[:, 1][:, None], b[:, 0][None, :], b[:, 1][None, :])
+
+def pairwise_distances(coords_a, coords_b):
+    """
+    Calculates the distance in meters between coords_a[i] and coords_b[i]
+    for every i. Returns a numpy array.
+    """
+    a = _to_radians(coords_a)
+    b = _to_radians(coords_b)
+    return _haversine(a[:, 0], a[:, 1], b[:, 0], b[:, 1])
+
+def path_distances(coords):
+    """
+    Calculates the length in meters of each leg of a path of (lat, lon)
+    points. Returns a numpy array with len(coords) - 1 entries.
+    """
+    c = _to_radians(coords)
+    if len(c) < 2:
+        return np.zeros(0)
+    return _haversine(c[:-1, 0], c[:-1, 1], c[1:, 0], c[1:, 1])
@@ -0,0 +1,48 @@
+import numpy as np
+
+# Google's encoded polyline format stores coordinates as 1e-5 degree integers
+POLYLINE_PRECISION = 5
+# A zigzagged 32-bit delta needs at most 7 five-bit chunks
+_MAX_CHUNKS = 7
+
+def encode_polyline(coords, precision=POLYLINE_PRECISION):
+    """
+    Encodes (lat, lon) pairs as a Google-compatible polyline string:
+    each coordinate is the zigzag varint of its delta from the previous one.
+    Vectorized with numpy; returns '' for no points.
+    """
+    coords = np.asarray(coords, dtype=float).reshape(-1, 2)
+    if not len(coords):
+        return ''
+    scaled = np.round(coords * 10 ** precision).astype(np.int64)
+    deltas = np.diff(scaled, axis=0, prepend=0).ravel()
+    values = np.where(deltas < 0, ~(deltas << 1), deltas << 1)
+
+    # Split every value into 5-bit chunks, low bits first
+    shifts = 5 * np.arange(_MAX_CHUNKS)
+    chunks = (values[:, None] >> shifts) & 0x1f
+    # Number of chunks a value needs: at least one, more while higher bits remain
+    lengths = np.maximum(1, (values[:, None] >> shifts > 0).sum(axis=1))
+    used = np.arange(_MAX_CHUNKS) < lengths[:, None]
+    more = np.arange(_MAX_CHUNKS) < (lengths - 1)[:, None]
+    chars = (chunks | np.where(more, 0x20, 0)) + 63
+    return chars[used].astype(np.uint8).tobytes().decode('ascii')
+
+def decode_polyline(encoded, precision=POLYLINE_PRECISION):
+    """
+    Decodes a Google polyline string back into an (n, 2) float array of
+    (lat, lon). Vectorized with numpy; returns an empty array for ''.
+    """
+    if not encoded:
+        return np.zeros((0, 2))
+    data = np.frombuffer(encoded.encode('ascii'), dtype=np.uint8).astype(np.int64) - 63
+    ends = data < 0x20
+    # Index of the value each character belongs to, and its chunk position within it
+    value_index = np.concatenate(([0], np.cumsum(ends)[:-1]))
+    starts = np.concatenate(([0], np.flatnonzero(ends)[:-1] + 1))
+    position = np.arange(len(data)) - starts[value_index]
+    values = np.zeros(int(ends.sum()), dtype=np.int64)
+    np.add.at(values, value_index, (data & 0x1f) << (5 * position))
+
+    deltas = np.where(values & 1, ~(values >> 1), values >> 1)
+    return np.cumsum(deltas.reshape(-1, 2), axis=0) / 10 ** precision
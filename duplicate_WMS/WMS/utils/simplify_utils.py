@@ -0,0 +1,84 @@
+import math
+import numpy as np
+from utils.geo_utils import EARTH_RADIUS_M
+
+def _project(coords):
+    # Flat x/y in meters around the trace's mean latitude; fine at city scale
+    lat0 = math.radians(coords[:, 0].mean())
+    lat, lon = np.radians(coords[:, 0]), np.radians(coords[:, 1])
+    return np.column_stack((lon * math.cos(lat0) * EARTH_RADIUS_M, lat * EARTH_RADIUS_M))
+
+def _segment_distances(points, starts, ends):
+    """Distance in meters from each point to the segment starts[i] -> ends[i]."""
+    chord = ends - starts
+    length_sq = (chord ** 2).sum(axis=1)
+    t = np.divide(((points - starts) * chord).sum(axis=1), length_sq,
+                  out=np.zeros(len(points)), where=length_sq > 0)
+    nearest = starts + np.clip(t, 0.0, 1.0)[:, None] * chord
+    return np.sqrt(((points - nearest) ** 2).sum(axis=1))
+
+def simplification_ranks(coords, min_tolerance_m=0.0):
+    """
+    Runs Douglas-Peucker once, without a tolerance, and returns for every
+    point the largest tolerance in meters at which it would still be kept
+    (inf for the two end points, 0 for points within min_tolerance_m of
+    their segment). Simplifying at any tolerance is then a comparison:
+    ranks > tolerance_m.
+
+    Every segment at the same depth is split in one vectorized pass, so
+    the Python loop runs once per level of the recursion, not per point.
+    """
+    coords = np.asarray(coords, dtype=float).reshape(-1, 2)
+    n = len(coords)
+    ranks = np.zeros(n)
+    if n == 0:
+        return ranks
+    ranks[[0, -1]] = np.inf
+    xy = _project(coords)
+
+    starts, ends = np.array([0]), np.array([n - 1])
+    caps = np.array([np.inf])  # a point can never outrank the split that created its segment
+    while len(starts):
+        inner = ends - starts - 1
+        open_ = inner > 0
+        starts, ends, caps, inner = starts[open_], ends[open_], caps[open_], inner[open_]
+        if not len(starts):
+            break
+        offsets = np.cumsum(inner) - inner
+        segment = np.repeat(np.arange(len(starts)), inner)
+        index = starts[segment] + 1 + np.arange(inner.sum()) - offsets[segment]
+        dist = _segment_distances(xy[index], xy[starts[segment]], xy[ends[segment]])
+
+        # The farthest point of every segment (the first one on ties)
+        seg_max = np.maximum.reduceat(dist, offsets)
+        candidates = np.flatnonzero(dist == seg_max[segment])
+        _, first = np.unique(segment[candidates], return_index=True)
+        split = index[candidates[first]]
+
+        significant = seg_max > min_tolerance_m
+        split, rank = split[significant], np.minimum(seg_max, caps)[significant]
+        ranks[split] = rank
+        starts, ends = np.concatenate((starts[significant], split)), np.concatenate((split, ends[significant]))
+        caps = np.concatenate((rank, rank))
+    return ranks
+
+def simplify_line(coords, tolerance_m, ranks=None):
+    """
+    Douglas-Peucker simplification of a (lat, lon) line: drops every point
+    that lies within tolerance_m meters of the simplified line. Pass ranks
+    from simplification_ranks to avoid recomputing them.
+    Returns an (m, 2) array.
+    """
+    coords = np.asarray(coords, dtype=float).reshape(-1, 2)
+    if ranks is None:
+        ranks = simplification_ranks(coords)
+    return coords[ranks > tolerance_m]
+
+def simplification_levels(coords, tolerances_m):
+    """
+    Simplifies one line at several tolerances, computing the ranks once.
+    Returns [(tolerance_m, (m, 2) array)] in the order given.
+    """
+    coords = np.asarray(coords, dtype=float).reshape(-1, 2)
+    ranks = simplification_ranks(coords)
+    return [(tolerance, coords[ranks > tolerance]) for tolerance in tolerances_m]
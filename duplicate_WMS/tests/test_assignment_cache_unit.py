@@ -0,0 +1,125 @@
+"""
+Unit tests for epic_2_operations.assignment_cache:
+- one query per driver per day, ordered pending stops
+- short-lived misses, failed queries not remembered
+- completing stops and invalidation
+"""
+
+import os
+import sys
+import datetime
+import unittest
+from unittest.mock import patch
+
+# Ensure project root is available for runtime imports
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+DAY = datetime.date(2025, 3, 1)
+
+
+def _row(route_stop_id, assignment_id=5, vehicle_id=3):
+    return {'assignment_id': assignment_id, 'vehicle_id': vehicle_id, 'route_stop_id': route_stop_id,
+            'booking_id': route_stop_id and route_stop_id + 100, 'status': route_stop_id and 'Pending',
+            'point_name': f"P{route_stop_id}", 'address': '', 'latitude': 12.0, 'longitude': 77.0,
+            'client_id': 40, 'client_email': 'c40@example.com', 'tariff_zone': None, 'waste_type': 'General'}
+
+
+class FakeClock:
+    """Monotonic clock the test moves by hand."""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@patch('epic_2_operations.assignment_cache.fetch_all')
+class TestAssignmentCache(unittest.TestCase):
+    """Behaviour of the (driver_id, date) assignment cache."""
+
+    def make(self):
+        from epic_2_operations.assignment_cache import AssignmentCache  # pylint: disable=import-outside-toplevel, import-error
+        self.clock = FakeClock()
+        return AssignmentCache(clock=self.clock)
+
+    def test_loads_once_per_driver_and_day(self, mock_fetch):
+        """The first lookup reads vehicle, assignment and stops; later ones hit memory."""
+        mock_fetch.return_value = [_row(11), _row(12), _row(99, assignment_id=6)]
+        cache = self.make()
+        assignment = cache.get(1, DAY)
+        self.assertEqual((assignment['assignment_id'], assignment['vehicle_id']), (5, 3))
+        self.assertEqual([s['route_stop_id'] for s in assignment['stops']], [11, 12])
+        self.assertIs(cache.get(1, DAY), assignment)
+        self.assertEqual(mock_fetch.call_count, 1)
+        self.assertEqual(mock_fetch.call_args[0][1], (1, DAY))
+        cache.get(1, DAY + datetime.timedelta(days=1))
+        self.assertEqual(mock_fetch.call_count, 2)
+
+    def test_assignment_without_pending_stops(self, mock_fetch):
+        """The LEFT JOIN row of a route with nothing pending gives an empty stop list."""
+        mock_fetch.return_value = [_row(None)]
+        self.assertEqual(self.make().get(1, DAY)['stops'], [])
+
+    def test_misses_expire_and_errors_are_not_cached(self, mock_fetch):
+        """No assignment is remembered briefly; a failed query not at all."""
+        from epic_2_operations.assignment_cache import NO_ASSIGNMENT_TTL_S  # pylint: disable=import-outside-toplevel, import-error
+        cache = self.make()
+        mock_fetch.return_value = None
+        self.assertIsNone(cache.get(1, DAY))
+        self.assertIsNone(cache.get(1, DAY))
+        self.assertEqual(mock_fetch.call_count, 2)
+
+        mock_fetch.return_value = []
+        cache.get(1, DAY)
+        cache.get(1, DAY)
+        self.assertEqual(mock_fetch.call_count, 3)
+        self.clock.now += NO_ASSIGNMENT_TTL_S + 1
+        mock_fetch.return_value = [_row(11)]
+        self.assertEqual(cache.get(1, DAY)['assignment_id'], 5)
+
+    def test_complete_stop_and_find_stop(self, mock_fetch):
+        """A completed stop leaves the pending list without another query."""
+        mock_fetch.return_value = [_row(11), _row(12)]
+        cache = self.make()
+        self.assertEqual(cache.find_stop(1, 12, DAY)['booking_id'], 112)
+        cache.complete_stop(1, 11, DAY)
+        self.assertEqual([s['route_stop_id'] for s in cache.get(1, DAY)['stops']], [12])
+        self.assertIsNone(cache.find_stop(1, 11, DAY))
+        self.assertEqual(mock_fetch.call_count, 1)
+
+    def test_invalidation(self, mock_fetch):
+        """Invalidating a driver or an assignment forces a fresh read."""
+        mock_fetch.return_value = [_row(11)]
+        cache = self.make()
+        cache.get(1, DAY)
+        cache.invalidate(1)
+        cache.get(1, DAY)
+        self.assertEqual(mock_fetch.call_count, 2)
+        cache.invalidate_assignment(5)
+        cache.get(1, DAY)
+        self.assertEqual(mock_fetch.call_count, 3)
+        cache.invalidate_assignment(999)
+        cache.get(1, DAY)
+        self.assertEqual(mock_fetch.call_count, 3)
+
+
+    def test_invalidate_during_load_is_not_overwritten(self, mock_fetch):
+        """A load that raced an invalidate is returned once but not kept."""
+        cache = self.make()
+
+        def stale_then_invalidated(*_):
+            cache.invalidate(9)   # e.g. a late stop was inserted while the query ran
+            return [_row(11)]
+        mock_fetch.side_effect = stale_then_invalidated
+        self.assertEqual(len(cache.get(9, DAY)['stops']), 1)
+        mock_fetch.side_effect = None
+        mock_fetch.return_value = [_row(11), _row(12)]
+        self.assertEqual(len(cache.get(9, DAY)['stops']), 2)
+        self.assertEqual(mock_fetch.call_count, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -22,7 +22,7 @@ class TestCreateRouteAssignmentIntegration(unittest.TestCase):
     """
 
     @patch('epic_1_routing.assignment_logic.execute_query')
-    @patch('epic_1_routing.assignment_logic.optimize_route_nearest_neighbor')
+    @patch('epic_1_routing.assignment_logic.optimize_stop_sequence')
     @patch('epic_1_routing.assignment_logic.fetch_all')
     def test_create_route_assignment_success(self, mock_fetch_all, mock_optimize, mock_execute):
         """
@@ -35,10 +35,10 @@ class TestCreateRouteAssignmentIntegration(unittest.TestCase):
             {'booking_id': 102, 'point_id': 2, 'latitude': 12.1, 'longitude': 77.1},
         ]
         # Optimizer returns reversed order to check insertion sequence
-        mock_optimize.return_value = [
+        mock_optimize.return_value = ([
             {'booking_id': 102, 'point_id': 2, 'latitude': 12.1, 'longitude': 77.1},
             {'booking_id': 101, 'point_id': 1, 'latitude': 12.0, 'longitude': 77.0},
-        ]
+        ], 15000.0)
         # execute_query returns assignment_id on first insert and True on stops
         mock_execute.side_effect = [999, True, True]
 
@@ -59,7 +59,28 @@ class TestCreateRouteAssignmentIntegration(unittest.TestCase):
             self.assertIn('RouteStops', c[0][0])
 
     @patch('epic_1_routing.assignment_logic.execute_query')
-    @patch('epic_1_routing.assignment_logic.optimize_route_nearest_neighbor')
+    @patch('epic_1_routing.assignment_logic.optimize_stop_sequence')
+    @patch('epic_1_routing.assignment_logic.fetch_all')
+    def test_create_route_assignment_keeps_selection_order(self, mock_fetch_all, mock_optimize, mock_execute):
+        """
+        With optimize=False the stops follow the order the bookings were selected in.
+        """
+        mock_fetch_all.return_value = [
+            {'booking_id': 101, 'point_id': 1, 'latitude': 12.0, 'longitude': 77.0},
+            {'booking_id': 102, 'point_id': 2, 'latitude': 12.1, 'longitude': 77.1},
+        ]
+        mock_execute.side_effect = [999, True, True]
+
+        from epic_1_routing.assignment_logic import create_route_assignment  # pylint: disable=import-outside-toplevel, import-error
+
+        ok = create_route_assignment(5, 7, 9, [102, 101], optimize=False)
+        self.assertTrue(ok)
+        mock_optimize.assert_not_called()
+        params = [c[0][1] for c in mock_execute.call_args_list[1:3]]
+        self.assertEqual(params, [(999, 2, 102, 1), (999, 1, 101, 2)])
+
+    @patch('epic_1_routing.assignment_logic.execute_query')
+    @patch('epic_1_routing.assignment_logic.optimize_stop_sequence')
     @patch('epic_1_routing.assignment_logic.fetch_all')
     def test_create_route_assignment_no_bookings_found(self, mock_fetch_all, mock_optimize, mock_execute):
         """
@@ -74,7 +95,7 @@ class TestCreateRouteAssignmentIntegration(unittest.TestCase):
         mock_execute.assert_not_called()
 
     @patch('epic_1_routing.assignment_logic.execute_query')
-    @patch('epic_1_routing.assignment_logic.optimize_route_nearest_neighbor')
+    @patch('epic_1_routing.assignment_logic.optimize_stop_sequence')
     @patch('epic_1_routing.assignment_logic.fetch_all')
     def test_create_route_assignment_insert_assignment_fail(self, mock_fetch_all, mock_optimize, mock_execute):
         """
@@ -83,7 +104,7 @@ class TestCreateRouteAssignmentIntegration(unittest.TestCase):
         mock_fetch_all.return_value = [
             {'booking_id': 1, 'point_id': 10, 'latitude': 1.0, 'longitude': 1.0}
         ]
-        mock_optimize.return_value = mock_fetch_all.return_value
+        mock_optimize.return_value = (mock_fetch_all.return_value, 0.0)
         mock_execute.side_effect = [None]  # assignment insert fails
 
         from epic_1_routing.assignment_logic import create_route_assignment  # pylint: disable=import-outside-toplevel, import-error
@@ -39,7 +39,7 @@ class TestSupervisorRoutingIntegrationUI(unittest.TestCase):
         self.assertTrue(get_pending_bookings())
 
     @patch('epic_1_routing.assignment_logic.execute_query')
-    @patch('epic_1_routing.assignment_logic.optimize_route_nearest_neighbor')
+    @patch('epic_1_routing.assignment_logic.optimize_stop_sequence')
     @patch('epic_1_routing.assignment_logic.fetch_all')
     def test_create_route_from_dashboard_path(self, mock_fetch_all, mock_optimize, mock_execute):
         """Creating a route from UI flow: verifies integration path returns True."""
@@ -47,7 +47,7 @@ class TestSupervisorRoutingIntegrationUI(unittest.TestCase):
             {'booking_id': 1, 'point_id': 100, 'latitude': 12.0, 'longitude': 77.0},
             {'booking_id': 2, 'point_id': 101, 'latitude': 12.2, 'longitude': 77.2},
         ]
-        mock_optimize.return_value = mock_fetch_all.return_value
+        mock_optimize.return_value = (mock_fetch_all.return_value, 30000.0)
         mock_execute.side_effect = [1000, True, True]
 
         from epic_1_routing.assignment_logic import create_route_assignment  # pylint: disable=import-outside-toplevel, import-error
@@ -0,0 +1,141 @@
+"""
+Unit tests for epic_1_routing.auto_assign_logic:
+- plan_vehicle_routes (capacity-aware sweep + local search)
+- create_route_assignments_batch (single transaction)
+- auto_assign_pending_bookings (driver/vehicle pairing)
+"""
+
+import os
+import sys
+import unittest
+from unittest.mock import patch, MagicMock
+
+# Ensure project root is available for runtime imports
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+
+def _bookings(count):
+    return [
+        {'booking_id': i, 'point_id': i, 'latitude': 17.3 + (i * 7 % 19) / 100, 'longitude': 78.3 + (i * 11 % 23) / 100}
+        for i in range(count)
+    ]
+
+
+class TestPlanVehicleRoutes(unittest.TestCase):
+    """Algorithm tests for the capacity-aware planner."""
+
+    def test_no_vehicle_is_overloaded(self):
+        """Every route stays within its vehicle's capacity and every booking is placed once."""
+        from epic_1_routing.auto_assign_logic import plan_vehicle_routes  # pylint: disable=import-outside-toplevel, import-error
+        bookings = _bookings(60)
+        vehicles = [{'vehicle_id': 1, 'capacity_kg': 300}, {'vehicle_id': 2, 'capacity_kg': 500},
+                    {'vehicle_id': 3, 'capacity_kg': 400}]
+        volumes = {b['point_id']: 20.0 for b in bookings}
+        routes, unassigned = plan_vehicle_routes(bookings, vehicles, volumes, depot=(17.4, 78.4), time_budget=1.0)
+        self.assertEqual(unassigned, [])
+        for route in routes:
+            self.assertLessEqual(route['load_kg'], route['capacity_kg'])
+        placed = sorted(s['booking_id'] for r in routes for s in r['stops'])
+        self.assertEqual(placed, list(range(60)))
+
+    def test_overflow_is_returned_unassigned(self):
+        """Bookings beyond the fleet's capacity come back as unassigned."""
+        from epic_1_routing.auto_assign_logic import plan_vehicle_routes  # pylint: disable=import-outside-toplevel, import-error
+        bookings = _bookings(10)
+        routes, unassigned = plan_vehicle_routes(bookings, [{'vehicle_id': 1, 'capacity_kg': 100}], {}, time_budget=0.5)
+        # Default expected volume is 25 kg, so four bookings fit
+        self.assertEqual(len(routes[0]['stops']), 4)
+        self.assertEqual(len(unassigned), 6)
+
+    def test_time_window_repair_fits_in_budget(self):
+        """With windows the whole plan, repair included, finishes within time_budget."""
+        import datetime  # pylint: disable=import-outside-toplevel
+        import time  # pylint: disable=import-outside-toplevel
+        from epic_1_routing.auto_assign_logic import plan_vehicle_routes  # pylint: disable=import-outside-toplevel, import-error
+        bookings = [dict(b, window_start=datetime.timedelta(hours=8), window_end=datetime.timedelta(hours=9))
+                    for b in _bookings(120)]
+        vehicles = [{'vehicle_id': v, 'capacity_kg': 800} for v in range(1, 5)]
+        from epic_1_routing import auto_assign_logic  # pylint: disable=import-outside-toplevel, import-error
+        started = time.perf_counter()
+        with patch('epic_1_routing.auto_assign_logic._repair_time_windows',
+                   wraps=auto_assign_logic._repair_time_windows) as mock_repair:  # pylint: disable=protected-access
+            routes, _ = plan_vehicle_routes(bookings, vehicles, {}, depot=(17.4, 78.4), time_budget=0.5,
+                                            depart_at=8 * 3600)
+        finished = time.perf_counter()
+        # The repair gets what is left of the budget, not time beyond it
+        repair_deadline = mock_repair.call_args[0][3]
+        self.assertLess(repair_deadline - started, 0.55)
+        self.assertLess(finished - started, 0.6)
+        self.assertEqual(sum(len(r['stops']) for r in routes), 120)
+
+    def test_empty_inputs(self):
+        """No vehicles means every booking is unassigned."""
+        from epic_1_routing.auto_assign_logic import plan_vehicle_routes  # pylint: disable=import-outside-toplevel, import-error
+        bookings = _bookings(3)
+        self.assertEqual(plan_vehicle_routes(bookings, [], {}), ([], bookings))
+
+
+class TestBatchCreation(unittest.TestCase):
+    """DB wiring tests with a mocked transaction."""
+
+    @patch('epic_1_routing.auto_assign_logic.get_geofence_engine')
+    @patch('epic_1_routing.auto_assign_logic.get_eta_engine')
+    @patch('epic_1_routing.auto_assign_logic.transaction')
+    def test_batch_inserts_all_stops_in_one_call(self, mock_transaction, mock_eta, mock_geofence):
+        """Assignments are inserted one by one, stops in one executemany."""
+        cursor = MagicMock()
+        cursor.lastrowid = 500
+        mock_transaction.return_value.__enter__.return_value = cursor
+        from epic_1_routing.auto_assign_logic import create_route_assignments_batch  # pylint: disable=import-outside-toplevel, import-error
+
+        routes = [
+            {'vehicle_id': 1, 'driver_id': 10, 'stops': [{'point_id': 5, 'booking_id': 50}, {'point_id': 6, 'booking_id': 60}]},
+            {'vehicle_id': 2, 'driver_id': 11, 'stops': [{'point_id': 7, 'booking_id': 70}]},
+        ]
+        ids = create_route_assignments_batch(1, routes)
+        self.assertEqual(ids, [500, 500])
+        self.assertEqual(cursor.execute.call_count, 2)
+        stop_rows = cursor.executemany.call_args[0][1]
+        self.assertEqual(stop_rows, [(500, 5, 50, 1), (500, 6, 60, 2), (500, 7, 70, 1)])
+        # ETAs and geofences pick up the new routes on their next update
+        mock_eta.return_value.invalidate.assert_called_once()
+        mock_geofence.return_value.invalidate.assert_called_once()
+
+    @patch('epic_1_routing.auto_assign_logic.create_route_assignments_batch')
+    @patch('epic_1_routing.auto_assign_logic.get_expected_volumes')
+    @patch('epic_1_routing.auto_assign_logic.get_pending_bookings')
+    @patch('epic_1_routing.auto_assign_logic.get_available_vehicles')
+    @patch('epic_1_routing.auto_assign_logic.get_available_drivers')
+    def test_uses_only_as_many_vehicles_as_drivers(self, mock_drivers, mock_vehicles, mock_bookings,
+                                                    mock_volumes, mock_batch):
+        """With one driver only one route is created, on the biggest vehicle."""
+        mock_drivers.return_value = [{'user_id': 3}]
+        mock_vehicles.return_value = [{'vehicle_id': 1, 'capacity_kg': 200}, {'vehicle_id': 2, 'capacity_kg': 900}]
+        mock_bookings.return_value = _bookings(5)
+        mock_volumes.return_value = {}
+        from epic_1_routing.auto_assign_logic import auto_assign_pending_bookings  # pylint: disable=import-outside-toplevel, import-error
+
+        summary = auto_assign_pending_bookings(1, time_budget=0.5)
+        self.assertEqual(summary['routes'], 1)
+        routes = mock_batch.call_args[0][1]
+        self.assertEqual(routes[0]['vehicle_id'], 2)
+        self.assertEqual(routes[0]['driver_id'], 3)
+
+    @patch('epic_1_routing.auto_assign_logic.get_pending_bookings')
+    @patch('epic_1_routing.auto_assign_logic.get_available_vehicles')
+    @patch('epic_1_routing.auto_assign_logic.get_available_drivers')
+    def test_nothing_to_assign(self, mock_drivers, mock_vehicles, mock_bookings):
+        """Without drivers nothing is planned."""
+        mock_drivers.return_value = []
+        mock_vehicles.return_value = [{'vehicle_id': 1, 'capacity_kg': 200}]
+        mock_bookings.return_value = _bookings(2)
+        from epic_1_routing.auto_assign_logic import auto_assign_pending_bookings  # pylint: disable=import-outside-toplevel, import-error
+
+        summary = auto_assign_pending_bookings(1)
+        self.assertEqual(summary['routes'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -25,7 +25,16 @@ class TestBookingLogicUnit(unittest.TestCase):
         self.assertEqual(result, 111)
         sql, params = mock_exec.call_args[0]
         self.assertIn('INSERT INTO ServiceBookings', sql)
-        self.assertEqual(params, (1, 2, '2025-01-01'))
+        self.assertEqual(params, (1, 2, '2025-01-01', None, None, 'General'))
+
+    @patch('epic_3_billing.booking_logic.execute_query')
+    def test_create_booking_with_time_window(self, mock_exec):
+        """create_booking stores the optional pickup window."""
+        mock_exec.return_value = 112
+        from epic_3_billing.booking_logic import create_booking  # pylint: disable=import-outside-toplevel, import-error
+        create_booking(1, 2, '2025-01-01', window_start='09:00', window_end='11:00')
+        _, params = mock_exec.call_args[0]
+        self.assertEqual(params, (1, 2, '2025-01-01', '09:00', '11:00', 'General'))
 
     @patch('epic_3_billing.booking_logic.fetch_all')
     def test_get_client_bookings(self, mock_fetch):
@@ -36,7 +45,20 @@ class TestBookingLogicUnit(unittest.TestCase):
         self.assertTrue(result[0].get('point_name'))
         sql, params = mock_fetch.call_args[0]
         self.assertIn('FROM ServiceBookings', sql)
-        self.assertEqual(params, (5,))
+        # First page: no keyset condition, limited to one page
+        self.assertEqual(params, (5, 50))
+        self.assertIn('LIMIT %s', sql)
+
+    @patch('epic_3_billing.booking_logic.fetch_all')
+    def test_get_client_bookings_next_page(self, mock_fetch):
+        """Later pages continue after the last (requested_date, booking_id) seen."""
+        mock_fetch.return_value = []
+        from epic_3_billing.booking_logic import get_client_bookings  # pylint: disable=import-outside-toplevel, import-error
+        get_client_bookings(5, after=('2025-01-01', 77), limit=20)
+        sql, params = mock_fetch.call_args[0]
+        self.assertIn('sb.booking_id < %s', sql)
+        self.assertIn('ORDER BY sb.requested_date DESC, sb.booking_id DESC', sql)
+        self.assertEqual(params, (5, '2025-01-01', '2025-01-01', 77, 20))
 
     @patch('epic_3_billing.booking_logic.fetch_all')
     def test_get_client_collection_points(self, mock_fetch):
@@ -58,7 +80,7 @@ class TestBookingLogicUnit(unittest.TestCase):
         self.assertTrue(ok)
         sql, params = mock_exec.call_args[0]
         self.assertIn('INSERT INTO CollectionPoints', sql)
-        self.assertEqual(params, (1, 'Home', '123 St', 1.0, 2.0))
+        self.assertEqual(params, (1, 'Home', '123 St', 1.0, 2.0, None, None, None))
 
     @patch('epic_3_billing.booking_logic.execute_query')
     def test_add_collection_point_fail(self, mock_exec):
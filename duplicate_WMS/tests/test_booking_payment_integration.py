@@ -64,39 +64,48 @@ class TestBookingAndPaymentIntegration(unittest.TestCase):
         result = process_cash_payment(9999, 100.0)
         self.assertFalse(result)
 
+    @patch('epic_3_billing.payment_logic.get_receipt_allocator')
+    @patch('epic_3_billing.payment_logic.transaction')
     @patch('epic_3_billing.payment_logic.fetch_one')
-    @patch('epic_3_billing.payment_logic.execute_query')
-    def test_process_cash_payment_success(self, mock_exec, mock_fetch_one):
-        """Logs payment and receipt successfully."""
-        mock_fetch_one.return_value = {'client_id': 20}
-        mock_exec.side_effect = [101, True]
+    def test_process_cash_payment_success(self, mock_fetch_one, mock_tx, mock_alloc):
+        """Logs payment and receipt successfully, in one transaction."""
+        mock_fetch_one.return_value = {'client_id': 20, 'email': 'c20@example.com'}
+        current_year = str(datetime.date.today().year)
+        mock_alloc.return_value.take.return_value = [f"RCPT-{current_year}-000007"]
+        cursor = mock_tx.return_value.__enter__.return_value
+        cursor.lastrowid = 101
         from epic_3_billing.payment_logic import process_cash_payment  # pylint: disable=import-outside-toplevel, import-error
         ok = process_cash_payment(5, 55.55)
         self.assertTrue(ok)
+        mock_tx.assert_called_once()
 
-        receipt_call = mock_exec.call_args_list[1]
-        receipt_num = receipt_call[0][1][1]
-        current_year = str(datetime.date.today().year)
+        receipt_call = cursor.executemany.call_args
+        self.assertIn('INSERT INTO Receipts', receipt_call[0][0])
+        receipt_num = receipt_call[0][1][0][1]
         self.assertIn(f"RCPT-{current_year}", receipt_num)
 
+    @patch('epic_3_billing.payment_logic.get_receipt_allocator')
+    @patch('epic_3_billing.payment_logic.transaction')
     @patch('epic_3_billing.payment_logic.fetch_one')
-    @patch('epic_3_billing.payment_logic.execute_query')
-    def test_process_cash_payment_insert_fail(self, mock_exec, mock_fetch_one):
-        """Returns False if payment insert fails."""
-        mock_fetch_one.return_value = {'client_id': 5}
-        mock_exec.side_effect = [None]
+    def test_process_cash_payment_insert_fail(self, mock_fetch_one, mock_tx, mock_alloc):
+        """Returns False if payment insert fails, and gives the receipt number back."""
+        mock_fetch_one.return_value = {'client_id': 5, 'email': 'c5@example.com'}
+        mock_alloc.return_value.take.return_value = ["RCPT-2025-000001"]
+        mock_tx.return_value.__enter__.return_value.execute.side_effect = RuntimeError("insert failed")
         from epic_3_billing.payment_logic import process_cash_payment  # pylint: disable=import-outside-toplevel, import-error
         ok = process_cash_payment(15, 20.0)
         self.assertFalse(ok)
+        mock_alloc.return_value.release.assert_any_call(["RCPT-2025-000001"])
 
-    @patch('epic_3_billing.booking_logic.execute_query')
+    @patch('epic_3_billing.payment_logic.get_receipt_allocator')
+    @patch('epic_3_billing.payment_logic.transaction')
     @patch('epic_3_billing.payment_logic.fetch_one')
-    @patch('epic_3_billing.payment_logic.execute_query')
-    def test_create_booking_and_process_payment(self, mock_pay_exec, mock_fetch_one, mock_booking_exec):
+    @patch('epic_3_billing.booking_logic.execute_query')
+    def test_create_booking_and_process_payment(self, mock_booking_exec, mock_fetch_one, mock_tx, mock_alloc):
         """Integration: booking created followed by successful payment."""
         mock_booking_exec.return_value = 777
-        mock_fetch_one.return_value = {'client_id': 42}
-        mock_pay_exec.side_effect = [9999, True]
+        mock_alloc.return_value.take.return_value = ["RCPT-2025-000001"]
+        mock_tx.return_value.__enter__.return_value.lastrowid = 9999
 
         from epic_3_billing.booking_logic import create_booking  # pylint: disable=import-outside-toplevel, import-error
         from epic_3_billing.payment_logic import process_cash_payment  # pylint: disable=import-outside-toplevel, import-error
@@ -104,8 +113,10 @@ class TestBookingAndPaymentIntegration(unittest.TestCase):
         booking_id = create_booking(10, 5, '2025-11-08')
         self.assertEqual(booking_id, 777)
 
-        ok = process_cash_payment(booking_id, 19.95)
+        # The client is already known from the booking, so nothing is read back
+        ok = process_cash_payment(booking_id, 19.95, 10, 'c10@example.com')
         self.assertTrue(ok)
+        mock_fetch_one.assert_not_called()
 
 if __name__ == '__main__':
     unittest.main()
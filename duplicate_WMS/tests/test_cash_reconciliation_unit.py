@@ -0,0 +1,87 @@
+"""
+Unit tests for epic_3_billing.cash_reconciliation:
+- stop completions grouped into one upsert per driver day
+- closing a day with the cash handed in
+- reports and discrepancies read from the running totals only
+"""
+
+import os
+import sys
+import datetime
+import unittest
+from unittest.mock import patch, MagicMock
+
+# Ensure project root is available for runtime imports
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+DAY = datetime.date(2025, 1, 31)
+
+
+class TestRecordStopCash(unittest.TestCase):
+    """Running totals updated by stop completions."""
+
+    def test_groups_completions_by_day(self):
+        """Stops of one day add up to a single upsert row."""
+        from epic_3_billing.cash_reconciliation import record_stop_cash  # pylint: disable=import-outside-toplevel, import-error
+        cursor = MagicMock()
+        record_stop_cash(cursor, 9, [
+            (datetime.datetime(2025, 1, 31, 9, 0), 10.0, 30.0, 30.0),
+            (DAY, 5.0, 15.0, 0),
+            (datetime.date(2025, 2, 1), 2.5, 7.5, 7.5),
+        ])
+        query, rows = cursor.executemany.call_args[0]
+        self.assertIn('ON DUPLICATE KEY UPDATE', query)
+        self.assertEqual(rows, [(DAY, 9, 2, 15.0, 45.0, 30.0), (datetime.date(2025, 2, 1), 9, 1, 2.5, 7.5, 7.5)])
+
+    def test_no_completions_no_write(self):
+        from epic_3_billing.cash_reconciliation import record_stop_cash  # pylint: disable=import-outside-toplevel, import-error
+        cursor = MagicMock()
+        record_stop_cash(cursor, 9, [])
+        cursor.executemany.assert_not_called()
+
+    def test_day_defaults_to_today(self):
+        from epic_3_billing.cash_reconciliation import record_stop_cash  # pylint: disable=import-outside-toplevel, import-error
+        cursor = MagicMock()
+        record_stop_cash(cursor, 9, [(None, 1.0, 3.0, 3.0)])
+        self.assertEqual(cursor.executemany.call_args[0][1][0][0], datetime.date.today())
+
+
+class TestCloseDayAndReports(unittest.TestCase):
+    """Closing days and reading the totals back."""
+
+    @patch('epic_3_billing.cash_reconciliation.execute_query')
+    def test_close_day(self, mock_exec):
+        """The cash handed in is stored against the driver day."""
+        mock_exec.return_value = 1
+        from epic_3_billing.cash_reconciliation import close_day  # pylint: disable=import-outside-toplevel, import-error
+        self.assertTrue(close_day(9, '2025-01-31', 44.999))
+        self.assertEqual(mock_exec.call_args[0][1], (DAY, 9, 45.0))
+
+    @patch('epic_3_billing.cash_reconciliation.execute_query')
+    def test_close_day_rejects_negative_and_db_errors(self, mock_exec):
+        from epic_3_billing.cash_reconciliation import close_day  # pylint: disable=import-outside-toplevel, import-error
+        self.assertFalse(close_day(9, DAY, -1))
+        mock_exec.assert_not_called()
+        mock_exec.return_value = None
+        self.assertFalse(close_day(9, DAY, 10))
+
+    @patch('epic_3_billing.cash_reconciliation.fetch_all')
+    def test_reports_never_read_payments(self, mock_fetch):
+        """Both reports come from DriverDailyCash alone."""
+        mock_fetch.return_value = []
+        from epic_3_billing.cash_reconciliation import get_close_of_day_report, get_discrepancies, TOLERANCE  # pylint: disable=import-outside-toplevel, import-error
+        get_close_of_day_report(DAY)
+        get_discrepancies('2025-01-01', DAY)
+        for call in mock_fetch.call_args_list:
+            self.assertIn('DriverDailyCash', call[0][0])
+            self.assertNotIn('Payments', call[0][0])
+        self.assertEqual(mock_fetch.call_args_list[0][0][1], (DAY,))
+        self.assertEqual(mock_fetch.call_args_list[1][0][1],
+                         (TOLERANCE, datetime.date(2025, 1, 1), DAY, TOLERANCE))
+        self.assertNotIn('expected_amount) >', mock_fetch.call_args_list[1][0][0])
+
+
+if __name__ == '__main__':
+    unittest.main()
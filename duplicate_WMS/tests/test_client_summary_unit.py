@@ -0,0 +1,102 @@
+"""
+Unit tests for epic_3_billing.client_summary:
+- one query per client, then served from memory
+- invalidation and expiry
+- failed reads and reads racing an invalidation are not cached
+"""
+
+import os
+import sys
+import unittest
+from unittest.mock import patch
+
+# Ensure project root is available for runtime imports
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+ROW = {'bookings': 12, 'open_bookings': 2, 'lifetime_kg': 340.5, 'amount_paid': 1021.5, 'outstanding': 30}
+
+
+class FakeClock:
+    """Monotonic clock the test moves by hand."""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@patch('epic_3_billing.client_summary.fetch_one')
+class TestClientSummaryCache(unittest.TestCase):
+    """Behaviour of ClientSummaryCache."""
+
+    def make(self, **kwargs):
+        from epic_3_billing.client_summary import ClientSummaryCache  # pylint: disable=import-outside-toplevel, import-error
+        self.clock = FakeClock()
+        return ClientSummaryCache(ttl_s=60, clock=self.clock, **kwargs)
+
+    def test_reads_once_per_client(self, mock_fetch):
+        mock_fetch.return_value = ROW
+        cache = self.make()
+        summary = cache.get(7)
+        self.assertEqual(summary, {'bookings': 12, 'open_bookings': 2, 'lifetime_kg': 340.5,
+                                   'amount_paid': 1021.5, 'outstanding': 30.0})
+        cache.get(7)
+        mock_fetch.assert_called_once()
+        sql, params = mock_fetch.call_args[0]
+        self.assertEqual(params, (7,) * 6)
+        # Outstanding follows payments made after the invoice was issued
+        self.assertNotIn('SUM(balance)', sql)
+        self.assertIn('SUM(amount_due)', sql)
+        self.assertIn('FROM Payments p', sql.split('SUM(amount_due)')[1])
+
+    def test_invalidation_and_expiry(self, mock_fetch):
+        """A new booking or payment, or the TTL, makes the next call read again."""
+        mock_fetch.return_value = ROW
+        cache = self.make()
+        cache.get(7)
+        cache.get(8)
+        cache.invalidate(7)
+        cache.get(7)
+        cache.get(8)
+        self.assertEqual(mock_fetch.call_count, 3)
+        self.clock.now = 61
+        cache.get(8)
+        self.assertEqual(mock_fetch.call_count, 4)
+
+    def test_failed_read_not_cached(self, mock_fetch):
+        mock_fetch.side_effect = [None, ROW]
+        cache = self.make()
+        self.assertIsNone(cache.get(7))
+        self.assertEqual(cache.get(7)['bookings'], 12)
+
+    def test_read_racing_invalidation_not_kept(self, mock_fetch):
+        """A summary read while the client's data changed is returned but not cached."""
+        cache = self.make()
+
+        def read_during_payment(*_args):
+            cache.invalidate(7)
+            return ROW
+        mock_fetch.side_effect = read_during_payment
+        cache.get(7)
+        mock_fetch.side_effect = None
+        mock_fetch.return_value = ROW
+        cache.get(7)
+        self.assertEqual(mock_fetch.call_count, 2)
+
+    def test_bounded_size(self, mock_fetch):
+        mock_fetch.return_value = ROW
+        cache = self.make(max_clients=2)
+        cache.get(1)
+        self.clock.now = 1
+        cache.get(2)
+        cache.get(3)   # drops client 1, the stalest
+        cache.get(2)
+        cache.get(1)
+        self.assertEqual(mock_fetch.call_count, 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,180 @@
+"""
+Unit tests for epic_2_operations.eta_logic:
+- route plans from leg times, historical segments and service times
+- ETAs from a GPS point, at a stop, and after a completed stop
+- threshold notifications, once per threshold
+- batched notification dispatch
+"""
+
+import os
+import sys
+import queue
+import threading
+import datetime
+import unittest
+from unittest.mock import patch, MagicMock
+
+# Ensure project root is available for runtime imports
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+T0 = datetime.datetime(2025, 1, 1, 9, 0)
+
+
+def _stop(route_stop_id, point_id, lat, status='Pending', client_id=None, service_minutes=5, notified=None):
+    return {
+        'vehicle_id': 3, 'assignment_id': 7, 'route_stop_id': route_stop_id, 'point_id': point_id,
+        'booking_id': route_stop_id * 10 if client_id else None, 'status': status,
+        'point_name': f"Point {point_id}", 'latitude': lat, 'longitude': 77.0,
+        'service_minutes': service_minutes, 'client_id': client_id,
+        'email': f"c{client_id}@example.com" if client_id else None, 'notified_minutes': notified,
+    }
+
+
+# Points 1 km apart (0.009 degrees of latitude) going north
+ROUTE = [
+    _stop(1, 100, 12.000, status='Completed'),
+    _stop(2, 200, 12.009),
+    _stop(3, 300, 12.018, client_id=50),
+    _stop(4, 400, 12.027, client_id=51),
+]
+
+
+class TestBuildPlan(unittest.TestCase):
+    """Offsets from leg and service times."""
+
+    def test_offsets_use_history_where_known(self):
+        """A leg with history uses its time; others run at the average speed."""
+        from epic_2_operations.eta_logic import build_plan, DEFAULT_SECONDS_PER_M  # pylint: disable=import-outside-toplevel, import-error
+        plan = build_plan(ROUTE[1:], {(300, 400): 600.0}, previous_point=ROUTE[0])
+        leg = 1000.0 * DEFAULT_SECONDS_PER_M
+        self.assertAlmostEqual(plan['offsets'][0], 0.0)
+        self.assertAlmostEqual(plan['offsets'][1], 300 + leg, delta=2)
+        self.assertAlmostEqual(plan['offsets'][2], 300 + leg + 300 + 600, delta=2)
+        self.assertAlmostEqual(plan['approach_s_per_m'], DEFAULT_SECONDS_PER_M)
+
+        plan = build_plan(ROUTE[1:], {(100, 200): 100.0}, previous_point=ROUTE[0])
+        self.assertAlmostEqual(plan['approach_s_per_m'], 0.1, places=3)
+
+
+@patch('epic_2_operations.eta_logic.fetch_all')
+class TestEtaEngine(unittest.TestCase):
+    """Estimates and notifications."""
+
+    def make(self, arrivals=None):
+        from epic_2_operations.eta_logic import EtaEngine  # pylint: disable=import-outside-toplevel, import-error
+        return EtaEngine(thresholds_min=(30, 10), notifications=queue.Queue(),
+                         arrivals=arrivals or (lambda route_stop_id: None))
+
+    def load(self, mock_fetch, route=None, segments=None):
+        # Segment history first, then today's routes
+        mock_fetch.side_effect = [segments or [], route or ROUTE]
+
+    def test_eta_from_position(self, mock_fetch):
+        """ETAs are the approach to the next stop plus the plan's offsets."""
+        self.load(mock_fetch)
+        engine = self.make()
+        engine.update([(3, 12.0, 77.0, T0), (9, 12.0, 77.0, T0)])
+        etas = engine.get_vehicle_etas(3)
+        self.assertEqual([e['route_stop_id'] for e in etas], [2, 3, 4])
+        self.assertAlmostEqual((etas[0]['eta'] - T0).total_seconds(), 144, delta=2)   # 1 km at 25 km/h
+        self.assertAlmostEqual((etas[1]['eta'] - T0).total_seconds(), 144 + 300 + 144, delta=2)
+        self.assertEqual(engine.get_vehicle_etas(9), [])
+        self.assertEqual([e['route_stop_id'] for e in engine.get_client_etas(51)], [4])
+
+    def test_notifies_once_per_threshold(self, mock_fetch):
+        """Crossing 30 and then 10 minutes notifies twice; staying below does not repeat."""
+        self.load(mock_fetch)
+        engine = self.make()
+        far = engine.update([(3, 11.8, 77.0, T0)])   # ~22 km away: ~53 min to the first stop
+        self.assertEqual(far, [])
+        events = engine.update([(3, 11.92, 77.0, T0)])   # ~9 km: ~21 min to stop 2, ~31/~41 to 3/4
+        self.assertEqual([(e['route_stop_id'], e['threshold_minutes']) for e in events], [])
+        events = engine.update([(3, 11.99, 77.0, T0)])
+        self.assertEqual([(e['route_stop_id'], e['threshold_minutes']) for e in events], [(3, 30), (4, 30)])
+        events = engine.update([(3, 12.009, 77.0, T0)])
+        self.assertEqual([(e['route_stop_id'], e['threshold_minutes']) for e in events], [(3, 10)])
+        self.assertEqual(engine.update([(3, 12.009, 77.0, T0)]), [])
+        self.assertEqual(engine.notifications.qsize(), 3)
+        self.assertEqual(events[0]['email'], 'c50@example.com')
+
+    def test_already_notified_stops_are_not_repeated(self, mock_fetch):
+        """Notifications sent before a restart are read back from the table."""
+        route = ROUTE[:2] + [_stop(3, 300, 12.018, client_id=50, notified=10)]
+        self.load(mock_fetch, route=route)
+        engine = self.make()
+        self.assertEqual(engine.update([(3, 12.009, 77.0, T0)]), [])
+
+    def test_at_stop_counts_remaining_service(self, mock_fetch):
+        """While the truck is at its next stop, only the rest of the service time is ahead."""
+        self.load(mock_fetch)
+        arrived = T0 - datetime.timedelta(minutes=2)
+        engine = self.make(lambda route_stop_id: {'vehicle_id': 3, 'arrived_at': arrived} if route_stop_id == 2 else None)
+        engine.update([(3, 12.009, 77.0, T0)])
+        etas = engine.get_vehicle_etas(3)
+        self.assertEqual(etas[0]['eta'], arrived)
+        self.assertAlmostEqual((etas[1]['eta'] - T0).total_seconds(), 180 + 144, delta=2)
+
+    def test_complete_stop_moves_plan_on(self, mock_fetch):
+        """Completing the next stop re-estimates the rest from the last position."""
+        self.load(mock_fetch, segments=[{'from_point': 200, 'to_point': 300, 'seconds': 60}])
+        engine = self.make()
+        engine.update([(3, 12.009, 77.0, T0)])
+        engine.complete_stop(2)
+        etas = engine.get_vehicle_etas(3)
+        self.assertEqual([e['route_stop_id'] for e in etas], [3, 4])
+        # The approach now runs at the historical pace of the 200 -> 300 leg
+        self.assertAlmostEqual((etas[0]['eta'] - T0).total_seconds(), 60, delta=1)
+        engine.complete_stop(3)
+        engine.complete_stop(4)
+        self.assertEqual(engine.get_vehicle_etas(3), [])
+
+    def test_failed_load_keeps_running(self, mock_fetch):
+        """A failed route query leaves the engine empty rather than raising."""
+        mock_fetch.return_value = None
+        engine = self.make()
+        self.assertEqual(engine.update([(3, 12.0, 77.0, T0)]), [])
+        self.assertEqual(mock_fetch.call_count, 2)
+        engine.update([(3, 12.0, 77.0, T0)])
+        self.assertEqual(mock_fetch.call_count, 2)
+
+    def test_started_engine_reloads_off_the_gps_path(self, mock_fetch):
+        """With the refresh thread running, an update only wakes it; the route query runs there."""
+        engine = self.make()
+        engine._wake = threading.Event()   # as start() does, without the thread
+        self.assertEqual(engine.update([(3, 12.0, 77.0, T0)]), [])
+        mock_fetch.assert_not_called()
+        self.assertTrue(engine._wake.is_set())
+        engine._wake.clear()
+        self.load(mock_fetch)
+        engine.load()
+        engine.invalidate()
+        self.assertTrue(engine._wake.is_set())
+        self.assertEqual(mock_fetch.call_count, 2)
+
+
+class TestNotificationDispatcher(unittest.TestCase):
+    """Batched sending."""
+
+    @patch('epic_2_operations.eta_logic.execute_many')
+    def test_one_email_per_client_and_one_insert(self, mock_many):
+        """Each client gets one email per batch; all notifications are recorded together."""
+        from epic_2_operations.eta_logic import NotificationDispatcher  # pylint: disable=import-outside-toplevel, import-error
+        notifications = queue.Queue()
+        for stop_id, email in [(3, 'a@x.com'), (4, 'a@x.com'), (5, 'b@x.com')]:
+            notifications.put({'client_id': 1, 'email': email, 'booking_id': None, 'route_stop_id': stop_id,
+                               'point_name': f"P{stop_id}", 'vehicle_id': 3, 'threshold_minutes': 10,
+                               'minutes_away': 8, 'eta': T0})
+        send = MagicMock(side_effect=[True, False])
+        dispatcher = NotificationDispatcher(notifications, send=send)
+        self.assertEqual(dispatcher.run_once(), 3)
+        self.assertEqual(send.call_count, 2)
+        self.assertEqual(len(send.call_args_list[0][0][1]), 2)
+        rows = mock_many.call_args[0][1]
+        self.assertEqual([r[-1] for r in rows], [True, True, False])
+        self.assertEqual(dispatcher.run_once(), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,113 @@
+"""
+Unit tests for epic_2_operations.fleet_simulator:
+- latency, statement and error recording per operation
+- simulated drivers moving along their stops
+- a short simulation run through (patched) tracking functions
+"""
+
+import os
+import sys
+import random
+import unittest
+from unittest.mock import patch, MagicMock
+
+# Ensure project root is available for runtime imports
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+# Two stops 500 m apart
+FLEET = [{'driver_id': 9, 'vehicle_id': 3, 'assignment_id': 5,
+          'stops': [(21, 12.0, 77.0), (22, 12.0045, 77.0)]}]
+
+
+class TestLatencyRecorder(unittest.TestCase):
+    """Per-operation summaries."""
+
+    @patch('epic_2_operations.fleet_simulator.get_thread_statements')
+    def test_summary(self, mock_statements):
+        """Counts calls, statements and failures (including exceptions)."""
+        from epic_2_operations.fleet_simulator import LatencyRecorder  # pylint: disable=import-outside-toplevel, import-error
+        mock_statements.side_effect = [0, 3, 3, 5, 5, 5]
+        recorder = LatencyRecorder()
+        self.assertEqual(recorder.call('op', lambda: 'ok'), 'ok')
+        recorder.call('op', lambda: False, failed=lambda result: not result)
+
+        def boom():
+            raise RuntimeError("down")
+        self.assertIsNone(recorder.call('op', boom))
+        summary = recorder.summary(1.0)['op']
+        self.assertEqual(summary['count'], 3)
+        self.assertAlmostEqual(summary['statements_per_op'], 5 / 3)
+        self.assertEqual(summary['errors'], 2)
+        self.assertLessEqual(summary['p50_ms'], summary['p99_ms'])
+
+
+class TestSimulatedDriver(unittest.TestCase):
+    """Driving a route."""
+
+    def test_drives_serves_and_completes(self):
+        """The driver reaches each stop, waits out the service time, then completes it."""
+        from epic_2_operations.fleet_simulator import SimulatedDriver  # pylint: disable=import-outside-toplevel, import-error
+        driver = SimulatedDriver(FLEET[0], random.Random(1), speed_kmh=(36.0, 36.0), service_s=30)
+        completed = [driver.advance(10) for _ in range(30)]
+        done = [c[0] for c in completed if c]
+        self.assertEqual(done, [21, 22])
+        # ~1 km at 10 m/s, 30 s service, ~500 m, 30 s service
+        self.assertEqual([i for i, c in enumerate(completed) if c], [13, 22])
+        self.assertTrue(driver.done)
+        self.assertIsNone(driver.advance(10))
+
+
+@patch('epic_2_operations.fleet_simulator.get_ingestor')
+@patch('epic_2_operations.fleet_simulator.get_db_stats', MagicMock(return_value={
+    'statements': 0, 'connections': 0, 'pool_wait_s': 0.0, 'pool_wait_max_s': 0.0, 'pool_exhausted': 0}))
+@patch('epic_2_operations.fleet_simulator.reset_db_stats', MagicMock())
+@patch('epic_2_operations.fleet_simulator.get_thread_statements', MagicMock(return_value=0))
+@patch('epic_2_operations.fleet_simulator.get_assignment_progress', MagicMock(return_value=[]))
+@patch('epic_2_operations.fleet_simulator.get_driver_assignment', MagicMock(return_value=[]))
+@patch('epic_2_operations.fleet_simulator.get_live_vehicle_locations')
+@patch('epic_2_operations.fleet_simulator.get_fleet_state')
+class TestRunSimulation(unittest.TestCase):
+    """A whole (tiny) run."""
+
+    @patch('epic_2_operations.fleet_simulator.mark_stop_complete')
+    @patch('epic_2_operations.fleet_simulator.log_driver_location')
+    def test_run_reports_every_operation(self, mock_log, mock_complete, mock_fleet, mock_sql_map, mock_ingestor):
+        """GPS fixes and completions go through the tracking functions and show up in the report."""
+        from epic_2_operations.fleet_simulator import run_simulation, format_report  # pylint: disable=import-outside-toplevel, import-error
+        mock_fleet.return_value.changes_since.return_value = (5, [])
+        mock_log.return_value = True
+        mock_complete.side_effect = ["Stop marked complete! Payment logged.", "Error: Could not update the stop."]
+        mock_ingestor.return_value.get_stats.return_value = {'accepted': 1}
+        result = run_simulation(FLEET, duration_s=3600, gps_interval_s=10, speedup=1e9, workers=2)
+
+        self.assertEqual([c[0][1] for c in mock_complete.call_args_list], [21, 22])
+        ops = result['operations']
+        self.assertEqual(ops['mark_stop_complete']['count'], 2)
+        self.assertEqual(ops['mark_stop_complete']['errors'], 1)
+        self.assertEqual(ops['log_driver_location']['count'], mock_log.call_count)
+        # The map is timed as the dashboard reads it: in memory, not with the SQL query
+        self.assertIn('fleet_changes_since', ops)
+        self.assertNotIn('get_live_vehicle_locations', ops)
+        mock_sql_map.assert_not_called()
+        mock_ingestor.return_value.flush.assert_called_once()
+        self.assertLess(result['simulated_s'], 3600)   # stops once every route is done
+        self.assertIn('mark_stop_complete', format_report(result))
+
+    def test_each_supervisor_keeps_its_version(self, mock_fleet, mock_sql_map, mock_ingestor):
+        """Every simulated viewer asks for what changed since the version it saw last."""
+        from epic_2_operations.fleet_simulator import run_simulation  # pylint: disable=import-outside-toplevel, import-error
+        mock_fleet.return_value.changes_since.side_effect = lambda version: (version + 1, [])
+        mock_sql_map.return_value = []
+        mock_ingestor.return_value.get_stats.return_value = {}
+        with patch('epic_2_operations.fleet_simulator.log_driver_location', return_value=True):
+            result = run_simulation(FLEET, duration_s=30, gps_interval_s=10, speedup=1e9, workers=2,
+                                    supervisors=2, sql_map=True)
+        versions = sorted(c[0][0] for c in mock_fleet.return_value.changes_since.call_args_list)
+        self.assertEqual(versions, [0, 0, 1, 1])
+        self.assertEqual(result['operations']['get_live_vehicle_locations']['count'], 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
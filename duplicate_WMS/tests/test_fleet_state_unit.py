@@ -0,0 +1,95 @@
+"""
+Unit tests for epic_2_operations.fleet_state:
+- heading and speed from consecutive positions
+- versioned snapshot and changes_since deltas
+- loading from VehicleLatestLocation
+"""
+
+import os
+import sys
+import datetime
+import unittest
+from unittest.mock import patch
+
+# Ensure project root is available for runtime imports
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+T0 = datetime.datetime(2025, 1, 1, 9, 0, 0)
+
+
+@patch('epic_2_operations.fleet_state.fetch_one', return_value={'license_plate': 'KA01'})
+class TestFleetState(unittest.TestCase):
+    """In-memory state and change feed."""
+
+    def make(self):
+        from epic_2_operations.fleet_state import FleetState  # pylint: disable=import-outside-toplevel, import-error
+        return FleetState()
+
+    def test_heading_and_speed(self, _mock_fetch):
+        """Moving ~1.1 km north in one minute is heading 0 at ~67 km/h."""
+        state = self.make()
+        state.update(1, 12.00, 77.0, T0)
+        state.update(1, 12.01, 77.0, T0 + datetime.timedelta(minutes=1))
+        _, vehicles = state.snapshot()
+        self.assertAlmostEqual(vehicles[0]['heading_deg'], 0.0, places=3)
+        self.assertAlmostEqual(vehicles[0]['speed_kmh'], 66.3, delta=1.0)
+        self.assertEqual(vehicles[0]['license_plate'], 'KA01')
+
+    def test_east_heading(self, _mock_fetch):
+        """Bearing due east is 90 degrees."""
+        from epic_2_operations.fleet_state import bearing_degrees  # pylint: disable=import-outside-toplevel, import-error
+        self.assertAlmostEqual(bearing_degrees((0.0, 77.0), (0.0, 77.01)), 90.0, places=3)
+
+    def test_changes_since_returns_only_moved_vehicles(self, _mock_fetch):
+        """A viewer holding version N only gets vehicles that changed after N."""
+        state = self.make()
+        state.update(1, 12.0, 77.0, T0)
+        state.update(2, 13.0, 78.0, T0)
+        version, changed = state.changes_since(0)
+        self.assertEqual(sorted(v['vehicle_id'] for v in changed), [1, 2])
+
+        state.update(2, 13.1, 78.0, T0 + datetime.timedelta(minutes=1))
+        new_version, changed = state.changes_since(version)
+        self.assertEqual([v['vehicle_id'] for v in changed], [2])
+        self.assertEqual(state.changes_since(new_version), (new_version, []))
+
+    def test_version_from_earlier_process_gets_everything(self, _mock_fetch):
+        """A version newer than the state (after a restart) resets to a full snapshot."""
+        state = self.make()
+        state.update(1, 12.0, 77.0, T0)
+        _, changed = state.changes_since(99)
+        self.assertEqual(len(changed), 1)
+
+    def test_late_older_point_is_ignored(self, _mock_fetch):
+        """A point older than the one held does not move the vehicle back."""
+        state = self.make()
+        state.update(1, 12.0, 77.0, T0)
+        self.assertFalse(state.update(1, 11.0, 77.0, T0 - datetime.timedelta(minutes=1)))
+        self.assertEqual(state.snapshot()[1][0]['latitude'], 12.0)
+        self.assertEqual(state.version, 1)
+
+    def test_plate_looked_up_once_per_vehicle(self, mock_fetch):
+        """Unknown vehicles cost one lookup, then never again."""
+        state = self.make()
+        for minute in range(3):
+            state.update(1, 12.0 + minute * 0.01, 77.0, T0 + datetime.timedelta(minutes=minute))
+        self.assertEqual(mock_fetch.call_count, 1)
+
+    @patch('epic_2_operations.fleet_state.fetch_all')
+    def test_load_seeds_from_latest_table(self, mock_fetch_all, mock_fetch):
+        """Startup reads the latest-position table once; vehicles without a position get no marker."""
+        mock_fetch_all.return_value = [
+            {'vehicle_id': 1, 'license_plate': 'KA01', 'latitude': 12.0, 'longitude': 77.0, 'timestamp': T0},
+            {'vehicle_id': 2, 'license_plate': 'KA02', 'latitude': None, 'longitude': None, 'timestamp': None},
+        ]
+        state = self.make().load()
+        _, vehicles = state.snapshot()
+        self.assertEqual([v['license_plate'] for v in vehicles], ['KA01'])
+        state.update(2, 13.0, 78.0, T0)
+        mock_fetch.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,160 @@
+"""
+Unit tests for epic_2_operations.geofence_logic:
+- grid index lookups
+- arrived / departed events with dwell time and exit hysteresis
+- arrivals kept for verification pre-fill
+- reloads off the GPS path, and vehicles whose route completed inside a geofence
+- verification in mark_stop_complete using a detected arrival
+"""
+
+import os
+import sys
+import datetime
+import threading
+import unittest
+from unittest.mock import patch, MagicMock
+
+# Ensure project root is available for runtime imports
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+T0 = datetime.datetime(2025, 1, 1, 9, 0)
+# ~0.0009 degrees of latitude is 100 m
+STOP_ROWS = [
+    {'vehicle_id': 3, 'route_stop_id': 21, 'latitude': 12.0, 'longitude': 77.0},
+    {'vehicle_id': 3, 'route_stop_id': 22, 'latitude': 12.01, 'longitude': 77.0},
+    {'vehicle_id': 4, 'route_stop_id': 31, 'latitude': 12.0, 'longitude': 77.0},
+]
+
+
+def _at(minutes):
+    return T0 + datetime.timedelta(minutes=minutes)
+
+
+class TestGeofenceIndex(unittest.TestCase):
+    """Spatial grid lookups."""
+
+    def test_nearest_within_cell(self):
+        """Points find the nearest stop near them, and nothing far away."""
+        from epic_2_operations.geofence_logic import GeofenceIndex  # pylint: disable=import-outside-toplevel, import-error
+        index = GeofenceIndex([(1, 12.0, 77.0), (2, 12.0005, 77.0), (3, 12.5, 77.5)])
+        found, distances = index.nearest([(12.0004, 77.0), (12.0001, 77.0), (12.2, 77.2)])
+        self.assertEqual(found, [2, 1, None])
+        self.assertLess(distances[1], 15)
+        self.assertAlmostEqual(index.distance_to(3, 12.5, 77.5), 0.0, places=3)
+
+
+@patch('epic_2_operations.geofence_logic.fetch_all')
+class TestGeofenceEngine(unittest.TestCase):
+    """Arrival and departure detection."""
+
+    def make(self):
+        from epic_2_operations.geofence_logic import GeofenceEngine  # pylint: disable=import-outside-toplevel, import-error
+        return GeofenceEngine()
+
+    def test_arrive_dwell_depart(self, mock_fetch):
+        """Entering 100 m emits arrived; leaving 150 m emits departed with the dwell time."""
+        mock_fetch.return_value = STOP_ROWS
+        engine = self.make()
+        events = engine.process([
+            (3, 11.99, 77.0, _at(0)),        # ~1.1 km out
+            (3, 12.0005, 77.0, _at(2)),      # ~55 m: arrived
+            (3, 12.0012, 77.0, _at(6)),      # ~130 m: jitter inside the exit radius
+            (3, 12.003, 77.0, _at(9)),       # ~330 m: departed
+        ])
+        self.assertEqual([(e[1], e[2], e[4]) for e in events], [(21, 'arrived', None), (21, 'departed', 420)])
+        self.assertEqual(engine.get_arrival(21)['arrived_at'], _at(2))
+        self.assertEqual(mock_fetch.call_count, 1)
+
+    def test_only_the_vehicles_own_stops(self, mock_fetch):
+        """A vehicle passing another route's stop raises nothing for it."""
+        mock_fetch.return_value = STOP_ROWS
+        engine = self.make()
+        events = engine.process([(4, 12.01, 77.0, _at(0))])
+        self.assertEqual(events, [])
+        events = engine.process([(4, 12.0, 77.0, _at(1)), (5, 12.0, 77.0, _at(1))])
+        self.assertEqual([(e[0], e[1], e[2]) for e in events], [(4, 31, 'arrived')])
+
+    def test_moving_to_next_stop_and_batches(self, mock_fetch):
+        """Going from one stop to the next, across batches, departs one and arrives at the other."""
+        mock_fetch.return_value = STOP_ROWS
+        engine = self.make()
+        engine.process([(3, 12.0, 77.0, _at(0))])
+        events = engine.process([(3, 12.01, 77.0, _at(10))])
+        self.assertEqual([(e[1], e[2]) for e in events], [(21, 'departed'), (22, 'arrived')])
+
+    def test_started_engine_reloads_off_the_gps_path(self, mock_fetch):
+        """With the refresh thread running, a batch only wakes it; the stop query runs there."""
+        engine = self.make()
+        engine._wake = threading.Event()   # as start() does, without the thread
+        self.assertEqual(engine.process([(3, 12.0, 77.0, _at(0))]), [])
+        mock_fetch.assert_not_called()
+        self.assertTrue(engine._wake.is_set())
+
+    def test_completed_route_departs_its_last_stop(self, mock_fetch):
+        """A vehicle whose route leaves the active set keeps its stops until it departs."""
+        mock_fetch.return_value = STOP_ROWS
+        engine = self.make()
+        engine.process([(3, 12.01, 77.0, _at(0)), (4, 12.0, 77.0, _at(0))])
+        mock_fetch.return_value = []   # both routes completed
+        engine.load()
+        events = engine.process([(3, 12.02, 77.0, _at(5)), (4, 12.0001, 77.0, _at(5))])
+        self.assertEqual([(e[0], e[1], e[2], e[4]) for e in events], [(3, 22, 'departed', 300)])
+        engine.load()
+        # Vehicle 4 is still at its stop; vehicle 3 has nothing left to follow
+        self.assertEqual(engine.process([(3, 12.01, 77.0, _at(6)), (4, 12.01, 77.0, _at(6))]),
+                         [(4, 31, 'departed', _at(6), 360, 12.01, 77.0)])
+
+    def test_new_day_forgets_vehicles_inside(self, mock_fetch):
+        """Yesterday's visits are not departed from today."""
+        mock_fetch.return_value = STOP_ROWS
+        engine = self.make()
+        engine.process([(3, 12.0, 77.0, _at(0))])
+        engine._day = datetime.date.today() - datetime.timedelta(days=1)
+        engine.load()
+        self.assertEqual(engine.process([(3, 12.02, 77.0, _at(5))]), [])
+        self.assertIsNone(engine.get_arrival(21))
+
+    def test_record_geofence_events_writes_batch(self, mock_fetch):
+        """Events are stored in one multi-row insert; failures never raise."""
+        mock_fetch.return_value = STOP_ROWS
+        from epic_2_operations.geofence_logic import record_geofence_events  # pylint: disable=import-outside-toplevel, import-error
+        engine = self.make()
+        with patch('epic_2_operations.geofence_logic.execute_many') as mock_many:
+            events = record_geofence_events([(3, 12.0, 77.0, _at(0))], engine)
+            mock_many.assert_called_once()
+            self.assertEqual(mock_many.call_args[0][1], events)
+            mock_many.reset_mock()
+            record_geofence_events([(3, 12.0, 77.0, _at(1))], engine)
+            mock_many.assert_not_called()
+        broken = MagicMock()
+        broken.process.side_effect = RuntimeError("bug")
+        self.assertEqual(record_geofence_events([(3, 12.0, 77.0, _at(0))], broken), [])
+
+
+class TestVerificationPrefill(unittest.TestCase):
+    """mark_stop_complete accepts a detected arrival when the driver has moved on."""
+
+    @patch('epic_2_operations.tracking_logic.get_stop_arrival')
+    @patch('epic_2_operations.tracking_logic.record_locations')
+    @patch('epic_2_operations.tracking_logic.transaction')
+    @patch('epic_2_operations.tracking_logic.get_assignment_cache')
+    def test_uses_arrival_point(self, mock_cache, mock_tx, _mock_record, mock_arrival):
+        """The stop is verified at the arrival point of the same vehicle."""
+        cache = mock_cache.return_value
+        cache.get.return_value = {'assignment_id': 5, 'vehicle_id': 3, 'stops': []}
+        cache.find_stop.return_value = {'route_stop_id': 21, 'latitude': 12.0, 'longitude': 77.0, 'booking_id': None}
+        mock_arrival.return_value = {'vehicle_id': 3, 'arrived_at': T0, 'latitude': 12.0003, 'longitude': 77.0}
+        from epic_2_operations.tracking_logic import mark_stop_complete  # pylint: disable=import-outside-toplevel, import-error
+        msg = mark_stop_complete(9, 21, 12.01, 77.0, 4.0)   # driver now ~1.1 km away
+        self.assertIn('complete', msg.lower())
+        cursor = mock_tx.return_value.__enter__.return_value
+        self.assertEqual(cursor.execute.call_args_list[0][0][1][:2], (12.0003, 77.0))
+
+        mock_arrival.return_value = {'vehicle_id': 99, 'arrived_at': T0, 'latitude': 12.0003, 'longitude': 77.0}
+        self.assertIn('verification failed', mark_stop_complete(9, 21, 12.01, 77.0, 4.0).lower())
+
+
+if __name__ == '__main__':
+    unittest.main()
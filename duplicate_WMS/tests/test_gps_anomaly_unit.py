@@ -0,0 +1,145 @@
+"""
+Unit tests for epic_2_operations.gps_anomaly:
+- impossible speed, teleports and acceleration across and within batches
+- frozen (bit-identical) raw fixes, counted before the ingestion filter
+- stop verification checks
+- wiring into the GPS write path
+Pure in-memory: no database is involved.
+"""
+
+import os
+import sys
+import datetime
+import unittest
+from unittest.mock import patch, MagicMock
+
+# Ensure project root is available for runtime imports
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+T0 = datetime.datetime(2025, 1, 1, 9, 0)
+
+
+def _at(seconds):
+    return T0 + datetime.timedelta(seconds=seconds)
+
+
+class TestGpsAnomalyDetector(unittest.TestCase):
+    """Streaming checks of the location feed."""
+
+    def make(self):
+        from epic_2_operations.gps_anomaly import GpsAnomalyDetector  # pylint: disable=import-outside-toplevel, import-error
+        return GpsAnomalyDetector()
+
+    def test_normal_driving_is_not_flagged(self):
+        """A truck at ~36 km/h with GPS jitter raises nothing."""
+        detector = self.make()
+        rows = [(1, 12.0 + i * 0.0009 + (i % 2) * 1e-6, 77.0, _at(i * 10)) for i in range(50)]
+        self.assertEqual(detector.check_batch(rows), [])
+
+    def test_teleport_and_impossible_speed(self):
+        """A 20 km jump in 30 s is a teleport; 300 m in 5 s is an impossible speed."""
+        detector = self.make()
+        detector.check_batch([(1, 12.0, 77.0, _at(0)), (2, 13.0, 78.0, _at(0))])
+        flags = detector.check_batch([
+            (1, 12.18, 77.0, _at(30)),    # ~20 km
+            (2, 13.0027, 78.0, _at(5)),   # ~300 m
+        ])
+        self.assertEqual(sorted((f['vehicle_id'], f['kind']) for f in flags),
+                         [(1, 'teleport'), (2, 'impossible_speed')])
+        self.assertEqual(len(detector.get_flags()), 2)
+
+    def test_batch_order_does_not_matter(self):
+        """Rows are checked in time order per vehicle, however they arrive."""
+        detector = self.make()
+        rows = [(1, 12.0 + i * 0.0009, 77.0, _at(i * 10)) for i in range(10)]
+        self.assertEqual(detector.check_batch(list(reversed(rows))), [])
+
+    def test_acceleration(self):
+        """Going from standstill to 100 km/h in 10 s is flagged."""
+        detector = self.make()
+        flags = detector.check_batch([
+            (1, 12.0, 77.0, _at(0)),
+            (1, 12.0, 77.00001, _at(10)),
+            (1, 12.0025, 77.00001, _at(20)),   # ~278 m in 10 s
+        ])
+        self.assertEqual([f['kind'] for f in flags], ['acceleration'])
+
+    def test_frozen_fix_run(self):
+        """Five bit-identical raw fixes in a row are flagged once; a stop verified during the run is too."""
+        from epic_2_operations.gps_anomaly import FROZEN_FIX_RUN  # pylint: disable=import-outside-toplevel, import-error
+        detector = self.make()
+        flags = []
+        for i in range(FROZEN_FIX_RUN + 3):
+            flags += detector.check_fix(1, 12.5, 77.5, _at(i * 5))
+        self.assertEqual([(f['kind'], f['timestamp']) for f in flags], [('frozen_fix', _at((FROZEN_FIX_RUN - 1) * 5))])
+        self.assertEqual([f['kind'] for f in detector.check_stop(1, 21, (12.5, 77.5), (12.6, 77.5))],
+                         ['stop_after_anomaly'])
+        detector.check_fix(1, 12.5000001, 77.5)
+        self.assertEqual(detector.check_stop(1, 21, (12.5, 77.5), (12.6, 77.5)), [])
+
+    def test_late_points_do_not_rewind_state(self):
+        """An old point arriving late does not become the vehicle's reference."""
+        detector = self.make()
+        detector.check_batch([(1, 12.0, 77.0, _at(100))])
+        detector.check_batch([(1, 12.5, 77.0, _at(0))])
+        self.assertEqual(detector.check_batch([(1, 12.0009, 77.0, _at(110))]), [])
+
+    def test_check_stop(self):
+        """A verification at exactly the stop's coordinates, or after a teleport, is flagged."""
+        detector = self.make()
+        flags = detector.check_stop(1, 21, (12.0, 77.0), (12.0, 77.0))
+        self.assertEqual([(f['kind'], f['route_stop_id']) for f in flags], [('stop_exact_match', 21)])
+        detector.check_batch([(2, 12.0, 77.0, _at(0))])
+        detector.check_batch([(2, 12.3, 77.0, _at(20))])
+        flags = detector.check_stop(2, 22, (12.3, 77.0), (12.30005, 77.0))
+        self.assertEqual([f['kind'] for f in flags], ['stop_after_anomaly'])
+
+
+class TestAnomalyWiring(unittest.TestCase):
+    """The detector sees every batch that is written."""
+
+    @patch('epic_2_operations.gps_ingestion.record_geofence_events', MagicMock())
+    @patch('epic_2_operations.gps_ingestion.update_etas', MagicMock())
+    @patch('epic_2_operations.gps_ingestion.get_anomaly_detector')
+    @patch('epic_2_operations.gps_ingestion.get_fleet_state')
+    @patch('epic_2_operations.gps_ingestion.transaction')
+    def test_record_locations_checks_rows(self, _mock_tx, _mock_fleet, mock_detector):
+        """Directly recorded points are checked after they are written."""
+        from epic_2_operations.gps_ingestion import record_locations  # pylint: disable=import-outside-toplevel, import-error
+        rows = [(3, 12.0, 77.0, T0)]
+        mock_detector.return_value.check_batch.side_effect = RuntimeError("bug")
+        self.assertTrue(record_locations(rows))
+        mock_detector.return_value.check_batch.assert_called_once_with(rows)
+
+    @patch('epic_2_operations.gps_ingestion.transaction')
+    def test_flush_checks_batch(self, _mock_tx):
+        """A flushed buffer is handed to the detector as one batch."""
+        from epic_2_operations.gps_ingestion import GpsIngestor  # pylint: disable=import-outside-toplevel, import-error
+        detector = MagicMock()
+        assignments = MagicMock()
+        assignments.get.return_value = {'vehicle_id': 7}
+        ingestor = GpsIngestor(spill_path=os.devnull + '.spill', detector=detector, assignments=assignments,
+                               flush_size=2, flush_interval_s=1000)
+        ingestor.submit(1, 12.0, 77.0)
+        ingestor.submit(1, 12.1, 77.0, force=True)
+        self.assertEqual(len(detector.check_batch.call_args[0][0]), 2)
+
+    @patch('epic_2_operations.gps_ingestion.transaction')
+    def test_frozen_fixes_dropped_by_filter_are_flagged(self, _mock_tx):
+        """Repeats of a point never reach a batch, but every fix is counted."""
+        from epic_2_operations.gps_ingestion import GpsIngestor, DROPPED  # pylint: disable=import-outside-toplevel, import-error
+        from epic_2_operations.gps_anomaly import GpsAnomalyDetector, FROZEN_FIX_RUN  # pylint: disable=import-outside-toplevel, import-error
+        detector = GpsAnomalyDetector()
+        assignments = MagicMock()
+        assignments.get.return_value = {'vehicle_id': 7}
+        ingestor = GpsIngestor(spill_path=os.devnull + '.spill', detector=detector, assignments=assignments,
+                               flush_size=1000, flush_interval_s=1000)
+        results = [ingestor.submit(1, 12.0, 77.0) for _ in range(FROZEN_FIX_RUN)]
+        self.assertEqual(results[1:], [DROPPED] * (FROZEN_FIX_RUN - 1))
+        self.assertEqual([f['kind'] for f in detector.get_flags()], ['frozen_fix'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,234 @@
+"""
+Unit tests for epic_2_operations.gps_ingestion:
+- driver -> vehicle from the shared assignment cache
+- distance / time throttling
+- size and time flush triggers (multi-row insert + latest-position upsert)
+- spill to disk and restore
+Uses a fake clock and mocks the database helpers.
+"""
+
+import os
+import sys
+import shutil
+import datetime
+import tempfile
+import unittest
+from unittest.mock import patch, MagicMock
+
+# Ensure project root is available for runtime imports
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+
+def _written_rows(mock_transaction, call=0):
+    """Rows passed to the history insert of the given flush."""
+    cursor = mock_transaction.return_value.__enter__.return_value
+    return cursor.executemany.call_args_list[2 * call][0][1]
+
+
+class FakeClock:
+    """Monotonic clock the test moves by hand."""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@patch('epic_2_operations.gps_ingestion.transaction')
+@patch('epic_2_operations.gps_ingestion.get_assignment_cache')
+class TestGpsIngestor(unittest.TestCase):
+    """Behaviour of the buffered ingestion stage."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.spill_path = os.path.join(self.tmpdir, 'spill.jsonl')
+        self.clock = FakeClock()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def make(self, **kwargs):
+        from epic_2_operations.gps_ingestion import GpsIngestor  # pylint: disable=import-outside-toplevel, import-error
+        kwargs.setdefault('flush_size', 100)
+        kwargs.setdefault('flush_interval_s', 1000)
+        return GpsIngestor(spill_path=self.spill_path, clock=self.clock, **kwargs)
+
+    def test_vehicle_comes_from_assignment_cache(self, mock_cache, _mock_tx):
+        """The vehicle is read from the shared assignment cache; forget_driver invalidates it."""
+        mock_cache.return_value.get.return_value = {'vehicle_id': 7}
+        ingestor = self.make()
+        ingestor.submit(1, 12.0, 77.0)
+        self.assertEqual(ingestor.get_stats()['buffered'], 1)
+        mock_cache.return_value.get.assert_called_with(1)
+        ingestor.forget_driver(1)
+        mock_cache.return_value.invalidate.assert_called_once_with(1)
+
+    def test_no_vehicle(self, mock_cache, _mock_tx):
+        """Drivers without an active assignment are counted and not buffered."""
+        mock_cache.return_value.get.return_value = None
+        ingestor = self.make()
+        self.assertEqual(ingestor.submit(1, 12.0, 77.0), 'no_vehicle')
+        self.assertEqual(ingestor.get_stats()['buffered'], 0)
+
+    def test_throttles_by_time_and_distance(self, mock_cache, _mock_tx):
+        """Points too soon or too close are dropped; a parked truck still sends heartbeats."""
+        mock_cache.return_value.get.return_value = {'vehicle_id': 7}
+        ingestor = self.make(min_distance_m=15, min_interval_s=10, heartbeat_s=300)
+        self.assertEqual(ingestor.submit(1, 12.0, 77.0), 'accepted')
+        self.clock.now += 5
+        self.assertEqual(ingestor.submit(1, 12.01, 77.0), 'dropped')   # too soon
+        self.clock.now += 30
+        self.assertEqual(ingestor.submit(1, 12.00001, 77.0), 'dropped')  # ~1 m away
+        self.assertEqual(ingestor.submit(1, 12.01, 77.0), 'accepted')  # ~1.1 km away
+        self.clock.now += 301
+        self.assertEqual(ingestor.submit(1, 12.01, 77.0), 'accepted')  # heartbeat
+        self.assertEqual(ingestor.submit(1, 12.01, 77.0, force=True), 'accepted')
+        stats = ingestor.get_stats()
+        self.assertEqual((stats['accepted'], stats['dropped'], stats['buffered']), (4, 2, 4))
+
+    def test_accepted_points_update_fleet_state(self, mock_cache, _mock_tx):
+        """Accepted points reach the live fleet state straight away; dropped ones do not."""
+        mock_cache.return_value.get.return_value = {'vehicle_id': 7}
+        fleet = MagicMock()
+        ingestor = self.make(fleet_state=fleet)
+        ingestor.submit(1, 12.0, 77.0)
+        ingestor.submit(1, 12.0, 77.0)  # too soon: dropped
+        fleet.update.assert_called_once()
+        self.assertEqual(fleet.update.call_args[0][:3], (7, 12.0, 77.0))
+
+    def test_flushes_multi_row_insert_on_size(self, mock_cache, mock_tx):
+        """Reaching flush_size writes every buffered point in one call."""
+        mock_cache.return_value.get.side_effect = lambda driver_id: {'vehicle_id': driver_id + 100}
+        ingestor = self.make(flush_size=3)
+        ingestor.submit(1, 12.0, 77.0)
+        ingestor.submit(2, 12.5, 77.5)
+        mock_tx.assert_not_called()
+        ingestor.submit(3, 13.0, 78.0)
+        mock_tx.assert_called_once()
+        rows = _written_rows(mock_tx)
+        self.assertEqual([r[:3] for r in rows], [(101, 12.0, 77.0), (102, 12.5, 77.5), (103, 13.0, 78.0)])
+        self.assertIsInstance(rows[0][3], datetime.datetime)
+        self.assertEqual(ingestor.get_stats()['flushed'], 3)
+        self.assertEqual(ingestor.get_stats()['buffered'], 0)
+
+    def test_flush_upserts_newest_point_per_vehicle(self, mock_cache, mock_tx):
+        """The latest-position upsert gets one row per vehicle: its newest point."""
+        mock_cache.return_value.get.return_value = {'vehicle_id': 7}
+        ingestor = self.make()
+        ingestor.submit(1, 12.0, 77.0, timestamp=datetime.datetime(2025, 1, 1, 9, 0))
+        self.clock.now += 60
+        ingestor.submit(1, 12.1, 77.0, timestamp=datetime.datetime(2025, 1, 1, 9, 1))
+        ingestor.flush()
+        cursor = mock_tx.return_value.__enter__.return_value
+        history_call, latest_call = cursor.executemany.call_args_list
+        self.assertIn('VehicleLocations', history_call[0][0])
+        self.assertIn('ON DUPLICATE KEY UPDATE', latest_call[0][0])
+        self.assertEqual(latest_call[0][1], [(7, 12.1, 77.0, datetime.datetime(2025, 1, 1, 9, 1))])
+
+    def test_flushes_on_time(self, mock_cache, mock_tx):
+        """A point arriving after flush_interval_s triggers a write of everything buffered."""
+        mock_cache.return_value.get.return_value = {'vehicle_id': 7}
+        ingestor = self.make(flush_interval_s=30)
+        ingestor.submit(1, 12.0, 77.0)
+        mock_tx.assert_not_called()
+        self.clock.now += 31
+        ingestor.submit(1, 12.1, 77.0)
+        self.assertEqual(len(_written_rows(mock_tx)), 2)
+
+    def test_failed_flush_keeps_points(self, mock_cache, mock_tx):
+        """If the insert fails, points stay buffered for the next attempt."""
+        mock_cache.return_value.get.return_value = {'vehicle_id': 7}
+        mock_tx.return_value.__enter__.side_effect = RuntimeError("db down")
+        ingestor = self.make()
+        ingestor.submit(1, 12.0, 77.0)
+        self.assertEqual(ingestor.flush(), 0)
+        self.assertEqual(ingestor.get_stats()['buffered'], 1)
+        mock_tx.return_value.__enter__.side_effect = None
+        self.assertEqual(ingestor.flush(), 1)
+
+    def test_slow_flush_does_not_block_submit(self, mock_cache, mock_tx):
+        """Points keep being accepted while a flush waits on the database."""
+        import threading  # pylint: disable=import-outside-toplevel
+        mock_cache.return_value.get.return_value = {'vehicle_id': 7}
+        writing, release = threading.Event(), threading.Event()
+
+        def slow_write(*_):
+            writing.set()
+            release.wait(5)
+            return MagicMock()
+        mock_tx.return_value.__enter__.side_effect = slow_write
+        ingestor = self.make()
+        ingestor.submit(1, 12.0, 77.0)
+        flusher = threading.Thread(target=ingestor.flush)
+        flusher.start()
+        self.assertTrue(writing.wait(5))
+
+        self.clock.now += 20
+        done = threading.Event()
+        threading.Thread(target=lambda: (ingestor.submit(1, 12.1, 77.0), done.set())).start()
+        self.assertTrue(done.wait(1))
+        release.set()
+        flusher.join(5)
+        # The point that arrived during the write is still buffered for the next one
+        self.assertEqual(ingestor.get_stats()['buffered'], 1)
+        self.assertEqual(ingestor.get_stats()['flushed'], 1)
+
+    def test_full_buffer_wakes_flush_thread(self, mock_cache, _mock_tx):
+        """With the flush thread running, submit hands the write to it instead of doing it."""
+        import threading  # pylint: disable=import-outside-toplevel
+        mock_cache.return_value.get.return_value = {'vehicle_id': 7}
+        ingestor = self.make(flush_size=1)
+        ingestor._wake = threading.Event()  # pylint: disable=protected-access
+        with patch.object(ingestor, 'flush') as mock_flush:
+            ingestor.submit(1, 12.0, 77.0)
+        mock_flush.assert_not_called()
+        self.assertTrue(ingestor._wake.is_set())  # pylint: disable=protected-access
+
+    def test_close_spills_and_next_process_restores(self, mock_cache, mock_tx):
+        """Unwritten points survive a shutdown in the spill file."""
+        mock_cache.return_value.get.return_value = {'vehicle_id': 7}
+        mock_tx.return_value.__enter__.side_effect = RuntimeError("db down")
+        ingestor = self.make()
+        ingestor.submit(1, 12.0, 77.0)
+        ingestor.submit(1, 12.0, 77.0, force=True)
+        ingestor.close()
+        self.assertTrue(os.path.exists(self.spill_path))
+        self.assertEqual(ingestor.get_stats()['spilled'], 2)
+
+        restarted = self.make()
+        self.assertFalse(os.path.exists(self.spill_path))
+        self.assertEqual(restarted.get_stats()['restored'], 2)
+        mock_tx.return_value.__enter__.side_effect = None
+        self.assertEqual(restarted.flush(), 2)
+        self.assertEqual(_written_rows(mock_tx)[0][:3], (7, 12.0, 77.0))
+
+
+@patch('epic_2_operations.gps_ingestion.record_geofence_events', MagicMock())
+@patch('epic_2_operations.gps_ingestion.update_etas', MagicMock())
+@patch('epic_2_operations.gps_ingestion.get_fleet_state')
+@patch('epic_2_operations.gps_ingestion.transaction')
+class TestRecordLocations(unittest.TestCase):
+    """Direct (unbuffered) writes."""
+
+    def test_writes_history_and_latest(self, mock_tx, mock_fleet):
+        """record_locations runs both statements in one transaction and updates the live state."""
+        from epic_2_operations.gps_ingestion import record_locations  # pylint: disable=import-outside-toplevel, import-error
+        row = (3, 12.0, 77.0, datetime.datetime(2025, 1, 1, 9, 0))
+        self.assertTrue(record_locations([row]))
+        cursor = mock_tx.return_value.__enter__.return_value
+        self.assertEqual(cursor.executemany.call_count, 2)
+        mock_fleet.return_value.update_many.assert_called_once_with([row])
+
+    def test_failure_returns_false(self, mock_tx, mock_fleet):
+        """Errors are reported, not raised, and the live state is left alone."""
+        mock_tx.return_value.__enter__.side_effect = RuntimeError("db down")
+        from epic_2_operations.gps_ingestion import record_locations  # pylint: disable=import-outside-toplevel, import-error
+        self.assertFalse(record_locations([(3, 12.0, 77.0, datetime.datetime(2025, 1, 1))]))
+        mock_fleet.return_value.update_many.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
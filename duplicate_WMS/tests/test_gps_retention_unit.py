@@ -0,0 +1,166 @@
+"""
+Unit tests for epic_2_operations.gps_retention:
+- downsample (time / distance thinning)
+- archive files (round trip, merge on re-run)
+- delete_in_chunks and roll_up_vehicle_day (chunked, idempotent)
+- get_location_trace (raw -> rollup -> archive fallback)
+- run_retention (per-vehicle loop)
+"""
+
+import os
+import sys
+import shutil
+import datetime
+import tempfile
+import unittest
+from unittest.mock import patch
+
+# Ensure project root is available for runtime imports
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+DAY = datetime.date(2025, 1, 1)
+T0 = datetime.datetime(2025, 1, 1, 9, 0, 0)
+
+
+def _points(count, step_s=5, step_deg=0.00001):
+    """A slow-moving truck: one point every step_s seconds, ~1 m apart."""
+    return [(T0 + datetime.timedelta(seconds=i * step_s), 12.0 + i * step_deg, 77.0) for i in range(count)]
+
+
+class TestDownsample(unittest.TestCase):
+    """Trace thinning."""
+
+    def test_keeps_one_point_per_interval(self):
+        """Slow movement keeps a point every 30 s, plus first and last."""
+        from epic_2_operations.gps_retention import downsample  # pylint: disable=import-outside-toplevel, import-error
+        kept = downsample(_points(61))  # 5 minutes at 5 s
+        self.assertEqual(kept[0], _points(1)[0])
+        self.assertEqual(len(kept), 11)
+
+    def test_keeps_points_every_50_m(self):
+        """Fast movement keeps points by distance even within 30 s."""
+        from epic_2_operations.gps_retention import downsample  # pylint: disable=import-outside-toplevel, import-error
+        fast = _points(10, step_s=1, step_deg=0.0005)  # ~55 m per second
+        self.assertEqual(len(downsample(fast)), 10)
+
+
+class TestArchive(unittest.TestCase):
+    """Compressed per vehicle-day archive files."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_round_trip_and_merge(self):
+        """Archived points read back identically; a re-run merges without duplicates."""
+        from epic_2_operations.gps_retention import write_archive, read_archive, archive_path  # pylint: disable=import-outside-toplevel, import-error
+        points = _points(5)
+        self.assertEqual(write_archive(3, DAY, points[:3], self.tmpdir), 3)
+        self.assertEqual(write_archive(3, DAY, points[2:], self.tmpdir), 5)
+        self.assertEqual(read_archive(3, DAY, self.tmpdir), points)
+        self.assertTrue(archive_path(3, DAY, self.tmpdir).endswith(os.path.join('vehicle_3', '2025-01-01.npz')))
+
+    def test_missing_archive_is_empty(self):
+        """No file means no points."""
+        from epic_2_operations.gps_retention import read_archive  # pylint: disable=import-outside-toplevel, import-error
+        self.assertEqual(read_archive(3, DAY, self.tmpdir), [])
+
+    @patch('epic_2_operations.gps_retention.execute_query')
+    @patch('epic_2_operations.gps_retention.execute_many', return_value=3)
+    @patch('epic_2_operations.gps_retention.fetch_all')
+    def test_roll_up_vehicle_day(self, mock_fetch_all, mock_many, mock_exec):
+        """Raw points are archived, rolled up, then deleted chunk by chunk."""
+        from epic_2_operations.gps_retention import roll_up_vehicle_day, read_archive  # pylint: disable=import-outside-toplevel, import-error
+        points = _points(61)
+        mock_fetch_all.return_value = [{'timestamp': t, 'latitude': a, 'longitude': b} for t, a, b in points]
+        mock_exec.side_effect = [25, 25, 11]
+        deleted = roll_up_vehicle_day(3, DAY, self.tmpdir, chunk_rows=25)
+        self.assertEqual(deleted, 61)
+        self.assertEqual(len(read_archive(3, DAY, self.tmpdir)), 61)
+        self.assertIn('INSERT IGNORE INTO VehicleLocationRollups', mock_many.call_args[0][0])
+        self.assertEqual(len(mock_many.call_args[0][1]), 11)
+        sql, params = mock_exec.call_args[0]
+        self.assertIn('LIMIT %s', sql)
+        self.assertEqual(params, (3, T0.replace(hour=0), T0.replace(hour=0) + datetime.timedelta(days=1), 25))
+
+    @patch('epic_2_operations.gps_retention.execute_query')
+    @patch('epic_2_operations.gps_retention.execute_many', return_value=None)
+    @patch('epic_2_operations.gps_retention.fetch_all')
+    def test_failed_rollup_keeps_raw(self, mock_fetch_all, _mock_many, mock_exec):
+        """Raw rows are only deleted once the rollup is stored."""
+        from epic_2_operations.gps_retention import roll_up_vehicle_day  # pylint: disable=import-outside-toplevel, import-error
+        mock_fetch_all.return_value = [{'timestamp': T0, 'latitude': 12.0, 'longitude': 77.0}]
+        self.assertIsNone(roll_up_vehicle_day(3, DAY, self.tmpdir))
+        mock_exec.assert_not_called()
+
+    @patch('epic_2_operations.gps_retention.execute_query')
+    @patch('epic_2_operations.gps_retention.fetch_all', return_value=None)
+    def test_failed_read_keeps_raw(self, _mock_fetch_all, mock_exec):
+        """Raw rows that could not be read are not deleted as if the day were empty."""
+        from epic_2_operations.gps_retention import roll_up_vehicle_day  # pylint: disable=import-outside-toplevel, import-error
+        self.assertIsNone(roll_up_vehicle_day(3, DAY, self.tmpdir))
+        mock_exec.assert_not_called()
+
+
+class TestTieredReads(unittest.TestCase):
+    """get_location_trace falls through the tiers."""
+
+    @patch('epic_2_operations.gps_retention.read_archive')
+    @patch('epic_2_operations.gps_retention.get_rollup_points')
+    @patch('epic_2_operations.gps_retention.get_raw_points')
+    def test_falls_back_tier_by_tier(self, mock_raw, mock_rollup, mock_archive):
+        """Raw first, then rollups, then the archive."""
+        from epic_2_operations.gps_retention import get_location_trace  # pylint: disable=import-outside-toplevel, import-error
+        mock_raw.return_value = []
+        mock_rollup.return_value = []
+        mock_archive.return_value = [(T0, 12.0, 77.0)]
+        path, tier = get_location_trace(3, '2025-01-01')
+        self.assertEqual((path.tolist(), tier), ([[12.0, 77.0]], 'archive'))
+        mock_raw.assert_called_once_with(3, DAY)
+
+        mock_rollup.return_value = [(T0, 13.0, 78.0)]
+        self.assertEqual(get_location_trace(3, DAY)[1], 'rollup')
+
+        # A failed read is not mistaken for an empty day
+        mock_raw.return_value = None
+        self.assertEqual(get_location_trace(3, DAY), (None, None))
+
+    @patch('epic_2_operations.gps_retention.fetch_all')
+    def test_raw_query_is_a_range(self, mock_fetch_all):
+        """The raw tier is read with a timestamp range, not DATE(timestamp)."""
+        from epic_2_operations.gps_retention import get_raw_points  # pylint: disable=import-outside-toplevel, import-error
+        mock_fetch_all.return_value = []
+        get_raw_points(3, DAY)
+        sql, params = mock_fetch_all.call_args[0]
+        self.assertNotIn('DATE(', sql)
+        self.assertEqual(params[1:], (datetime.datetime(2025, 1, 1), datetime.datetime(2025, 1, 2)))
+
+
+class TestRunRetention(unittest.TestCase):
+    """The retention job loop."""
+
+    @patch('epic_2_operations.gps_retention.delete_in_chunks', return_value=7)
+    @patch('epic_2_operations.gps_retention.roll_up_vehicle_day', return_value=40)
+    @patch('epic_2_operations.gps_retention.fetch_one')
+    @patch('epic_2_operations.gps_retention.fetch_all', return_value=[{'vehicle_id': 3}])
+    def test_rolls_up_old_days_then_expires_rollups(self, _mock_vehicles, mock_oldest, mock_roll, mock_expire):
+        """Each vehicle is processed day by day until its oldest raw point is recent enough."""
+        from epic_2_operations.gps_retention import run_retention  # pylint: disable=import-outside-toplevel, import-error
+        today = datetime.date(2025, 3, 1)
+        mock_oldest.side_effect = [
+            {'oldest': datetime.datetime(2025, 1, 1, 8)},
+            {'oldest': datetime.datetime(2025, 1, 2, 8)},
+            {'oldest': datetime.datetime(2025, 2, 20, 8)},
+        ]
+        summary = run_retention(raw_days=30, rollup_days=180, today=today)
+        self.assertEqual(summary, {'vehicle_days': 2, 'raw_deleted': 80, 'rollups_deleted': 7, 'errors': 0})
+        self.assertEqual([c[0][1] for c in mock_roll.call_args_list], [DAY, datetime.date(2025, 1, 2)])
+        self.assertEqual(mock_expire.call_args[0][1], (datetime.datetime(2024, 9, 2),))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,223 @@
+"""
+Unit tests for epic_3_billing.invoice_logic:
+- invoices built from stop lines, priced in one batch, with payments
+- chunked runs: one transaction per chunk that also moves the resume cursor
+- resuming after a failed chunk, and skipping completed runs
+- rendering documents and recording the rendered ones
+"""
+
+import os
+import sys
+import datetime
+import tempfile
+import unittest
+from unittest.mock import patch, MagicMock
+
+# Ensure project root is available for runtime imports
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+JAN = datetime.date(2025, 1, 1)
+FEB = datetime.date(2025, 2, 1)
+
+
+def _client(client_id):
+    return {'client_id': client_id, 'first_name': 'Client', 'last_name': str(client_id),
+            'email': f'c{client_id}@example.com'}
+
+
+def _line(client_id, route_stop_id, weight, paid=0):
+    return {'client_id': client_id, 'route_stop_id': route_stop_id, 'booking_id': route_stop_id + 100,
+            'service_date': datetime.date(2025, 1, 10), 'point_name': f'Point <{route_stop_id}>',
+            'tariff_zone': None, 'waste_type': 'General', 'weight_kg': weight, 'paid': paid}
+
+
+def _price(weights, *args):
+    return [round(w * 3.0, 2) for w in weights]
+
+
+class FakeCursor:
+    """Records statements; the invoice id read-back answers with ids in insert order."""
+
+    def __init__(self):
+        self.statements = []
+        self.inserted = []
+        self.rowcount = 1
+
+    def execute(self, query, params=None):
+        self.statements.append((query, params))
+
+    def executemany(self, query, rows):
+        self.statements.append((query, rows))
+        if 'INSERT INTO Invoices' in query:
+            self.inserted = [row[1] for row in rows]
+
+    def fetchall(self):
+        return [{'client_id': client_id, 'invoice_id': 1000 + client_id} for client_id in self.inserted]
+
+
+class TestBuildInvoices(unittest.TestCase):
+    """Turning lines into invoice documents."""
+
+    @patch('epic_3_billing.invoice_logic.price_many', side_effect=_price)
+    def test_totals_and_balances(self, mock_price):
+        """Lines are priced in one call and summed per client; payments reduce the balance."""
+        from epic_3_billing.invoice_logic import build_invoices  # pylint: disable=import-outside-toplevel, import-error
+        lines = [_line(1, 11, 10.0, paid=30.0), _line(1, 12, 5.0), _line(2, 21, 2.5)]
+        invoices = build_invoices([_client(1), _client(2), _client(3)], lines, JAN, FEB)
+        mock_price.assert_called_once()
+        self.assertEqual(mock_price.call_args[0][0], [10.0, 5.0, 2.5])
+        self.assertEqual([inv['invoice_number'] for inv in invoices], ['INV-202501-1', 'INV-202501-2', 'INV-202501-3'])
+        first = invoices[0]
+        self.assertEqual((first['total_kg'], first['amount_due'], first['amount_paid'], first['balance']),
+                         (15.0, 45.0, 30.0, 15.0))
+        self.assertEqual(len(first['lines']), 2)
+        self.assertEqual(invoices[2]['lines'], [])
+        self.assertEqual(invoices[2]['amount_due'], 0)
+
+    def test_month_period(self):
+        from epic_3_billing.invoice_logic import month_period  # pylint: disable=import-outside-toplevel, import-error
+        self.assertEqual(month_period('2025-01'), (JAN, FEB))
+        self.assertEqual(month_period(datetime.date(2024, 12, 15)), (datetime.date(2024, 12, 1), JAN))
+
+
+@patch('epic_3_billing.invoice_logic.price_many', side_effect=_price)
+@patch('epic_3_billing.invoice_logic.transaction')
+@patch('epic_3_billing.invoice_logic.fetch_all')
+@patch('epic_3_billing.invoice_logic.fetch_one')
+class TestRunBilling(unittest.TestCase):
+    """Chunked, resumable billing runs."""
+
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp()
+        self.cursors = []
+
+    def wire(self, mock_fetch_one, mock_fetch_all, mock_tx, last_client_id=0, status='Running', chunks=None):
+        mock_fetch_one.return_value = {'run_id': 4, 'status': status, 'last_client_id': last_client_id, 'invoices': 0}
+        chunks = chunks if chunks is not None else [
+            ([_client(1), _client(2)], [_line(1, 11, 10.0), _line(2, 21, 4.0)]),
+            ([_client(5)], [_line(5, 51, 1.0, paid=3.0)]),
+        ]
+
+        def fetch_all(query, params=None):
+            if 'FROM Users u' in query and 'EXISTS' in query:
+                for clients, _ in chunks:
+                    if clients[0]['client_id'] > params[0]:
+                        return clients
+                return []
+            if 'FROM RouteStops rs' in query:
+                for clients, lines in chunks:
+                    if clients[0]['client_id'] == params[0]:
+                        return lines
+            return []   # no unrendered invoices left over
+        mock_fetch_all.side_effect = fetch_all
+
+        def new_tx():
+            cursor = FakeCursor()
+            self.cursors.append(cursor)
+            tx = MagicMock()
+            tx.__enter__.return_value = cursor
+            return tx
+        mock_tx.side_effect = new_tx
+
+    def run_billing(self, **kwargs):
+        from epic_3_billing.invoice_logic import run_billing  # pylint: disable=import-outside-toplevel, import-error
+        return run_billing(JAN, FEB, chunk_size=2, workers=0, output_dir=self.output_dir, **kwargs)
+
+    def test_chunks_write_invoices_and_cursor_together(self, mock_fetch_one, mock_fetch_all, mock_tx, _):
+        """Each chunk's invoices, lines and cursor move share one transaction."""
+        self.wire(mock_fetch_one, mock_fetch_all, mock_tx)
+        summary = self.run_billing()
+        self.assertEqual(summary['status'], 'Completed')
+        self.assertEqual((summary['invoices'], summary['chunks'], summary['rendered']), (3, 2, 3))
+
+        chunk = self.cursors[0].statements
+        self.assertIn('INSERT INTO Invoices', chunk[0][0])
+        self.assertEqual([row[1] for row in chunk[0][1]], [1, 2])
+        self.assertIn('INSERT INTO InvoiceLines', chunk[2][0])
+        self.assertEqual([row[0] for row in chunk[2][1]], [1001, 1002])
+        self.assertIn('UPDATE BillingRuns SET last_client_id', chunk[3][0])
+        self.assertEqual(chunk[3][1], (2, 2, 4))
+        # Rendered invoices are recorded with one statement per chunk
+        rendered = self.cursors[1].statements[0]
+        self.assertIn("status = 'Rendered'", rendered[0])
+        self.assertEqual(rendered[1][1:], (1001, 1002))
+        self.assertIn('UPDATE BillingRuns SET status', self.cursors[-1].statements[0][0])
+
+        with open(os.path.join(self.output_dir, 'INV-202501-5.html'), encoding='utf-8') as f:
+            document = f.read()
+        self.assertIn('Balance: 0.00', document)
+        self.assertIn('Point &lt;51&gt;', document)
+
+    def test_resumes_after_cursor(self, mock_fetch_one, mock_fetch_all, mock_tx, _):
+        """A stopped run continues after the last written client."""
+        self.wire(mock_fetch_one, mock_fetch_all, mock_tx, last_client_id=2)
+        summary = self.run_billing()
+        self.assertEqual((summary['chunks'], summary['status']), (1, 'Completed'))
+        self.assertEqual([row[1] for row in self.cursors[0].statements[0][1]], [5])
+
+    def test_failed_chunk_leaves_run_resumable(self, mock_fetch_one, mock_fetch_all, mock_tx, _):
+        """A chunk that cannot be written stops the run without completing it."""
+        self.wire(mock_fetch_one, mock_fetch_all, mock_tx)
+        mock_tx.side_effect = Exception('deadlock')
+        summary = self.run_billing()
+        self.assertEqual((summary['status'], summary['chunks'], summary['invoices']), ('Running', 0, 0))
+
+    def test_completed_run_is_not_repeated(self, mock_fetch_one, mock_fetch_all, mock_tx, _):
+        """A completed run bills nobody again; it only renders what is still Issued."""
+        self.wire(mock_fetch_one, mock_fetch_all, mock_tx, status='Completed')
+        summary = self.run_billing()
+        self.assertEqual((summary['status'], summary['chunks']), ('Completed', 0))
+        queries = [c[0][0] for c in mock_fetch_all.call_args_list]
+        self.assertEqual(len(queries), 1)
+        self.assertIn("i.status = 'Issued'", queries[0])
+        mock_tx.assert_not_called()
+
+    @patch('epic_3_billing.invoice_logic.render_invoice')
+    def test_render_errors_keep_run_open(self, mock_render, mock_fetch_one, mock_fetch_all, mock_tx, _):
+        """Invoices that could not be rendered leave the run Running for the next attempt."""
+        self.wire(mock_fetch_one, mock_fetch_all, mock_tx)
+        mock_render.side_effect = [os.path.join(self.output_dir, 'a.html'), OSError('disk full'),
+                                   os.path.join(self.output_dir, 'c.html')]
+        summary = self.run_billing()
+        self.assertEqual((summary['status'], summary['rendered'], summary['render_errors']), ('Running', 2, 1))
+        self.assertFalse(any('UPDATE BillingRuns SET status' in q
+                             for cursor in self.cursors for q, _ in cursor.statements))
+
+    def test_unrendered_invoice_blocks_completion(self, mock_fetch_one, mock_fetch_all, mock_tx, _):
+        """The run is only completed when no invoice of it is still Issued."""
+        self.wire(mock_fetch_one, mock_fetch_all, mock_tx)
+        original = mock_tx.side_effect
+
+        def new_tx():
+            tx = original()
+            tx.__enter__.return_value.rowcount = 0
+            return tx
+        mock_tx.side_effect = new_tx
+        summary = self.run_billing()
+        self.assertEqual(summary['status'], 'Running')
+        completion = self.cursors[-1].statements[0]
+        self.assertIn("status = 'Issued'", completion[0])
+        self.assertEqual(completion[1], ('Completed', 4, 4))
+
+class TestRenderInvoice(unittest.TestCase):
+    """The invoice document."""
+
+    def test_writes_escaped_html(self):
+        from epic_3_billing.invoice_logic import render_invoice  # pylint: disable=import-outside-toplevel, import-error
+        document = {'invoice_number': 'INV-202501-1', 'client_name': 'A & B', 'email': 'a@example.com',
+                    'period_start': JAN, 'period_end': FEB, 'total_kg': 10.0, 'amount_due': 30.0,
+                    'amount_paid': 0.0, 'balance': 30.0,
+                    'lines': [{'service_date': JAN, 'description': 'Collection', 'weight_kg': 10.0,
+                               'amount': 30.0, 'paid': 0.0}]}
+        path = render_invoice(document, tempfile.mkdtemp())
+        with open(path, encoding='utf-8') as f:
+            body = f.read()
+        self.assertIn('A &amp; B', body)
+        self.assertIn('01 Jan 2025 to 31 Jan 2025', body)
+        self.assertIn('Balance: 30.00', body)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+"""
+Unit tests for epic_2_operations.latest_location:
+- backfill_latest_locations (idempotent upsert from history)
+- check_latest_locations (missing / stale / position mismatches)
+- main (command line entry point)
+"""
+
+import os
+import sys
+import datetime
+import unittest
+from unittest.mock import patch
+
+# Ensure project root is available for runtime imports
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+T1 = datetime.datetime(2025, 1, 1, 9, 0)
+T2 = datetime.datetime(2025, 1, 1, 9, 5)
+
+
+class TestLatestLocation(unittest.TestCase):
+    """Backfill and consistency checks with mocked queries."""
+
+    @patch('epic_2_operations.latest_location.execute_query', return_value=4)
+    def test_backfill_upserts_from_history(self, mock_exec):
+        """Backfill is a single INSERT ... SELECT that never moves a row back in time."""
+        from epic_2_operations.latest_location import backfill_latest_locations  # pylint: disable=import-outside-toplevel, import-error
+        self.assertEqual(backfill_latest_locations(), 4)
+        sql = mock_exec.call_args[0][0]
+        self.assertIn('INSERT INTO VehicleLatestLocation', sql)
+        self.assertIn('FROM VehicleLocations', sql)
+        self.assertIn('GREATEST', sql)
+
+    @patch('epic_2_operations.latest_location.fetch_all')
+    def test_check_reports_each_kind_of_problem(self, mock_fetch):
+        """Missing, stale and wrong-position rows are reported; consistent ones are not."""
+        mock_fetch.return_value = [
+            {'vehicle_id': 1, 'history_time': T2, 'latest_time': T2, 'position_matches': 1},
+            {'vehicle_id': 2, 'history_time': T2, 'latest_time': None, 'position_matches': 0},
+            {'vehicle_id': 3, 'history_time': T2, 'latest_time': T1, 'position_matches': 1},
+            {'vehicle_id': 4, 'history_time': T2, 'latest_time': T2, 'position_matches': 0},
+        ]
+        from epic_2_operations.latest_location import check_latest_locations  # pylint: disable=import-outside-toplevel, import-error
+        problems = {m['vehicle_id']: m['problem'] for m in check_latest_locations()}
+        self.assertEqual(problems, {2: 'missing', 3: 'stale', 4: 'position'})
+
+    @patch('epic_2_operations.latest_location.backfill_latest_locations', return_value=1)
+    @patch('epic_2_operations.latest_location.check_latest_locations')
+    def test_check_with_repair(self, mock_check, mock_backfill):
+        """check --repair backfills and succeeds when nothing is left out of step."""
+        mock_check.side_effect = [
+            [{'vehicle_id': 2, 'problem': 'missing', 'history_time': T2, 'latest_time': None}],
+            [],
+        ]
+        from epic_2_operations.latest_location import main  # pylint: disable=import-outside-toplevel, import-error
+        self.assertEqual(main(['check', '--repair']), 0)
+        mock_backfill.assert_called_once()
+
+    @patch('epic_2_operations.latest_location.check_latest_locations', return_value=[
+        {'vehicle_id': 2, 'problem': 'stale', 'history_time': T2, 'latest_time': T1}])
+    def test_check_without_repair_fails(self, _mock_check):
+        """check exits non-zero when the table is out of step."""
+        from epic_2_operations.latest_location import main  # pylint: disable=import-outside-toplevel, import-error
+        self.assertEqual(main(['check']), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
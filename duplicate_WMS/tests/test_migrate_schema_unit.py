@@ -0,0 +1,93 @@
+"""
+Unit tests for migrate_schema:
+- new tables come from the CREATE TABLE statements of DDL_Final.sql
+- only missing columns, indexes and foreign keys are added, one ALTER per table
+- the stop counters are backfilled after the columns exist
+"""
+
+import os
+import sys
+import unittest
+from unittest.mock import patch
+
+# Ensure project root is available for runtime imports
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+
+def _rows(pairs):
+    return [{'table_name': table, 'name': name} for table, name in pairs]
+
+
+class TestCreateTableStatements(unittest.TestCase):
+    """Tables are created from the DDL file, never by dropping the database."""
+
+    def test_reads_create_statements_in_order(self):
+        from migrate_schema import create_table_statements  # pylint: disable=import-outside-toplevel, import-error
+        statements = create_table_statements()
+        self.assertTrue(all(s.startswith('CREATE TABLE IF NOT EXISTS') for s in statements))
+        names = [s.split('`')[1] for s in statements]
+        # Referenced tables come first
+        self.assertLess(names.index('BookingSchedules'), names.index('ServiceBookings'))
+        self.assertIn('DriverDailyCash', names)
+
+
+@patch('migrate_schema.backfill_assignment_counters')
+@patch('migrate_schema.create_table_statements', lambda path: ['CREATE TABLE IF NOT EXISTS `X` (id INT)'])
+@patch('migrate_schema.execute_query')
+@patch('migrate_schema.fetch_all')
+class TestMigrate(unittest.TestCase):
+    """The upgrade of an existing database."""
+
+    def test_old_database_gets_missing_columns_then_backfill(self, mock_fetch, mock_execute, mock_backfill):
+        """A database from before the counters gets them, and they are recomputed afterwards."""
+        import migrate_schema  # pylint: disable=import-outside-toplevel, import-error
+        already = [(t, c) for t, c, _ in migrate_schema.COLUMNS if t != 'RouteAssignments']
+        mock_fetch.side_effect = [_rows(already), _rows([(t, i) for t, i, _ in migrate_schema.INDEXES]),
+                                  _rows([(t, k) for t, k, _ in migrate_schema.FOREIGN_KEYS])]
+        mock_execute.return_value = 0
+        mock_backfill.return_value = 3
+
+        self.assertTrue(migrate_schema.migrate())
+        statements = [c[0][0] for c in mock_execute.call_args_list]
+        alters = [s for s in statements if s.startswith('ALTER TABLE')]
+        self.assertEqual(alters, ["ALTER TABLE `RouteAssignments` ADD COLUMN `total_stops` INT NOT NULL DEFAULT 0, "
+                                  "ADD COLUMN `completed_stops` INT NOT NULL DEFAULT 0"])
+        self.assertTrue(statements[0].startswith('CREATE TABLE'))
+        self.assertTrue(all('INSERT IGNORE' in s for s in statements[2:]))
+        mock_backfill.assert_called_once_with()
+
+    def test_up_to_date_database_alters_nothing(self, mock_fetch, mock_execute, mock_backfill):
+        import migrate_schema  # pylint: disable=import-outside-toplevel, import-error
+        mock_fetch.side_effect = [_rows([(t, c) for t, c, _ in migrate_schema.COLUMNS]),
+                                  _rows([(t, i) for t, i, _ in migrate_schema.INDEXES]),
+                                  _rows([(t, k) for t, k, _ in migrate_schema.FOREIGN_KEYS])]
+        mock_execute.return_value = 0
+        self.assertTrue(migrate_schema.migrate(backfill=False))
+        self.assertFalse(any(c[0][0].startswith('ALTER') for c in mock_execute.call_args_list))
+        mock_backfill.assert_not_called()
+
+    def test_foreign_key_added_after_its_column(self, mock_fetch, mock_execute, mock_backfill):
+        import migrate_schema  # pylint: disable=import-outside-toplevel, import-error
+        mock_fetch.side_effect = [_rows([]), _rows([]), _rows([])]
+        mock_execute.return_value = 0
+        mock_backfill.return_value = 0
+        self.assertTrue(migrate_schema.migrate())
+        alters = [c[0][0] for c in mock_execute.call_args_list if c[0][0].startswith('ALTER')]
+        bookings = [i for i, s in enumerate(alters) if 'ServiceBookings' in s]
+        self.assertEqual(len(bookings), 2)
+        self.assertIn('ADD COLUMN `schedule_id`', alters[bookings[0]])
+        self.assertIn('uq_booking_schedule_date', alters[bookings[0]])
+        self.assertIn('fk_booking_schedule', alters[bookings[1]])
+
+    def test_stops_at_failed_alter(self, mock_fetch, mock_execute, mock_backfill):
+        import migrate_schema  # pylint: disable=import-outside-toplevel, import-error
+        mock_fetch.side_effect = [_rows([]), _rows([])]
+        mock_execute.side_effect = [0, None]
+        self.assertFalse(migrate_schema.migrate())
+        mock_backfill.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
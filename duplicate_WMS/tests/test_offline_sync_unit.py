@@ -0,0 +1,171 @@
+"""
+Unit tests for epic_2_operations.offline_sync:
+- validation of every event in one pass (fields, ownership, distance)
+- idempotency keys (within a batch and across batches)
+- set-based writes in one transaction, and error handling
+Mocks the database helpers, the assignment cache and the GPS write path.
+"""
+
+import os
+import sys
+import datetime
+import unittest
+from unittest.mock import patch, MagicMock
+
+# Ensure project root is available for runtime imports
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+STOPS = {
+    21: {'route_stop_id': 21, 'booking_id': 101, 'latitude': 12.0, 'longitude': 77.0, 'status': 'Pending',
+         'client_id': 7, 'client_email': 'c7@example.com'},
+    22: {'route_stop_id': 22, 'booking_id': None, 'latitude': 12.01, 'longitude': 77.0, 'status': 'Pending'},
+}
+
+
+def _event(key, route_stop_id, lat=12.0, lon=77.0, weight=5.0):
+    return {'idempotency_key': key, 'route_stop_id': route_stop_id, 'latitude': lat, 'longitude': lon,
+            'weight': weight, 'client_timestamp': '2025-01-01T09:30:00'}
+
+
+@patch('epic_2_operations.offline_sync.price_many', lambda weights, *args: [w * 3.0 for w in weights])
+@patch('epic_2_operations.offline_sync.get_stop_arrival', MagicMock(return_value=None))
+@patch('epic_2_operations.offline_sync.record_cash_payments')
+@patch('epic_2_operations.offline_sync.record_locations')
+@patch('epic_2_operations.offline_sync.transaction')
+@patch('epic_2_operations.offline_sync.get_assignment_cache')
+@patch('epic_2_operations.offline_sync.fetch_all')
+class TestSyncStopCompletions(unittest.TestCase):
+    """Behaviour of sync_stop_completions."""
+
+    def setUp(self):
+        self.cursor = MagicMock()
+        # FOR UPDATE check, then the assignment status read
+        self.cursor.fetchall.side_effect = [
+            [{'route_stop_id': 21}, {'route_stop_id': 22}],
+            [{'assignment_id': 5, 'vehicle_id': 3, 'assigned_date': datetime.date(2025, 1, 1), 'status': 'Completed'}],
+        ]
+
+    def wire(self, mock_fetch, mock_cache, mock_tx, known=None):
+        mock_fetch.return_value = known or []
+        cache = mock_cache.return_value
+        cache.get.return_value = {'assignment_id': 5, 'vehicle_id': 3, 'stops': list(STOPS.values())}
+        cache.find_stop.side_effect = lambda driver_id, route_stop_id: STOPS.get(route_stop_id)
+        mock_tx.return_value.__enter__.return_value = self.cursor
+        return cache
+
+    def statements(self):
+        return [c[0][0] for c in self.cursor.execute.call_args_list + self.cursor.executemany.call_args_list]
+
+    def test_applies_batch_in_one_transaction(self, mock_fetch, mock_cache, mock_tx, mock_record, mock_pay):
+        """Valid events update stops, counters, payments and bookings together."""
+        cache = self.wire(mock_fetch, mock_cache, mock_tx)
+        from epic_2_operations.offline_sync import sync_stop_completions  # pylint: disable=import-outside-toplevel, import-error
+        from epic_2_operations.tracking_logic import _history_cache  # pylint: disable=import-outside-toplevel, import-error
+        _history_cache.clear()
+        _history_cache[(3, datetime.date(2025, 1, 1))] = {'stops': []}
+        _history_cache[(4, datetime.date(2025, 1, 1))] = {'stops': []}
+        results = sync_stop_completions(9, [_event('a', 21), _event('b', 22, lat=12.01)])
+        self.assertEqual([r['status'] for r in results], ['applied', 'applied'])
+        mock_tx.assert_called_once()
+
+        stop_update = self.cursor.execute.call_args_list[1][0]
+        self.assertIn('UNION ALL', stop_update[0])
+        self.assertEqual(stop_update[1][:4], [21, 12.0, 77.0, 5.0])
+        self.assertEqual(stop_update[1][4], datetime.datetime(2025, 1, 1, 9, 30))
+        counter_rows = self.cursor.executemany.call_args_list[0][0][1]
+        self.assertEqual(counter_rows, [(2, 5)])
+        # Payments and receipts are written in the same transaction, with the client from the stop
+        mock_pay.assert_called_once_with(self.cursor, [(101, 7, 'c7@example.com', 15.0)])
+        self.assertTrue(any('ServiceBookings SET status' in s for s in self.statements()))
+        records = self.cursor.executemany.call_args_list[-1][0][1]
+        self.assertEqual([(r[0], r[3]) for r in records], [('a', 'applied'), ('b', 'applied')])
+        # Both stops count for the driver's daily totals; only the booked one is billed and paid
+        daily_cash = next(c[0] for c in self.cursor.executemany.call_args_list if 'DriverDailyCash' in c[0][0])
+        self.assertEqual(daily_cash[1], [(datetime.date(2025, 1, 1), 9, 2, 10.0, 15.0, 15.0)])
+
+        self.assertEqual(len(mock_record.call_args[0][0]), 2)
+        self.assertEqual(cache.complete_stop.call_count, 2)
+        cache.invalidate_assignment.assert_called_once_with(5)
+        # The synced day's cached route history is read again; other vehicles keep theirs
+        self.assertEqual(list(_history_cache), [(4, datetime.date(2025, 1, 1))])
+
+    def test_rejects_invalid_events_in_one_pass(self, mock_fetch, mock_cache, mock_tx, _mock_record, _mock_pay):
+        """Bad fields, far-away drivers and unknown stops are rejected; the rest still apply."""
+        self.wire(mock_fetch, mock_cache, mock_tx)
+        self.cursor.fetchall.side_effect = [
+            [{'route_stop_id': 21}],
+            [{'assignment_id': 5, 'vehicle_id': 3, 'assigned_date': datetime.date(2025, 1, 1), 'status': 'In Progress'}],
+        ]
+        mock_fetch.side_effect = [[], []]  # no known keys; stop 99 unknown
+        from epic_2_operations.offline_sync import sync_stop_completions  # pylint: disable=import-outside-toplevel, import-error
+        results = sync_stop_completions(9, [
+            _event('a', 21),
+            _event('b', 22, lat=12.5),        # ~55 km away
+            _event('c', 99),                  # not on the driver's routes
+            _event('d', 21, weight=0),        # no weight
+            {'route_stop_id': 21},            # no key
+        ])
+        self.assertEqual([r['status'] for r in results], ['applied', 'rejected', 'rejected', 'rejected', 'rejected'])
+        self.assertIn('Verification Failed', results[1]['message'])
+        self.assertIn('not found', results[2]['message'])
+        records = self.cursor.executemany.call_args_list[-1][0][1]
+        self.assertEqual(sorted((r[0], r[3]) for r in records),
+                         [('a', 'applied'), ('b', 'rejected'), ('c', 'rejected')])
+
+    def test_arrival_verifies_a_driver_who_moved_on(self, mock_fetch, mock_cache, mock_tx, _mock_record, _mock_pay):
+        """Like a live completion, a far-away driver is verified where their own truck was seen arriving."""
+        self.wire(mock_fetch, mock_cache, mock_tx)
+        self.cursor.fetchall.side_effect = [
+            [{'route_stop_id': 21}],
+            [{'assignment_id': 5, 'vehicle_id': 3, 'assigned_date': datetime.date(2025, 1, 1), 'status': 'In Progress'}],
+        ]
+        arrivals = {21: {'vehicle_id': 3, 'latitude': 12.0003, 'longitude': 77.0},
+                    22: {'vehicle_id': 8, 'latitude': 12.01, 'longitude': 77.0}}
+        from epic_2_operations.offline_sync import sync_stop_completions  # pylint: disable=import-outside-toplevel, import-error
+        with patch('epic_2_operations.offline_sync.get_stop_arrival', side_effect=arrivals.get):
+            results = sync_stop_completions(9, [_event('a', 21, lat=12.5), _event('b', 22, lat=12.5)])
+        self.assertEqual([r['status'] for r in results], ['applied', 'rejected'])
+        self.assertIn('Must be within 100m', results[1]['message'])
+        stop_update = self.cursor.execute.call_args_list[1][0]
+        self.assertEqual(stop_update[1][:3], [21, 12.0003, 77.0])
+
+    def test_idempotency_keys(self, mock_fetch, mock_cache, mock_tx, _mock_record, _mock_pay):
+        """A key seen before, or twice in one batch, is reported as a duplicate and not applied again."""
+        self.wire(mock_fetch, mock_cache, mock_tx,
+                  known=[{'idempotency_key': 'old', 'status': 'applied', 'message': None}])
+        self.cursor.fetchall.side_effect = [
+            [{'route_stop_id': 22}],
+            [{'assignment_id': 5, 'vehicle_id': 3, 'assigned_date': datetime.date(2025, 1, 1), 'status': 'In Progress'}],
+        ]
+        from epic_2_operations.offline_sync import sync_stop_completions  # pylint: disable=import-outside-toplevel, import-error
+        results = sync_stop_completions(9, [_event('old', 21), _event('new', 22, lat=12.01),
+                                            _event('new', 22, lat=12.01)])
+        self.assertEqual([r['status'] for r in results], ['duplicate', 'applied', 'duplicate'])
+        stop_update = self.cursor.execute.call_args_list[1][0]
+        self.assertEqual(stop_update[1][0], 22)
+
+    def test_stop_completed_online_meanwhile(self, mock_fetch, mock_cache, mock_tx, _mock_record, _mock_pay):
+        """A stop no longer pending under the row lock is rejected without writes."""
+        self.wire(mock_fetch, mock_cache, mock_tx)
+        self.cursor.fetchall.side_effect = [[]]
+        from epic_2_operations.offline_sync import sync_stop_completions  # pylint: disable=import-outside-toplevel, import-error
+        results = sync_stop_completions(9, [_event('a', 21)])
+        self.assertEqual(results[0]['status'], 'rejected')
+        self.assertEqual(self.cursor.execute.call_count, 1)
+        self.assertEqual(self.cursor.executemany.call_args[0][1][0][3], 'rejected')
+
+    def test_transaction_failure_reports_error(self, mock_fetch, mock_cache, mock_tx, mock_record, _mock_pay):
+        """If the batch cannot be written nothing is recorded and every event can be retried."""
+        self.wire(mock_fetch, mock_cache, mock_tx)
+        mock_tx.return_value.__enter__.side_effect = RuntimeError("db down")
+        from epic_2_operations.offline_sync import sync_stop_completions  # pylint: disable=import-outside-toplevel, import-error
+        results = sync_stop_completions(9, [_event('a', 21), _event('b', 22, lat=12.01)])
+        self.assertEqual([r['status'] for r in results], ['error', 'error'])
+        mock_record.assert_not_called()
+        mock_cache.return_value.complete_stop.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
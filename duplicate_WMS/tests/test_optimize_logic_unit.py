@@ -1,5 +1,8 @@
 """
-Unit tests for epic_1_routing.optimize_logic.optimize_route_nearest_neighbor.
+Unit tests for epic_1_routing.optimize_logic:
+- optimize_route_nearest_neighbor (greedy ordering)
+- optimize_stop_sequence (nearest neighbour + 2-opt/Or-opt with depots)
+- insertion costs and removal gains measured with the route optimizer's matrix
 Focuses on algorithm behavior; mocks geo distance when needed.
 """
 
@@ -7,6 +10,7 @@ import os
 import sys
 import unittest
 from unittest.mock import patch
+import numpy as np
 
 # Ensure project root is available for runtime imports
 PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
@@ -75,5 +79,135 @@ class TestOptimizeRouteNearestNeighbor(unittest.TestCase):
         self.assertEqual([s['point_id'] for s in result], ['A', 'B', 'C'])
 
 
+class TestOptimizeStopSequence(unittest.TestCase):
+    """Unit tests for the sequencing engine."""
+
+    def test_empty_input_returns_zero_distance(self):
+        """No stops gives an empty route of length zero."""
+        from epic_1_routing.optimize_logic import optimize_stop_sequence  # pylint: disable=import-outside-toplevel, import-error
+        self.assertEqual(optimize_stop_sequence([]), ([], 0.0))
+
+    def test_untangles_zig_zag_order(self):
+        """Stops clicked in zig-zag order along a line come back in line order."""
+        from epic_1_routing.optimize_logic import optimize_stop_sequence  # pylint: disable=import-outside-toplevel, import-error
+        lons = [77.00, 77.04, 77.01, 77.03, 77.02]
+        stops = [{'booking_id': i, 'latitude': 12.0, 'longitude': lon} for i, lon in enumerate(lons)]
+        ordered, total = optimize_stop_sequence(stops)
+        ordered_lons = [s['longitude'] for s in ordered]
+        self.assertIn(ordered_lons, (sorted(lons), sorted(lons, reverse=True)))
+        # 0.04 degrees of longitude at 12N is roughly 4.35 km
+        self.assertAlmostEqual(total, 4350, delta=50)
+
+    def test_depot_start_and_end_are_respected(self):
+        """With a depot the route starts next to it and the return leg is counted."""
+        from epic_1_routing.optimize_logic import optimize_stop_sequence  # pylint: disable=import-outside-toplevel, import-error
+        stops = [
+            {'booking_id': 'far', 'latitude': 12.0, 'longitude': 77.05},
+            {'booking_id': 'near', 'latitude': 12.0, 'longitude': 77.01},
+        ]
+        depot = (12.0, 77.0)
+        ordered, open_total = optimize_stop_sequence(stops, start=depot)
+        self.assertEqual([s['booking_id'] for s in ordered], ['near', 'far'])
+        _, round_trip_total = optimize_stop_sequence(stops, start=depot, end=depot)
+        self.assertAlmostEqual(round_trip_total, 2 * open_total, delta=1.0)
+
+    def test_keeps_every_stop_exactly_once(self):
+        """The optimized route is a permutation of the input stops."""
+        from epic_1_routing.optimize_logic import optimize_stop_sequence  # pylint: disable=import-outside-toplevel, import-error
+        stops = [
+            {'booking_id': i, 'latitude': 17.3 + (i * 7 % 11) / 100, 'longitude': 78.3 + (i * 5 % 13) / 100}
+            for i in range(40)
+        ]
+        ordered, _ = optimize_stop_sequence(stops, time_budget=0.5)
+        self.assertEqual(sorted(s['booking_id'] for s in ordered), list(range(40)))
+
+
+class TestTimeWindows(unittest.TestCase):
+    """Unit tests for time-window sequencing and feasibility checks."""
+
+    def test_time_to_seconds_formats(self):
+        """TIME values arrive as timedelta from MySQL, or as strings from forms."""
+        import datetime  # pylint: disable=import-outside-toplevel
+        from epic_1_routing.optimize_logic import time_to_seconds  # pylint: disable=import-outside-toplevel, import-error
+        self.assertEqual(time_to_seconds(datetime.timedelta(hours=9, minutes=30)), 34200)
+        self.assertEqual(time_to_seconds('09:30'), 34200)
+        self.assertEqual(time_to_seconds(datetime.time(9, 30)), 34200)
+        self.assertIsNone(time_to_seconds(None))
+
+    def test_window_pulls_stop_forward(self):
+        """A stop that closes early is visited first even though it is furthest away."""
+        from epic_1_routing.optimize_logic import optimize_stop_sequence, check_time_windows  # pylint: disable=import-outside-toplevel, import-error
+        depot = (12.0, 77.0)
+        stops = [
+            {'booking_id': 'near', 'latitude': 12.0, 'longitude': 77.01},
+            {'booking_id': 'mid', 'latitude': 12.0, 'longitude': 77.02},
+            {'booking_id': 'far', 'latitude': 12.0, 'longitude': 77.03,
+             'window_start': '08:00', 'window_end': '08:10'},
+        ]
+        ordered, _ = optimize_stop_sequence(stops, start=depot, depart_at=8 * 3600)
+        self.assertEqual(ordered[0]['booking_id'], 'far')
+        feasible, _, late = check_time_windows(ordered, start=depot, depart_at=8 * 3600)
+        self.assertTrue(feasible)
+        self.assertEqual(max(late), 0)
+
+    def test_waits_for_window_to_open(self):
+        """Arriving early means waiting; the next stop is reached after the wait and service."""
+        from epic_1_routing.optimize_logic import check_time_windows  # pylint: disable=import-outside-toplevel, import-error
+        stops = [
+            {'latitude': 12.0, 'longitude': 77.0, 'window_start': '09:00', 'service_minutes': 10},
+            {'latitude': 12.0, 'longitude': 77.0, 'window_end': '09:05'},
+        ]
+        feasible, arrivals, late = check_time_windows(stops, depart_at=8 * 3600)
+        self.assertFalse(feasible)
+        self.assertEqual(arrivals[1], 9 * 3600 + 600)
+        self.assertEqual(late[1], 300)
+
+    def test_insertion_feasible_marks_late_positions(self):
+        """Only positions that keep every window are feasible."""
+        from epic_1_routing.optimize_logic import insertion_feasible  # pylint: disable=import-outside-toplevel, import-error
+        stops = [
+            {'latitude': 12.0, 'longitude': 77.0, 'service_minutes': 30},
+            {'latitude': 12.0, 'longitude': 77.0, 'service_minutes': 30},
+        ]
+        urgent = {'latitude': 12.0, 'longitude': 77.0, 'window_end': '08:45', 'service_minutes': 5}
+        result = insertion_feasible(stops, urgent, depart_at=8 * 3600)
+        self.assertEqual(result.tolist(), [True, True, False])
+
+
+class TestInsertionAndRemoval(unittest.TestCase):
+    """Local-search moves measure distance like the optimizer does."""
+
+    @staticmethod
+    def one_way_matrix(coords):
+        """Road-like distances: going north costs double."""
+        lat = np.array([c[0] for c in coords])
+        step = (lat[None, :] - lat[:, None]) * 111_000
+        return np.where(step > 0, 2 * step, -step)
+
+    def stops(self, *lats):
+        return [{'latitude': lat, 'longitude': 77.0} for lat in lats]
+
+    def test_uses_matrix_fn_in_both_directions(self):
+        from epic_1_routing.optimize_logic import (  # pylint: disable=import-outside-toplevel, import-error
+            insertion_costs, removal_gains, route_distance
+        )
+        route = self.stops(12.0, 12.02)
+        new = self.stops(12.03)[0]
+        # Straight lines would give [3330, 2220, 1110]; northward legs cost double here
+        costs = insertion_costs(route, new, matrix_fn=self.one_way_matrix)
+        np.testing.assert_allclose(costs, [3330, 3330, 2220])
+        gains = removal_gains(self.stops(12.0, 12.01, 12.02), matrix_fn=self.one_way_matrix)
+        np.testing.assert_allclose(gains, [2220, 0, 2220], atol=1e-6)
+        self.assertAlmostEqual(route_distance(route, matrix_fn=self.one_way_matrix), 4440, places=3)
+
+    @patch('epic_1_routing.optimize_logic.get_matrix_functions')
+    def test_default_matrix_comes_from_settings(self, mock_functions):
+        from epic_1_routing.optimize_logic import insertion_costs, removal_gains  # pylint: disable=import-outside-toplevel, import-error
+        mock_functions.return_value = (self.one_way_matrix, None)
+        insertion_costs(self.stops(12.0), self.stops(12.01)[0], start=(11.9, 77.0))
+        removal_gains(self.stops(12.0, 12.01))
+        self.assertEqual(mock_functions.call_count, 2)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -1,51 +1,166 @@
 """
 Unit tests for epic_3_billing.payment_logic.
-Mocks DB calls to check cash payment logic edge cases.
+Mocks DB calls to check cash payment logic edge cases:
+- payment and receipt written in one transaction
+- client data passed in by the caller, or read once
+- receipt numbers reserved in blocks, reused after a rollback, returned at shutdown
 """
 
 import os
 import sys
+import datetime
 import unittest
-from unittest.mock import patch
+from unittest.mock import patch, MagicMock
 
 PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
 if PROJECT_ROOT not in sys.path:
     sys.path.insert(0, PROJECT_ROOT)
 
+YEAR = datetime.date.today().year
+
+
+class FakeDatabase:
+    """ReceiptSequences in a dict; every transaction gets a recording cursor."""
+
+    def __init__(self, fail_on=None):
+        self.next_value = {}
+        self.cursors = []
+        self.fail_on = fail_on   # statement fragment that raises
+
+    def transaction(self):
+        cursor = FakeCursor(self)
+        self.cursors.append(cursor)
+        tx = MagicMock()
+        tx.__enter__.return_value = cursor
+        return tx
+
+    def statements(self):
+        return [s for cursor in self.cursors for s in cursor.statements]
+
+
+class FakeCursor:
+    """Answers the sequence statements; payments get ids from 500 up."""
+
+    def __init__(self, db):
+        self.db = db
+        self.statements = []
+        self.lastrowid = None
+
+    def execute(self, query, params=None):
+        if self.db.fail_on and self.db.fail_on in query:
+            raise RuntimeError('deadlock')
+        self.statements.append((query, params))
+        if 'INSERT IGNORE INTO ReceiptSequences' in query:
+            self.db.next_value.setdefault(params[0], 1)
+        elif 'UPDATE ReceiptSequences' in query:
+            year = params[1]
+            if len(params) == 2 or self.db.next_value[year] == params[2]:
+                self.db.next_value[year] = params[0]
+        elif 'INSERT INTO Payments' in query:
+            self.lastrowid = 500
+
+    def executemany(self, query, rows):
+        if self.db.fail_on and self.db.fail_on in query:
+            raise RuntimeError('deadlock')
+        self.statements.append((query, rows))
+
+    def fetchone(self):
+        return {'next_value': self.db.next_value[self.statements[-1][1][0]]}
+
+
 class TestPaymentLogicUnit(unittest.TestCase):
     """Isolated tests for process_cash_payment."""
 
-    @patch('epic_3_billing.payment_logic.execute_query')
+    def setUp(self):
+        self.db = FakeDatabase()
+        from epic_3_billing.payment_logic import ReceiptNumberAllocator  # pylint: disable=import-outside-toplevel, import-error
+        self.allocator = ReceiptNumberAllocator(block_size=3)
+        patches = [
+            patch('epic_3_billing.payment_logic.transaction', side_effect=self.db.transaction),
+            patch('epic_3_billing.payment_logic.get_receipt_allocator', return_value=self.allocator),
+        ]
+        for p in patches:
+            p.start()
+            self.addCleanup(p.stop)
+
+    def receipts(self):
+        return [rows[0] for query, rows in self.db.statements() if 'INSERT INTO Receipts' in query]
+
     @patch('epic_3_billing.payment_logic.fetch_one')
-    def test_process_cash_payment_success(self, mock_fetch_one, mock_exec):
-        """Happy path: logs payment, adds receipt, returns True."""
-        mock_fetch_one.return_value = {'client_id': 22}
-        mock_exec.side_effect = [1001, True]
+    def test_process_cash_payment_success(self, mock_fetch_one):
+        """Happy path: payment and receipt in one transaction, with the client the caller already has."""
         from epic_3_billing.payment_logic import process_cash_payment  # pylint: disable=import-outside-toplevel, import-error
-        ok = process_cash_payment(15, 33.0)
+        ok = process_cash_payment(15, 33.0, 22, 'c22@example.com')
         self.assertTrue(ok)
-        # Check correct SQL for insert
-        self.assertIn('INSERT INTO Payments', mock_exec.call_args_list[0][0][0])
-        self.assertIn('INSERT INTO Receipts', mock_exec.call_args_list[1][0][0])
+        mock_fetch_one.assert_not_called()
+        # The block reservation has its own short transaction; the payment and receipt share one
+        payment_tx = [c.statements for c in self.db.cursors if 'Payments' in c.statements[0][0]][0]
+        self.assertEqual(len(payment_tx), 2)
+        self.assertIn('INSERT INTO Payments', payment_tx[0][0])
+        self.assertEqual(payment_tx[0][1][:3], (15, 22, 33.0))
+        self.assertIn('INSERT INTO Receipts', payment_tx[1][0])
+        self.assertEqual(payment_tx[1][1], [(500, f'RCPT-{YEAR}-000001', 'c22@example.com')])
 
-    @patch('epic_3_billing.payment_logic.execute_query')
     @patch('epic_3_billing.payment_logic.fetch_one')
-    def test_process_cash_payment_payment_id_fail(self, mock_fetch_one, mock_exec):
-        """Returns False if payment insert fails."""
-        mock_fetch_one.return_value = {'client_id': 10}
-        mock_exec.side_effect = [None]
+    def test_process_cash_payment_reads_client(self, mock_fetch_one):
+        """Without client data it is read once, together with the email."""
+        mock_fetch_one.return_value = {'client_id': 10, 'email': 'c10@example.com'}
         from epic_3_billing.payment_logic import process_cash_payment  # pylint: disable=import-outside-toplevel, import-error
-        ok = process_cash_payment(5, 20.0)
-        self.assertFalse(ok)
+        self.assertTrue(process_cash_payment(5, 20.0))
+        mock_fetch_one.assert_called_once()
+        self.assertEqual(self.receipts()[0][2], 'c10@example.com')
 
-    @patch('epic_3_billing.payment_logic.execute_query')
     @patch('epic_3_billing.payment_logic.fetch_one')
-    def test_process_cash_payment_missing_client(self, mock_fetch_one, mock_exec):
+    def test_process_cash_payment_missing_client(self, mock_fetch_one):
         """Returns False if booking_id is not found."""
         mock_fetch_one.return_value = None
         from epic_3_billing.payment_logic import process_cash_payment  # pylint: disable=import-outside-toplevel, import-error
         ok = process_cash_payment(123, 2.0)
         self.assertFalse(ok)
+        self.assertEqual(self.db.cursors, [])
+
+    def test_failed_receipt_rolls_back_and_reuses_number(self):
+        """A failure after the payment insert fails the whole payment; its receipt number is issued next."""
+        from epic_3_billing.payment_logic import process_cash_payment  # pylint: disable=import-outside-toplevel, import-error
+        self.db.fail_on = 'INSERT INTO Receipts'
+        self.assertFalse(process_cash_payment(15, 33.0, 22, 'c22@example.com'))
+        self.db.fail_on = None
+        self.assertTrue(process_cash_payment(16, 10.0, 22, 'c22@example.com'))
+        self.assertEqual([r[1] for r in self.receipts()], [f'RCPT-{YEAR}-000001'])
+
+    def test_numbers_reserved_in_blocks(self):
+        """The sequence row is only touched once per block."""
+        from epic_3_billing.payment_logic import process_cash_payment  # pylint: disable=import-outside-toplevel, import-error
+        for booking_id in range(4):
+            self.assertTrue(process_cash_payment(booking_id, 1.0, 22, 'c22@example.com'))
+        reservations = [q for q, _ in self.db.statements() if 'FOR UPDATE' in q]
+        self.assertEqual(len(reservations), 2)
+        self.assertEqual([r[1] for r in self.receipts()],
+                         [f'RCPT-{YEAR}-{n:06d}' for n in (1, 2, 3, 4)])
+
+    def test_close_returns_unused_tail(self):
+        """Unused numbers go back unless another process reserved after them."""
+        self.assertEqual(self.allocator.take(1), [f'RCPT-{YEAR}-000001'])
+        self.assertEqual(self.db.next_value[YEAR], 4)
+        self.allocator.close()
+        self.assertEqual(self.db.next_value[YEAR], 2)
+
+        self.allocator.take(1)          # reserves 2-4
+        self.db.next_value[YEAR] = 8    # someone else reserved 5-7
+        self.allocator.close()
+        self.assertEqual(self.db.next_value[YEAR], 8)
+
+    def test_record_cash_payments_batch(self):
+        """A batch writes every payment and receipt with multi-row inserts."""
+        from epic_3_billing.payment_logic import record_cash_payments  # pylint: disable=import-outside-toplevel, import-error
+        cursor = self.db.transaction().__enter__()
+        cursor.fetchall = lambda: [{'payment_id': 500}, {'payment_id': 503}]
+        numbers = record_cash_payments(cursor, [(1, 7, 'a@example.com', 3.0), (2, 8, 'b@example.com', 4.0)],
+                                       self.allocator)
+        self.assertEqual(numbers, [f'RCPT-{YEAR}-000001', f'RCPT-{YEAR}-000002'])
+        self.assertEqual(self.receipts(), [(500, numbers[0], 'a@example.com')])
+        receipts = [rows for query, rows in cursor.statements if 'INSERT INTO Receipts' in query][0]
+        self.assertEqual([r[0] for r in receipts], [500, 503])
 
 if __name__ == '__main__':
     unittest.main()
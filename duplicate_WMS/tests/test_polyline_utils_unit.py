@@ -0,0 +1,53 @@
+"""
+Unit tests for utils.polyline_utils:
+- encode_polyline matches Google's reference example
+- decode_polyline round-trips long traces
+"""
+
+import os
+import sys
+import unittest
+import numpy as np
+
+# Ensure project root is available for runtime imports
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+
+class TestPolyline(unittest.TestCase):
+    """Encoded polyline format."""
+
+    def test_google_reference_example(self):
+        """The example from Google's format documentation encodes identically."""
+        from utils.polyline_utils import encode_polyline, decode_polyline  # pylint: disable=import-outside-toplevel, import-error
+        coords = [(38.5, -120.2), (40.7, -120.95), (43.252, -126.453)]
+        encoded = encode_polyline(coords)
+        self.assertEqual(encoded, '_p~iF~ps|U_ulLnnqC_mqNvxq`@')
+        np.testing.assert_allclose(decode_polyline(encoded), coords)
+
+    def test_round_trip_random_walk(self):
+        """A long trace survives encoding to 1e-5 degree precision."""
+        from utils.polyline_utils import encode_polyline, decode_polyline  # pylint: disable=import-outside-toplevel, import-error
+        rng = np.random.default_rng(0)
+        coords = np.cumsum(rng.normal(0, 0.001, (5000, 2)), axis=0) + [17.4, 78.4]
+        decoded = decode_polyline(encode_polyline(coords))
+        np.testing.assert_allclose(decoded, np.round(coords, 5), atol=1e-9)
+
+    def test_small_negative_and_zero_steps(self):
+        """Zero and -1e-5 deltas encode to single characters."""
+        from utils.polyline_utils import encode_polyline, decode_polyline  # pylint: disable=import-outside-toplevel, import-error
+        coords = [(0.0, 0.0), (-0.00001, 0.0), (-0.00001, 0.0)]
+        encoded = encode_polyline(coords)
+        self.assertEqual(len(encoded), 6)
+        np.testing.assert_allclose(decode_polyline(encoded), coords)
+
+    def test_empty(self):
+        """No points encode to '' and decode to an empty array."""
+        from utils.polyline_utils import encode_polyline, decode_polyline  # pylint: disable=import-outside-toplevel, import-error
+        self.assertEqual(encode_polyline([]), '')
+        self.assertEqual(decode_polyline('').shape, (0, 2))
+
+
+if __name__ == '__main__':
+    unittest.main()
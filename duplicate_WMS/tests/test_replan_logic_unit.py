@@ -0,0 +1,122 @@
+"""
+Unit tests for epic_1_routing.replan_logic:
+- find_cheapest_insertion (capacity and distance)
+- insert_late_bookings (only the chosen assignment is renumbered)
+"""
+
+import os
+import sys
+import unittest
+from unittest.mock import patch, MagicMock
+
+# Ensure project root is available for runtime imports
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+
+def _route(assignment_id, lons, capacity=1000.0, load=0.0):
+    pending = [
+        {'route_stop_id': assignment_id * 10 + i, 'point_id': i, 'stop_order': i + 1,
+         'latitude': 12.0, 'longitude': lon}
+        for i, lon in enumerate(lons)
+    ]
+    return {'assignment_id': assignment_id, 'capacity_kg': capacity, 'load_kg': load,
+            'last_position': None, 'last_stop_order': len(lons), 'pending': pending}
+
+
+class TestFindCheapestInsertion(unittest.TestCase):
+    """Tests for the insertion search."""
+
+    def test_picks_route_and_gap_closest_to_booking(self):
+        """A booking between two stops of a nearby route goes between them."""
+        from epic_1_routing.replan_logic import find_cheapest_insertion  # pylint: disable=import-outside-toplevel, import-error
+        routes = {1: _route(1, [77.00, 77.02]), 2: _route(2, [78.00, 78.02])}
+        booking = {'booking_id': 9, 'point_id': 99, 'latitude': 12.0, 'longitude': 77.01}
+        route, position, added = find_cheapest_insertion(routes, booking, 20.0)
+        self.assertEqual(route['assignment_id'], 1)
+        self.assertEqual(position, 1)
+        self.assertLess(added, 1.0)
+
+    def test_skips_full_vehicles(self):
+        """A route without room is never chosen, even if it is closest."""
+        from epic_1_routing.replan_logic import find_cheapest_insertion  # pylint: disable=import-outside-toplevel, import-error
+        routes = {1: _route(1, [77.00, 77.02], capacity=100, load=90),
+                  2: _route(2, [78.00, 78.02])}
+        booking = {'booking_id': 9, 'point_id': 99, 'latitude': 12.0, 'longitude': 77.01}
+        route, _, _ = find_cheapest_insertion(routes, booking, 20.0)
+        self.assertEqual(route['assignment_id'], 2)
+        routes.pop(2)
+        self.assertIsNone(find_cheapest_insertion(routes, booking, 20.0))
+
+
+class TestInsertLateBookings(unittest.TestCase):
+    """DB wiring tests with mocked boundaries."""
+
+    @patch('epic_1_routing.replan_logic.get_geofence_engine')
+    @patch('epic_1_routing.replan_logic.get_eta_engine')
+    @patch('epic_1_routing.replan_logic.transaction')
+    @patch('epic_1_routing.replan_logic.get_expected_volumes')
+    @patch('epic_1_routing.replan_logic.get_active_routes')
+    @patch('epic_1_routing.replan_logic.get_booking_stop_details')
+    def test_shifts_later_stops_and_inserts(self, mock_details, mock_routes, mock_volumes, mock_transaction,
+                                            mock_eta, mock_geofence):
+        """The new stop takes the order of the stop it precedes, later stops move down by one."""
+        mock_details.return_value = [{'booking_id': 9, 'point_id': 99, 'latitude': 12.0, 'longitude': 77.01}]
+        mock_routes.return_value = {1: _route(1, [77.00, 77.02, 77.04])}
+        mock_volumes.return_value = {}
+        cursor = MagicMock()
+        cursor.fetchone.return_value = {'assignment_id': 1}
+        cursor.rowcount = 1
+        mock_transaction.return_value.__enter__.return_value = cursor
+        from epic_1_routing.replan_logic import insert_late_booking  # pylint: disable=import-outside-toplevel, import-error
+
+        self.assertEqual(insert_late_booking(9), (1, 2))
+        # Only bookings still pending for today are considered
+        self.assertEqual(mock_details.call_args, (([9],), {'pending_only': True}))
+        shift_params = cursor.execute.call_args_list[2][0][1]
+        insert = cursor.execute.call_args_list[3][0]
+        self.assertEqual(shift_params, (1, 2))
+        self.assertEqual(insert[1], (1, 99, 9, 2, 9))
+        self.assertIn('NOT (', insert[0])
+        # Later stops' ETAs and the new stop's geofence are re-read
+        mock_eta.return_value.invalidate.assert_called_once()
+        mock_geofence.return_value.invalidate.assert_called_once()
+
+    @patch('epic_1_routing.replan_logic.get_geofence_engine')
+    @patch('epic_1_routing.replan_logic.get_eta_engine')
+    @patch('epic_1_routing.replan_logic.transaction')
+    @patch('epic_1_routing.replan_logic.get_expected_volumes')
+    @patch('epic_1_routing.replan_logic.get_active_routes')
+    @patch('epic_1_routing.replan_logic.get_booking_stop_details')
+    def test_booking_assigned_meanwhile_is_not_inserted_twice(self, mock_details, mock_routes, mock_volumes,
+                                                              mock_transaction, mock_eta, _mock_geofence):
+        """A booking that got onto a route after it was read is skipped without writing."""
+        mock_details.return_value = [{'booking_id': 9, 'point_id': 99, 'latitude': 12.0, 'longitude': 77.01}]
+        mock_routes.return_value = {1: _route(1, [77.00, 77.02, 77.04])}
+        mock_volumes.return_value = {}
+        cursor = MagicMock()
+        cursor.fetchone.side_effect = [{'assignment_id': 1}, None]
+        mock_transaction.return_value.__enter__.return_value = cursor
+        from epic_1_routing.replan_logic import insert_late_booking  # pylint: disable=import-outside-toplevel, import-error
+
+        self.assertIsNone(insert_late_booking(9))
+        self.assertEqual(cursor.execute.call_count, 2)
+        self.assertIn('FOR UPDATE', cursor.execute.call_args_list[1][0][0])
+        mock_eta.return_value.invalidate.assert_not_called()
+
+    @patch('epic_1_routing.replan_logic.transaction')
+    @patch('epic_1_routing.replan_logic.get_active_routes')
+    @patch('epic_1_routing.replan_logic.get_booking_stop_details')
+    def test_no_active_routes(self, mock_details, mock_routes, mock_transaction):
+        """Without published routes the booking stays pending."""
+        mock_details.return_value = [{'booking_id': 9, 'point_id': 99, 'latitude': 12.0, 'longitude': 77.01}]
+        mock_routes.return_value = {}
+        from epic_1_routing.replan_logic import insert_late_booking  # pylint: disable=import-outside-toplevel, import-error
+
+        self.assertIsNone(insert_late_booking(9))
+        mock_transaction.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
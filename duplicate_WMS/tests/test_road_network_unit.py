@@ -0,0 +1,161 @@
+"""
+Unit tests for epic_1_routing.road_network:
+- building the graph from an OSM XML extract (one-way streets, access tags)
+- snapping points to the nearest node
+- Dijkstra / A* shortest paths
+- the on-disk travel cache and compiled graph reuse
+Uses a tiny hand-written extract in a temporary directory.
+"""
+
+import os
+import sys
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from unittest.mock import patch
+import numpy as np
+
+# Ensure project root is available for runtime imports
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+# Four corners of a block ~1.1 km on each side. The top street (2 -> 3) is
+# one-way eastbound, so going from 3 back to 2 means driving round the block.
+OSM_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<osm version="0.6">
+  <node id="1" lat="12.000" lon="77.000"/>
+  <node id="2" lat="12.010" lon="77.000"/>
+  <node id="3" lat="12.010" lon="77.010"/>
+  <node id="4" lat="12.000" lon="77.010"/>
+  <node id="5" lat="12.005" lon="77.005"/>
+  <way id="10">
+    <nd ref="1"/><nd ref="2"/>
+    <tag k="highway" v="residential"/>
+  </way>
+  <way id="11">
+    <nd ref="2"/><nd ref="3"/>
+    <tag k="highway" v="residential"/>
+    <tag k="oneway" v="yes"/>
+  </way>
+  <way id="12">
+    <nd ref="3"/><nd ref="4"/><nd ref="1"/>
+    <tag k="highway" v="residential"/>
+  </way>
+  <way id="13">
+    <nd ref="1"/><nd ref="5"/>
+    <tag k="highway" v="service"/>
+    <tag k="access" v="private"/>
+  </way>
+  <way id="14">
+    <nd ref="2"/><nd ref="4"/>
+    <tag k="highway" v="footway"/>
+  </way>
+</osm>
+"""
+
+
+class TestRoadNetwork(unittest.TestCase):
+    """Graph building, snapping and shortest paths on the sample block."""
+
+    def setUp(self):
+        from epic_1_routing.road_network import RoadNetwork  # pylint: disable=import-outside-toplevel, import-error
+        self.tmpdir = tempfile.mkdtemp()
+        self.osm_path = os.path.join(self.tmpdir, 'block.osm')
+        with open(self.osm_path, 'w', encoding='utf-8') as f:
+            f.write(OSM_XML)
+        self.cache_path = os.path.join(self.tmpdir, 'cache.sqlite')
+        self.network = RoadNetwork.from_osm_xml(self.osm_path, cache_path=self.cache_path)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def node(self, osm_id):
+        return int(list(self.network.node_ids).index(osm_id))
+
+    def test_only_drivable_public_ways_are_kept(self):
+        """Private and footway-only nodes are left out of the graph."""
+        self.assertEqual(sorted(self.network.node_ids.tolist()), [1, 2, 3, 4])
+        # 1-2, 3-4, 4-1 both ways plus 2->3 only
+        self.assertEqual(len(self.network.indices), 7)
+
+    def test_one_way_street_makes_routes_asymmetric(self):
+        """Driving against the one-way street has to go round the block."""
+        forward = self.network.route(self.node(2), self.node(3))
+        backward = self.network.route(self.node(3), self.node(2))
+        self.assertEqual([self.network.node_ids[n] for n in forward[2]], [2, 3])
+        self.assertEqual([self.network.node_ids[n] for n in backward[2]], [3, 4, 1, 2])
+        self.assertGreater(backward[1], 2.5 * forward[1])
+
+    def test_dijkstra_agrees_with_a_star(self):
+        """Both searches find the same fastest path."""
+        result = self.network.shortest_paths(self.node(3), [self.node(2), self.node(1)])
+        seconds, meters, _ = self.network.route(self.node(3), self.node(2))
+        self.assertAlmostEqual(result[self.node(2)][0], seconds)
+        self.assertAlmostEqual(result[self.node(2)][1], meters)
+        self.assertIn(self.node(1), result)
+
+    def test_snap_returns_nearest_node_and_offset(self):
+        """Points are snapped to the closest graph node."""
+        nodes, offsets = self.network.snap([(12.0101, 77.0099), (12.0, 77.0)])
+        self.assertEqual(self.network.node_ids[nodes].tolist(), [3, 1])
+        self.assertGreater(offsets[0], 0)
+        self.assertAlmostEqual(offsets[1], 0.0)
+
+    def test_travel_matrix_is_cached_on_disk(self):
+        """Searched pairs are stored and reused instead of searched again."""
+        coords = [(12.010, 77.000), (12.010, 77.010), (12.000, 77.000)]
+        seconds, meters = self.network.travel_matrix(coords)
+        self.assertGreater(meters[1, 0], 2.5 * meters[0, 1])
+        self.assertTrue((seconds > 0)[~np.eye(3, dtype=bool)].all())
+
+        with sqlite3.connect(self.cache_path) as conn:
+            count = conn.execute("SELECT COUNT(*) FROM travel_cache").fetchone()[0]
+        self.assertEqual(count, 6)
+
+        with patch.object(self.network, 'shortest_paths') as mock_search:
+            again_s, again_m = self.network.travel_matrix(coords)
+        mock_search.assert_not_called()
+        self.assertTrue((again_s == seconds).all())
+        self.assertTrue((again_m == meters).all())
+
+    def test_cache_lookup_does_not_bind_a_variable_per_point(self):
+        """Large matrices stay under SQLite's bound-variable limit (999 on older builds)."""
+        coords = [(12.010, 77.000), (12.010, 77.010), (12.000, 77.000)]
+        self.network.travel_matrix(coords)
+        open_cache = self.network._open_cache  # pylint: disable=protected-access
+
+        def limited_cache():
+            conn = open_cache()
+            conn.setlimit(sqlite3.SQLITE_LIMIT_VARIABLE_NUMBER, 4)
+            return conn
+
+        with patch.object(self.network, '_open_cache', limited_cache), \
+                patch.object(self.network, 'shortest_paths') as mock_search:
+            self.network.travel_matrix(coords)
+        mock_search.assert_not_called()
+
+    def test_unreachable_pair_falls_back_to_straight_line(self):
+        """Pairs with no road path get the straight-line distance times the detour factor."""
+        from epic_1_routing.road_network import DETOUR_FACTOR  # pylint: disable=import-outside-toplevel, import-error
+        from utils.geo_utils import distance_matrix  # pylint: disable=import-outside-toplevel, import-error
+        coords = [(12.0, 77.0), (12.01, 77.01)]
+        with patch.object(self.network, 'shortest_paths', return_value={}):
+            _, meters = self.network.travel_matrix(coords)
+        self.assertAlmostEqual(meters[0, 1], distance_matrix(coords)[0, 1] * DETOUR_FACTOR)
+
+    def test_load_reuses_compiled_graph(self):
+        """The second load reads the saved .npz instead of parsing the XML again."""
+        from epic_1_routing.road_network import RoadNetwork  # pylint: disable=import-outside-toplevel, import-error
+        first = RoadNetwork.load(self.osm_path)
+        self.assertTrue(os.path.exists(self.osm_path + '.graph.npz'))
+        with patch.object(RoadNetwork, 'from_osm_xml') as mock_parse:
+            second = RoadNetwork.load(self.osm_path)
+        mock_parse.assert_not_called()
+        self.assertEqual(second.indices.tolist(), first.indices.tolist())
+        self.assertEqual(second.signature, first.signature)
+
+
+if __name__ == '__main__':
+    unittest.main()
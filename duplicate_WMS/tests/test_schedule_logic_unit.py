@@ -0,0 +1,145 @@
+"""
+Unit tests for epic_3_billing.schedule_logic:
+- weekly, biweekly and monthly occurrences
+- materialization: one multi-row upsert per chunk, only uncovered days
+- creating and cancelling schedules
+"""
+
+import os
+import sys
+import datetime
+import unittest
+from unittest.mock import patch, MagicMock
+
+# Ensure project root is available for runtime imports
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+TODAY = datetime.date(2025, 1, 1)   # a Wednesday
+
+
+def _d(day):
+    return datetime.date(2025, 1, day)
+
+
+def _schedule(schedule_id, frequency='Weekly', start=_d(2), end=None, materialized_until=None, client_id=7):
+    return {'schedule_id': schedule_id, 'client_id': client_id, 'point_id': 3, 'frequency': frequency,
+            'start_date': start, 'end_date': end, 'window_start': None, 'window_end': None,
+            'waste_type': 'General', 'materialized_until': materialized_until}
+
+
+class TestOccurrences(unittest.TestCase):
+    """Dates a schedule falls on."""
+
+    def test_weekly_and_biweekly(self):
+        from epic_3_billing.schedule_logic import occurrences  # pylint: disable=import-outside-toplevel, import-error
+        self.assertEqual(occurrences('Weekly', _d(2), _d(5), _d(20)), [_d(9), _d(16)])
+        self.assertEqual(occurrences('Biweekly', _d(2), _d(1), _d(31)), [_d(2), _d(16), _d(30)])
+        self.assertEqual(occurrences('Weekly', _d(20), _d(1), _d(10)), [])
+
+    def test_monthly_keeps_day_of_month(self):
+        """The 31st becomes the last day of shorter months."""
+        from epic_3_billing.schedule_logic import occurrences  # pylint: disable=import-outside-toplevel, import-error
+        dates = occurrences('Monthly', _d(31), datetime.date(2025, 2, 1), datetime.date(2025, 5, 31))
+        self.assertEqual(dates, [datetime.date(2025, 2, 28), datetime.date(2025, 3, 31),
+                                 datetime.date(2025, 4, 30), datetime.date(2025, 5, 31)])
+        dates = occurrences('Monthly', _d(10), datetime.date(2025, 2, 15), datetime.date(2025, 4, 1))
+        self.assertEqual(dates, [datetime.date(2025, 3, 10)])
+
+
+@patch('epic_3_billing.schedule_logic.invalidate_client_summary')
+@patch('epic_3_billing.schedule_logic.transaction')
+@patch('epic_3_billing.schedule_logic.fetch_all')
+class TestMaterializeBookings(unittest.TestCase):
+    """The daily materialization job."""
+
+    def setUp(self):
+        self.cursor = MagicMock()
+        self.cursor.rowcount = 3
+
+    def test_one_upsert_per_chunk(self, mock_fetch, mock_tx, mock_invalidate):
+        """Every schedule of a chunk is written with one multi-row upsert and one cursor update."""
+        mock_tx.return_value.__enter__.return_value = self.cursor
+        mock_fetch.side_effect = [
+            [_schedule(1), _schedule(2, 'Biweekly', client_id=8)],
+            [_schedule(5, 'Monthly', start=_d(10), materialized_until=_d(10))],
+            [],
+        ]
+        from epic_3_billing.schedule_logic import materialize_bookings  # pylint: disable=import-outside-toplevel, import-error
+        summary = materialize_bookings(horizon_days=14, today=TODAY, chunk_size=2)
+        self.assertEqual(summary, {'schedules': 3, 'bookings': 3})
+        # The monthly one has nothing new up to the 15th, but still moves its cursor
+        self.assertEqual(mock_tx.call_count, 2)
+        self.cursor.executemany.assert_called_once()
+
+        upsert, rows = self.cursor.executemany.call_args[0]
+        self.assertIn('ON DUPLICATE KEY UPDATE', upsert)
+        self.assertEqual([(r[6], r[2]) for r in rows], [(1, _d(2)), (1, _d(9)), (2, _d(2))])
+        updates = [c[0] for c in self.cursor.execute.call_args_list]
+        self.assertIn('materialized_until', updates[0][0])
+        self.assertEqual([u[1] for u in updates], [(_d(15), 1, 2), (_d(15), 5)])
+        # Keyset over schedules: the second read starts after the first chunk
+        self.assertEqual(mock_fetch.call_args_list[1][0][1][0], 2)
+        mock_invalidate.assert_any_call(7, 8)
+
+    def test_skips_covered_days_and_respects_end(self, mock_fetch, mock_tx, _):
+        mock_tx.return_value.__enter__.return_value = self.cursor
+        mock_fetch.side_effect = [[_schedule(1, materialized_until=_d(9)), _schedule(2, end=_d(5))], []]
+        from epic_3_billing.schedule_logic import materialize_bookings  # pylint: disable=import-outside-toplevel, import-error
+        materialize_bookings(horizon_days=20, today=TODAY)
+        rows = self.cursor.executemany.call_args[0][1]
+        self.assertEqual([(r[6], r[2]) for r in rows], [(1, _d(16)), (2, _d(2))])
+
+    def test_errors(self, mock_fetch, mock_tx, _):
+        """A failed read or write stops the run; the next run picks the schedules up again."""
+        from epic_3_billing.schedule_logic import materialize_bookings  # pylint: disable=import-outside-toplevel, import-error
+        mock_fetch.return_value = None
+        self.assertIsNone(materialize_bookings(today=TODAY))
+        mock_fetch.return_value = [_schedule(1)]
+        mock_tx.side_effect = Exception('deadlock')
+        self.assertIsNone(materialize_bookings(today=TODAY))
+
+
+@patch('epic_3_billing.schedule_logic.invalidate_client_summary')
+@patch('epic_3_billing.schedule_logic.transaction')
+class TestSchedules(unittest.TestCase):
+    """Creating and cancelling schedules."""
+
+    @patch('epic_3_billing.schedule_logic.materialize_bookings')
+    def test_create_materializes_new_schedule(self, mock_materialize, mock_tx, _):
+        cursor = mock_tx.return_value.__enter__.return_value
+        cursor.lastrowid = 12
+        from epic_3_billing.schedule_logic import create_schedule  # pylint: disable=import-outside-toplevel, import-error
+        tomorrow = datetime.date.today() + datetime.timedelta(days=1)
+        self.assertEqual(create_schedule(7, 3, 'Weekly', tomorrow), 12)
+        mock_materialize.assert_called_once_with(schedule_ids=[12])
+
+    def test_create_validates(self, mock_tx, _):
+        from epic_3_billing.schedule_logic import create_schedule  # pylint: disable=import-outside-toplevel, import-error
+        tomorrow = datetime.date.today() + datetime.timedelta(days=1)
+        self.assertIsNone(create_schedule(7, 3, 'Daily', tomorrow))
+        self.assertIsNone(create_schedule(7, 3, 'Weekly', datetime.date.today()))
+        self.assertIsNone(create_schedule(7, 3, 'Weekly', tomorrow, end_date=datetime.date.today()))
+        mock_tx.assert_not_called()
+
+    def test_cancel_cancels_future_bookings(self, mock_tx, mock_invalidate):
+        cursor = mock_tx.return_value.__enter__.return_value
+        cursor.rowcount = 1
+        from epic_3_billing.schedule_logic import cancel_schedule  # pylint: disable=import-outside-toplevel, import-error
+        self.assertTrue(cancel_schedule(12, 7))
+        statements = [c[0][0] for c in cursor.execute.call_args_list]
+        self.assertIn('active = 0', statements[0])
+        self.assertIn("status = 'Cancelled'", statements[1])
+        mock_invalidate.assert_called_once_with(7)
+
+    def test_cancel_other_clients_schedule(self, mock_tx, _):
+        cursor = mock_tx.return_value.__enter__.return_value
+        cursor.rowcount = 0
+        from epic_3_billing.schedule_logic import cancel_schedule  # pylint: disable=import-outside-toplevel, import-error
+        self.assertFalse(cancel_schedule(12, 99))
+        self.assertEqual(cursor.execute.call_count, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
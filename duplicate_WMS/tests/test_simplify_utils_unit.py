@@ -0,0 +1,85 @@
+"""
+Unit tests for utils.simplify_utils:
+- vectorized Douglas-Peucker ranks agree with the recursive algorithm
+- tolerances are in meters
+- closed loops (start == end) simplify correctly
+"""
+
+import os
+import sys
+import unittest
+import numpy as np
+
+# Ensure project root is available for runtime imports
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+
+def _recursive_dp(xy, tolerance):
+    """Plain recursive Douglas-Peucker on projected points, for comparison."""
+    from utils.simplify_utils import _segment_distances  # pylint: disable=import-outside-toplevel, import-error
+    keep = {0, len(xy) - 1}
+
+    def split(i, j):
+        if j - i < 2:
+            return
+        inner = xy[i + 1:j]
+        dist = _segment_distances(inner, np.repeat(xy[[i]], len(inner), 0), np.repeat(xy[[j]], len(inner), 0))
+        k = int(dist.argmax())
+        if dist[k] > tolerance:
+            keep.add(i + 1 + k)
+            split(i, i + 1 + k)
+            split(i + 1 + k, j)
+
+    split(0, len(xy) - 1)
+    return sorted(keep)
+
+
+class TestSimplify(unittest.TestCase):
+    """Line simplification."""
+
+    def setUp(self):
+        rng = np.random.default_rng(3)
+        self.coords = np.cumsum(rng.normal(0, 0.0003, (1500, 2)), axis=0) + [17.4, 78.4]
+
+    def test_matches_recursive_douglas_peucker(self):
+        """Every tolerance keeps exactly the points recursive Douglas-Peucker keeps."""
+        from utils.simplify_utils import simplification_ranks, _project  # pylint: disable=import-outside-toplevel, import-error
+        ranks = simplification_ranks(self.coords)
+        xy = _project(self.coords)
+        for tolerance in (300.0, 60.0, 8.0):
+            self.assertEqual(list(np.flatnonzero(ranks > tolerance)), _recursive_dp(xy, tolerance))
+
+    def test_tolerance_in_meters(self):
+        """A 30 m bump survives a 10 m tolerance and is dropped at 50 m."""
+        from utils.simplify_utils import simplify_line  # pylint: disable=import-outside-toplevel, import-error
+        # ~0.00027 degrees of latitude is 30 m
+        line = [(17.0, 78.0), (17.00027, 78.005), (17.0, 78.01)]
+        self.assertEqual(len(simplify_line(line, 10.0)), 3)
+        self.assertEqual(len(simplify_line(line, 50.0)), 2)
+
+    def test_closed_loop(self):
+        """A round trip back to the start keeps its far point."""
+        from utils.simplify_utils import simplify_line  # pylint: disable=import-outside-toplevel, import-error
+        loop = [(17.0, 78.0), (17.01, 78.0), (17.02, 78.0), (17.01, 78.0), (17.0, 78.0)]
+        self.assertEqual(simplify_line(loop, 100.0).tolist(), [[17.0, 78.0], [17.02, 78.0], [17.0, 78.0]])
+
+    def test_levels_are_nested(self):
+        """Coarser levels are subsets of finer ones; tolerance 0 keeps every bend."""
+        from utils.simplify_utils import simplification_levels  # pylint: disable=import-outside-toplevel, import-error
+        levels = simplification_levels(self.coords, (200.0, 20.0, 0.0))
+        sets = [set(map(tuple, level)) for _, level in levels]
+        self.assertTrue(sets[0] <= sets[1] <= sets[2])
+        self.assertEqual(len(levels[-1][1]), len(self.coords))
+
+    def test_short_lines(self):
+        """Empty, single-point and two-point lines come back unchanged."""
+        from utils.simplify_utils import simplify_line  # pylint: disable=import-outside-toplevel, import-error
+        self.assertEqual(simplify_line([], 10.0).shape, (0, 2))
+        self.assertEqual(len(simplify_line([(17.0, 78.0)], 10.0)), 1)
+        self.assertEqual(len(simplify_line([(17.0, 78.0), (17.1, 78.1)], 1e9)), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
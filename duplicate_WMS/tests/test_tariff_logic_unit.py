@@ -0,0 +1,162 @@
+"""
+Unit tests for epic_3_billing.tariff_logic:
+- tiered (marginal) bracket prices
+- most specific tariff in effect on the day
+- batch pricing matches single prices
+- reloading when the tables change, and the flat-rate fallback
+"""
+
+import os
+import sys
+import datetime
+import unittest
+from unittest.mock import patch
+
+import numpy as np
+
+# Ensure project root is available for runtime imports
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+JAN = datetime.date(2025, 1, 1)
+JUN = datetime.date(2025, 6, 1)
+
+
+def _rows(tariff_id, brackets, client_id=None, zone=None, waste_type=None, start=datetime.date(2000, 1, 1), end=None):
+    return [{'tariff_id': tariff_id, 'client_id': client_id, 'zone': zone, 'waste_type': waste_type,
+             'effective_from': start, 'effective_to': end, 'min_kg': kg, 'rate_per_kg': rate}
+            for kg, rate in brackets]
+
+
+TARIFFS = (
+    _rows(1, [(0, 3.0)])
+    + _rows(2, [(0, 3.0), (100, 2.5)], waste_type='General', start=JUN)
+    + _rows(3, [(0, 5.0)], waste_type='Hazardous')
+    + _rows(4, [(0, 2.0)], zone='North')
+    + _rows(5, [(0, 1.0)], client_id=7, start=JAN, end=datetime.date(2025, 3, 31))
+)
+
+
+class FakeClock:
+    """Monotonic clock the test moves by hand."""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@patch('epic_3_billing.tariff_logic.fetch_one')
+@patch('epic_3_billing.tariff_logic.fetch_all')
+class TestTariffEngine(unittest.TestCase):
+    """Lookup and pricing."""
+
+    def make(self, mock_fetch_all, mock_fetch_one, rows=TARIFFS):
+        from epic_3_billing.tariff_logic import TariffEngine  # pylint: disable=import-outside-toplevel, import-error
+        mock_fetch_all.return_value = rows
+        mock_fetch_one.return_value = {'tariffs': 5, 'changed': datetime.datetime(2025, 1, 1)}
+        self.clock = FakeClock()
+        return TariffEngine(reload_check_s=60, clock=self.clock)
+
+    def test_brackets_are_marginal(self, mock_fetch_all, mock_fetch_one):
+        """150 kg at 3.00 up to 100 kg and 2.50 above costs 300 + 125."""
+        engine = self.make(mock_fetch_all, mock_fetch_one)
+        self.assertEqual(engine.price(150, day=JUN), 425.0)
+        self.assertEqual(engine.price(80, day=JUN), 240.0)
+        self.assertEqual(engine.price(150, day=JAN), 450.0)   # before the tiered tariff starts
+
+    def test_most_specific_tariff_wins(self, mock_fetch_all, mock_fetch_one):
+        """Client beats zone beats waste type beats the open tariff; expired tariffs fall through."""
+        engine = self.make(mock_fetch_all, mock_fetch_one)
+        self.assertEqual(engine.price(10, client_id=7, zone='North', waste_type='Hazardous', day=JAN), 10.0)
+        self.assertEqual(engine.price(10, client_id=7, zone='North', waste_type='Hazardous', day=JUN), 20.0)
+        self.assertEqual(engine.price(10, client_id=8, waste_type='Hazardous', day=JUN), 50.0)
+        self.assertEqual(engine.price(10, client_id=8, day=JUN), 30.0)   # no waste type means General
+
+    def test_price_many_matches_single_prices(self, mock_fetch_all, mock_fetch_one):
+        """A batch is priced like its items one by one, with one load."""
+        engine = self.make(mock_fetch_all, mock_fetch_one)
+        weights = [150, 10, 10, 0.5]
+        clients = [None, 7, 8, 7]
+        zones = [None, None, 'North', None]
+        days = [JUN, JAN, JUN, datetime.datetime(2025, 2, 1, 10, 0)]
+        amounts = engine.price_many(weights, clients, zones, 'General', days)
+        expected = [engine.price(w, c, z, 'General', d) for w, c, z, d in zip(weights, clients, zones, days)]
+        np.testing.assert_allclose(amounts, expected)
+        np.testing.assert_allclose(amounts, [425.0, 10.0, 20.0, 0.5])
+        self.assertEqual(mock_fetch_all.call_count, 1)
+
+    def test_reloads_only_when_tables_change(self, mock_fetch_all, mock_fetch_one):
+        """The tables are checked every interval and recompiled when their version moves."""
+        engine = self.make(mock_fetch_all, mock_fetch_one)
+        engine.price(10)
+        self.clock.now = 61
+        engine.price(10)
+        self.assertEqual(mock_fetch_all.call_count, 1)
+        mock_fetch_all.return_value = _rows(9, [(0, 4.0)])
+        mock_fetch_one.return_value = {'tariffs': 1, 'changed': datetime.datetime(2025, 2, 1)}
+        self.clock.now = 122
+        self.assertEqual(engine.price(10), 40.0)
+        self.assertEqual(mock_fetch_all.call_count, 2)
+
+    def test_falls_back_to_flat_rate(self, mock_fetch_all, mock_fetch_one):
+        """Without readable tariffs a collection is still priced at the default rate."""
+        engine = self.make(mock_fetch_all, mock_fetch_one, rows=None)
+        self.assertEqual(engine.price(10), 30.0)
+
+
+class TestSaveTariff(unittest.TestCase):
+    """Adding tariffs."""
+
+    @patch('epic_3_billing.tariff_logic.get_tariff_engine')
+    @patch('epic_3_billing.tariff_logic.transaction')
+    def test_saves_tariff_and_brackets(self, mock_tx, mock_engine):
+        """The tariff and its brackets go in one transaction; the book is rebuilt."""
+        from epic_3_billing.tariff_logic import save_tariff  # pylint: disable=import-outside-toplevel, import-error
+        cursor = mock_tx.return_value.__enter__.return_value
+        cursor.lastrowid = 12
+        self.assertEqual(save_tariff([(100, 2.5), (0, 3)], JAN, zone='North'), 12)
+        self.assertEqual(cursor.executemany.call_args[0][1], [(12, 0.0, 3.0), (12, 100.0, 2.5)])
+        mock_engine.return_value.load.assert_called_once()
+
+    @patch('epic_3_billing.tariff_logic.transaction')
+    def test_rejects_bad_brackets(self, mock_tx):
+        """Brackets must start at 0 kg and have non-negative rates."""
+        from epic_3_billing.tariff_logic import save_tariff  # pylint: disable=import-outside-toplevel, import-error
+        self.assertIsNone(save_tariff([(10, 3.0)], JAN))
+        self.assertIsNone(save_tariff([(0, -1.0)], JAN))
+        self.assertIsNone(save_tariff([(0, 3.0)], JUN, effective_to=JAN))
+        mock_tx.assert_not_called()
+
+
+class TestPointZones(unittest.TestCase):
+    """Assigning collection points to tariff zones."""
+
+    @patch('epic_3_billing.tariff_logic.get_assignment_cache')
+    @patch('epic_3_billing.tariff_logic.execute_query', return_value=2)
+    def test_sets_zone_and_refreshes_drivers(self, mock_execute, mock_cache):
+        """One UPDATE for every point; drivers' cached stops pick up the zone."""
+        from epic_3_billing.tariff_logic import set_point_tariff_zone  # pylint: disable=import-outside-toplevel, import-error
+        self.assertEqual(set_point_tariff_zone([4, '7'], ' North '), 2)
+        sql, params = mock_execute.call_args[0]
+        self.assertIn('IN (%s, %s)', sql)
+        self.assertEqual(params, ('North', 4, 7))
+        mock_cache.return_value.invalidate.assert_called_once_with()
+
+        self.assertEqual(set_point_tariff_zone([4], ''), 2)
+        self.assertEqual(mock_execute.call_args[0][1], (None, 4))
+
+    @patch('epic_3_billing.tariff_logic.get_assignment_cache')
+    @patch('epic_3_billing.tariff_logic.execute_query', return_value=None)
+    def test_failed_update(self, mock_execute, mock_cache):
+        from epic_3_billing.tariff_logic import set_point_tariff_zone  # pylint: disable=import-outside-toplevel, import-error
+        self.assertIsNone(set_point_tariff_zone([4], 'North'))
+        self.assertEqual(set_point_tariff_zone([], 'North'), 0)
+        self.assertEqual(mock_execute.call_count, 1)
+        mock_cache.return_value.invalidate.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
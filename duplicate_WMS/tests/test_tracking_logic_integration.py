@@ -6,7 +6,7 @@ Mocks DB, geo, payment, but wires together stop updating, payment, and completio
 import os
 import sys
 import unittest
-from unittest.mock import patch
+from unittest.mock import patch, MagicMock
 
 # Set sys.path for runtime dynamic import
 PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
@@ -14,28 +14,45 @@ if PROJECT_ROOT not in sys.path:
     sys.path.insert(0, PROJECT_ROOT)
 
 
+def _no_cached_assignment():
+    """An assignment cache that knows nothing, so stops are read from the database."""
+    cache = MagicMock()
+    cache.get.return_value = None
+    cache.find_stop.return_value = None
+    return cache
+
+
 class TestTrackingLogicIntegration(unittest.TestCase):
     """
     Integration tests for mark_stop_complete and flow combinations.
     """
 
-    @patch('epic_2_operations.tracking_logic._check_and_complete_assignment')
-    @patch('epic_2_operations.tracking_logic.execute_query')
-    @patch('epic_2_operations.tracking_logic.process_cash_payment')
+    @patch('epic_2_operations.tracking_logic.invalidate_client_summary')
+    @patch('epic_2_operations.tracking_logic.get_receipt_allocator')
+    @patch('epic_2_operations.tracking_logic.get_assignment_cache')
+    @patch('epic_2_operations.tracking_logic.record_locations')
+    @patch('epic_2_operations.tracking_logic.transaction')
+    @patch('epic_2_operations.tracking_logic.price_stop', MagicMock(return_value=15.0))
+    @patch('epic_2_operations.tracking_logic.record_cash_payments')
     @patch('epic_2_operations.tracking_logic.fetch_one')
     @patch('epic_2_operations.tracking_logic.calculate_distance')
     def test_mark_stop_complete_success_flow(
-        self, mock_dist, mock_fetch, mock_pay, mock_exec, mock_check
+        self, mock_dist, mock_fetch, mock_pay, mock_tx, mock_record, mock_cache, mock_allocator, mock_invalidate
     ):
         """
-        Happy path: mark stop complete, process payment, update DB, call check-complete.
+        Happy path: update the stop, the assignment counter, the payment
+        with its receipt and the booking in one transaction.
+        The stop and vehicle come from the cached assignment, without a query.
         """
-        mock_fetch.side_effect = [
-            {'latitude': 12.0, 'longitude': 77.0, 'booking_id': 101, 'assignment_id': 505},
-            {'vehicle_id': 66}
-        ]
+        cursor = mock_tx.return_value.__enter__.return_value
+        cursor.rowcount = 1
+        cursor.fetchone.return_value = {'status': 'Completed'}
+        cache = mock_cache.return_value
+        cache.get.return_value = {'assignment_id': 505, 'vehicle_id': 66, 'stops': []}
+        cache.find_stop.return_value = {'route_stop_id': 21, 'latitude': 12.0, 'longitude': 77.0, 'booking_id': 101,
+                                        'client_id': 40, 'client_email': 'c40@example.com'}
         mock_dist.return_value = 10.0
-        mock_pay.return_value = True
+        mock_pay.return_value = ['RCPT-2025-000001']
 
         from epic_2_operations.tracking_logic import mark_stop_complete  # pylint: disable=import-outside-toplevel, import-error
 
@@ -44,10 +61,25 @@ class TestTrackingLogicIntegration(unittest.TestCase):
             driver_lon=77.0, weight=5.0
         )
         self.assertIn('complete', msg.lower())
-        self.assertTrue(mock_pay.called)
-        self.assertTrue(mock_exec.called)
-        self.assertTrue(mock_check.called)
+        mock_fetch.assert_not_called()
+        # The client and receipt address come from the cached stop
+        mock_pay.assert_called_once_with(cursor, [(101, 40, 'c40@example.com', 15.0)],
+                                         mock_allocator.return_value)
+        mock_invalidate.assert_called_once_with(40)
+        statements = [c[0][0] for c in cursor.execute.call_args_list]
+        self.assertIn('UPDATE RouteStops', statements[0])
+        self.assertIn('completed_stops + 1', statements[1])
+        self.assertIn('ServiceBookings', statements[-1])
+        # The driver's daily cash totals move in the same transaction
+        daily_cash = cursor.executemany.call_args
+        self.assertIn('DriverDailyCash', daily_cash[0][0])
+        self.assertEqual(daily_cash[0][1][0][1:], (9, 1, 5.0, 15.0, 15.0))
+        cache.complete_stop.assert_called_once_with(9, 21)
+        cache.invalidate_assignment.assert_called_once_with(505)
+        # Verification point goes to the history and the latest-position table
+        self.assertEqual(mock_record.call_args[0][0][0][:3], (66, 12.0, 77.0))
 
+    @patch('epic_2_operations.tracking_logic.get_assignment_cache', _no_cached_assignment)
     @patch('epic_2_operations.tracking_logic.fetch_one')
     def test_mark_stop_complete_no_stop(self, mock_fetch):
         """Returns error if stop not found."""
@@ -56,6 +88,7 @@ class TestTrackingLogicIntegration(unittest.TestCase):
         result = mark_stop_complete(1, 2, 0, 0, 1)
         self.assertIn('not found', result.lower())
 
+    @patch('epic_2_operations.tracking_logic.get_assignment_cache', _no_cached_assignment)
     @patch('epic_2_operations.tracking_logic.fetch_one')
     @patch('epic_2_operations.tracking_logic.calculate_distance')
     def test_mark_stop_complete_too_far(self, mock_dist, mock_fetch):
@@ -68,41 +101,103 @@ class TestTrackingLogicIntegration(unittest.TestCase):
         result = mark_stop_complete(1, 2, 10, 10, 3)
         self.assertIn('verification failed', result.lower())
 
-    @patch('epic_2_operations.tracking_logic.process_cash_payment')
+    @patch('epic_2_operations.tracking_logic.get_assignment_cache', _no_cached_assignment)
+    @patch('epic_2_operations.tracking_logic.get_receipt_allocator')
+    @patch('epic_2_operations.tracking_logic.transaction')
+    @patch('epic_2_operations.tracking_logic.price_stop', MagicMock(return_value=15.0))
+    @patch('epic_2_operations.tracking_logic.record_cash_payments')
     @patch('epic_2_operations.tracking_logic.fetch_one')
     @patch('epic_2_operations.tracking_logic.calculate_distance')
-    def test_mark_stop_complete_payment_fail(self, mock_dist, mock_fetch, mock_pay):
-        """Returns error if cash payment fails."""
+    def test_mark_stop_complete_payment_fail(self, mock_dist, mock_fetch, mock_pay, mock_tx, mock_allocator):
+        """A failed payment rolls the stop back with it."""
         mock_fetch.side_effect = [
-            {'latitude': 12.0, 'longitude': 77.0, 'booking_id': 202, 'assignment_id': 333},
-            None
+            {'latitude': 12.0, 'longitude': 77.0, 'booking_id': 202, 'assignment_id': 333,
+             'client_id': 40, 'client_email': 'c40@example.com'},
         ]
         mock_dist.return_value = 5.0
-        mock_pay.return_value = False
+        mock_tx.return_value.__enter__.return_value.rowcount = 1
+        mock_pay.side_effect = Exception("duplicate receipt")
         from epic_2_operations.tracking_logic import mark_stop_complete  # pylint: disable=import-outside-toplevel, import-error
         out = mark_stop_complete(8, 12, 12.1, 77.1, 3.3)
-        self.assertIn('could not process cash payment', out.lower())
+        self.assertIn('could not update', out.lower())
+        self.assertIsNotNone(mock_tx.return_value.__exit__.call_args[0][0])
+        mock_allocator.return_value.release.assert_called_once_with([])
 
-    @patch('epic_2_operations.tracking_logic._check_and_complete_assignment')
-    @patch('epic_2_operations.tracking_logic.execute_query')
-    @patch('epic_2_operations.tracking_logic.process_cash_payment')
+    @patch('epic_2_operations.tracking_logic.get_assignment_cache', _no_cached_assignment)
+    @patch('epic_2_operations.tracking_logic.transaction')
+    @patch('epic_2_operations.tracking_logic.price_stop', MagicMock(return_value=15.0))
+    @patch('epic_2_operations.tracking_logic.record_cash_payments')
     @patch('epic_2_operations.tracking_logic.fetch_one')
     @patch('epic_2_operations.tracking_logic.calculate_distance')
     def test_mark_stop_complete_no_booking_id(
-        self, mock_dist, mock_fetch, mock_pay, mock_exec, mock_check  # pylint: disable=unused-argument
+        self, mock_dist, mock_fetch, mock_pay, mock_tx
     ):
         """
         Should still try to complete stop even if booking_id is missing (no payment).
         """
         mock_fetch.side_effect = [
             {'latitude': 1.0, 'longitude': 2.0, 'booking_id': None, 'assignment_id': 7},
-            None
         ]
         mock_dist.return_value = 1.0
+        cursor = mock_tx.return_value.__enter__.return_value
+        cursor.rowcount = 1
         from epic_2_operations.tracking_logic import mark_stop_complete  # pylint: disable=import-outside-toplevel, import-error
         msg = mark_stop_complete(5, 10, 1.0, 2.0, 7.0)
-        self.assertIn('complete', msg.lower())
+        self.assertIn('marked complete', msg.lower())
         mock_pay.assert_not_called()
+        # Counted for the driver's day, but neither billed nor logged
+        self.assertEqual(cursor.executemany.call_args[0][1][0][1:], (5, 1, 7.0, 0.0, 0.0))
+
+    @patch('epic_2_operations.tracking_logic.get_assignment_cache', _no_cached_assignment)
+    @patch('epic_2_operations.tracking_logic.transaction')
+    @patch('epic_2_operations.tracking_logic.fetch_one')
+    @patch('epic_2_operations.tracking_logic.calculate_distance')
+    def test_mark_stop_complete_twice_counts_once(self, mock_dist, mock_fetch, mock_tx):
+        """A stop that was already completed does not bump the assignment counter again."""
+        mock_fetch.return_value = {'latitude': 1.0, 'longitude': 2.0, 'booking_id': None, 'assignment_id': 7}
+        mock_dist.return_value = 1.0
+        cursor = mock_tx.return_value.__enter__.return_value
+        cursor.rowcount = 0
+        from epic_2_operations.tracking_logic import mark_stop_complete  # pylint: disable=import-outside-toplevel, import-error
+        mark_stop_complete(5, 10, 1.0, 2.0, 7.0)
+        self.assertEqual(cursor.execute.call_count, 1)
+
+    @patch('epic_2_operations.tracking_logic.get_assignment_cache')
+    @patch('epic_2_operations.tracking_logic.invalidate_client_summary')
+    @patch('epic_2_operations.tracking_logic.transaction')
+    @patch('epic_2_operations.tracking_logic.price_stop', MagicMock(return_value=15.0))
+    @patch('epic_2_operations.tracking_logic.record_cash_payments')
+    @patch('epic_2_operations.tracking_logic.fetch_one')
+    @patch('epic_2_operations.tracking_logic.calculate_distance')
+    def test_mark_stop_complete_resubmit_pays_once(self, mock_dist, mock_fetch, mock_pay, mock_tx, mock_invalidate,
+                                                  mock_cache):
+        """A resubmitted form for a booked stop writes no second payment or receipt."""
+        mock_fetch.return_value = {'latitude': 1.0, 'longitude': 2.0, 'booking_id': 101, 'assignment_id': 7,
+                                   'client_id': 40, 'client_email': 'c40@example.com'}
+        mock_dist.return_value = 1.0
+        cursor = mock_tx.return_value.__enter__.return_value
+        cursor.rowcount = 0
+        from epic_2_operations.tracking_logic import mark_stop_complete  # pylint: disable=import-outside-toplevel, import-error
+        mock_cache.return_value = _no_cached_assignment()
+        self.assertIn('already completed', mark_stop_complete(5, 10, 1.0, 2.0, 7.0).lower())
+        # The driver is not shown the stop again
+        mock_cache.return_value.complete_stop.assert_called_once_with(5, 10)
+        mock_pay.assert_not_called()
+        cursor.executemany.assert_not_called()
+        self.assertEqual(cursor.execute.call_count, 1)
+        mock_invalidate.assert_not_called()
+
+    @patch('epic_2_operations.tracking_logic.get_assignment_cache', _no_cached_assignment)
+    @patch('epic_2_operations.tracking_logic.transaction')
+    @patch('epic_2_operations.tracking_logic.fetch_one')
+    @patch('epic_2_operations.tracking_logic.calculate_distance')
+    def test_mark_stop_complete_rolls_back_on_error(self, mock_dist, mock_fetch, mock_tx):
+        """A failed update is reported instead of raised."""
+        mock_fetch.return_value = {'latitude': 1.0, 'longitude': 2.0, 'booking_id': None, 'assignment_id': 7}
+        mock_dist.return_value = 1.0
+        mock_tx.return_value.__enter__.side_effect = RuntimeError("db down")
+        from epic_2_operations.tracking_logic import mark_stop_complete  # pylint: disable=import-outside-toplevel, import-error
+        self.assertIn('could not update', mark_stop_complete(5, 10, 1.0, 2.0, 7.0).lower())
 
 
 if __name__ == '__main__':
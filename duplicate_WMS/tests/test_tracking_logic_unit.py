@@ -5,8 +5,10 @@ Mocks all external dependencies and tests each function in isolation.
 
 import os
 import sys
+import datetime
 import unittest
-from unittest.mock import patch
+from unittest.mock import patch, MagicMock
+import numpy as np
 
 # Set sys.path to import the tracking logic module at runtime
 PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
@@ -24,77 +26,156 @@ class TestTrackingLogicUnit(unittest.TestCase):
         result = get_live_vehicle_locations()
         self.assertEqual(result, [{'license_plate': 'KA01', 'latitude': 1, 'longitude': 2}])
         sql = mock_fetch.call_args[0][0]
-        self.assertIn('FROM VehicleLocations', sql)
+        self.assertIn('FROM VehicleLatestLocation', sql)
+        self.assertNotIn('GROUP BY', sql)
         self.assertIn('license_plate', sql)
             
-    @patch('epic_2_operations.tracking_logic.fetch_all')
-    def test_get_driver_assignment(self, mock_fetch):
-        """get_driver_assignment should filter by driver and status."""
-        mock_fetch.return_value = [{'route_stop_id': 1, 'point_name': 'Home'}]
+    @patch('epic_2_operations.tracking_logic.get_assignment_cache')
+    def test_get_driver_assignment(self, mock_cache):
+        """get_driver_assignment returns copies of the cached pending stops, in order."""
+        stops = [{'route_stop_id': 1, 'point_name': 'Home'}, {'route_stop_id': 2, 'point_name': 'Shop'}]
+        mock_cache.return_value.get.return_value = {'assignment_id': 5, 'vehicle_id': 3, 'stops': stops}
         from epic_2_operations.tracking_logic import get_driver_assignment  # pylint: disable=import-outside-toplevel, import-error
         result = get_driver_assignment(42)
-        self.assertEqual(result[0]['route_stop_id'], 1)
-        sql = mock_fetch.call_args[0][0]
-        self.assertIn('Pending', sql)
-        self.assertIn('%s', sql)
-        params = mock_fetch.call_args[0][1]
-        self.assertEqual(params, (42,))
-    
-    @patch('epic_2_operations.tracking_logic.fetch_one')
-    @patch('epic_2_operations.tracking_logic.execute_query')
-    def test__check_and_complete_assignment_marks_complete(self, mock_exec, mock_fetch):
-        """_check_and_complete_assignment should set assignment to Completed when done."""
-        mock_fetch.return_value = {'pending_count': 0}
-        from epic_2_operations.tracking_logic import _check_and_complete_assignment  # pylint: disable=import-outside-toplevel, import-error
-        _check_and_complete_assignment(7)
-        sql = mock_exec.call_args[0][0]
-        params = mock_exec.call_args[0][1]
-        self.assertIn('RouteAssignments', sql)
+        self.assertEqual([s['route_stop_id'] for s in result], [1, 2])
+        mock_cache.return_value.get.assert_called_once_with(42)
+        result[0]['status'] = 'changed'
+        self.assertNotIn('status', stops[0])
+
+    @patch('epic_2_operations.tracking_logic.get_assignment_cache')
+    def test_get_driver_assignment_none(self, mock_cache):
+        """No active assignment gives an empty stop list."""
+        mock_cache.return_value.get.return_value = None
+        from epic_2_operations.tracking_logic import get_driver_assignment  # pylint: disable=import-outside-toplevel, import-error
+        self.assertEqual(get_driver_assignment(42), [])
+
+    def test__record_stop_completion_counts_and_completes(self):
+        """_record_stop_completion bumps the counter in the caller's transaction and reports completion."""
+        cursor = MagicMock()
+        cursor.fetchone.return_value = {'status': 'Completed'}
+        from epic_2_operations.tracking_logic import _record_stop_completion  # pylint: disable=import-outside-toplevel, import-error
+        self.assertTrue(_record_stop_completion(cursor, 7))
+        sql, params = cursor.execute.call_args_list[0][0]
+        self.assertIn('completed_stops = completed_stops + 1', sql)
+        # status is assigned after the counter so it sees the new value
+        self.assertLess(sql.index('completed_stops = completed_stops'), sql.index('status = IF'))
         self.assertEqual(params, (7,))
 
+    def test__record_stop_completion_in_progress(self):
+        """An assignment with stops left is not reported as completed."""
+        cursor = MagicMock()
+        cursor.fetchone.return_value = {'status': 'In Progress'}
+        from epic_2_operations.tracking_logic import _record_stop_completion  # pylint: disable=import-outside-toplevel, import-error
+        self.assertFalse(_record_stop_completion(cursor, 111))
+        self.assertFalse(_record_stop_completion(cursor, None))
+        self.assertEqual(cursor.execute.call_count, 2)
+
+    @patch('epic_2_operations.tracking_logic.fetch_all')
     @patch('epic_2_operations.tracking_logic.fetch_one')
-    @patch('epic_2_operations.tracking_logic.execute_query')
-    def test__check_and_complete_assignment_pending(self, mock_exec, mock_fetch):
-        """Does not update assignment when pending_count > 0."""
-        mock_fetch.return_value = {'pending_count': 2}
-        from epic_2_operations.tracking_logic import _check_and_complete_assignment  # pylint: disable=import-outside-toplevel, import-error
-        _check_and_complete_assignment(111)
-        mock_exec.assert_not_called()
-    
-    @patch('epic_2_operations.tracking_logic.fetch_one')
-    @patch('epic_2_operations.tracking_logic.execute_query')
-    def test_log_driver_location_with_assignment(self, mock_exec, mock_fetch):
-        """log_driver_location logs when assigned, returns True; else returns False."""
-        mock_fetch.return_value = {'vehicle_id': 55}
+    def test_get_assignment_progress_reads_counters(self, mock_fetch_one, mock_fetch_all):
+        """Progress comes from the RouteAssignments counters, never from RouteStops."""
+        from epic_2_operations.tracking_logic import get_assignment_progress  # pylint: disable=import-outside-toplevel, import-error
+        get_assignment_progress(5)
+        get_assignment_progress()
+        for sql in (mock_fetch_one.call_args[0][0], mock_fetch_all.call_args[0][0]):
+            self.assertIn('completed_stops', sql)
+            self.assertNotIn('RouteStops', sql)
+        self.assertEqual(mock_fetch_one.call_args[0][1], (5,))
+        self.assertIn('CURDATE()', mock_fetch_all.call_args[0][0])
+
+    @patch('epic_2_operations.tracking_logic.get_ingestor')
+    def test_log_driver_location_with_assignment(self, mock_get_ingestor):
+        """log_driver_location hands the point to the ingestion buffer and returns True."""
+        mock_get_ingestor.return_value.submit.return_value = 'accepted'
         from epic_2_operations.tracking_logic import log_driver_location  # pylint: disable=import-outside-toplevel, import-error
         ok = log_driver_location(10, 1.1, 2.2)
         self.assertTrue(ok)
-        # Should log location with vehicle_id, lat, lon
-        params = mock_exec.call_args[0][1]
-        self.assertEqual(params, (55, 1.1, 2.2))
+        mock_get_ingestor.return_value.submit.assert_called_once_with(10, 1.1, 2.2)
 
-    @patch('epic_2_operations.tracking_logic.fetch_one')
-    def test_log_driver_location_no_vehicle(self, mock_fetch):
+    @patch('epic_2_operations.tracking_logic.get_ingestor')
+    def test_log_driver_location_throttled_still_true(self, mock_get_ingestor):
+        """A point dropped by the throttle is not an error: the driver has a vehicle."""
+        mock_get_ingestor.return_value.submit.return_value = 'dropped'
+        from epic_2_operations.tracking_logic import log_driver_location  # pylint: disable=import-outside-toplevel, import-error
+        self.assertTrue(log_driver_location(10, 1.1, 2.2))
+
+    @patch('epic_2_operations.tracking_logic.get_ingestor')
+    def test_log_driver_location_no_vehicle(self, mock_get_ingestor):
         """log_driver_location returns False if driver has no assignment."""
-        mock_fetch.return_value = None
+        mock_get_ingestor.return_value.submit.return_value = 'no_vehicle'
         from epic_2_operations.tracking_logic import log_driver_location  # pylint: disable=import-outside-toplevel, import-error
         ok = log_driver_location(22, 0, 0)
         self.assertFalse(ok)
     
+    @patch('epic_2_operations.tracking_logic.get_location_trace')
     @patch('epic_2_operations.tracking_logic.fetch_all')
-    def test_get_route_history(self, mock_fetch_all):
-        """get_route_history combines stops and path queries for right vehicle/date."""
-        # Simulate: first call (stops), second call (path)
-        mock_fetch_all.side_effect = (
-            [{'point_name': 'A', 'completed_at': 't1', 'latitude': 11, 'longitude': 12, 'collected_volume_kg': 1.2}],
-            [{'latitude': 1, 'longitude': 2}, {'latitude': 3, 'longitude': 4}]
-        )
-        from epic_2_operations.tracking_logic import get_route_history  # pylint: disable=import-outside-toplevel, import-error
+    def test_get_route_history(self, mock_fetch_all, mock_trace):
+        """get_route_history combines the stops query and the tiered GPS trace, encoded as a polyline."""
+        mock_fetch_all.return_value = [
+            {'point_name': 'A', 'completed_at': 't1', 'latitude': 11, 'longitude': 12, 'collected_volume_kg': 1.2}
+        ]
+        mock_trace.return_value = (np.array([[1.0, 2.0], [3.0, 4.0]]), 'rollup')
+        from epic_2_operations.tracking_logic import get_route_history, _history_cache  # pylint: disable=import-outside-toplevel, import-error
+        from utils.polyline_utils import decode_polyline  # pylint: disable=import-outside-toplevel, import-error
+        _history_cache.clear()
         out = get_route_history(10, '2025-01-01')
         self.assertIn('stops', out)
         self.assertIn('path', out)
         self.assertTrue(out['stops'])
-        self.assertTrue(out['path'])
+        self.assertEqual(decode_polyline(out['path']).tolist(), [[1.0, 2.0], [3.0, 4.0]])
+        self.assertEqual((out['path_points'], out['path_source']), (2, 'rollup'))
+        mock_trace.assert_called_once_with(10, datetime.date(2025, 1, 1))
+
+    @patch('epic_2_operations.tracking_logic.get_location_trace')
+    @patch('epic_2_operations.tracking_logic.fetch_all')
+    def test_get_route_history_simplifies_long_traces(self, mock_fetch_all, mock_trace):
+        """A long trace opens at a few hundred points, with finer levels available."""
+        rng = np.random.default_rng(0)
+        coords = np.cumsum(rng.normal(0, 0.0002, (5000, 2)), axis=0) + [17.4, 78.4]
+        mock_fetch_all.return_value = []
+        mock_trace.return_value = (coords, 'raw')
+        from epic_2_operations.tracking_logic import (  # pylint: disable=import-outside-toplevel, import-error
+            get_route_history, _history_cache, PLAYBACK_DEFAULT_POINTS
+        )
+        _history_cache.clear()
+        out = get_route_history(10, datetime.date.today())
+        counts = [level['points'] for level in out['path_levels']]
+        self.assertEqual(counts, sorted(counts))
+        self.assertEqual(counts[-1], 5000)
+        self.assertLessEqual(out['path_levels'][out['path_level']]['points'], PLAYBACK_DEFAULT_POINTS)
+        self.assertEqual(out['path'], out['path_levels'][out['path_level']]['path'])
+
+    @patch('epic_2_operations.tracking_logic.get_location_trace')
+    @patch('epic_2_operations.tracking_logic.fetch_all')
+    def test_get_route_history_caches_past_days_only(self, mock_fetch_all, mock_trace):
+        """A past day is read once; today is always read fresh."""
+        mock_fetch_all.return_value = []
+        mock_trace.return_value = (np.zeros((0, 2)), None)
+        from epic_2_operations.tracking_logic import get_route_history, _history_cache  # pylint: disable=import-outside-toplevel, import-error
+        _history_cache.clear()
+        past = datetime.date.today() - datetime.timedelta(days=3)
+        first = get_route_history(10, past)
+        self.assertIs(get_route_history(10, past), first)
+        self.assertEqual(mock_trace.call_count, 1)
+        get_route_history(10, datetime.date.today())
+        get_route_history(10, datetime.date.today())
+        self.assertEqual(mock_trace.call_count, 3)
+
+    @patch('epic_2_operations.tracking_logic.get_location_trace')
+    @patch('epic_2_operations.tracking_logic.fetch_all')
+    def test_get_route_history_does_not_cache_failed_path(self, mock_fetch_all, mock_trace):
+        """A path that could not be read is shown empty once, then read again."""
+        mock_fetch_all.return_value = []
+        mock_trace.return_value = (None, None)
+        from epic_2_operations.tracking_logic import get_route_history, _history_cache  # pylint: disable=import-outside-toplevel, import-error
+        _history_cache.clear()
+        past = datetime.date.today() - datetime.timedelta(days=3)
+        self.assertEqual(get_route_history(10, past)['path_points'], 0)
+        mock_trace.return_value = (np.array([[1.0, 2.0]]), 'raw')
+        self.assertEqual(get_route_history(10, past)['path_points'], 1)
+        self.assertEqual(mock_trace.call_count, 2)
+        self.assertEqual(get_route_history(10, past)['path_points'], 1)
+        self.assertEqual(mock_trace.call_count, 2)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,99 @@
+"""
+Unit tests for epic_1_routing.zoning_logic:
+- cluster_bookings (capacity cap, zone summaries)
+- get_pending_booking_zones (DB wiring)
+"""
+
+import os
+import sys
+import unittest
+from unittest.mock import patch
+
+# Ensure project root is available for runtime imports
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+
+def _neighbourhood(start_id, lat, lon, count):
+    return [
+        {'booking_id': start_id + i, 'point_id': start_id + i, 'point_name': f"P{start_id + i}",
+         'latitude': lat + (i % 5) * 0.001, 'longitude': lon + (i // 5) * 0.001}
+        for i in range(count)
+    ]
+
+
+class TestClusterBookings(unittest.TestCase):
+    """Algorithm tests for the zoning engine."""
+
+    def test_separate_neighbourhoods_become_separate_zones(self):
+        """Two far-apart groups that each fit in a vehicle end up in two zones."""
+        from epic_1_routing.zoning_logic import cluster_bookings  # pylint: disable=import-outside-toplevel, import-error
+        bookings = _neighbourhood(0, 17.30, 78.30, 10) + _neighbourhood(100, 17.50, 78.60, 10)
+        zones = cluster_bookings(bookings, {}, max_cluster_kg=300)
+        self.assertEqual(len(zones), 2)
+        groups = sorted(sorted(z['booking_ids']) for z in zones)
+        self.assertEqual(groups, [list(range(10)), list(range(100, 110))])
+        for zone in zones:
+            self.assertEqual(zone['count'], 10)
+            self.assertAlmostEqual(zone['estimated_kg'], 250.0)
+
+    def test_zones_never_exceed_capacity(self):
+        """Heavy areas are split until every zone fits and every booking is in exactly one zone."""
+        from epic_1_routing.zoning_logic import cluster_bookings  # pylint: disable=import-outside-toplevel, import-error
+        bookings = _neighbourhood(0, 17.30, 78.30, 40) + _neighbourhood(100, 17.31, 78.31, 35)
+        volumes = {b['point_id']: 10.0 + b['point_id'] % 7 for b in bookings}
+        zones = cluster_bookings(bookings, volumes, max_cluster_kg=120)
+        for zone in zones:
+            self.assertLessEqual(zone['estimated_kg'], 120)
+        placed = sorted(i for z in zones for i in z['booking_ids'])
+        self.assertEqual(placed, sorted(b['booking_id'] for b in bookings))
+
+    def test_identical_locations_are_still_split(self):
+        """Bookings at the very same spot are split by weight when they do not fit together."""
+        from epic_1_routing.zoning_logic import cluster_bookings  # pylint: disable=import-outside-toplevel, import-error
+        bookings = [{'booking_id': i, 'point_id': 1, 'latitude': 17.3, 'longitude': 78.3} for i in range(10)]
+        zones = cluster_bookings(bookings, {1: 30.0}, max_cluster_kg=100)
+        self.assertEqual(sorted(z['estimated_kg'] for z in zones), [30.0, 90.0, 90.0, 90.0])
+
+    def test_centroid_is_inside_the_zone(self):
+        """The reported centroid is the (weighted) middle of the zone's bookings."""
+        from epic_1_routing.zoning_logic import cluster_bookings  # pylint: disable=import-outside-toplevel, import-error
+        bookings = [
+            {'booking_id': 1, 'point_id': 1, 'latitude': 17.30, 'longitude': 78.30},
+            {'booking_id': 2, 'point_id': 2, 'latitude': 17.32, 'longitude': 78.34},
+        ]
+        zones = cluster_bookings(bookings, {1: 10.0, 2: 30.0})
+        self.assertEqual(len(zones), 1)
+        self.assertAlmostEqual(zones[0]['centroid'][0], 17.315)
+        self.assertAlmostEqual(zones[0]['centroid'][1], 78.33)
+
+    def test_empty_input_returns_empty(self):
+        """No bookings, no zones."""
+        from epic_1_routing.zoning_logic import cluster_bookings  # pylint: disable=import-outside-toplevel, import-error
+        self.assertEqual(cluster_bookings([]), [])
+
+
+class TestPendingBookingZones(unittest.TestCase):
+    """DB wiring tests with mocked queries."""
+
+    @patch('epic_1_routing.zoning_logic.get_expected_volumes')
+    @patch('epic_1_routing.zoning_logic.get_pending_bookings')
+    def test_uses_pending_bookings_and_expected_volumes(self, mock_pending, mock_volumes):
+        """Pending bookings are zoned with their expected volumes."""
+        from epic_1_routing.zoning_logic import get_pending_booking_zones  # pylint: disable=import-outside-toplevel, import-error
+        mock_pending.return_value = _neighbourhood(0, 17.30, 78.30, 4)
+        mock_volumes.return_value = {0: 100.0, 1: 100.0, 2: 100.0, 3: 100.0}
+        zones = get_pending_booking_zones(max_cluster_kg=200)
+        self.assertEqual(len(zones), 2)
+        self.assertEqual(sum(z['estimated_kg'] for z in zones), 400.0)
+
+    @patch('epic_1_routing.zoning_logic.get_pending_bookings', return_value=None)
+    def test_no_pending_bookings(self, _mock_pending):
+        """A failed or empty query gives no zones."""
+        from epic_1_routing.zoning_logic import get_pending_booking_zones  # pylint: disable=import-outside-toplevel, import-error
+        self.assertEqual(get_pending_booking_zones(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()